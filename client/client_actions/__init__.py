@@ -13,6 +13,7 @@ from grr.lib import rdfvalues
 from grr.client import actions
 from grr.client.client_actions import admin
 from grr.client.client_actions import enrol
+from grr.client.client_actions import file_finder
 from grr.client.client_actions import file_fingerprint
 from grr.client.client_actions import grr_rekall
 from grr.client.client_actions import network
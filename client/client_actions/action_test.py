@@ -216,6 +216,71 @@ class ActionTest(test_lib.EmptyActionTest):
     # Make sure the thread has been deleted.
     self.assertEqual(grr_worker.suspended_actions, {})
 
+  def testRecursiveListDirectory(self):
+    """Tests the resumable walk of a directory tree."""
+    for path in ["a/b/c/deep.txt", "a/b/b.txt", "a/a.txt", "top.txt"]:
+      path = os.path.join(self.temp_dir, path)
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      with open(path, "wb") as fd:
+        fd.write("data")
+    os.symlink(os.path.join(self.temp_dir, "a"),
+               os.path.join(self.temp_dir, "link"))
+
+    request = rdf_client.RecursiveListDirRequest(
+        pathspec=rdf_paths.PathSpec(path=self.temp_dir, pathtype="OS"),
+        max_depth=2, batch_size=2)
+    request.iterator.number = 3
+
+    paths = []
+    iterations = 0
+    while request.iterator.state != request.iterator.State.FINISHED:
+      iterations += 1
+      for response in self.RunAction("RecursiveListDirectory", request):
+        if isinstance(response, rdf_client.Iterator):
+          request.iterator = response
+        else:
+          self.assertTrue(len(response.entries) <= 2)
+          paths.extend(os.path.relpath(entry.pathspec.path, self.temp_dir)
+                       for entry in response.entries)
+
+    # The symlink is not followed and the contents of a/b/c are too deep to
+    # be listed.
+    self.assertEqual(sorted(paths),
+                     ["a", "a/a.txt", "a/b", "a/b/b.txt", "a/b/c", "link",
+                      "top.txt"])
+    self.assertEqual(iterations, 3)
+
+    # A walk does not use the listings cached by another walk, even when the
+    # other walk listed the directory after it changed.
+    first = rdf_client.RecursiveListDirRequest(
+        pathspec=rdf_paths.PathSpec(path=self.temp_dir, pathtype="OS"),
+        max_depth=0, batch_size=10)
+    first.iterator.number = 1
+    first_paths = []
+    for response in self.RunAction("RecursiveListDirectory", first):
+      if isinstance(response, rdf_client.Iterator):
+        first.iterator = response
+      else:
+        first_paths.extend(os.path.relpath(entry.pathspec.path, self.temp_dir)
+                           for entry in response.entries)
+
+    with open(os.path.join(self.temp_dir, "new.txt"), "wb") as fd:
+      fd.write("data")
+    second = rdf_client.RecursiveListDirRequest(
+        pathspec=rdf_paths.PathSpec(path=self.temp_dir, pathtype="OS"),
+        max_depth=0, batch_size=10)
+    second.iterator.number = 1
+    self.RunAction("RecursiveListDirectory", second)
+
+    first.iterator.number = 100
+    for response in self.RunAction("RecursiveListDirectory", first):
+      if not isinstance(response, rdf_client.Iterator):
+        first_paths.extend(os.path.relpath(entry.pathspec.path, self.temp_dir)
+                           for entry in response.entries)
+
+    self.assertEqual(sorted(first_paths), ["a", "link", "top.txt"])
+
   def testSuspendableActionException(self):
 
     class RaisingListDirectory(standard.SuspendableListDirectory):
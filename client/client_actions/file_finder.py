@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""The client side of the FileFinder flow."""
+
+
+import hashlib
+import re
+import stat
+
+import logging
+
+from grr.client import vfs
+from grr.client.client_actions import file_fingerprint
+from grr.client.client_actions import searching
+from grr.client.client_actions import standard
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import crypto as rdf_crypto
+from grr.lib.rdfvalues import file_finder as rdf_file_finder
+from grr.lib.rdfvalues import paths as rdf_paths
+
+
+class FileFinderOS(searching.Grep):
+  """Finds the files matching all the FileFinder conditions in a single pass.
+
+  The server side FileFinder needs a round trip for every directory it globs
+  and for every file it checks a content condition on. This action globs the
+  (already interpolated) paths locally, applies the conditions in the order
+  they are given - the flow sorts them so the cheap ones come first - and runs
+  the hash action, so only the final matches are sent back.
+  """
+  in_rdfvalue = rdf_file_finder.FileFinderArgs
+  out_rdfvalue = rdf_file_finder.FileFinderResult
+
+  # Maximum number of files to inspect in a single directory
+  FILE_MAX_PER_DIR = 100000
+
+  def Run(self, args):
+    """Globs, filters and hashes the files."""
+    self.request = args
+
+    condition_type = rdf_file_finder.FileFinderCondition.Type
+    self.condition_handlers = {
+        condition_type.MODIFICATION_TIME: self.ModificationTimeCondition,
+        condition_type.ACCESS_TIME: self.AccessTimeCondition,
+        condition_type.INODE_CHANGE_TIME: self.InodeChangeTimeCondition,
+        condition_type.SIZE: self.SizeCondition,
+        condition_type.CONTENTS_REGEX_MATCH: self.ContentsRegexMatchCondition,
+        condition_type.CONTENTS_LITERAL_MATCH: (
+            self.ContentsLiteralMatchCondition),
+    }
+
+    seen = set()
+    for path in args.paths:
+      for stat_entry in self.Glob(path):
+        self.Progress()
+
+        # Overlapping globs can match the same file more than once.
+        collapsed_path = stat_entry.pathspec.CollapsePath()
+        if collapsed_path in seen:
+          continue
+        seen.add(collapsed_path)
+
+        result = rdf_file_finder.FileFinderResult(stat_entry=stat_entry)
+        if self.ApplyConditions(result) and self.ApplyAction(result):
+          self.SendReply(result)
+
+  def Glob(self, path):
+    """Yields a StatEntry for every file matching the glob."""
+    components = rdf_paths.GlobExpression(path).AsPathComponents(
+        self.request.pathtype)
+    return self._Glob(None, components)
+
+  def _Glob(self, stat_entry, components):
+    """Matches the components against the children of stat_entry."""
+    if not components:
+      yield stat_entry
+      return
+
+    # Like the server side glob, we only descend into directories. Entries
+    # with an unknown mode were not stat'ed, they come from literal path
+    # components.
+    if (stat_entry is not None and stat_entry.st_mode and
+        not stat.S_ISDIR(stat_entry.st_mode) and
+        not self.request.no_file_type_check):
+      return
+
+    component, components = components[0], components[1:]
+    if stat_entry is not None:
+      base_pathspec = stat_entry.pathspec.Copy()
+    else:
+      base_pathspec = None
+
+    if component.path_options == component.Options.CASE_INSENSITIVE:
+      if base_pathspec:
+        pathspec = base_pathspec.Append(component)
+      else:
+        pathspec = component
+
+      if components:
+        # There is no need to stat the intermediate directories.
+        children = [rdf_client.StatEntry(pathspec=pathspec)]
+      else:
+        children = [self._Stat(pathspec)]
+
+      for child in children:
+        if child is not None:
+          for match in self._Glob(child, components):
+            yield match
+      return
+
+    if not base_pathspec:
+      base_pathspec = rdf_paths.PathSpec(path="/", pathtype="OS")
+
+    regex = re.compile(component.path, re.IGNORECASE)
+    if component.path_options == component.Options.RECURSIVE:
+      depth = component.recursion_depth
+    else:
+      depth = 1
+
+    for match in self._Recurse(base_pathspec, regex, depth, components):
+      yield match
+
+  def _Recurse(self, pathspec, regex, depth, components):
+    """Matches the regex against all the entries up to depth levels down."""
+    if depth <= 0:
+      return
+
+    for child in self._ListDirectory(pathspec):
+      if regex.match(child.pathspec.Basename()):
+        for match in self._Glob(child, components):
+          yield match
+
+      if stat.S_ISDIR(child.st_mode):
+        for match in self._Recurse(child.pathspec, regex, depth - 1,
+                                   components):
+          yield match
+
+  def _ListDirectory(self, pathspec):
+    try:
+      fd = vfs.VFSOpen(pathspec, progress_callback=self.Progress)
+      children = []
+      for child in fd.ListFiles():
+        children.append(child)
+        if len(children) >= self.FILE_MAX_PER_DIR:
+          break
+
+      return children
+    except (IOError, OSError) as e:
+      logging.info("FileFinder failed to list %s: %s", pathspec, e)
+      return []
+
+  def _Stat(self, pathspec):
+    try:
+      return vfs.VFSOpen(pathspec, progress_callback=self.Progress).Stat()
+    except (IOError, OSError):
+      return None
+
+  def _IsRegularFile(self, stat_entry):
+    return (self.request.no_file_type_check or
+            stat.S_ISREG(stat_entry.st_mode))
+
+  def ApplyConditions(self, result):
+    """Returns True if the result matches all the conditions."""
+    for condition in self.request.conditions:
+      handler = self.condition_handlers[condition.condition_type]
+      if not handler(result, condition):
+        return False
+
+    return True
+
+  def ModificationTimeCondition(self, result, condition):
+    settings = condition.modification_time
+    return (settings.min_last_modified_time.AsSecondsFromEpoch() <=
+            result.stat_entry.st_mtime <=
+            settings.max_last_modified_time.AsSecondsFromEpoch())
+
+  def AccessTimeCondition(self, result, condition):
+    settings = condition.access_time
+    return (settings.min_last_access_time.AsSecondsFromEpoch() <=
+            result.stat_entry.st_atime <=
+            settings.max_last_access_time.AsSecondsFromEpoch())
+
+  def InodeChangeTimeCondition(self, result, condition):
+    settings = condition.inode_change_time
+    return (settings.min_last_inode_change_time.AsSecondsFromEpoch() <=
+            result.stat_entry.st_ctime <=
+            settings.max_last_inode_change_time.AsSecondsFromEpoch())
+
+  def SizeCondition(self, result, condition):
+    return (self._IsRegularFile(result.stat_entry) and
+            condition.size.min_file_size <=
+            result.stat_entry.st_size <=
+            condition.size.max_file_size)
+
+  def ContentsRegexMatchCondition(self, result, condition):
+    if not self._IsRegularFile(result.stat_entry):
+      return False
+
+    options = condition.contents_regex_match
+    grep_spec = rdf_client.GrepSpec(
+        target=result.stat_entry.pathspec,
+        regex=options.regex,
+        mode=options.mode,
+        start_offset=options.start_offset,
+        length=options.length,
+        bytes_before=options.bytes_before,
+        bytes_after=options.bytes_after)
+
+    return self._GrepCondition(result, grep_spec)
+
+  def ContentsLiteralMatchCondition(self, result, condition):
+    if not self._IsRegularFile(result.stat_entry):
+      return False
+
+    options = condition.contents_literal_match
+    grep_spec = rdf_client.GrepSpec(
+        target=result.stat_entry.pathspec,
+        literal=options.literal,
+        mode=options.mode,
+        start_offset=options.start_offset,
+        length=options.length,
+        bytes_before=options.bytes_before,
+        bytes_after=options.bytes_after,
+        xor_in_key=options.xor_in_key,
+        xor_out_key=options.xor_out_key)
+
+    return self._GrepCondition(result, grep_spec)
+
+  def _GrepCondition(self, result, grep_spec):
+    """Adds the hits of the grep to the result, True if there were any."""
+    try:
+      hits = [rdf_client.BufferReference(**hit)
+              for hit in self.Search(grep_spec)]
+    except (IOError, OSError) as e:
+      logging.info("FileFinder failed to grep %s: %s", grep_spec.target, e)
+      return False
+
+    for hit in hits:
+      result.matches.append(hit)
+
+    return bool(hits)
+
+  def ApplyAction(self, result):
+    """Hashes the file if needed, returns False if it can't be acted on."""
+    action = self.request.action.action_type
+    if action == rdf_file_finder.FileFinderAction.Action.STAT:
+      return True
+
+    # Hashing and downloading only makes sense for regular files.
+    if not self._IsRegularFile(result.stat_entry):
+      return False
+
+    pathspec = result.stat_entry.pathspec
+    try:
+      if (action == rdf_file_finder.FileFinderAction.Action.DOWNLOAD and
+          result.stat_entry.st_size <= self.request.action.download.max_size):
+        # The server only needs the hash the file store uses to dedup.
+        result.hash_entry = self._HashFile(pathspec, self.request.file_size)
+      else:
+        # Files too large to download are fingerprinted instead.
+        result.hash_entry = self._FingerprintFile(pathspec)
+    except (IOError, OSError) as e:
+      logging.info("FileFinder failed to hash %s: %s", pathspec, e)
+      return False
+
+    return True
+
+  def _HashFile(self, pathspec, max_size):
+    """Hashes the first max_size bytes of the file like HashFile does."""
+    hashers = dict(md5=hashlib.md5(), sha1=hashlib.sha1(),
+                   sha256=hashlib.sha256())
+
+    with vfs.VFSOpen(pathspec, progress_callback=self.Progress) as file_obj:
+      bytes_read = 0
+      while bytes_read < max_size:
+        self.Progress()
+        data = file_obj.Read(min(standard.MAX_BUFFER_SIZE,
+                                 max_size - bytes_read))
+        if not data:
+          break
+        for hasher in hashers.values():
+          hasher.update(data)
+
+        bytes_read += len(data)
+
+    return rdf_crypto.Hash(
+        **dict((k, v.digest()) for k, v in hashers.iteritems()))
+
+  def _FingerprintFile(self, pathspec):
+    """Computes the generic and authenticode hashes like FingerprintFile."""
+    hashers = [hashlib.md5, hashlib.sha1, hashlib.sha256]
+
+    with vfs.VFSOpen(pathspec, progress_callback=self.Progress) as file_obj:
+      fingerprinter = file_fingerprint.Fingerprinter(self.Progress, file_obj)
+      fingerprinter.EvalGeneric(hashers=hashers)
+      fingerprinter.EvalPecoff(hashers=hashers)
+
+      return file_fingerprint.ResultsToHash(fingerprinter.HashIt())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Tests for the FileFinderOS client action."""
+
+
+import hashlib
+import os
+
+
+# Populate the action registry
+# pylint: disable=unused-import
+from grr.client import client_actions
+# pylint: enable=unused-import
+from grr.client import vfs
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib.rdfvalues import file_finder as rdf_file_finder
+from grr.lib.rdfvalues import paths as rdf_paths
+
+
+class FileFinderOSTest(test_lib.EmptyActionTest):
+  """Test the FileFinderOS client action."""
+
+  def setUp(self):
+    super(FileFinderOSTest, self).setUp()
+    # Use the real file system.
+    vfs.VFSInit().Run()
+
+  def _WriteFile(self, path, data, mtime=None):
+    path = os.path.join(self.temp_dir, path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+
+    with open(path, "wb") as fd:
+      fd.write(data)
+
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+
+    return path
+
+  def _Run(self, paths, conditions=None, action_type=None):
+    args = rdf_file_finder.FileFinderArgs(
+        paths=paths, pathtype=rdf_paths.PathSpec.PathType.OS,
+        conditions=conditions or [],
+        action=rdf_file_finder.FileFinderAction(
+            action_type=action_type or
+            rdf_file_finder.FileFinderAction.Action.STAT))
+    return self.RunAction("FileFinderOS", args)
+
+  def _Basenames(self, results):
+    return sorted(r.stat_entry.pathspec.Basename() for r in results)
+
+  def testGlobsLocally(self):
+    self._WriteFile("a.log", "a")
+    self._WriteFile("b.txt", "b")
+    self._WriteFile("dir/c.log", "c")
+
+    results = self._Run([os.path.join(self.temp_dir, "*.log")])
+    self.assertEqual(self._Basenames(results), ["a.log"])
+
+    results = self._Run([os.path.join(self.temp_dir, "**", "*.log")])
+    self.assertEqual(self._Basenames(results), ["c.log"])
+
+  def testRecursionDepth(self):
+    self._WriteFile("a/b/c/file.txt", "deep")
+
+    results = self._Run([os.path.join(self.temp_dir, "**2", "file.txt")])
+    self.assertEqual(results, [])
+
+    results = self._Run([os.path.join(self.temp_dir, "**3", "file.txt")])
+    self.assertEqual(self._Basenames(results), ["file.txt"])
+
+  def testAppliesStatAndContentConditions(self):
+    self._WriteFile("old.log", "needle", mtime=1000)
+    self._WriteFile("new.log", "needle", mtime=3000)
+    self._WriteFile("new_big.log", "needle" + "x" * 100, mtime=3000)
+    self._WriteFile("new_other.log", "haystack", mtime=3000)
+
+    conditions = [
+        rdf_file_finder.FileFinderCondition(
+            condition_type=rdf_file_finder.FileFinderCondition.Type.SIZE,
+            size=rdf_file_finder.FileFinderSizeCondition(max_file_size=10)),
+        rdf_file_finder.FileFinderCondition(
+            condition_type=
+            rdf_file_finder.FileFinderCondition.Type.MODIFICATION_TIME,
+            modification_time=
+            rdf_file_finder.FileFinderModificationTimeCondition(
+                min_last_modified_time=
+                rdfvalue.RDFDatetime().FromSecondsFromEpoch(2000))),
+        rdf_file_finder.FileFinderCondition(
+            condition_type=
+            rdf_file_finder.FileFinderCondition.Type.CONTENTS_LITERAL_MATCH,
+            contents_literal_match=
+            rdf_file_finder.FileFinderContentsLiteralMatchCondition(
+                literal="needle", bytes_before=0, bytes_after=0))]
+
+    results = self._Run([os.path.join(self.temp_dir, "*.log")],
+                        conditions=conditions)
+    self.assertEqual(self._Basenames(results), ["new.log"])
+    self.assertEqual(len(results[0].matches), 1)
+    self.assertEqual(results[0].matches[0].offset, 0)
+    self.assertEqual(results[0].matches[0].data, "needle")
+
+  def testHashesMatchingFiles(self):
+    path = self._WriteFile("a.log", "hash me")
+    self._WriteFile("dir/b.log", "a directory is not hashed")
+
+    results = self._Run(
+        [os.path.join(self.temp_dir, "*")],
+        action_type=rdf_file_finder.FileFinderAction.Action.HASH)
+
+    # Only the regular file is returned.
+    self.assertEqual(len(results), 1)
+    self.assertEqual(results[0].stat_entry.pathspec.CollapsePath(), path)
+    self.assertEqual(results[0].hash_entry.sha256,
+                     hashlib.sha256("hash me").digest())
+
+    results = self._Run(
+        [os.path.join(self.temp_dir, "*")],
+        action_type=rdf_file_finder.FileFinderAction.Action.DOWNLOAD)
+    self.assertEqual(len(results), 1)
+    self.assertEqual(results[0].hash_entry.md5,
+                     hashlib.md5("hash me").digest())
+
+
+def main(argv):
+  test_lib.main(argv)
+
+if __name__ == "__main__":
+  flags.StartMain(main)
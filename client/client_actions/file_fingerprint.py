@@ -9,6 +9,7 @@ from grr.parsers import fingerprint
 from grr.client import vfs
 from grr.client.client_actions import standard
 from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import crypto as rdf_crypto
 
 
 class Fingerprinter(fingerprint.Fingerprinter):
@@ -23,6 +24,30 @@ class Fingerprinter(fingerprint.Fingerprinter):
     return super(Fingerprinter, self)._GetNextInterval()
 
 
+def ResultsToHash(results):
+  """Converts the results of Fingerprinter.HashIt() into a Hash."""
+  hash_obj = rdf_crypto.Hash()
+  for result in results:
+    if result["name"] == "generic":
+      for hash_type in ["md5", "sha1", "sha256"]:
+        value = result.get(hash_type)
+        if value is not None:
+          setattr(hash_obj, hash_type, value)
+
+    if result["name"] == "pecoff":
+      for hash_type in ["md5", "sha1", "sha256"]:
+        value = result.get(hash_type)
+        if value:
+          setattr(hash_obj, "pecoff_" + hash_type, value)
+
+      signed_data = result.get("SignedData", [])
+      for data in signed_data:
+        hash_obj.signed_data.Append(
+            revision=data[0], cert_type=data[1], certificate=data[2])
+
+  return hash_obj
+
+
 class FingerprintFile(standard.ReadBuffer):
   """Apply a set of fingerprinting methods to a file."""
   in_rdfvalue = rdf_client.FingerprintRequest
@@ -71,25 +96,10 @@ class FingerprintFile(standard.ReadBuffer):
       # name of the hashing method, hashes for enabled hash algorithms,
       # and auxilliary data where present (e.g. signature blobs).
       # Also see Fingerprint:HashIt()
-      response.results = fingerprinter.HashIt()
+      results = fingerprinter.HashIt()
+      response.results = results
 
       # We now return data in a more structured form.
-      for result in response.results:
-        if result.GetItem("name") == "generic":
-          for hash_type in ["md5", "sha1", "sha256"]:
-            value = result.GetItem(hash_type)
-            if value is not None:
-              setattr(response.hash, hash_type, value)
-
-        if result["name"] == "pecoff":
-          for hash_type in ["md5", "sha1", "sha256"]:
-            value = result.GetItem(hash_type)
-            if value:
-              setattr(response.hash, "pecoff_" + hash_type, value)
-
-          signed_data = result.GetItem("SignedData", [])
-          for data in signed_data:
-            response.hash.signed_data.Append(
-                revision=data[0], cert_type=data[1], certificate=data[2])
+      response.hash = ResultsToHash(results)
 
       self.SendReply(response)
@@ -9,6 +9,7 @@ import logging
 
 from grr.client import actions
 from grr.client import vfs
+from grr.lib import aho_corasick
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
@@ -77,8 +78,22 @@ class Find(actions.IteratedAction):
     except KeyError:
       pass
 
-  def TestFileContent(self, file_stat):
-    """Checks the file for the presence of the regular expression."""
+  def TestFileContent(self, file_stat, search_func=None, context_size=100):
+    """Checks the file for the presence of the regular expression.
+
+    Args:
+      file_stat: StatEntry of the file to check.
+      search_func: Callable returning True if the given buffer matches.
+                   Defaults to searching the request's data_regex.
+      context_size: How much of the previous buffer to keep to catch matches
+                    spanning buffers.
+
+    Returns:
+      True if the file content matches.
+    """
+    if search_func is None:
+      search_func = self.request.data_regex.Search
+
     # Content regex check
     try:
 
@@ -92,13 +107,13 @@ class Find(actions.IteratedAction):
           data += data_read
 
           # Got it.
-          if self.request.data_regex.Search(data):
+          if search_func(data):
             return True
 
           # Keep a bit of context from the last buffer to ensure we dont miss a
           # match broken by buffer. We do not expect regex's to match something
-          # larger than about 100 chars.
-          data = data[-100:]
+          # larger than about 100 chars. data[-0:] would keep everything.
+          data = data[-context_size:] if context_size else ""
 
     except (IOError, KeyError):
       pass
@@ -167,6 +182,23 @@ class Find(actions.IteratedAction):
 
       result.append(FilterData)
 
+    if request.data_literals:
+      matcher = aho_corasick.Matcher(
+          [utils.SmartStr(literal) for literal in request.data_literals])
+
+      def SearchLiterals(data):
+        for _ in matcher.FindIter(data):
+          return True
+        return False
+
+      def FilterLiterals(file_stat, **_):
+        """Suppress files that contain none of the literals."""
+        return not self.TestFileContent(
+            file_stat, search_func=SearchLiterals,
+            context_size=matcher.max_length - 1)
+
+      result.append(FilterLiterals)
+
     return result
 
   def Iterate(self, request, client_state):
@@ -283,6 +315,11 @@ class Grep(actions.ActionPlugin):
       RuntimeError: No search pattern has been given in the request.
 
     """
+    for hit in self.Search(args):
+      self.SendReply(**hit)
+
+  def Search(self, args):
+    """Yields the BufferReference arguments of the hits for a GrepSpec."""
     fd = vfs.VFSOpen(args.target, progress_callback=self.Progress)
     fd.Seek(args.start_offset)
     base_offset = args.start_offset
@@ -295,6 +332,16 @@ class Grep(actions.ActionPlugin):
     elif args.literal:
       find_func = functools.partial(self.FindLiteral,
                                     bytearray(utils.SmartStr(args.literal)))
+    elif args.literals:
+      # The literals stay XOR encoded, the matcher encodes the data instead.
+      matcher = aho_corasick.Matcher(
+          [utils.SmartStr(literal) for literal in args.literals],
+          xor_key=self.xor_in_key)
+      # Hits are only reported once if they fit into the preamble.
+      if matcher.max_length > self.ENVELOPE_SIZE:
+        raise RuntimeError("Grep literals can't be longer than %d bytes." %
+                           self.ENVELOPE_SIZE)
+      find_func = matcher.FindIter
     else:
       raise RuntimeError("Grep needs a regex or a literal.")
 
@@ -318,7 +365,8 @@ class Grep(actions.ActionPlugin):
 
       if data_size == 0 and postscript_size == 0: break
 
-      for (start, end) in find_func(data):
+      for hit in find_func(data):
+        start, end = hit[:2]
         # Ignore hits in the preamble.
         if end <= preamble_size:
           continue
@@ -336,10 +384,15 @@ class Grep(actions.ActionPlugin):
                         min(len(data), end + args.bytes_after)):
           out_data += chr(ord(data[i]) ^ self.xor_out_key)
 
+        reply = dict(offset=base_offset + start - preamble_size,
+                     data=out_data, length=len(out_data),
+                     pathspec=fd.pathspec)
+        # Multi-pattern searches also report which pattern matched.
+        if len(hit) > 2:
+          reply["pattern_index"] = hit[2]
+
         hits += 1
-        self.SendReply(offset=base_offset + start - preamble_size,
-                       data=out_data, length=len(out_data),
-                       pathspec=fd.pathspec)
+        yield reply
 
         if args.mode == rdf_client.GrepSpec.Mode.FIRST_HIT:
           return
@@ -347,8 +400,7 @@ class Grep(actions.ActionPlugin):
         if hits >= self.HIT_LIMIT:
           msg = utils.Xor("This Grep has reached the maximum number of hits"
                           " (%d)." % self.HIT_LIMIT, self.xor_out_key)
-          self.SendReply(offset=0,
-                         data=msg, length=len(msg))
+          yield dict(offset=0, data=msg, length=len(msg))
           return
 
       self.Progress()
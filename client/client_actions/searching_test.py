@@ -209,6 +209,19 @@ class FindTest(test_lib.EmptyActionTest):
     self.assertEqual(all_files[1].pathspec.Basename(),
                      "long_file.text")
 
+  def testFindActionDataLiterals(self):
+    """Test the find action with multiple data literals."""
+    pathspec = rdf_paths.PathSpec(path="/mock2/",
+                                  pathtype=rdf_paths.PathSpec.PathType.OS)
+    request = rdf_client.FindSpec(pathspec=pathspec,
+                                  data_literals=["Secret", "MP3"],
+                                  cross_devs=True)
+    request.iterator.number = 200
+    result = self.RunAction("Find", request)
+    all_files = [x.hit for x in result if isinstance(x, rdf_client.FindSpec)]
+    self.assertItemsEqual([x.pathspec.Basename() for x in all_files],
+                          ["file1.txt", "file.mp3", "long_file.text"])
+
   def testFindSizeLimits(self):
     """Test the find action size limits."""
     # First get all the files at once
@@ -676,6 +689,51 @@ class GrepTest(test_lib.EmptyActionTest):
       self.assertEqual(utils.Xor(result[0].data, self.XOR_OUT_KEY),
                        expected)
 
+  @SearchParams(1000, 100)
+  def testGrepMultipleLiteralsAcrossBufferBoundaries(self):
+    literals = ["HIT", "MISS", "IT"]
+
+    for offset in xrange(-20, 20):
+      data = "X" * (1000 + offset) + "HIT" + "X" * 50 + "MISS" + "X" * 100
+      MockVFSHandlerFind.filesystem[self.filename] = data
+
+      request = rdf_client.GrepSpec(
+          literals=[utils.Xor(l, self.XOR_IN_KEY) for l in literals],
+          xor_in_key=self.XOR_IN_KEY,
+          xor_out_key=self.XOR_OUT_KEY,
+          bytes_before=0,
+          bytes_after=0)
+      request.target.path = self.filename
+      request.target.pathtype = rdf_paths.PathSpec.PathType.OS
+      request.start_offset = 0
+
+      result = self.RunAction("Grep", request)
+      self.assertEqual([(x.offset, x.pattern_index) for x in result],
+                       [(1000 + offset, 0),
+                        (1001 + offset, 2),
+                        (1053 + offset, 1)])
+      for x in result:
+        self.assertEqual(utils.Xor(x.data, self.XOR_OUT_KEY),
+                         literals[x.pattern_index])
+
+  def testGrepMultipleLiteralsFirstHit(self):
+    data = "X" * 10 + "MISS" + "X" * 10 + "HIT" + "X" * 10
+    MockVFSHandlerFind.filesystem[self.filename] = data
+
+    request = rdf_client.GrepSpec(
+        literals=[utils.Xor(l, self.XOR_IN_KEY) for l in ["HIT", "MISS"]],
+        xor_in_key=self.XOR_IN_KEY,
+        xor_out_key=self.XOR_OUT_KEY,
+        mode=rdf_client.GrepSpec.Mode.FIRST_HIT)
+    request.target.path = self.filename
+    request.target.pathtype = rdf_paths.PathSpec.PathType.OS
+    request.start_offset = 0
+
+    result = self.RunAction("Grep", request)
+    self.assertEqual(len(result), 1)
+    self.assertEqual(result[0].offset, 10)
+    self.assertEqual(result[0].pattern_index, 1)
+
   def testHitLimit(self):
     limit = searching.Grep.HIT_LIMIT
 
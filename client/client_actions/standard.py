@@ -9,6 +9,7 @@ import hashlib
 import os
 import platform
 import socket
+import stat
 import sys
 import time
 import zlib
@@ -294,6 +295,106 @@ class SuspendableListDirectory(actions.SuspendableAction):
       self.Suspend()
 
 
+# Sorted listings of the directories a RecursiveListDirectory walk stopped
+# in, so the next iteration does not have to list them again. Keyed by walk id
+# and path, so walks of different requests never share listings.
+DIRECTORY_LISTING_CACHE = utils.TimeBasedCache(max_size=10, max_age=600)
+
+
+class RecursiveListDirectory(actions.IteratedAction):
+  """Walks a directory tree down to max_depth, sending batches of StatEntries.
+
+  Like the server side walk, the contents of the directories max_depth levels
+  below the top directory are listed, but not their subdirectories.
+
+  Each iteration sends at most iterator.number entries, or max_bytes worth of
+  them. The iterator's client_state is the cursor of the walk: it maps the
+  directories currently being walked to the index of their next entry, so
+  the walk can be resumed from any iterator the server received. It also
+  holds a random walk id under which the listings of those directories are
+  kept in DIRECTORY_LISTING_CACHE; if they expired, a resumed walk lists the
+  directories again.
+  """
+
+  in_rdfvalue = rdf_client.RecursiveListDirRequest
+  out_rdfvalue = rdf_client.StatEntryBatch
+
+  # The client_state key of the walk id, paths in the cursor start with "/".
+  WALK_ID = "walk_id"
+
+  def Iterate(self, request, client_state):
+    """Walks the tree from the cursor until the budget is spent."""
+    self.request = request
+    if self.WALK_ID not in client_state:
+      client_state[self.WALK_ID] = utils.PRNG.GetULong()
+    self.walk_id = client_state[self.WALK_ID]
+
+    batch = rdf_client.StatEntryBatch()
+    count = size = 0
+    for stat_entry in self.Walk(request.pathspec, client_state):
+      self.Progress()
+
+      batch.entries.Append(stat_entry)
+      if len(batch.entries) >= request.batch_size:
+        self.SendReply(batch)
+        batch = rdf_client.StatEntryBatch()
+
+      count += 1
+      size += len(stat_entry.SerializeToString())
+      if count >= request.iterator.number or size >= request.max_bytes:
+        break
+
+    else:
+      request.iterator.state = rdf_client.Iterator.State.FINISHED
+
+    if batch.entries:
+      self.SendReply(batch)
+
+  def Walk(self, pathspec, state, depth=0):
+    """Yields the entries of the tree, children before their directory."""
+    if depth > self.request.max_depth:
+      return
+
+    path = pathspec.CollapsePath()
+    start = state.get(path, 0)
+    files = None
+    try:
+      files = DIRECTORY_LISTING_CACHE.Get((self.walk_id, path))
+    except KeyError:
+      pass
+
+    if files is None:
+      try:
+        fd = vfs.VFSOpen(pathspec, progress_callback=self.Progress)
+        # The cursor relies on the order of the entries.
+        files = sorted(fd.ListFiles(), key=lambda x: x.pathspec.path)
+      except (IOError, OSError) as e:
+        if depth == 0:
+          self.SetStatus(rdf_flows.GrrStatus.ReturnedStatus.IOERROR, e)
+        else:
+          logging.info("Failed to list %s: %s", pathspec, e)
+        return
+
+      DIRECTORY_LISTING_CACHE.Put((self.walk_id, path), files)
+
+    for i, stat_entry in enumerate(files):
+      # Skip the entries sent in previous iterations.
+      if i < start:
+        continue
+
+      # Do not follow symlinks.
+      if stat.S_ISDIR(stat_entry.st_mode) and not stat_entry.symlink:
+        for child_entry in self.Walk(stat_entry.pathspec, state, depth + 1):
+          yield child_entry
+
+      state[path] = i + 1
+      yield stat_entry
+
+    # The directory is done, keep the cursor small.
+    state.pop(path, None)
+    DIRECTORY_LISTING_CACHE.ExpireObject((self.walk_id, path))
+
+
 class StatFile(ListDirectory):
   """Sends a StatEntry for a single file."""
   in_rdfvalue = rdf_client.ListDirRequest
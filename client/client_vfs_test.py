@@ -368,6 +368,46 @@ class VFSTest(test_lib.GRRBaseTest):
 
     self.CheckDirectoryListing(directory, "morenumbers.txt")
 
+  def testListFilesStatsEntriesLikeStat(self):
+    """The fast listing returns the same entries as Stat() would."""
+    for name in ["file", "dir"]:
+      path = os.path.join(self.temp_dir, name)
+      if name == "dir":
+        os.mkdir(path)
+      else:
+        with open(path, "wb") as fd:
+          fd.write("data")
+
+    os.symlink(os.path.join(self.temp_dir, "file"),
+               os.path.join(self.temp_dir, "link"))
+    os.symlink(os.path.join(self.temp_dir, "missing"),
+               os.path.join(self.temp_dir, "broken_link"))
+
+    pathspec = rdf_paths.PathSpec(path=self.temp_dir,
+                                  pathtype=rdf_paths.PathSpec.PathType.OS)
+
+    for scandir in [files.scandir, None]:
+      with utils.Stubber(files, "scandir", scandir):
+        directory = vfs.VFSOpen(pathspec)
+        entries = dict((entry.pathspec.Basename(), entry)
+                       for entry in directory.ListFiles())
+
+      # Like Stat(), broken symlinks are skipped.
+      self.assertItemsEqual(entries, ["file", "dir", "link"])
+
+      for name, entry in entries.items():
+        expected = directory.Stat(utils.JoinPath(directory.path, name))
+        self.assertEqual(entry.pathspec.CollapsePath(),
+                         utils.JoinPath(self.temp_dir, name))
+        self.assertEqual(entry.symlink, expected.symlink)
+        for attribute in ["st_mode", "st_ino", "st_size", "st_mtime"]:
+          self.assertEqual(getattr(entry, attribute),
+                           getattr(expected, attribute))
+
+      self.assertTrue(stat.S_ISREG(entries["link"].st_mode))
+      self.assertEqual(entries["link"].symlink,
+                       os.path.join(self.temp_dir, "file"))
+
   def testTSKListDirectory(self):
     """Test directory listing in sleuthkit."""
     path = os.path.join(self.base_path, u"test_img.dd")
@@ -533,6 +573,43 @@ class VFSTest(test_lib.GRRBaseTest):
         vfs.VFSInit().Run()
 
 
+class VFSBenchmarks(test_lib.AverageMicroBenchmarks):
+  """Benchmarks the client OS VFS handler."""
+
+  REPEATS = 5
+  units = "ms"
+
+  # Number of files in the synthetic directory.
+  FILES = 20000
+
+  def testListFiles(self):
+    """Lists a large directory."""
+    for i in xrange(self.FILES):
+      open(os.path.join(self.temp_dir, "file%d" % i), "wb").close()
+
+    pathspec = rdf_paths.PathSpec(path=self.temp_dir,
+                                  pathtype=rdf_paths.PathSpec.PathType.OS)
+
+    def StatEveryEntry():
+      """How the directory was listed before: a Stat() for every entry."""
+      directory = vfs.VFSOpen(pathspec)
+      for name in directory.ListNames():
+        response = directory.Stat(utils.JoinPath(directory.path, name))
+        response.pathspec = directory.pathspec.Copy()
+        response.pathspec.last.path = utils.JoinPath(directory.path, name)
+
+      return len(directory.ListNames())
+
+    def ListFiles():
+      return len(list(vfs.VFSOpen(pathspec).ListFiles()))
+
+    self.TimeIt(StatEveryEntry, name="Stat every entry of %d" % self.FILES)
+    self.TimeIt(ListFiles, name="ListFiles of %d" % self.FILES)
+    with utils.Stubber(files, "scandir", None):
+      self.TimeIt(ListFiles, name="ListFiles of %d without scandir" %
+                  self.FILES)
+
+
 def main(argv):
   vfs.VFSInit()
   test_lib.main(argv)
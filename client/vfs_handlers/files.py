@@ -2,10 +2,12 @@
 # Copyright 2010 Google Inc. All Rights Reserved.
 """Implements VFSHandlers for files on the client."""
 
+import errno
 import logging
 import os
 import platform
 import re
+import stat
 import sys
 import threading
 
@@ -15,6 +17,14 @@ from grr.lib import utils
 from grr.lib.rdfvalues import client
 from grr.lib.rdfvalues import paths
 
+# pylint: disable=g-import-not-at-top
+try:
+  # scandir returns the type of the entries, and on Windows their stat, with
+  # the directory listing.
+  import scandir
+except ImportError:
+  scandir = None
+# pylint: enable=g-import-not-at-top
 
 # File handles are cached here. They expire after a couple minutes so
 # we don't keep files locked on the client.
@@ -100,6 +110,13 @@ def MakeStatResponse(st, pathspec):
   return response
 
 
+def _ReadLink(local_path):
+  try:
+    return utils.SmartUnicode(os.readlink(local_path))
+  except (OSError, AttributeError):
+    return None
+
+
 class File(vfs.VFSHandler):
   """Read a regular file."""
 
@@ -151,8 +168,14 @@ class File(vfs.VFSHandler):
       if not self.files:
         # Note that the encoding of local path is system specific
         local_path = client_utils.CanonicalPathToLocalPath(self.path + "/")
-        self.files = [utils.SmartUnicode(entry) for entry in
-                      os.listdir(local_path)]
+        if scandir is None:
+          self.files = [utils.SmartUnicode(entry) for entry in
+                        os.listdir(local_path)]
+        else:
+          # ListFiles() lists the directory with scandir, so only list it
+          # here if ListNames() is called. The trailing separator makes this
+          # fail for anything but a directory.
+          os.stat(local_path)
     # Some filesystems do not support unicode properly
     except UnicodeEncodeError as e:
       raise IOError(str(e))
@@ -216,6 +239,14 @@ class File(vfs.VFSHandler):
         self.alignment = 512
 
   def ListNames(self):
+    if self.files is None and self.IsDirectory():
+      local_path = client_utils.CanonicalPathToLocalPath(self.path + "/")
+      try:
+        self.files = [utils.SmartUnicode(entry) for entry in
+                      os.listdir(local_path)]
+      except (IOError, OSError):
+        self.files = []
+
     return self.files or []
 
   def Read(self, length):
@@ -278,16 +309,76 @@ class File(vfs.VFSHandler):
       raise IOError("%s is not a directory." % self.path)
 
     else:
-      for path in self.files:
-        try:
-          response = self.Stat(utils.JoinPath(self.path, path))
-          pathspec = self.pathspec.Copy()
-          pathspec.last.path = utils.JoinPath(pathspec.last.path, path)
-          response.pathspec = pathspec
+      # The paths of the entries are built from the directory's paths, which
+      # is much cheaper than joining and converting the path of every entry.
+      directory = self.pathspec.last.path.rstrip("/")
+      for name, st, symlink in self._StatEntries():
+        pathspec = self.pathspec.Copy()
+        pathspec.last.path = directory + "/" + name
+
+        response = MakeStatResponse(st, pathspec)
+        if symlink is not None:
+          response.symlink = symlink
+
+        yield response
+
+  def _StatEntries(self):
+    """Yields (name, stat, symlink target) for the entries of the directory.
 
-          yield response
+    Unlike Stat(), only symlinks are readlink()ed and stat()ed twice, other
+    entries are lstat()ed once - or not at all if scandir returns their stat
+    with the listing.
+    """
+    local_dir = client_utils.CanonicalPathToLocalPath(self.path + "/")
+
+    # The drive letters are not entries of a real directory.
+    windows_root = sys.platform == "win32" and self.path == "/"
+
+    if scandir is not None and not windows_root:
+      try:
+        scandir_entries = scandir.scandir(local_dir)
+      except OSError as e:
+        # The directory is gone.
+        if e.errno == errno.ENOENT:
+          return
+        # The directory was not listed when it was opened, so this is where
+        # an unreadable directory is found.
+        raise IOError(str(e))
+
+      for entry in scandir_entries:
+        try:
+          if entry.is_symlink():
+            st = os.stat(entry.path)
+            symlink = _ReadLink(entry.path)
+          else:
+            st = entry.stat()
+            symlink = None
         except OSError:
-          pass
+          continue
+
+        yield utils.SmartUnicode(entry.name), st, symlink
+
+      return
+
+    if isinstance(local_dir, unicode) and not windows_root:
+      entries = ((name, os.path.join(local_dir, name))
+                 for name in self.ListNames())
+    else:
+      # Encoded local paths are converted one at a time.
+      entries = ((name, client_utils.CanonicalPathToLocalPath(
+          utils.JoinPath(self.path, name))) for name in self.ListNames())
+
+    for name, local_path in entries:
+      try:
+        st = os.lstat(local_path)
+        symlink = None
+        if stat.S_ISLNK(st.st_mode):
+          st = os.stat(local_path)
+          symlink = _ReadLink(local_path)
+      except OSError:
+        continue
+
+      yield name, st, symlink
 
   def IsDirectory(self):
     return self.size is None
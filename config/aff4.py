@@ -27,3 +27,13 @@ config_lib.DEFINE_string(
     "AFF4.change_email", None,
     "Email used by AFF4NotificationEmailListener to notify "
     "about AFF4 changes.")
+
+config_lib.DEFINE_integer(
+    "AFF4.deletion_batch_size", 1000,
+    "Number of objects deleted at a time when recursively deleting AFF4 "
+    "objects.")
+
+config_lib.DEFINE_integer(
+    "AFF4.max_deleted_objects_per_second", 0,
+    "Recursive deletions sleep between batches to delete at most this many "
+    "objects per second. 0 means unlimited.")
@@ -17,6 +17,23 @@ config_lib.DEFINE_string("Datastore.implementation", "FakeDataStore",
 config_lib.DEFINE_integer("Datastore.transaction_timeout", default=600,
                           help="How long do we wait for a transaction lock.")
 
+config_lib.DEFINE_bool("Datastore.enable_instrumentation", default=True,
+                       help="Record latency and volume of every data store "
+                       "operation in the datastore_operation_* metrics.")
+
+config_lib.DEFINE_string("Datastore.trace_path", default="",
+                         help="If set, every data store operation is recorded "
+                         "to a workload trace at this path, which can be "
+                         "replayed with the replay_data_store_trace tool.")
+
+config_lib.DEFINE_bool("Datastore.trace_anonymise", default=False,
+                       help="Replace subjects and attribute names in the "
+                       "workload trace by consistent pseudonyms.")
+
+config_lib.DEFINE_string("Datastore.trace_anonymisation_key", default="",
+                         help="Key for the trace pseudonyms. A random key is "
+                         "used if empty, so pseudonyms differ between traces.")
+
 DATASTORE_PATHING = [r"%{(?P<path>files/hash/generic/sha256/...).*}",
                      r"%{(?P<path>files/hash/generic/sha1/...).*}",
                      r"%{(?P<path>files/hash/generic/md5/...).*}",
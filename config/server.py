@@ -16,10 +16,29 @@ config_lib.DEFINE_integer("Worker.well_known_flow_lease_time", 600,
                           "Duration of a well known flow lease time in "
                           "seconds.")
 
+config_lib.DEFINE_integer("Worker.max_running_sessions_per_flow", 10,
+                          "The maximum number of sessions of a single flow "
+                          "or hunt the worker processes at the same time. "
+                          "If 0, the number is not limited.")
+
 config_lib.DEFINE_integer("Worker.compaction_lease_time", 3600,
                           "Duration of collections lease time for compaction "
                           "in seconds.")
 
+config_lib.DEFINE_integer("Worker.hunt_results_threadpool_size", 10,
+                          "Number of threads used to process hunts results "
+                          "in parallel, and to run output plugins of a hunt "
+                          "in parallel. If 0, hunts results are processed "
+                          "serially in the calling thread.")
+
+config_lib.DEFINE_integer("Export.metadata_cache_max_size", 10000,
+                          "Maximum number of clients whose metadata is "
+                          "cached by export converters.")
+
+config_lib.DEFINE_integer("Export.metadata_cache_age", 600,
+                          "The number of seconds clients metadata lives in "
+                          "the export converters cache.")
+
 config_lib.DEFINE_bool("Worker.enable_packed_versioned_collection_journaling",
                        False, "If True, all Add*() operations and all "
                        "compactions of PackedVersionedCollections will be "
@@ -268,6 +287,13 @@ config_lib.DEFINE_integer("StatsStore.ttl", default=60 * 60 * 24 * 3,
                           help="Maximum lifetime (in seconds) of data in the "
                           "stats store. Default is three days.")
 
+config_lib.DEFINE_list("StatsStore.rollups", ["5m:30d", "1h:365d"],
+                       help="Rollups of the stats data, as <interval>:<ttl> "
+                       "durations. The first sample of every interval is "
+                       "also written to the rollup and kept for ttl, so "
+                       "queries over long time ranges can read the rollups "
+                       "instead of every raw sample.")
+
 config_lib.DEFINE_list("ConfigIncludes", [],
                        "List of additional config files to include. Files are "
                        "processed recursively depth-first, later values "
@@ -298,3 +324,13 @@ config_lib.DEFINE_semantic(
 config_lib.DEFINE_string("DataRetention.hunts_ttl_exception_label",
                          default="retain", help="Hunts marked with this label "
                          "will be retained forever.")
+
+config_lib.DEFINE_integer("DataRetention.deletion_batch_size", 100,
+                          help="Number of expired objects the data retention "
+                          "cron jobs delete at a time.")
+
+config_lib.DEFINE_integer("DataRetention.max_deleted_objects_per_second", 1000,
+                          help="The data retention cron jobs sleep between "
+                          "batches to delete at most this many objects "
+                          "(including children) per second. 0 means "
+                          "unlimited.")
@@ -10,9 +10,12 @@ from grr.gui import api_value_renderers
 
 from grr.lib import aff4
 from grr.lib import client_index
+from grr.lib import data_store
 from grr.lib import flow
+from grr.lib import rdfvalue
 from grr.lib import utils
 
+from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import structs as rdf_structs
 
 from grr.proto import api_pb2
@@ -84,22 +87,24 @@ class ApiClientsAddLabelsRenderer(api_call_renderers.ApiCallRenderer):
     audit_events = []
 
     try:
+      # Only existing clients are labelled.
+      labelled_urns = aff4.FACTORY.MultiAddLabels(
+          [rdf_client.ClientURN(urn) for urn in args.client_ids], args.labels,
+          aff4_type="VFSGRRClient", token=token)
+      client_urns = [rdf_client.ClientURN(urn) for urn in labelled_urns]
+
       index = aff4.FACTORY.Create(client_index.MAIN_INDEX,
                                   aff4_type="ClientIndex",
                                   mode="rw",
                                   token=token)
-      client_objs = aff4.FACTORY.MultiOpen(
-          args.client_ids, aff4_type="VFSGRRClient", mode="rw", token=token)
-      for client_obj in client_objs:
-        client_obj.AddLabels(*args.labels)
-        index.AddClient(client_obj)
-        client_obj.Close()
+      index.AddClientLabels(client_urns, args.labels)
 
+      for client_urn in client_urns:
         audit_events.append(
             flow.AuditEvent(
                 user=token.username, action="CLIENT_ADD_LABEL",
                 flow_name="renderer.ApiClientsAddLabelsRenderer",
-                client=client_obj.urn, description=audit_description))
+                client=client_urn, description=audit_description))
 
       return dict(status="OK")
     finally:
@@ -117,16 +122,31 @@ class ApiClientsRemoveLabelsRenderer(api_call_renderers.ApiCallRenderer):
   args_type = ApiClientsRemoveLabelsRendererArgs
   privileged = True
 
-  def RemoveClientLabels(self, client, labels_names):
-    """Removes labels with given names from a given client object."""
-
-    affected_owners = set()
-    for label in client.GetLabels():
-      if label.name in labels_names and label.owner != "GRR":
-        affected_owners.add(label.owner)
-
-    for owner in affected_owners:
-      client.RemoveLabels(*labels_names, owner=owner)
+  def RemoveClientsLabels(self, client_urns, labels_names, token=None):
+    """Removes labels with given names from the given clients."""
+    labels_attribute = aff4.VFSGRRClient.SchemaCls.LABELS
+
+    # Only the labels of the given clients are read. Labels are removed for
+    # every owner but GRR itself.
+    owners_urns = {}
+    for subject, values in data_store.DB.MultiResolveRegex(
+        [utils.SmartUnicode(urn) for urn in client_urns],
+        [labels_attribute.predicate],
+        timestamp=data_store.DB.NEWEST_TIMESTAMP, token=token):
+      for _, value, _ in values:
+        try:
+          labels = labels_attribute.attribute_type(initializer=value)
+        except rdfvalue.DecodeError:
+          continue
+
+        for label in labels:
+          if label.name in labels_names and label.owner != "GRR":
+            owners_urns.setdefault(label.owner, set()).add(
+                rdf_client.ClientURN(subject))
+
+    for owner, urns in owners_urns.iteritems():
+      aff4.FACTORY.MultiRemoveLabels(urns, labels_names, owner=owner,
+                                     aff4_type="VFSGRRClient", token=token)
 
   def Render(self, args, token=None):
     audit_description = ",".join(
@@ -135,24 +155,17 @@ class ApiClientsRemoveLabelsRenderer(api_call_renderers.ApiCallRenderer):
     audit_events = []
 
     try:
-      index = aff4.FACTORY.Create(client_index.MAIN_INDEX,
-                                  aff4_type="ClientIndex",
-                                  mode="rw",
-                                  token=token)
-      client_objs = aff4.FACTORY.MultiOpen(
-          args.client_ids, aff4_type="VFSGRRClient", mode="rw", token=token)
-      for client_obj in client_objs:
-        self.RemoveClientLabels(client_obj, args.labels)
-        # TODO(user): AddClient doesn't remove labels. Make sure removed labels
-        # are actually removed from the index.
-        index.AddClient(client_obj)
-        client_obj.Close()
+      client_urns = [rdf_client.ClientURN(urn) for urn in args.client_ids]
+      self.RemoveClientsLabels(client_urns, args.labels, token=token)
+      # TODO(user): The client index doesn't remove labels. Make sure removed
+      # labels are actually removed from the index.
 
+      for client_urn in client_urns:
         audit_events.append(
             flow.AuditEvent(
                 user=token.username, action="CLIENT_REMOVE_LABEL",
                 flow_name="renderer.ApiClientsRemoveLabelsRenderer",
-                client=client_obj.urn, description=audit_description))
+                client=client_urn, description=audit_description))
     finally:
       flow.Events.PublishMultipleEvents({"Audit": audit_events},
                                         token=token)
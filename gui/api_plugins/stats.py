@@ -71,10 +71,30 @@ class ApiStatsStoreMetricRenderer(api_call_renderers.ApiCallRenderer):
         metric_name=args.metric_name,
         timeseries=[])
 
+    requested_duration = end_time - start_time
+    if requested_duration >= rdfvalue.Duration("1d"):
+      sampling_duration = rdfvalue.Duration("5m")
+    elif requested_duration >= rdfvalue.Duration("6h"):
+      sampling_duration = rdfvalue.Duration("1m")
+    else:
+      sampling_duration = rdfvalue.Duration("30s")
+
+    # The data is resampled to sampling_duration, so a rollup that is not
+    # coarser than that has enough samples. Ranges older than such a rollup is
+    # kept for are read from a coarser one, and resampled to its interval.
+    rollup_interval = stats_store.RollupForSampling(sampling_duration,
+                                                    start_time=start_time)
+    if rollup_interval and rollup_interval > sampling_duration:
+      sampling_duration = rollup_interval
+
+    # Gaps are filled over at least one sample.
+    fill_window = max(rdfvalue.Duration("10m"), sampling_duration)
+
     data = stats_store.MultiReadStats(
         process_ids=filtered_ids,
         predicate_regex=utils.SmartStr(args.metric_name),
-        timestamp=(start_time, end_time))
+        timestamp=(start_time, end_time),
+        rollup_interval=rollup_interval)
 
     if not data:
       return result
@@ -88,17 +108,9 @@ class ApiStatsStoreMetricRenderer(api_call_renderers.ApiCallRenderer):
     if metric_metadata.fields_defs:
       query.InAll()
 
-    requested_duration = end_time - start_time
-    if requested_duration >= rdfvalue.Duration("1d"):
-      sampling_duration = rdfvalue.Duration("5m")
-    elif requested_duration >= rdfvalue.Duration("6h"):
-      sampling_duration = rdfvalue.Duration("1m")
-    else:
-      sampling_duration = rdfvalue.Duration("30s")
-
     if metric_metadata.metric_type == metric_metadata.MetricType.COUNTER:
       query.TakeValue().EnsureIsIncremental().Resample(sampling_duration)
-      query.FillMissing(rdfvalue.Duration("10m"))
+      query.FillMissing(fill_window)
     elif metric_metadata.metric_type == metric_metadata.MetricType.EVENT:
       if args.distribution_handling_mode == "DH_SUM":
         query.TakeDistributionSum()
@@ -109,10 +121,10 @@ class ApiStatsStoreMetricRenderer(api_call_renderers.ApiCallRenderer):
                          "value: %s." % args.distribution_handling_mode)
 
       query.EnsureIsIncremental().Resample(sampling_duration)
-      query.FillMissing(rdfvalue.Duration("10m"))
+      query.FillMissing(fill_window)
     elif metric_metadata.metric_type == metric_metadata.MetricType.GAUGE:
       query.TakeValue().Resample(sampling_duration)
-      query.FillMissing(rdfvalue.Duration("10m"))
+      query.FillMissing(fill_window)
     else:
       raise RuntimeError("Unsupported metric type.")
 
@@ -491,7 +491,7 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
     with self.ACLChecksDisabled():
       cronjobs.ScheduleSystemCronFlows(token=self.token)
       cronjobs.CRON_MANAGER.DisableJob(
-          rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     # Open up and click on Cron Job Viewer.
     self.Open("/")
@@ -499,7 +499,7 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
     self.Click("css=a[grrtarget=ManageCron]")
 
     # Select a cron job
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Click on Enable button and check that dialog appears.
     self.Click("css=button[name=EnableCronJob]")
@@ -531,12 +531,13 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
     self.WaitUntil(self.IsTextPresent, "The user test has requested")
 
     # Cron job overview should be visible
-    self.WaitUntil(self.IsTextPresent, "aff4:/cron/OSBreakDown")
+    self.WaitUntil(self.IsTextPresent, "aff4:/cron/ClientFleetStatsCronFlow")
     self.WaitUntil(self.IsTextPresent, "CRON_ARGS")
 
     self.Click("css=button:contains('Approve')")
     self.WaitUntil(self.IsTextPresent,
-                   "You have granted access for aff4:/cron/OSBreakDown to test")
+                   "You have granted access for "
+                   "aff4:/cron/ClientFleetStatsCronFlow to test")
 
     # Now test starts up
     self.Open("/")
@@ -549,8 +550,9 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
                    "a cron job')")
     self.Click("css=tr:contains('has granted you access') a")
 
-    # Enable OSBreakDown cron job (it should be selected by default).
-    self.Click("css=td:contains('OSBreakDown')")
+    # Enable ClientFleetStatsCronFlow cron job (it should be selected by
+    # default).
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Click on Enable and wait for dialog again.
     self.Click("css=button[name=EnableCronJob]")
@@ -567,7 +569,7 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
     token = access_control.ACLToken(username="approver")
     flow.GRRFlow.StartFlow(
         flow_name="GrantCronJobApprovalFlow",
-        subject_urn=rdfvalue.RDFURN("aff4:/cron/OSBreakDown"),
+        subject_urn=rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"),
         reason=self.reason, delegate="test", token=token)
 
     # Now test starts up
@@ -580,9 +582,10 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
     # Wait for modal backdrop to go away.
     self.WaitUntilNot(self.IsVisible, "css=.modal-backdrop")
 
-    self.WaitUntil(self.IsTextPresent, "OSBreakDown")
+    self.WaitUntil(self.IsTextPresent, "ClientFleetStatsCronFlow")
 
-    # Enable OSBreakDown cron job (it should be selected by default).
+    # Enable ClientFleetStatsCronFlow cron job (it should be selected by
+    # default).
     self.Click("css=button[name=EnableCronJob]")
     self.WaitUntil(self.IsTextPresent,
                    "Are you sure you want to ENABLE this cron job?")
@@ -602,8 +605,8 @@ class TestACLWorkflow(test_lib.GRRSeleniumTest):
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
 
-    # Select and enable OSBreakDown cron job.
-    self.Click("css=td:contains('OSBreakDown')")
+    # Select and enable ClientFleetStatsCronFlow cron job.
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Click on Enable button and check that dialog appears.
     self.Click("css=button[name=EnableCronJob]")
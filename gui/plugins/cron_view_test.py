@@ -21,8 +21,8 @@ class TestCronView(test_lib.GRRSeleniumTest):
 
   def AddJobStatus(self, job, status):
     with self.ACLChecksDisabled():
-      with aff4.FACTORY.OpenWithLock("aff4:/cron/OSBreakDown",
-                                     token=self.token) as job:
+      with aff4.FACTORY.OpenWithLock(
+          "aff4:/cron/ClientFleetStatsCronFlow", token=self.token) as job:
         job.Set(job.Schema.LAST_RUN_TIME(rdfvalue.RDFDatetime().Now()))
         job.Set(job.Schema.LAST_RUN_STATUS(status=status))
 
@@ -45,16 +45,17 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.WaitUntil(self.IsTextPresent, "Last Run")
 
     # Table should contain system cron jobs
-    self.WaitUntil(self.IsTextPresent, "GRRVersionBreakDown")
-    self.WaitUntil(self.IsTextPresent, "LastAccessStats")
-    self.WaitUntil(self.IsTextPresent, "OSBreakDown")
+    self.WaitUntil(self.IsTextPresent, "FilestoreStatsCronFlow")
+    self.WaitUntil(self.IsTextPresent, "InterrogateClientsCronFlow")
+    self.WaitUntil(self.IsTextPresent, "ClientFleetStatsCronFlow")
 
     # Select a Cron.
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Check that there's one flow in the list.
-    self.WaitUntil(self.IsElementPresent,
-                   "css=#main_bottomPane td:contains('OSBreakDown')")
+    self.WaitUntil(
+        self.IsElementPresent,
+        "css=#main_bottomPane td:contains('ClientFleetStatsCronFlow')")
 
   def testMessageIsShownWhenNoCronJobSelected(self):
     self.Open("/")
@@ -68,7 +69,7 @@ class TestCronView(test_lib.GRRSeleniumTest):
   def testShowsCronJobDetailsOnClick(self):
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Tabs should appear in the bottom pane
     self.WaitUntil(self.IsElementPresent, "css=#main_bottomPane #Details")
@@ -81,7 +82,8 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.Click("css=#main_bottomPane #Flows")
 
     # Click on the first flow and wait for flow details panel to appear.
-    self.Click("css=#main_bottomPane td:contains('OSBreakDown')")
+    self.Click(
+        "css=#main_bottomPane td:contains('ClientFleetStatsCronFlow')")
     self.WaitUntil(self.IsTextPresent, "FLOW_STATE")
     self.WaitUntil(self.IsTextPresent, "next_states")
     self.WaitUntil(self.IsTextPresent, "outstanding_requests")
@@ -95,11 +97,11 @@ class TestCronView(test_lib.GRRSeleniumTest):
   def testToolbarStateForDisabledCronJob(self):
     with self.ACLChecksDisabled():
       cronjobs.CRON_MANAGER.DisableJob(
-          rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     self.assertTrue(self.IsElementPresent(
         "css=button[name=EnableCronJob]:not([disabled])"))
@@ -111,11 +113,11 @@ class TestCronView(test_lib.GRRSeleniumTest):
   def testToolbarStateForEnabledCronJob(self):
     with self.ACLChecksDisabled():
       cronjobs.CRON_MANAGER.EnableJob(
-          rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     self.assertTrue(self.IsElementPresent(
         "css=button[name=EnableCronJob][disabled]"))
@@ -127,11 +129,11 @@ class TestCronView(test_lib.GRRSeleniumTest):
   def testEnableCronJob(self):
     with self.ACLChecksDisabled():
       cronjobs.CRON_MANAGER.DisableJob(
-          rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Click on Enable button and check that dialog appears.
     self.Click("css=button[name=EnableCronJob]")
@@ -149,7 +151,8 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.WaitUntilNot(self.IsVisible, "css=.modal-backdrop")
 
     with self.ACLChecksDisabled():
-      self.GrantCronJobApproval(rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+      self.GrantCronJobApproval(
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     # Click on Enable button and check that dialog appears.
     self.Click("css=button[name=EnableCronJob]")
@@ -168,18 +171,19 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.WaitUntilNot(self.IsVisible, "css=.modal-backdrop")
 
     # View should be refreshed automatically.
-    self.WaitUntil(self.IsTextPresent, "OSBreakDown")
-    self.WaitUntil(self.IsElementPresent,
-                   "css=tr:contains('OSBreakDown') *[state=enabled]")
+    self.WaitUntil(self.IsTextPresent, "ClientFleetStatsCronFlow")
+    self.WaitUntil(
+        self.IsElementPresent,
+        "css=tr:contains('ClientFleetStatsCronFlow') *[state=enabled]")
 
   def testDisableCronJob(self):
     with self.ACLChecksDisabled():
       cronjobs.CRON_MANAGER.EnableJob(
-          rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Click on Enable button and check that dialog appears.
     self.Click("css=button[name=DisableCronJob]")
@@ -195,7 +199,8 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.WaitUntilNot(self.IsVisible, "css=.modal-backdrop")
 
     with self.ACLChecksDisabled():
-      self.GrantCronJobApproval(rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+      self.GrantCronJobApproval(
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     # Click on Disable button and check that dialog appears.
     self.Click("css=button[name=DisableCronJob]")
@@ -214,18 +219,19 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.WaitUntilNot(self.IsVisible, "css=.modal-backdrop")
 
     # View should be refreshed automatically.
-    self.WaitUntil(self.IsTextPresent, "OSBreakDown")
-    self.WaitUntil(self.IsElementPresent,
-                   "css=tr:contains('OSBreakDown') *[state=disabled]")
+    self.WaitUntil(self.IsTextPresent, "ClientFleetStatsCronFlow")
+    self.WaitUntil(
+        self.IsElementPresent,
+        "css=tr:contains('ClientFleetStatsCronFlow') *[state=disabled]")
 
   def testDeleteCronJob(self):
     with self.ACLChecksDisabled():
       cronjobs.CRON_MANAGER.EnableJob(
-          rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     self.Open("/")
     self.Click("css=a[grrtarget=ManageCron]")
-    self.Click("css=td:contains('OSBreakDown')")
+    self.Click("css=td:contains('ClientFleetStatsCronFlow')")
 
     # Click on Enable button and check that dialog appears.
     self.Click("css=button[name=DeleteCronJob]")
@@ -241,7 +247,8 @@ class TestCronView(test_lib.GRRSeleniumTest):
     self.WaitUntilNot(self.IsVisible, "css=.modal-backdrop")
 
     with self.ACLChecksDisabled():
-      self.GrantCronJobApproval(rdfvalue.RDFURN("aff4:/cron/OSBreakDown"))
+      self.GrantCronJobApproval(
+          rdfvalue.RDFURN("aff4:/cron/ClientFleetStatsCronFlow"))
 
     # Click on Disable button and check that dialog appears.
     self.Click("css=button[name=DeleteCronJob]")
@@ -261,9 +268,10 @@ class TestCronView(test_lib.GRRSeleniumTest):
 
     # View should be refreshed automatically.
     self.WaitUntil(self.IsElementPresent,
-                   "css=#main_topPane td:contains('GRRVersionBreakDown')")
-    self.WaitUntilNot(self.IsElementPresent,
-                      "css=#main_topPane td:contains('OSBreakDown')")
+                   "css=#main_topPane td:contains('FilestoreStatsCronFlow')")
+    self.WaitUntilNot(
+        self.IsElementPresent,
+        "css=#main_topPane td:contains('ClientFleetStatsCronFlow')")
 
   def testHuntSchedulingWorksCorrectly(self):
     self.Open("/")
@@ -395,7 +403,7 @@ $("button:contains('Add Rule')").parent().scrollTop(10000)
     # Make sure a lot of time has passed since the last
     # execution
     with test_lib.FakeTime(0):
-      self.AddJobStatus("aff4:/cron/OSBreakDown",
+      self.AddJobStatus("aff4:/cron/ClientFleetStatsCronFlow",
                         grr_rdf.CronJobRunStatus.Status.OK)
 
     self.Open("/")
@@ -403,17 +411,17 @@ $("button:contains('Add Rule')").parent().scrollTop(10000)
     self.WaitUntil(self.IsElementPresent, "client_query")
     self.Click("css=a[grrtarget=ManageCron]")
 
-    # OSBreakDown's row should have a 'warn' class
+    # ClientFleetStatsCronFlow's row should have a 'warn' class
     self.WaitUntil(self.IsElementPresent,
-                   "css=tr.warning td:contains('OSBreakDown')")
+                   "css=tr.warning td:contains('ClientFleetStatsCronFlow')")
 
-    # Check that only OSBreakDown is highlighted
+    # Check that only ClientFleetStatsCronFlow is highlighted
     self.WaitUntilNot(self.IsElementPresent,
-                      "css=tr.warning td:contains('GRRVersionBreakDown')")
+                      "css=tr.warning td:contains('FilestoreStatsCronFlow')")
 
   def testFailingCronJobIsHighlighted(self):
     for _ in range(4):
-      self.AddJobStatus("aff4:/cron/OSBreakDown",
+      self.AddJobStatus("aff4:/cron/ClientFleetStatsCronFlow",
                         grr_rdf.CronJobRunStatus.Status.ERROR)
 
     self.Open("/")
@@ -421,12 +429,12 @@ $("button:contains('Add Rule')").parent().scrollTop(10000)
     self.WaitUntil(self.IsElementPresent, "client_query")
     self.Click("css=a[grrtarget=ManageCron]")
 
-    # OSBreakDown's row should have an 'error' class
+    # ClientFleetStatsCronFlow's row should have an 'error' class
     self.WaitUntil(self.IsElementPresent,
-                   "css=tr.danger td:contains('OSBreakDown')")
-    # Check that only OSBreakDown is highlighted
+                   "css=tr.danger td:contains('ClientFleetStatsCronFlow')")
+    # Check that only ClientFleetStatsCronFlow is highlighted
     self.WaitUntilNot(self.IsElementPresent,
-                      "css=tr.danger td:contains('GRRVersionBreakDown')")
+                      "css=tr.danger td:contains('FilestoreStatsCronFlow')")
 
 
 def main(argv):
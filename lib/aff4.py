@@ -8,6 +8,7 @@ import __builtin__
 import abc
 import itertools
 import StringIO
+import threading
 import time
 import zlib
 
@@ -261,9 +262,225 @@ class DeletionPool(object):
     return self._urns_for_deletion
 
 
+class RecursiveDeletion(object):
+  """Deletes object hierarchies a batch at a time.
+
+  The hierarchies are walked depth first through the children indexes, which
+  are paged with ScanAttributes, so at most a page of children per level is
+  held in memory however large the hierarchy is. Objects are deleted after
+  their children, a batch per DeleteSubjects call, so an interrupted deletion
+  leaves the remaining objects reachable: it can be resumed from the last
+  cursor passed to the progress callback, or simply started again.
+
+  Only the objects whose class overrides OnDelete() are opened, the others
+  are deleted after reading just their type.
+  """
+
+  INDEX_PREFIX = "index:dir/"
+
+  def __init__(self, urns, batch_size=None, max_rate=None,
+               progress_callback=None, token=None):
+    """Constructor.
+
+    Args:
+      urns: Urns of the objects to delete along with their children.
+      batch_size: The number of objects deleted at a time. Defaults to
+          AFF4.deletion_batch_size.
+      max_rate: The maximum number of objects deleted per second, 0 means
+          unlimited. Defaults to AFF4.max_deleted_objects_per_second.
+      progress_callback: Called with the number of objects deleted so far and
+          the current cursor after every batch.
+      token: The Security Token to use.
+
+    Raises:
+      ValueError: if token is None.
+    """
+    if token is None:
+      raise ValueError("token can't be None")
+
+    if max_rate is None:
+      max_rate = config_lib.CONFIG["AFF4.max_deleted_objects_per_second"]
+
+    self.urns = self._RootUrns(urns)
+    self.batch_size = (batch_size or
+                       config_lib.CONFIG["AFF4.deletion_batch_size"])
+    self.max_rate = max_rate
+    self.progress_callback = progress_callback
+    self.token = token
+
+    self.deleted = 0
+    self.roots_done = 0
+    self.stack = []
+    self.batch = []
+    self.batch_started = time.time()
+
+  @property
+  def cursor(self):
+    """A serializable position to resume this deletion from."""
+    return dict(roots_done=self.roots_done,
+                stack=[(utils.SmartUnicode(frame["urn"]), frame["after"])
+                       for frame in self.stack])
+
+  def _RootUrns(self, urns):
+    """Sorts the urns, dropping the ones inside the others' hierarchies."""
+    urns = set(rdfvalue.RDFURN(urn) for urn in urns)
+
+    roots = []
+    for urn in sorted(urns):
+      parent = urn
+      while parent.Path() != "/":
+        parent = rdfvalue.RDFURN(parent.Dirname())
+        if parent in urns:
+          break
+      else:
+        roots.append(urn)
+
+    return roots
+
+  def _Frame(self, urn, after=None):
+    return dict(urn=rdfvalue.RDFURN(urn), after=after, pending=[],
+                exhausted=False)
+
+  def Run(self, cursor=None):
+    """Deletes the objects and all their children.
+
+    Args:
+      cursor: A cursor passed to the progress callback of an interrupted
+          deletion of the same urns, to resume it from.
+
+    Returns:
+      The number of objects deleted.
+    """
+    if cursor:
+      self.roots_done = cursor["roots_done"]
+      self.stack = [self._Frame(urn, after) for urn, after in cursor["stack"]]
+
+    for root in self.urns[self.roots_done:]:
+      if not self.stack:
+        self.stack = [self._Frame(root)]
+      self._DeleteTree()
+
+    return self.deleted
+
+  def _DeleteTree(self):
+    """Deletes the hierarchy on the stack, children first."""
+    while self.stack:
+      frame = self.stack[-1]
+      if not frame["pending"] and not frame["exhausted"]:
+        page = data_store.DB.ScanAttributes(
+            frame["urn"], self.INDEX_PREFIX + ".+", after=frame["after"],
+            limit=self.batch_size, token=self.token)
+        # Pending children are popped from the end.
+        frame["pending"] = [column for column, _, _ in reversed(page)]
+        frame["exhausted"] = len(page) < self.batch_size
+
+      if frame["pending"]:
+        child = frame["urn"].Add(
+            frame["pending"][-1][len(self.INDEX_PREFIX):])
+        self.stack.append(self._Frame(child))
+        continue
+
+      # All the children of this object are gone, so it can go too.
+      self.stack.pop()
+      self.batch.append(frame["urn"])
+      if self.stack:
+        parent = self.stack[-1]
+        parent["after"] = parent["pending"].pop()
+
+        if len(self.batch) >= self.batch_size:
+          self._DeleteBatch()
+      else:
+        self.roots_done += 1
+        self._DeleteBatch(root=frame["urn"])
+
+  def _DeleteBatch(self, root=None):
+    """Deletes the queued objects, running their OnDelete hooks first."""
+    deletion_pool = DeletionPool(token=self.token)
+
+    type_predicate = AFF4Object.SchemaCls.TYPE.predicate
+    hooked_urns = []
+    for subject, values in data_store.DB.MultiResolveRegex(
+        self.batch, [type_predicate],
+        timestamp=data_store.DB.NEWEST_TIMESTAMP, token=self.token):
+      for _, aff4_type, _ in values:
+        aff4_cls = AFF4Object.classes.get(utils.SmartStr(aff4_type))
+        if (aff4_cls is not None and
+            aff4_cls.OnDelete.im_func is not AFF4Object.OnDelete.im_func):
+          hooked_urns.append(subject)
+          break
+
+    for obj in deletion_pool.MultiOpen(hooked_urns):
+      obj.OnDelete(deletion_pool=deletion_pool)
+
+    # Hooks can mark dependent objects elsewhere for deletion too.
+    index_roots = list(deletion_pool.root_urns_for_deletion)
+    if root is not None:
+      index_roots.append(root)
+
+    urns = set(self.batch) | set(deletion_pool.urns_for_deletion)
+    for urn in urns:
+      try:
+        FACTORY.intermediate_cache.ExpireObject(urn.Path())
+      except KeyError:
+        pass
+
+    data_store.DB.DeleteSubjects(list(urns), sync=False, token=self.token)
+    FACTORY.MultiDeleteChildrenFromIndex(index_roots, token=self.token)
+
+    self.deleted += len(urns)
+    self.batch = []
+
+    if self.max_rate:
+      delay = float(len(urns)) / self.max_rate - (time.time() -
+                                                    self.batch_started)
+      if delay > 0:
+        time.sleep(delay)
+    self.batch_started = time.time()
+
+    if self.progress_callback:
+      self.progress_callback(self.deleted, self.cursor)
+
+
+# Per thread list of the writes deferred by a WriteBatch.
+_WRITE_BATCH = threading.local()
+
+
+class WriteBatch(object):
+  """Batches the asynchronous AFF4 writes done in this context.
+
+  Objects closed or flushed with sync=False in this context are written when
+  it exits, all of them in a single data store operation (split by token) and
+  a single child index update, instead of a few data store operations each.
+  Synchronous writes, which include all the writes of locked objects, are
+  done immediately.
+
+  Usage:
+
+  with aff4.WriteBatch():
+    for stat_entry in stat_entries:
+      ... create the object for the entry and Close(sync=False) it ...
+  """
+
+  def __enter__(self):
+    # Nested batches are written when the outermost one exits.
+    self.outermost = getattr(_WRITE_BATCH, "writes", None) is None
+    if self.outermost:
+      _WRITE_BATCH.writes = []
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    if self.outermost:
+      writes, _WRITE_BATCH.writes = _WRITE_BATCH.writes, None
+      FACTORY.MultiSetAttributes(writes)
+
+
 class Factory(object):
   """A central factory for AFF4 objects."""
 
+  # The number of objects whose children are listed at a time when walking a
+  # hierarchy.
+  LIST_BATCH_SIZE = 1000
+
   def __init__(self):
     # This is a relatively short lived cache of objects.
     self.cache = utils.AgeBasedCache(
@@ -338,6 +555,14 @@ class Factory(object):
     except KeyError:
       pass
 
+    batch = getattr(_WRITE_BATCH, "writes", None)
+    if batch is not None and not sync:
+      # The caller clears its attributes and deletions after this returns, so
+      # keep copies until the batch is written.
+      batch.append((urn, dict(attributes), set(to_delete), add_child_index,
+                    token))
+      return
+
     attributes[AFF4Object.SchemaCls.LAST] = [
         rdfvalue.RDFDatetime().Now().SerializeToDataStore()]
     to_delete.add(AFF4Object.SchemaCls.LAST)
@@ -348,6 +573,52 @@ class Factory(object):
     # critical.
     self._UpdateIndex(urn, attributes, add_child_index, token)
 
+  def MultiSetAttributes(self, writes):
+    """Performs many SetAttributes() calls with few data store operations.
+
+    Args:
+      writes: A list of (urn, attributes, to_delete, add_child_index, token)
+        tuples, the arguments of the SetAttributes() calls.
+    """
+    now = rdfvalue.RDFDatetime().Now().SerializeToDataStore()
+
+    values = {}
+    to_delete = {}
+    child_index_urns = []
+    batch_token = None
+    for urn, attributes, attributes_to_delete, add_child_index, token in writes:
+      # All the subjects of a data store call are written with the same token.
+      # A subject written twice needs its first write to be done before the
+      # second one's to_delete is applied.
+      if values and (urn in values or token != batch_token):
+        self._WriteBatch(values, to_delete, child_index_urns, batch_token)
+        values, to_delete, child_index_urns = {}, {}, []
+
+      batch_token = token
+      attributes[AFF4Object.SchemaCls.LAST] = [now]
+      attributes_to_delete.add(AFF4Object.SchemaCls.LAST)
+      values[urn] = attributes
+      to_delete[urn] = attributes_to_delete
+      self._UpdateIndex(urn, attributes, False, token)
+      if add_child_index:
+        child_index_urns.append(urn)
+
+    if values:
+      self._WriteBatch(values, to_delete, child_index_urns, batch_token)
+
+  def _WriteBatch(self, values, to_delete, child_index_urns, token):
+    data_store.DB.MultiSetMulti(values, to_delete=to_delete, replace=False,
+                                sync=False, token=token)
+
+    try:
+      # The objects might have been read while their writes were deferred.
+      self.cache.ExpirePrefix(
+          tuple(utils.SmartStr(urn) + ":" for urn in values))
+    except KeyError:
+      pass
+
+    self._MultiUpdateChildIndex(child_index_urns, token)
+
   def _UpdateIndex(self, urn, attributes, add_child_index, token):
     """Updates any indexes we need."""
     index = {}
@@ -384,30 +655,39 @@ class Factory(object):
 
       token: The token to use.
     """
-    try:
-      # Create navigation aids by touching intermediate subject names.
-      while urn.Path() != "/":
-        basename = urn.Basename()
-        dirname = rdfvalue.RDFURN(urn.Dirname())
+    self._MultiUpdateChildIndex([urn], token)
 
+  def _MultiUpdateChildIndex(self, urns, token):
+    """Updates the child indexes of many urns in one operation."""
+    # Create navigation aids by touching intermediate subject names. All the
+    # parents that are not yet known to exist are written in one operation.
+    to_set = {}
+    indexed = set()
+    now = rdfvalue.RDFDatetime().Now().SerializeToDataStore()
+    for urn in urns:
+      while urn.Path() != "/" and urn not in indexed:
         try:
           self.intermediate_cache.Get(urn)
-          return
+          break
         except KeyError:
-          data_store.DB.MultiSet(dirname, {
-              AFF4Object.SchemaCls.LAST: [
-                  rdfvalue.RDFDatetime().Now().SerializeToDataStore()],
+          dirname = rdfvalue.RDFURN(urn.Dirname())
+          to_set.setdefault(dirname, {AFF4Object.SchemaCls.LAST: [now]})[
               # This updates the directory index.
-              "index:dir/%s" % utils.SmartStr(basename): [EMPTY_DATA],
-          },
-                                 token=token, replace=True, sync=False)
-
-          self.intermediate_cache.Put(urn, 1)
-
+              "index:dir/%s" % utils.SmartStr(urn.Basename())] = [EMPTY_DATA]
+          indexed.add(urn)
           urn = dirname
 
+    if not to_set:
+      return
+
+    try:
+      data_store.DB.MultiSetMulti(to_set, token=token, replace=True,
+                                  sync=False)
     except access_control.UnauthorizedAccess:
-      pass
+      return
+
+    for urn in indexed:
+      self.intermediate_cache.Put(urn, 1)
 
   def _DeleteChildFromIndex(self, urn, token):
     try:
@@ -430,6 +710,32 @@ class Factory(object):
     except access_control.UnauthorizedAccess:
       pass
 
+  def MultiDeleteChildrenFromIndex(self, urns, token):
+    """Removes the urns from the children indexes of their parents."""
+    to_delete = {}
+    for urn in urns:
+      try:
+        self.intermediate_cache.ExpireObject(urn.Path())
+      except KeyError:
+        pass
+
+      to_delete.setdefault(rdfvalue.RDFURN(urn.Dirname()), []).append(
+          "index:dir/%s" % utils.SmartStr(urn.Basename()))
+
+    if not to_delete:
+      return
+
+    now = rdfvalue.RDFDatetime().Now().SerializeToDataStore()
+    try:
+      data_store.DB.MultiSetMulti(
+          dict((dirname, {AFF4Object.SchemaCls.LAST: [now]})
+               for dirname in to_delete),
+          to_delete=to_delete, token=token, replace=True, sync=False)
+    except access_control.UnauthorizedAccess:
+      # Update the parents we are allowed to write to one at a time.
+      for urn in urns:
+        self._DeleteChildFromIndex(urn, token)
+
   def _ExpandURNComponents(self, urn, unique_urns):
     """This expands URNs.
 
@@ -896,15 +1202,159 @@ class Factory(object):
 
     return result
 
-  def MultiDelete(self, urns, token=None):
+  def MultiAddLabels(self, urns, labels_names, owner=None, sync=True,
+                     aff4_type=None, token=None):
+    """Adds labels to many objects without opening them.
+
+    This is the bulk version of AFF4Object.AddLabels(): the labels of all the
+    objects are read and written in single data store operations and each
+    labels index is flushed once.
+
+    Args:
+      urns: The urns of the objects to label. Objects that do not exist are
+            skipped.
+      labels_names: The names of the labels to add.
+      owner: The owner of the labels, defaults to the token's user.
+      sync: Write the labels synchronously to the data store.
+      aff4_type: If set, objects which are not of this type are skipped, as
+            MultiOpen would.
+      token: The Security Token to use.
+
+    Returns:
+      The urns of the objects which were not skipped.
+    """
+    return self._MultiUpdateLabels(urns, labels_names, owner, False, sync,
+                                   aff4_type, token)
+
+  def MultiRemoveLabels(self, urns, labels_names, owner=None, sync=True,
+                        aff4_type=None, token=None):
+    """Removes labels from many objects without opening them.
+
+    This is the bulk version of AFF4Object.RemoveLabels().
+
+    Args:
+      urns: The urns of the objects to remove the labels from. Objects that do
+            not exist are skipped.
+      labels_names: The names of the labels to remove.
+      owner: The owner of the labels, defaults to the token's user.
+      sync: Write the labels synchronously to the data store.
+      aff4_type: If set, objects which are not of this type are skipped, as
+            MultiOpen would.
+      token: The Security Token to use.
+
+    Returns:
+      The urns of the objects which were not skipped.
+    """
+    return self._MultiUpdateLabels(urns, labels_names, owner, True, sync,
+                                   aff4_type, token)
+
+  def _MultiUpdateLabels(self, urns, labels_names, owner, remove, sync,
+                         aff4_type, token):
+    """Adds or removes labels on many objects and updates the indexes."""
+    if token is None:
+      token = data_store.default_token
+
+    if owner is None:
+      if not token:
+        raise RuntimeError("Can't update labels: No owner specified and "
+                           "no access token available.")
+      owner = token.username
+
+    schema = AFF4Object.SchemaCls
+    now = rdfvalue.RDFDatetime().Now()
+
+    to_set = {}
+    matching_urns = []
+    # Maps the labels index of each object type to the urns to update in it.
+    indexed_urns = {}
+    for subject, values in data_store.DB.MultiResolveRegex(
+        [utils.SmartUnicode(rdfvalue.RDFURN(u)) for u in urns],
+        [schema.TYPE.predicate, schema.LABELS.predicate],
+        timestamp=data_store.DB.NEWEST_TIMESTAMP, token=token):
+      newest = {}
+      for attribute, value, ts in values:
+        if attribute not in newest or newest[attribute][1] < ts:
+          newest[attribute] = (value, ts)
+
+      # Only existing objects are labelled, as MultiOpen would.
+      if schema.TYPE.predicate not in newest:
+        continue
+
+      aff4_cls = AFF4Object.classes.get(
+          utils.SmartStr(newest[schema.TYPE.predicate][0]), AFF4Volume)
+      if (aff4_type is not None and
+          not issubclass(aff4_cls, AFF4Object.classes[aff4_type])):
+        continue
+
+      matching_urns.append(rdfvalue.RDFURN(subject))
+
+      labels = schema.LABELS.attribute_type()
+      if schema.LABELS.predicate in newest:
+        value, ts = newest[schema.LABELS.predicate]
+        try:
+          labels = schema.LABELS.attribute_type(initializer=value, age=ts)
+        except rdfvalue.DecodeError:
+          pass
+
+      changed = False
+      for label_name in labels_names:
+        if remove:
+          if labels.HasLabelWithNameAndOwner(label_name, owner):
+            labels.RemoveLabel(aff4_rdfvalues.AFF4ObjectLabel(
+                name=label_name, owner=owner))
+            changed = True
+        else:
+          changed |= labels.AddLabel(aff4_rdfvalues.AFF4ObjectLabel(
+              name=label_name, owner=owner, timestamp=now))
+
+      # Stale index entries are removed even if the object was not labelled.
+      if changed or remove:
+        indexed_urns.setdefault(aff4_cls.labels_index_urn, []).append(
+            rdfvalue.RDFURN(subject))
+
+      if changed:
+        to_set[subject] = {
+            schema.LABELS: [labels.SerializeToDataStore()],
+            schema.LAST: [now.SerializeToDataStore()]}
+
+    if to_set:
+      data_store.DB.MultiSetMulti(to_set, replace=True, sync=sync,
+                                  token=token)
+
+      try:
+        self.cache.ExpirePrefix(
+            tuple(utils.SmartStr(subject) + ":" for subject in to_set))
+      except KeyError:
+        pass
+
+    for labels_index_urn, index_urns in indexed_urns.iteritems():
+      labels_index = self.Create(labels_index_urn, "AFF4LabelsIndex",
+                                 mode="w", token=token)
+      if remove:
+        labels_index.RemoveLabels(index_urns, labels_names, owner=owner)
+      else:
+        labels_index.AddLabels(index_urns, labels_names, owner=owner)
+      labels_index.Close(sync=sync)
+
+    return matching_urns
+
+  def MultiDelete(self, urns, token=None, progress_callback=None):
     """Drop all the information about given objects.
 
     DANGEROUS! This recursively deletes all objects contained within the
     specified URN.
 
+    Objects are deleted in batches of AFF4.deletion_batch_size, at most
+    AFF4.max_deleted_objects_per_second a second. Use RecursiveDeletion
+    directly to resume an interrupted deletion.
+
     Args:
       urns: Urns of objects to remove.
       token: The Security Token to use for opening this item.
+      progress_callback: Called with the number of objects deleted so far and
+          the RecursiveDeletion cursor after every batch.
+    Returns:
+      The number of objects deleted.
     Raises:
       RuntimeError: If one of the urns is too short. This is a safety check to
       ensure the root is not removed.
@@ -918,40 +1368,14 @@ class Factory(object):
       if urn.Path() == "/":
         raise RuntimeError("Can't delete root URN. Please enter a valid URN")
 
-    deletion_pool = DeletionPool(token=token)
-    for urn in urns:
-      deletion_pool.MarkForDeletion(urn)
-
-    marked_root_urns = deletion_pool.root_urns_for_deletion
-    marked_urns = deletion_pool.urns_for_deletion
-
-    logging.debug(
-        u"Found %d objects to remove when removing %s",
-        len(marked_urns), urns)
-
-    logging.debug(
-        u"Removing %d root objects when removing %s: %s",
-        len(marked_root_urns), urns, marked_root_urns)
-
-    for root in marked_root_urns:
-      # Only the index of the parent object should be updated. Everything
-      # below the target object (along with indexes) is going to be
-      # deleted.
-      self._DeleteChildFromIndex(root, token)
-
-    for urn_to_delete in marked_urns:
-      try:
-        self.intermediate_cache.ExpireObject(urn_to_delete.Path())
-      except KeyError:
-        pass
-
-      data_store.DB.DeleteSubject(urn_to_delete, token=token, sync=False)
-      logging.debug(u"%s deleted from data store", urn_to_delete)
+    deleted = RecursiveDeletion(urns, progress_callback=progress_callback,
+                                token=token).Run()
 
     # Ensure this is removed from the cache as well.
     self.Flush()
 
-    logging.debug("Removed %d objects", len(marked_urns))
+    logging.debug(u"Removed %d objects when removing %s", deleted, urns)
+    return deleted
 
   def Delete(self, urn, token=None):
     """Drop all the information about this object.
@@ -1051,31 +1475,98 @@ class Factory(object):
        children lists for initial set of urns and then will fetch children's
        children, etc.
 
+       Every urn is listed once, even if it is reachable from several of the
+       given urns. Urns are listed up to LIST_BATCH_SIZE at a time with the
+       most recently found ones first, so the descendants of an urn are
+       listed before its later siblings.
+
        For example, for the following objects structure:
        a->
           b -> c
             -> d
 
        RecursiveMultiListChildren(['a']) will return:
-       [('a', ['b']), ('b', ['c', 'd'])]
+       [('a', ['b']), ('b', ['c', 'd']), ('c', []), ('d', [])]
+       where c and d are listed in the same batch, so their order depends on
+       the data store.
     """
-
+    # Children are listed a batch at a time, depth first, so only the urns
+    # waiting to be listed are kept rather than whole levels of the tree.
     checked_urns = set()
-    urns_to_check = urns
-    while True:
-      found_children = []
+    stack = list(urns)
+    while stack:
+      batch = []
+      while stack and len(batch) < self.LIST_BATCH_SIZE:
+        urn = stack.pop()
+        key = utils.SmartUnicode(urn)
+        if key not in checked_urns:
+          checked_urns.add(key)
+          batch.append(urn)
+
+      if not batch:
+        break
 
       for subject, values in self.MultiListChildren(
-          urns_to_check, token=token, limit=limit, age=age):
-
-        found_children.extend(values)
+          batch, token=token, limit=limit, age=age):
         yield subject, values
 
-      checked_urns.update(urns_to_check)
+        # Older versions of the index list the same children again, and the
+        # given urns may overlap.
+        stack.extend(sorted(set(urn for urn in values
+                                if utils.SmartUnicode(urn) not in checked_urns),
+                            reverse=True))
 
-      urns_to_check = set(found_children) - checked_urns
-      if not urns_to_check:
-        break
+  def ListSubtree(self, urns, attributes=None, batch_size=None, token=None):
+    """Streams the objects below the urns along with some of their attributes.
+
+    The hierarchies are walked through the children indexes. The index and
+    the requested attributes of a batch of objects are read in a single data
+    store round trip, and the objects are walked depth first, so only the
+    urns waiting to be read are held in memory rather than the whole subtree.
+
+    Args:
+      urns: The urns to list the descendants of.
+      attributes: A list of Attribute objects to read.
+      batch_size: The number of objects read at a time, defaults to
+          LIST_BATCH_SIZE.
+      token: The Security Token to use.
+
+    Yields:
+      (urn, values) tuples for every descendant of the urns, where values maps
+      the requested attributes the object has to their newest value. Objects
+      are yielded before their children.
+    """
+    batch_size = batch_size or self.LIST_BATCH_SIZE
+    index_prefix = "index:dir/"
+    attributes = dict((attribute.predicate, attribute)
+                      for attribute in attributes or [])
+    regexes = [index_prefix + ".+"] + sorted(attributes)
+
+    roots = set(rdfvalue.RDFURN(urn) for urn in urns)
+    stack = list(roots)
+    while stack:
+      batch = stack[-batch_size:]
+      del stack[-batch_size:]
+
+      results = dict(data_store.DB.MultiResolveRegex(
+          [utils.SmartUnicode(urn) for urn in batch], regexes,
+          timestamp=data_store.DB.NEWEST_TIMESTAMP, token=token))
+
+      for urn in batch:
+        values = {}
+        for predicate, value, ts in results.get(utils.SmartUnicode(urn), []):
+          if predicate.startswith(index_prefix):
+            stack.append(urn.Add(predicate[len(index_prefix):]))
+          elif predicate in attributes:
+            attribute = attributes[predicate]
+            try:
+              values[attribute] = attribute.attribute_type(initializer=value,
+                                                           age=ts)
+            except rdfvalue.DecodeError:
+              pass
+
+        if urn not in roots:
+          yield urn, values
 
   def Flush(self):
     data_store.DB.Flush()
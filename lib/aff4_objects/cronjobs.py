@@ -170,7 +170,7 @@ class SystemCronFlow(flow.GRRFlow):
   def WriteState(self):
     if "w" in self.mode:
       # For normal flows it's a bug to write an empty state, here it's ok.
-      self.Set(self.Schema.FLOW_STATE(self.state))
+      self._WriteStateRecords()
 
 
 class StateReadError(Error):
@@ -206,6 +206,49 @@ class StatefulSystemCronFlow(SystemCronFlow):
     except aff4.InstantiationError as e:
       raise StateWriteError(e)
 
+  def ReadCheckpoint(self, key):
+    """Returns the scan checkpoint saved under key or None.
+
+    Checkpoints are dicts which record when the scan "started". A checkpoint
+    older than the job frequency is discarded, so a scan which keeps failing
+    eventually starts over.
+
+    If the flow is not running as a scheduled cron job there is no state to
+    read and checkpointing is disabled for the rest of the run.
+
+    Args:
+      key: The key of the checkpoint in the cron job state.
+
+    Returns:
+      The checkpoint or None if there is nothing to resume.
+    """
+    try:
+      checkpoint = self.ReadCronState().get(key)
+    except StateReadError:
+      self.checkpointing = False
+      return None
+
+    self.checkpointing = True
+    if not checkpoint:
+      return None
+
+    scan_age = rdfvalue.RDFDatetime().Now() - checkpoint["started"]
+    if scan_age.seconds > self.frequency.seconds:
+      logging.info("%s: discarding stale checkpoint from %s.",
+                   self.__class__.__name__, checkpoint["started"])
+      return None
+
+    return checkpoint
+
+  def WriteCheckpoint(self, key, checkpoint):
+    """Saves the scan checkpoint under key, None clears it."""
+    if not self.checkpointing:
+      return
+
+    cron_state = self.ReadCronState()
+    cron_state.Register(key, checkpoint)
+    self.WriteCronState(cron_state)
+
 
 def GetStartTime(cron_cls):
   """Get start time for a SystemCronFlow class.
@@ -627,6 +627,78 @@ class AFF4Index(aff4.AFF4Object):
         attribute.predicate, value.lower(), urn)
     self.to_set.add(column_name)
 
+  # How many index columns are read from the data store at a time.
+  SCAN_PAGE_SIZE = 1000
+
+  def _ScanIndex(self, regexes, after=None):
+    """Yields all the matching index columns in column order.
+
+    Args:
+      regexes: The column regexes to match.
+      after: Only columns sorting after this one are returned.
+
+    Yields:
+      The names of the matching columns.
+    """
+    while True:
+      page = data_store.DB.ScanAttributes(
+          self.urn, regexes, after=after, limit=self.SCAN_PAGE_SIZE,
+          token=self.token)
+      for col, _, _ in page:
+        yield col
+
+      if len(page) < self.SCAN_PAGE_SIZE:
+        return
+      after = page[-1][0]
+
+  def _MakeRegexes(self, attributes, regex):
+    # Begin and end string matches work because they are explicit in the
+    # storage.
+    regex = regex.lstrip("^").rstrip("$")
+    return ["index:%s:%s:.*" % (a.predicate, regex.lower())
+            for a in attributes]
+
+  def QueryPage(self, attributes, regex, after=None, limit=100):
+    """Query a page of the index for the attribute.
+
+    Hits are returned in index column order, so pages are stable while the
+    index is not modified. A urn indexed under several attributes or values is
+    only returned once per page, it can show up again on a later page.
+
+    Args:
+      attributes: A list of attributes to query for.
+      regex: The regex to search this attribute.
+      after: The cursor returned by the previous page, None for the first page.
+      limit: The maximum number of hits to return.
+
+    Returns:
+      A (hits, cursor) tuple. hits is a list of RDFURNs which match the index
+      search, cursor is passed as after to get the next page and is None once
+      there are no more hits.
+    """
+    regexes = self._MakeRegexes(attributes, regex)
+
+    seen = set()
+    hits = []
+    while True:
+      page = data_store.DB.ScanAttributes(
+          self.urn, regexes, after=after, limit=limit, token=self.token)
+
+      for col, _, _ in page:
+        after = col
+        hit = rdfvalue.RDFURN(col.rsplit("aff4:/", 1)[1])
+        if hit in seen:
+          continue
+        seen.add(hit)
+
+        hits.append(hit)
+        if limit and len(hits) >= limit:
+          return hits, after
+
+      # Duplicates were skipped so keep reading until the page is full.
+      if not limit or len(page) < limit:
+        return hits, None
+
   def Query(self, attributes, regex, limit=100):
     """Query the index for the attribute.
 
@@ -637,34 +709,28 @@ class AFF4Index(aff4.AFF4Object):
           return. Useful for paging. If its a single integer we take it as the
           length limit (start=0).
     Returns:
-      A list of RDFURNs which match the index search.
+      A list of RDFURNs which match the index search, in index order.
     """
-    # Make the regular expressions.
-    regex = regex.lstrip("^")   # Begin and end string matches work because
-    regex = regex.rstrip("$")   # they are explicit in the storage.
-    regexes = ["index:%s:%s:.*" % (a.predicate, regex.lower())
-               for a in attributes]
     start = 0
     try:
       start, length = limit  # pylint: disable=unpacking-non-sequence
     except TypeError:
       length = limit
 
-    # Get all the hits
-    index_hits = set()
-    for col, _, _ in data_store.DB.ResolveRegex(
-        self.urn, regexes, token=self.token,
-        timestamp=data_store.DB.ALL_TIMESTAMPS):
-      # Extract URN from the column_name.
-      index_hits.add(rdfvalue.RDFURN(col.rsplit("aff4:/", 1)[1]))
-
+    # The same urn might be indexed under several attributes or values.
+    seen = set()
     hits = []
-    for i, hit in enumerate(index_hits):
-      if i < start: continue
-      hits.append(hit)
+    for col in self._ScanIndex(self._MakeRegexes(attributes, regex)):
+      # Extract URN from the column_name.
+      hit = rdfvalue.RDFURN(col.rsplit("aff4:/", 1)[1])
+      if hit in seen:
+        continue
+      seen.add(hit)
 
-      if i >= start + length - 1:
-        break
+      if len(seen) > start:
+        hits.append(hit)
+        if len(hits) >= length:
+          break
 
     return hits
 
@@ -692,9 +758,7 @@ class AFF4Index(aff4.AFF4Object):
 
     # Get all the hits
     result = {}
-    for col, _, _ in data_store.DB.ResolveRegex(
-        self.urn, combined_regexes, token=self.token,
-        timestamp=data_store.DB.ALL_TIMESTAMPS):
+    for col in self._ScanIndex(combined_regexes):
       # Extract the attribute name.
       attribute_name = col.split(":")[3]
       # Extract URN from the column_name.
@@ -767,6 +831,76 @@ class AFF4IndexSet(aff4.AFF4Object):
     super(AFF4IndexSet, self).Close(sync=sync)
 
 
+class AFF4ExpiryIndex(aff4.AFF4Object):
+  """Index of objects ordered by the time they expire.
+
+  The expiry time is the first part of the column name, so the objects that
+  expired before a deadline can be paged through in order without reading the
+  whole index.
+  """
+
+  PLACEHOLDER_VALUE = "X"
+  INDEX_PREFIX = "index:expires:"
+  INDEX_PREFIX_LEN = len(INDEX_PREFIX)
+
+  def Initialize(self):
+    super(AFF4ExpiryIndex, self).Initialize()
+    self.to_set = {}
+    self.to_delete = set()
+
+  def _ColumnName(self, urn, expires):
+    expires = rdfvalue.RDFDatetime(expires).AsMicroSecondsFromEpoch()
+    return "%s%016X:%s" % (self.INDEX_PREFIX, expires, rdfvalue.RDFURN(urn))
+
+  def Add(self, urn, expires):
+    self.to_set[self._ColumnName(urn, expires)] = self.PLACEHOLDER_VALUE
+
+  def Remove(self, urn, expires):
+    self.to_delete.add(self._ColumnName(urn, expires))
+
+  def ListExpired(self, deadline, after=None, limit=1000):
+    """Lists a page of the objects which expired before the deadline.
+
+    Args:
+      deadline: An RDFDatetime, objects expiring before it are returned.
+      after: The cursor returned with the previous page.
+      limit: The maximum number of objects to return.
+
+    Returns:
+      A list of (urn, expires, cursor) tuples in expiry order. Passing the
+      cursor of the last item as after returns the next page.
+    """
+    deadline = rdfvalue.RDFDatetime(deadline).AsMicroSecondsFromEpoch()
+
+    results = []
+    for column, _, _ in data_store.DB.ScanAttributes(
+        self.urn, self.INDEX_PREFIX + ".+", after=after, limit=limit,
+        token=self.token):
+      expires, urn = column[self.INDEX_PREFIX_LEN:].split(":", 1)
+      expires = int(expires, 16)
+      if expires >= deadline:
+        break
+
+      results.append((rdfvalue.RDFURN(urn), rdfvalue.RDFDatetime(expires),
+                      column))
+
+    return results
+
+  def Flush(self, sync=False):
+    super(AFF4ExpiryIndex, self).Flush(sync=sync)
+
+    data_store.DB.MultiSet(self.urn, self.to_set, token=self.token,
+                           to_delete=list(self.to_delete), replace=True,
+                           sync=sync)
+    self.to_set = {}
+    self.to_delete = set()
+
+  def Close(self, sync=False):
+    self.Flush(sync=sync)
+
+    super(AFF4ExpiryIndex, self).Close(sync=sync)
+
+
 class AFF4LabelsIndex(aff4.AFF4Volume):
   """Index for objects' labels with vaiorus querying capabilities."""
 
@@ -807,20 +941,52 @@ class AFF4LabelsIndex(aff4.AFF4Volume):
     return aff4_rdfvalues.AFF4ObjectLabel(name=label_name, owner=label_owner)
 
   def AddLabel(self, urn, label_name, owner=None):
+    self.AddLabels([urn], [label_name], owner=owner)
+
+  def AddLabels(self, urns, labels_names, owner=None):
+    """Adds the labels of many objects to the index.
+
+    The index is written in a single operation when this object is flushed.
+
+    Args:
+      urns: The RDFURNs of the labelled objects.
+      labels_names: The names of the labels.
+      owner: The owner of the labels.
+
+    Raises:
+      ValueError: if owner is None.
+    """
     if owner is None:
       raise ValueError("owner can't be None")
 
-    index_name = self.IndexNameForLabel(label_name, owner)
-    self.urns_index.Add(urn, aff4.AFF4Object.SchemaCls.LABELS, index_name)
-    self.used_labels_index.Add(index_name)
+    for label_name in labels_names:
+      index_name = self.IndexNameForLabel(label_name, owner)
+      for urn in urns:
+        self.urns_index.Add(urn, aff4.AFF4Object.SchemaCls.LABELS, index_name)
+      self.used_labels_index.Add(index_name)
 
   def RemoveLabel(self, urn, label_name, owner=None):
+    self.RemoveLabels([urn], [label_name], owner=owner)
+
+  def RemoveLabels(self, urns, labels_names, owner=None):
+    """Removes the labels of many objects from the index.
+
+    Args:
+      urns: The RDFURNs of the objects.
+      labels_names: The names of the labels.
+      owner: The owner of the labels.
+
+    Raises:
+      ValueError: if owner is None.
+    """
     if owner is None:
       raise ValueError("owner can't be None")
 
-    self.urns_index.DeleteAttributeIndexesForURN(
-        aff4.AFF4Object.SchemaCls.LABELS,
-        self.IndexNameForLabel(label_name, owner), urn)
+    for label_name in labels_names:
+      index_name = self.IndexNameForLabel(label_name, owner)
+      for urn in urns:
+        self.urns_index.DeleteAttributeIndexesForURN(
+            aff4.AFF4Object.SchemaCls.LABELS, index_name, urn)
 
   def ListUsedLabels(self, owner=None):
     results = []
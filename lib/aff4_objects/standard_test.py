@@ -9,6 +9,7 @@ import zlib
 from grr.lib import aff4
 from grr.lib import rdfvalue
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.rdfvalues import aff4_rdfvalues
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import paths as rdf_paths
@@ -100,6 +101,61 @@ class IndexTest(test_lib.AFF4ObjectTest):
     results = list(index.Query([client_schema.LABELS], ".*test.*", limit=1))
     self.assertEqual(len(results), 1)
 
+  def testIndexesPaging(self):
+    """Check index queries page in index order."""
+    client_schema = aff4.VFSGRRClient.SchemaCls
+    index = aff4.FACTORY.Create("aff4:/index/myfirstindex", "AFF4Index",
+                                mode="w", token=self.token)
+    urns = [rdfvalue.RDFURN("C.%016X" % i) for i in range(10)]
+    for urn in urns:
+      index.Add(urn, client_schema.LABELS, "test")
+    index.Close(sync=True)
+
+    index = aff4.FACTORY.Open("aff4:/index/myfirstindex", aff4_type="AFF4Index",
+                              token=self.token)
+    results = []
+    cursor = None
+    while True:
+      hits, cursor = index.QueryPage([client_schema.LABELS], "test",
+                                     after=cursor, limit=3)
+      results.extend(hits)
+      if cursor is None:
+        break
+
+    self.assertEqual(results, urns)
+
+    # Query pages are stable and do not overlap.
+    self.assertEqual(index.Query([client_schema.LABELS], "test", limit=(0, 4)),
+                     urns[:4])
+    self.assertEqual(index.Query([client_schema.LABELS], "test", limit=(4, 4)),
+                     urns[4:8])
+
+    with utils.Stubber(index, "SCAN_PAGE_SIZE", 2):
+      self.assertEqual(index.MultiQuery([client_schema.LABELS], ["test"]),
+                       {"test": urns})
+
+  def testIndexesPagingSkipsDuplicates(self):
+    """A urn indexed under several attributes is returned once per page."""
+    client_schema = aff4.VFSGRRClient.SchemaCls
+    index = aff4.FACTORY.Create("aff4:/index/myfirstindex", "AFF4Index",
+                                mode="w", token=self.token)
+    urns = [rdfvalue.RDFURN("C.%016X" % i) for i in range(3)]
+    for urn in urns:
+      index.Add(urn, client_schema.LABELS, "test")
+      index.Add(urn, client_schema.HOSTNAME, "test")
+    index.Close(sync=True)
+
+    index = aff4.FACTORY.Open("aff4:/index/myfirstindex", aff4_type="AFF4Index",
+                              token=self.token)
+    attributes = [client_schema.LABELS, client_schema.HOSTNAME]
+    hits, cursor = index.QueryPage(attributes, "test", limit=10)
+    self.assertEqual(hits, urns)
+    self.assertIsNone(cursor)
+
+    hits, cursor = index.QueryPage(attributes, "test", limit=3)
+    self.assertEqual(hits, urns)
+    self.assertIsNotNone(cursor)
+
   def testIndexesDeletion(self):
     """Check indexes can be created and queried."""
     client1 = aff4.FACTORY.Create("C.0000000000000001", "VFSGRRClient",
@@ -201,6 +257,63 @@ class AFF4IndexSetTest(test_lib.AFF4ObjectTest):
       self.assertListEqual(["wow", "wow3"], sorted(index.ListValues()))
 
 
+class AFF4ExpiryIndexTest(test_lib.AFF4ObjectTest):
+
+  def CreateIndex(self, token=None):
+    return aff4.FACTORY.Create("aff4:/index/expiry/foo", "AFF4ExpiryIndex",
+                               mode="rw", token=token)
+
+  def testExpiredUrnsAreListedInExpiryOrder(self):
+    with self.CreateIndex(token=self.token) as index:
+      index.Add("aff4:/foo/c", rdfvalue.RDFDatetime().FromSecondsFromEpoch(30))
+      index.Add("aff4:/foo/a", rdfvalue.RDFDatetime().FromSecondsFromEpoch(10))
+      index.Add("aff4:/foo/b", rdfvalue.RDFDatetime().FromSecondsFromEpoch(20))
+      index.Add("aff4:/foo/d", rdfvalue.RDFDatetime().FromSecondsFromEpoch(99))
+
+    index = self.CreateIndex(token=self.token)
+    expired = index.ListExpired(
+        rdfvalue.RDFDatetime().FromSecondsFromEpoch(50))
+    self.assertEqual([urn for urn, _, _ in expired],
+                     ["aff4:/foo/a", "aff4:/foo/b", "aff4:/foo/c"])
+    self.assertEqual(expired[0][1],
+                     rdfvalue.RDFDatetime().FromSecondsFromEpoch(10))
+
+  def testExpiredUrnsArePaged(self):
+    with self.CreateIndex(token=self.token) as index:
+      for i in range(5):
+        index.Add("aff4:/foo/%d" % i,
+                  rdfvalue.RDFDatetime().FromSecondsFromEpoch(i + 1))
+
+    index = self.CreateIndex(token=self.token)
+    deadline = rdfvalue.RDFDatetime().FromSecondsFromEpoch(100)
+
+    urns = []
+    cursor = None
+    while True:
+      expired = index.ListExpired(deadline, after=cursor, limit=2)
+      if not expired:
+        break
+      self.assertLessEqual(len(expired), 2)
+      urns.extend(urn for urn, _, _ in expired)
+      cursor = expired[-1][2]
+
+    self.assertEqual(urns, ["aff4:/foo/%d" % i for i in range(5)])
+
+  def testRemovedUrnIsNotListed(self):
+    expires = rdfvalue.RDFDatetime().FromSecondsFromEpoch(10)
+    with self.CreateIndex(token=self.token) as index:
+      index.Add("aff4:/foo/a", expires)
+      index.Add("aff4:/foo/b", expires)
+
+    with self.CreateIndex(token=self.token) as index:
+      index.Remove("aff4:/foo/a", expires)
+
+    index = self.CreateIndex(token=self.token)
+    expired = index.ListExpired(
+        rdfvalue.RDFDatetime().FromSecondsFromEpoch(50))
+    self.assertEqual([urn for urn, _, _ in expired], ["aff4:/foo/b"])
+
+
 class AFF4LabelsIndexTest(test_lib.AFF4ObjectTest):
 
   def CreateIndex(self, token=None):
@@ -240,6 +353,19 @@ class AFF4LabelsIndexTest(test_lib.AFF4ObjectTest):
                            aff4_rdfvalues.AFF4ObjectLabel(name="foo",
                                                           owner="testuser2")])
 
+  def testBulkAddedAndRemovedLabelsCanBeFound(self):
+    urns = [rdfvalue.RDFURN("aff4:/foo/bar%d" % i) for i in range(3)]
+
+    with self.CreateIndex(token=self.token) as index:
+      index.AddLabels(urns, ["foo", "bar"], owner="testuser")
+
+    with self.CreateIndex(token=self.token) as index:
+      index.RemoveLabels(urns[:1], ["bar"], owner="testuser")
+
+    index = self.ReadIndex(token=self.token)
+    self.assertItemsEqual(index.FindUrnsByLabel("foo"), urns)
+    self.assertItemsEqual(index.FindUrnsByLabel("bar"), urns[1:])
+
   def testUrnWithAddedLabelCanBeFound(self):
     urn = rdfvalue.RDFURN("aff4:/foo/bar")
 
@@ -31,6 +31,11 @@ stored as datastore row attributes.
 Statistics is written to the data store by StatsStoreWorker. It periodically
 fetches values for all the metrics and writes them to corresponding
 object on AFF4.
+
+For every rollup interval in StatsStore.rollups, StatsStoreWorker also writes
+the first sample of every interval as aff4:stats_store_rollup/<seconds>/<metric
+name> attributes. Rollups are kept longer than the raw samples, and queries
+over long time ranges read them instead of every raw sample.
 """
 
 
@@ -133,10 +138,29 @@ class StatsStoreMetricsMetadata(structs.RDFProtoStruct):
     return result
 
 
+def ParseRollups(rollups):
+  """Parses "<interval>:<ttl>" rollup specifications into Durations."""
+  result = []
+  for rollup in rollups:
+    interval, ttl = rollup.split(":", 1)
+    result.append((rdfvalue.Duration(interval), rdfvalue.Duration(ttl)))
+
+  return sorted(result)
+
+
 class StatsStoreProcessData(aff4.AFF4Object):
   """Stores stats data for a particular process."""
 
   STATS_STORE_PREFIX = "aff4:stats_store/"
+  ROLLUP_PREFIX = "aff4:stats_store_rollup/%d/"
+
+  @classmethod
+  def Prefix(cls, rollup_interval=None):
+    """Prefix of the attributes holding samples at the given rollup."""
+    if rollup_interval is None:
+      return cls.STATS_STORE_PREFIX
+
+    return cls.ROLLUP_PREFIX % rollup_interval.seconds
 
   ALL_TIMESTAMPS = data_store.DataStore.ALL_TIMESTAMPS
   NEWEST_TIMESTAMP = data_store.DataStore.NEWEST_TIMESTAMP
@@ -162,7 +186,8 @@ class StatsStoreProcessData(aff4.AFF4Object):
                         age=timestamp)
       self.Flush(sync=sync)
 
-  def WriteStats(self, timestamp=None, sync=False):
+  def WriteStats(self, timestamp=None, sync=False, rollup_intervals=None):
+    """Writes current stats values, also to the given rollups."""
     to_set = {}
     metrics_metadata = stats.STATS.GetAllMetricsMetadata()
     self.WriteMetadataDescriptors(metrics_metadata, timestamp=timestamp,
@@ -194,19 +219,28 @@ class StatsStoreProcessData(aff4.AFF4Object):
 
         to_set[self.STATS_STORE_PREFIX + name] = [store_value]
 
+    # The rollups get the same samples, under their own prefixes.
+    for rollup_interval in rollup_intervals or []:
+      prefix = self.Prefix(rollup_interval)
+      for predicate, values in to_set.items():
+        if predicate.startswith(self.STATS_STORE_PREFIX):
+          to_set[prefix + predicate[len(self.STATS_STORE_PREFIX):]] = values
+
     # Write actual data
     data_store.DB.MultiSet(self.urn, to_set, replace=False,
                            token=self.token, timestamp=timestamp, sync=sync)
 
-  def DeleteStats(self, timestamp=ALL_TIMESTAMPS, sync=False):
-    """Deletes all stats in the given time range."""
+  def DeleteStats(self, timestamp=ALL_TIMESTAMPS, sync=False,
+                  rollup_interval=None):
+    """Deletes all stats (or rollup samples) in the given time range."""
 
     if timestamp == self.NEWEST_TIMESTAMP:
       raise ValueError("Can't use NEWEST_TIMESTAMP in DeleteStats.")
 
+    prefix = self.Prefix(rollup_interval)
     predicates = []
     for key in stats.STATS.GetAllMetricsMetadata().keys():
-      predicates.append(self.STATS_STORE_PREFIX + key)
+      predicates.append(prefix + key)
 
     start = None
     end = None
@@ -237,15 +271,28 @@ class StatsStore(aff4.AFF4Volume):
     if self.urn is None:
       self.urn = self.DATA_STORE_ROOT
 
-  def WriteStats(self, process_id=None, timestamp=None, sync=False):
-    """Writes current stats values to the data store with a given timestamp."""
+  def WriteStats(self, process_id=None, timestamp=None, sync=False,
+                 rollup_intervals=None):
+    """Writes current stats values to the data store with a given timestamp.
+
+    Args:
+      process_id: Id of the process the stats belong to.
+      timestamp: Timestamp of the written values. Now if None.
+      sync: If true we block until the operation completes.
+      rollup_intervals: Durations of the rollups the values are also written
+          to, as their sample for the current interval.
+
+    Raises:
+      ValueError: if process_id is not set.
+    """
     if not process_id:
       raise ValueError("process_id can't be None")
 
     process_data = aff4.FACTORY.Create(self.urn.Add(process_id),
                                        "StatsStoreProcessData",
                                        mode="rw", token=self.token)
-    process_data.WriteStats(timestamp=timestamp, sync=sync)
+    process_data.WriteStats(timestamp=timestamp, sync=sync,
+                            rollup_intervals=rollup_intervals)
 
   def ListUsedProcessIds(self):
     """List process ids that were used when saving data to stats store."""
@@ -286,22 +333,75 @@ class StatsStore(aff4.AFF4Volume):
     return results
 
   def ReadStats(self, process_id=None, predicate_regex=".*",
-                timestamp=ALL_TIMESTAMPS, limit=10000):
+                timestamp=ALL_TIMESTAMPS, limit=10000, rollup_interval=None):
     """Reads stats values from the data store for the current process."""
     if not process_id:
       raise ValueError("process_id can't be None")
 
     results = self.MultiReadStats(process_ids=[process_id],
                                   predicate_regex=predicate_regex,
-                                  timestamp=timestamp, limit=limit)
+                                  timestamp=timestamp, limit=limit,
+                                  rollup_interval=rollup_interval)
     try:
       return results[process_id]
     except KeyError:
       return {}
 
+  @staticmethod
+  def RollupForSampling(sampling_interval, start_time=None):
+    """Returns the rollup to read for resampling a time range.
+
+    The coarsest rollup that is fine enough for the sampling is used as long
+    as its samples are kept long enough to cover start_time. Otherwise the
+    finest rollup which covers it is used, so old ranges are read at a coarser
+    interval rather than from samples which already expired.
+
+    Args:
+      sampling_interval: The Duration the read data will be resampled to.
+      start_time: The RDFDatetime the read range starts at, None for the
+          recent past.
+
+    Returns:
+      The Duration of the rollup to read, or None if the raw samples have to
+      be read.
+    """
+    now = rdfvalue.RDFDatetime().Now()
+    # The raw samples come first, like a rollup finer than all the others.
+    rollups = [(None, rdfvalue.Duration(config_lib.CONFIG["StatsStore.ttl"]))]
+    rollups.extend(ParseRollups(config_lib.CONFIG["StatsStore.rollups"]))
+
+    covering = [interval for interval, ttl in rollups
+                if start_time is None or start_time >= now - ttl]
+    if not covering:
+      # Nothing covers the whole range, the longest kept samples cover most.
+      return max(rollups, key=lambda rollup: rollup[1])[0]
+
+    fine_enough = [interval for interval in covering
+                   if interval is None or
+                   interval.seconds <= sampling_interval.seconds]
+    if fine_enough:
+      return fine_enough[-1]
+
+    return covering[0]
+
   def MultiReadStats(self, process_ids=None, predicate_regex=".*",
-                     timestamp=ALL_TIMESTAMPS, limit=10000):
-    """Reads historical data for multiple process ids at once."""
+                     timestamp=ALL_TIMESTAMPS, limit=10000,
+                     rollup_interval=None):
+    """Reads historical data for multiple process ids at once.
+
+    Args:
+      process_ids: Ids of the processes to read. All of them if None.
+      predicate_regex: Regex matching the names of the metrics to read.
+      timestamp: Time range to read, as accepted by the data store.
+      limit: Maximum number of samples to read.
+      rollup_interval: If set, the samples of this rollup are read instead of
+          the raw ones.
+
+    Returns:
+      A dict of process ids to dicts of metric names to lists of
+      (value, timestamp) tuples, nested in dicts by fields values for metrics
+      with fields.
+    """
     if not process_ids:
       process_ids = self.ListUsedProcessIds()
 
@@ -310,8 +410,9 @@ class StatsStore(aff4.AFF4Volume):
     subjects = [self.DATA_STORE_ROOT.Add(process_id)
                 for process_id in process_ids]
 
+    prefix = StatsStoreProcessData.Prefix(rollup_interval)
     multi_query_results = data_store.DB.MultiResolveRegex(
-        subjects, StatsStoreProcessData.STATS_STORE_PREFIX + predicate_regex,
+        subjects, prefix + predicate_regex,
         token=self.token, timestamp=timestamp, limit=limit)
 
     results = {}
@@ -322,7 +423,7 @@ class StatsStore(aff4.AFF4Volume):
 
       part_results = {}
       for predicate, value_string, timestamp in subject_results:
-        metric_name = predicate[len(StatsStoreProcessData.STATS_STORE_PREFIX):]
+        metric_name = predicate[len(prefix):]
 
         try:
           metadata = subject_metadata[metric_name]
@@ -353,8 +454,8 @@ class StatsStore(aff4.AFF4Volume):
     return results
 
   def DeleteStats(self, process_id=None, timestamp=ALL_TIMESTAMPS,
-                  sync=False):
-    """Deletes all stats in the given time range."""
+                  sync=False, rollup_interval=None):
+    """Deletes all stats (or rollup samples) in the given time range."""
 
     if not process_id:
       raise ValueError("process_id can't be None")
@@ -362,7 +463,8 @@ class StatsStore(aff4.AFF4Volume):
     process_data = aff4.FACTORY.Create(self.urn.Add(process_id),
                                        "StatsStoreProcessData",
                                        mode="w", token=self.token)
-    process_data.DeleteStats(timestamp=timestamp, sync=sync)
+    process_data.DeleteStats(timestamp=timestamp, sync=sync,
+                             rollup_interval=rollup_interval)
 
 
 class StatsStoreDataQuery(object):
@@ -401,6 +503,7 @@ class StatsStoreDataQuery(object):
     values = []
     timestamps = []
     for value, timestamp in data:
+      timestamps.append(timestamp)
       if attr:
         try:
           values.append(getattr(value, attr))
@@ -414,9 +517,8 @@ class StatsStoreDataQuery(object):
 
         values.append(value)
 
-      timestamps.append(pandas.Timestamp(timestamp * 1e3))
-
-    return pandas.Series(values, index=timestamps)
+    return pandas.Series(values, index=pandas.to_datetime(timestamps,
+                                                           unit="us"))
 
   @property
   def ts(self):
@@ -492,21 +594,13 @@ class StatsStoreDataQuery(object):
     if self.time_series is None:
       raise RuntimeError("EnsureIsIncremental must be called after Take*().")
 
-    state = dict()
-    def FixIncremention(value):
-      if state["prev_value"] is None:
-        state["prev_value"] = value
-      elif state["prev_value"] > value:
-        state["increment"] += state["prev_value"]
-
-      state["prev_value"] = value
-      return value + state["increment"]
-
     new_time_series = []
     for time_serie in self.time_series:
-      state["prev_value"] = None
-      state["increment"] = 0
-      new_time_series.append(time_serie.apply(FixIncremention))
+      # Every time the value drops, the value before the drop is added to all
+      # the following values.
+      previous = time_serie.shift(1)
+      increments = previous.where(time_serie < previous, 0).cumsum()
+      new_time_series.append(time_serie + increments.fillna(0))
 
     self.time_series = new_time_series
     return self
@@ -646,7 +740,8 @@ class StatsStoreDataQuery(object):
 
     num_time_series = len(self.time_series)
     self.AggregateViaSum()
-    self.ts.div(num_time_series)
+    if self.time_series:
+      self.time_series = [self.ts.div(num_time_series)]
 
     return self
 
@@ -678,13 +773,11 @@ class StatsStoreDataQuery(object):
     num_samples = time_window.seconds / self.sample_interval.seconds + 1
     num_seconds = float(time_window.seconds)
 
-    def Rate(x):
-      return (x[-1] - x[0]) / num_seconds
-
     new_time_series = []
     for time_serie in self.time_series:
-      new_time_series.append(pandas.rolling_apply(
-          time_serie, num_samples, Rate)[(num_samples - 1):])
+      # The difference between the last and first value of every window.
+      rate = (time_serie - time_serie.shift(num_samples - 1)) / num_seconds
+      new_time_series.append(rate[(num_samples - 1):])
 
     self.time_series = new_time_series
     return self
@@ -697,7 +790,7 @@ class StatsStoreDataQuery(object):
 
     new_time_series = []
     for time_serie in self.time_series:
-      new_time_series.append(time_serie.apply(lambda x: x * multiplier))
+      new_time_series.append(time_serie * multiplier)
 
     self.time_series = new_time_series
     return self
@@ -733,28 +826,48 @@ class StatsStoreWorker(object):
     self.thread_name = thread_name
     self.sleep = sleep or config_lib.CONFIG["StatsStore.write_interval"]
 
-  def _RunLoop(self):
-    while True:
-      logging.debug("Writing stats to stats store.")
+    self.rollups = ParseRollups(config_lib.CONFIG["StatsStore.rollups"])
+    # The last interval each rollup got a sample for.
+    self.rollup_buckets = {}
 
-      try:
-        self.stats_store.WriteStats(process_id=self.process_id, sync=False)
-      except Exception as e:  # pylint: disable=broad-except
-        logging.exception(
-            "StatsStore exception caught during WriteStats(): %s", e)
+  def WriteAndPruneStats(self):
+    """Writes the current stats and deletes the expired ones."""
+    logging.debug("Writing stats to stats store.")
 
-      logging.debug("Removing old stats from stats store.""")
-      try:
-        now = rdfvalue.RDFDatetime().Now().AsMicroSecondsFromEpoch()
+    now = rdfvalue.RDFDatetime().Now().AsMicroSecondsFromEpoch()
+    due_rollups = {}
+    for rollup_interval, _ in self.rollups:
+      bucket = now // rollup_interval.microseconds
+      if self.rollup_buckets.get(rollup_interval) != bucket:
+        due_rollups[rollup_interval] = bucket
+
+    try:
+      self.stats_store.WriteStats(process_id=self.process_id, sync=False,
+                                  rollup_intervals=sorted(due_rollups))
+      self.rollup_buckets.update(due_rollups)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception(
+          "StatsStore exception caught during WriteStats(): %s", e)
+
+    logging.debug("Removing old stats from stats store.""")
+    try:
+      self.stats_store.DeleteStats(
+          process_id=self.process_id,
+          timestamp=(0, now -
+                     config_lib.CONFIG["StatsStore.ttl"] * 1000000),
+          sync=False)
+
+      for rollup_interval, ttl in self.rollups:
         self.stats_store.DeleteStats(
-            process_id=self.process_id,
-            timestamp=(0, now -
-                       config_lib.CONFIG["StatsStore.ttl"] * 1000000),
-            sync=False)
-      except Exception as e:  # pylint: disable=broad-except
-        logging.exception(
-            "StatsStore exception caught during DeleteStats(): %s", e)
+            process_id=self.process_id, timestamp=(0, now - ttl.microseconds),
+            sync=False, rollup_interval=rollup_interval)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception(
+          "StatsStore exception caught during DeleteStats(): %s", e)
 
+  def _RunLoop(self):
+    while True:
+      self.WriteAndPruneStats()
       time.sleep(self.sleep)
 
   def Run(self):
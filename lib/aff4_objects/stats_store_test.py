@@ -9,6 +9,7 @@ import pandas
 
 
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import rdfvalue
@@ -348,6 +349,76 @@ class StatsStoreTest(test_lib.AFF4ObjectTest):
     self.assertEqual(results["pid1"]["counter"], [(2, 44)])
     self.assertEqual(results["pid2"]["counter"], [(1, 44)])
 
+  def testRollupsAreOnlyWrittenWhenRequested(self):
+    stats.STATS.RegisterCounterMetric("counter")
+    rollup_interval = rdfvalue.Duration("1h")
+
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(process_id=self.process_id, timestamp=42,
+                                sync=True, rollup_intervals=[rollup_interval])
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(process_id=self.process_id, timestamp=43,
+                                sync=True)
+
+    stats_history = self.stats_store.ReadStats(process_id=self.process_id)
+    self.assertEqual(stats_history["counter"], [(1, 42), (2, 43)])
+
+    stats_history = self.stats_store.ReadStats(
+        process_id=self.process_id, rollup_interval=rollup_interval)
+    self.assertEqual(stats_history["counter"], [(1, 42)])
+
+  def testDeleteStatsOnlyDeletesGivenRollup(self):
+    stats.STATS.RegisterCounterMetric("counter")
+    rollup_interval = rdfvalue.Duration("1h")
+
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(process_id=self.process_id, timestamp=42,
+                                sync=True, rollup_intervals=[rollup_interval])
+
+    self.stats_store.DeleteStats(process_id=self.process_id, timestamp=(0, 43),
+                                 sync=True, rollup_interval=rollup_interval)
+
+    stats_history = self.stats_store.ReadStats(process_id=self.process_id)
+    self.assertEqual(stats_history["counter"], [(1, 42)])
+    stats_history = self.stats_store.ReadStats(
+        process_id=self.process_id, rollup_interval=rollup_interval)
+    self.assertFalse(stats_history.get("counter"))
+
+  def testRollupForSamplingReturnsCoarsestFineEnoughRollup(self):
+    config_lib.CONFIG.Set("StatsStore.rollups", ["5m:30d", "1h:365d"])
+
+    self.assertIsNone(
+        self.stats_store.RollupForSampling(rdfvalue.Duration("1m")))
+    self.assertEqual(
+        self.stats_store.RollupForSampling(rdfvalue.Duration("5m")),
+        rdfvalue.Duration("5m"))
+    self.assertEqual(
+        self.stats_store.RollupForSampling(rdfvalue.Duration("1d")),
+        rdfvalue.Duration("1h"))
+
+  def testRollupForSamplingUsesRollupsCoveringTheRange(self):
+    config_lib.CONFIG.Set("StatsStore.ttl", 3 * 24 * 60 * 60)
+    config_lib.CONFIG.Set("StatsStore.rollups", ["5m:30d", "1h:365d"])
+    now = rdfvalue.RDFDatetime().Now()
+
+    self.assertIsNone(self.stats_store.RollupForSampling(
+        rdfvalue.Duration("1m"), start_time=now - rdfvalue.Duration("1d")))
+    # The raw samples expired, the 5m rollup is the finest one left.
+    self.assertEqual(
+        self.stats_store.RollupForSampling(
+            rdfvalue.Duration("1m"), start_time=now - rdfvalue.Duration("10d")),
+        rdfvalue.Duration("5m"))
+    self.assertEqual(
+        self.stats_store.RollupForSampling(
+            rdfvalue.Duration("5m"), start_time=now - rdfvalue.Duration("60d")),
+        rdfvalue.Duration("1h"))
+    # Nothing covers the range, the rollup kept the longest covers most of it.
+    start_time = now - rdfvalue.Duration("730d")
+    self.assertEqual(
+        self.stats_store.RollupForSampling(rdfvalue.Duration("5m"),
+                                           start_time=start_time),
+        rdfvalue.Duration("1h"))
+
   def testReadMetadataReturnsAllUsedMetadata(self):
     # Register metrics
     stats.STATS.RegisterCounterMetric("counter")
@@ -468,6 +539,58 @@ class StatsStoreTest(test_lib.AFF4ObjectTest):
     self.assertTrue("counter" in metadata_by_id["pid2"])
 
 
+class StatsStoreWorkerTest(test_lib.AFF4ObjectTest):
+  """Tests for the StatsStoreWorker."""
+
+  def setUp(self):
+    super(StatsStoreWorkerTest, self).setUp()
+    config_lib.CONFIG.Set("StatsStore.ttl", 60 * 60)
+    config_lib.CONFIG.Set("StatsStore.rollups", ["5m:1d"])
+
+    self.stats_store = aff4.FACTORY.Create(
+        None, "StatsStore", mode="w", token=self.token)
+    self.worker = stats_store.StatsStoreWorker(self.stats_store, "pid")
+
+    stats.STATS.RegisterCounterMetric("counter")
+
+  def testWritesOneRollupSamplePerInterval(self):
+    for seconds in [0, 60, 120, 300, 360]:
+      with test_lib.FakeTime(seconds):
+        stats.STATS.IncrementCounter("counter")
+        self.worker.WriteAndPruneStats()
+
+    raw = self.stats_store.ReadStats(process_id="pid")
+    self.assertEqual(len(raw["counter"]), 5)
+
+    rollup = self.stats_store.ReadStats(
+        process_id="pid", rollup_interval=rdfvalue.Duration("5m"))
+    self.assertEqual(rollup["counter"], [(1, 0), (4, 300 * 1000000)])
+
+  def testPrunesRawSamplesAndRollupsWithTheirOwnTTL(self):
+    for seconds in [0, 2 * 60 * 60, 2 * 24 * 60 * 60]:
+      with test_lib.FakeTime(seconds):
+        stats.STATS.IncrementCounter("counter")
+        self.worker.WriteAndPruneStats()
+
+    raw = self.stats_store.ReadStats(process_id="pid")
+    self.assertEqual(raw["counter"], [(3, 2 * 24 * 60 * 60 * 1000000)])
+
+    rollup = self.stats_store.ReadStats(
+        process_id="pid", rollup_interval=rdfvalue.Duration("5m"))
+    self.assertEqual(rollup["counter"], [(3, 2 * 24 * 60 * 60 * 1000000)])
+
+    with test_lib.FakeTime(2 * 24 * 60 * 60 + 2 * 60 * 60):
+      stats.STATS.IncrementCounter("counter")
+      self.worker.WriteAndPruneStats()
+
+    # The raw sample expired, the rollup sample did not.
+    raw = self.stats_store.ReadStats(process_id="pid")
+    self.assertEqual(len(raw["counter"]), 1)
+    rollup = self.stats_store.ReadStats(
+        process_id="pid", rollup_interval=rdfvalue.Duration("5m"))
+    self.assertEqual(len(rollup["counter"]), 2)
+
+
 class StatsStoreDataQueryTest(test_lib.AFF4ObjectTest):
   """Tests for StatsStoreDataQuery class."""
 
@@ -872,6 +995,30 @@ class StatsStoreDataQueryTest(test_lib.AFF4ObjectTest):
                                           pandas.Timestamp(60 * 1e9),
                                           pandas.Timestamp(90 * 1e9)])
 
+  def testAggregateViaMeanDividesSumByNumberOfTimeSeries(self):
+    stats.STATS.RegisterCounterMetric("counter")
+
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(
+        process_id="pid1",
+        timestamp=rdfvalue.RDFDatetime().FromSecondsFromEpoch(0),
+        sync=True)
+
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(
+        process_id="pid2",
+        timestamp=rdfvalue.RDFDatetime().FromSecondsFromEpoch(0),
+        sync=True)
+
+    stats_data = self.stats_store.MultiReadStats(process_ids=["pid1", "pid2"])
+    query = stats_store.StatsStoreDataQuery(stats_data)
+
+    ts = query.In("pid.*").In("counter").TakeValue().Resample(
+        rdfvalue.Duration("30s")).AggregateViaMean().ts
+
+    # (1 + 2) / 2
+    self.assertAlmostEqual(ts[0], 1.5)
+
   def testAggregateViaSumAlignsMultipleTimeSeriesBeforeAggregation(self):
     # Initialize and write test data.
     stats.STATS.RegisterCounterMetric("counter")
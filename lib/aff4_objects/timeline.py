@@ -3,11 +3,12 @@
 """A timeline AFF4 object implementation."""
 
 
+import bisect
 import heapq
-import StringIO
 import struct
 
 from grr.lib import aff4
+from grr.lib import lexer
 from grr.lib import rdfvalue
 from grr.lib.aff4_objects import collections
 # AFF4Filter is defined in aff4 but needs this pylint: disable=unused-import
@@ -53,11 +54,170 @@ class TimelineView(collections.AFF4CollectionView):
   """A timeline view."""
 
 
+class _StreamReader(object):
+  """Reads an AFF4Image sequentially, keeping only one block in memory."""
+
+  def __init__(self, fd, offset=0):
+    self.fd = fd
+    self.fd.Seek(offset)
+    self.offset = offset
+    self.buffer = ""
+    self.position = 0
+    # The image reads ahead 10 chunks so we consume them all at once.
+    self.read_size = 10 * fd.chunksize
+
+  def Read(self, length):
+    """Returns the next length bytes, fewer at the end of the stream."""
+    while len(self.buffer) - self.position < length:
+      data = self.fd.Read(self.read_size)
+      # The chunks are never read again so do not keep them cached.
+      self.fd.chunk_cache.Flush()
+      if not data:
+        break
+
+      self.buffer = self.buffer[self.position:] + data
+      self.position = 0
+
+    result = self.buffer[self.position:self.position + length]
+    self.position += len(result)
+    self.offset += len(result)
+    return result
+
+  def ReadRecords(self, record_format):
+    """Yields (offset, header, data) for each record until the end.
+
+    Args:
+      record_format: The struct format of the record header. Its last field
+        is the length of the data following the header.
+    """
+    header_size = struct.calcsize(record_format)
+    while True:
+      offset = self.offset
+      header = self.Read(header_size)
+      if len(header) < header_size:
+        return
+
+      header = struct.unpack(record_format, header)
+      yield offset, header, self.Read(header[-1])
+
+
+class _StreamWriter(object):
+  """Writes to an AFF4Image in blocks, keeping only one block in memory."""
+
+  def __init__(self, fd, block_size):
+    self.fd = fd
+    self.offset = 0
+    self.data = []
+    self.pending = 0
+    # Only whole chunks are written so flushed chunks are never reopened.
+    self.block_size = max(block_size, fd.chunksize)
+
+  def Write(self, data):
+    self.data.append(data)
+    self.pending += len(data)
+    self.offset += len(data)
+    if self.pending >= self.block_size:
+      data = "".join(self.data)
+      cut = len(data) - len(data) % self.fd.chunksize
+      self.fd.Write(data[:cut])
+      self.fd.chunk_cache.Flush()
+      self.data = [data[cut:]]
+      self.pending = len(data) - cut
+
+  def Close(self):
+    self.fd.Write("".join(self.data))
+    self.data = []
+    self.pending = 0
+    self.fd.Close()
+
+
+class _TimestampRange(object):
+  """A filter implementation which returns the (start, end) it matches.
+
+  None means the range is open on that side. Strict comparisons give the
+  inclusive bound since this is only used to skip events.
+  """
+
+  @staticmethod
+  def PredicateLessThanFilter(unused_attribute, value):
+    return None, value
+
+  PredicateLesserEqualFilter = PredicateLessThanFilter
+
+  @staticmethod
+  def PredicateGreaterThanFilter(unused_attribute, value):
+    return value, None
+
+  PredicateGreaterEqualFilter = PredicateGreaterThanFilter
+
+  @staticmethod
+  def PredicateNumericEqualFilter(unused_attribute, value):
+    return value, value
+
+
+def GetTimestampRange(expression):
+  """Returns the (start, end) timestamps a query can possibly match.
+
+  Args:
+    expression: The parsed query.
+
+  Returns:
+    A (start, end) tuple, where None means the range is open on that side.
+  """
+  if isinstance(expression, aff4.AttributeExpression):
+    if expression.attribute == "timestamp":
+      try:
+        return expression.Compile(_TimestampRange)
+      except AttributeError:
+        pass
+
+  elif (isinstance(expression, lexer.BinaryExpression) and
+        expression.operator.lower() in ("and", "&&")):
+    start = end = None
+    for arg in expression.args:
+      arg_start, arg_end = GetTimestampRange(arg)
+      if arg_start is not None:
+        start = arg_start if start is None else max(start, arg_start)
+      if arg_end is not None:
+        end = arg_end if end is None else min(end, arg_end)
+
+    return start, end
+
+  return None, None
+
+
 class GRRTimeSeries(standard.VFSDirectory):
-  """A time series is a sequence of serialized Event protobufs."""
+  """A time series is a sequence of serialized Event protobufs.
+
+  The events are stored in time order in the Storage stream, each one
+  prefixed by its length. They are sorted with an external merge sort: up to
+  SORT_BUFFER_SIZE bytes of events are sorted in memory and spilled as a run
+  under Runs, and the runs are merged into the Storage on Close().
+
+  The Index stream holds the timestamp, Storage offset and number of every
+  INDEX_INTERVAL-th event so time range queries can seek to their start.
+  """
 
   _behaviours = set()
 
+  # Bytes of serialized events sorted in memory before spilling a run.
+  SORT_BUFFER_SIZE = 32 * 1024 * 1024
+
+  # The maximum number of runs merged at once.
+  MERGE_FAN_IN = 16
+
+  # Every INDEX_INTERVAL-th event is added to the index.
+  INDEX_INTERVAL = 1000
+
+  # Streams are written in blocks of this size.
+  WRITE_BLOCK_SIZE = 4 * 1024 * 1024
+
+  # A run record is the timestamp and length of the serialized event.
+  RUN_FORMAT = "<qi"
+
+  # An index record is the timestamp, Storage offset and number of an event.
+  INDEX_FORMAT = "<qQQ"
+
   class SchemaCls(standard.VFSDirectory.SchemaCls):
     """Attributes of the timeseries object."""
     # Total number of events here
@@ -85,7 +245,10 @@ class GRRTimeSeries(standard.VFSDirectory):
     if "r" in self.mode:
       self.size = self.Get(self.Schema.SIZE)
 
-    self.heap = []
+    self.buffer = []
+    self.buffer_size = 0
+    self.runs = []
+    self.run_count = 0
 
   def AddEvent(self, event=None, **kw):
     """Add the event protobuf to the series.
@@ -96,11 +259,46 @@ class GRRTimeSeries(standard.VFSDirectory):
     if event is None:
       event = analysis_pb2.Event(**kw)
 
-    # Push the serialized event proto on the heap to save memory
-    heapq.heappush(self.heap, (event.timestamp, event.SerializeToString()))
+    # Keep the serialized event proto to save memory.
+    serialized_event = event.SerializeToString()
+    self.buffer.append((long(event.timestamp), serialized_event))
+    self.buffer_size += len(serialized_event)
     self.dirty = True
     self.size += 1
 
+    if self.buffer_size >= self.SORT_BUFFER_SIZE:
+      self.buffer.sort()
+      self._WriteRun(self.buffer)
+      self.buffer = []
+      self.buffer_size = 0
+
+  def _WriteRun(self, records):
+    """Writes the sorted (timestamp, serialized event) records to a new run."""
+    urn = self.urn.Add("Runs").Add("%08d" % self.run_count)
+    self.run_count += 1
+
+    writer = _StreamWriter(
+        aff4.FACTORY.Create(urn, "AFF4Image", token=self.token),
+        self.WRITE_BLOCK_SIZE)
+    for timestamp, serialized_event in records:
+      writer.Write(struct.pack(self.RUN_FORMAT, timestamp,
+                               len(serialized_event)))
+      writer.Write(serialized_event)
+
+    writer.Close()
+    self.runs.append(urn)
+
+  def _ReadRun(self, urn):
+    """Yields the (timestamp, serialized event) records of a run."""
+    reader = _StreamReader(aff4.FACTORY.Open(urn, aff4_type="AFF4Image",
+                                             token=self.token))
+    for _, (timestamp, _), serialized_event in reader.ReadRecords(
+        self.RUN_FORMAT):
+      yield timestamp, serialized_event
+
+  def _MergeRuns(self, runs):
+    return heapq.merge(*[self._ReadRun(urn) for urn in runs])
+
   def __len__(self):
     return self.size
 
@@ -113,32 +311,72 @@ class GRRTimeSeries(standard.VFSDirectory):
     Raises:
       RuntimeError: if we are in write mode.
     """
-    if self.mode == "w":
-      raise RuntimeError("Can not read when in write mode.")
+    for event in self.Events():
+      yield event
 
-    count = 0
-    storage = aff4.FACTORY.Open(self.urn.Add("Storage"), token=self.token)
+  def _ReadIndex(self):
+    """Returns the timestamps and (offset, event number) of the index."""
+    timestamps = []
+    positions = []
+    try:
+      index = aff4.FACTORY.Open(self.urn.Add("Index"), aff4_type="AFF4Image",
+                                token=self.token)
+    except IOError:
+      # Timelines written before the index existed.
+      return timestamps, positions
+
+    # The index is small, one record for every INDEX_INTERVAL events.
+    data = index.Read(index.size)
+    record_size = struct.calcsize(self.INDEX_FORMAT)
+    for i in range(0, len(data) - record_size + 1, record_size):
+      timestamp, offset, count = struct.unpack_from(self.INDEX_FORMAT, data, i)
+      timestamps.append(timestamp)
+      positions.append((offset, count))
+
+    return timestamps, positions
+
+  def Events(self, start=None, end=None):
+    """Iterate over the events with start <= timestamp <= end.
 
-    # If the timeline is small enough we buffer it in memory to make quick
-    # iteration possible. This is limited to a size of one GB.
-    # Note that this is a hack and is supposed to go away soon as we integrate
-    # plaso for timelines.
-    if storage.size <= 1024 * 1024 * 1024:
-      buf = storage.Read(1024 * 1024 * 1024)
-      storage = StringIO.StringIO(buf)
-      storage.Read = storage.read
+    Args:
+      start: The first timestamp to return, None for the first event.
+      end: The last timestamp to return, None for the last event.
 
-    while True:
-      try:
-        length = struct.unpack("<i", storage.Read(4))[0]
-        serialized_event = storage.Read(length)
-      except struct.error:
-        break
+    Yields:
+      event protobufs in increasing time order.
+    Raises:
+      RuntimeError: if we are in write mode.
+    """
+    if self.mode == "w":
+      raise RuntimeError("Can not read when in write mode.")
 
+    offset = count = 0
+    if start is not None:
+      timestamps, positions = self._ReadIndex()
+      # Events equal to start may precede the first indexed one >= start, so
+      # seek to the indexed event before it.
+      i = bisect.bisect_left(timestamps, start) - 1
+      if i >= 0:
+        offset, count = positions[i]
+
+    try:
+      storage = aff4.FACTORY.Open(self.urn.Add("Storage"),
+                                  aff4_type="AFF4Image", token=self.token)
+    except IOError:
+      return
+
+    for _, _, serialized_event in _StreamReader(storage, offset).ReadRecords(
+        "<i"):
       event = Event(serialized_event)
       event.id = count
       count += 1
 
+      if start is not None and event.timestamp < start:
+        continue
+
+      if end is not None and event.timestamp > end:
+        break
+
       yield event
 
   def Query(self, filter_string="", filter_obj=None):
@@ -153,43 +391,80 @@ class GRRTimeSeries(standard.VFSDirectory):
     # Query our own data store
     filter_obj = ast.Compile(aff4.AFF4Filter)
 
-    return filter_obj.Filter(self.OpenChildren(mode=self.mode))
+    # Only read the events in the time range the query can match.
+    start, end = GetTimestampRange(ast)
+
+    return filter_obj.Filter(self.OpenChildren(mode=self.mode, start=start,
+                                               end=end))
 
   def Close(self):
     """Flush the events into the image stream."""
     if not self.dirty: return
+
+    if self.runs:
+      if self.buffer:
+        self.buffer.sort()
+        self._WriteRun(self.buffer)
+        self.buffer = []
+
+      # Merge the runs in groups until they can all be merged at once.
+      while len(self.runs) > self.MERGE_FAN_IN:
+        runs = self.runs[:self.MERGE_FAN_IN]
+        self.runs = self.runs[self.MERGE_FAN_IN:]
+        self._WriteRun(self._MergeRuns(runs))
+
+      records = self._MergeRuns(self.runs)
+    else:
+      self.buffer.sort()
+      records = self.buffer
+
     storage = aff4.FACTORY.Create(self.urn.Add("Storage"), "AFF4Image",
                                   token=self.token)
     storage.SetChunksize(1024 * 1024)
+    storage = _StreamWriter(storage, self.WRITE_BLOCK_SIZE)
+    index = _StreamWriter(
+        aff4.FACTORY.Create(self.urn.Add("Index"), "AFF4Image",
+                            token=self.token),
+        self.WRITE_BLOCK_SIZE)
 
-    if self.heap:
-      first = last = self.heap[0][0]
-      # Note our first event and size
-      self.Set(self.Schema.SIZE(len(self.heap)))
-      self.Set(self.Schema.START(first))
-
-      while self.heap:
-        # This pulls the smallest time from the heap
-        last, serialized_event = heapq.heappop(self.heap)
+    count = 0
+    first = last = None
+    for last, serialized_event in records:
+      if first is None:
+        first = last
+
+      if count % self.INDEX_INTERVAL == 0:
+        index.Write(struct.pack(self.INDEX_FORMAT, last, storage.offset,
+                                count))
+
+      # Write the length and then the data
+      storage.Write(struct.pack("<i", len(serialized_event)))
+      storage.Write(serialized_event)
+      count += 1
 
-        # Write the length and then the data
-        storage.Write(struct.pack("<i", len(serialized_event)))
-        storage.Write(serialized_event)
+    # We are done - flush and close the files.
+    storage.Close()
+    index.Close()
 
-      # Note our last event and size
+    if first is not None:
+      # Note our first and last events
+      self.Set(self.Schema.START(first))
       self.Set(self.Schema.END(last))
 
-      # We are done - flush and close the file.
-      storage.Close()
+    if self.runs:
+      aff4.FACTORY.Delete(self.urn.Add("Runs"), token=self.token)
+      self.runs = []
 
+    self.buffer = []
+    self.buffer_size = 0
     self.Set(self.Schema.SIZE(self.size))
     super(GRRTimeSeries, self).Close()
 
-  def OpenChildren(self, children=None, mode="r"):
+  def OpenChildren(self, children=None, mode="r", start=None, end=None):
     if mode != "r":
       raise IOError("Events are always read only.")
 
-    for event in self:
+    for event in self.Events(start=start, end=end):
       result = AFF4Event(event)
       # Allow users to filter events
       if children is not None and str(result.urn) not in children:
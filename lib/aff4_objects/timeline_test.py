@@ -7,6 +7,7 @@ import time
 
 from grr.lib import aff4
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.aff4_objects import timeline
 
 
@@ -86,3 +87,148 @@ class TimelineTest(test_lib.AFF4ObjectTest):
     results = list(fd.Query("event.stat.pathspec.path contains Fri"))
     self.assertEqual(len(results), 1)
     self.assertEqual(results[0].event.timestamp, 1321633293629468)
+
+  def _BuildTimeSeries(self, path, times):
+    fd = aff4.FACTORY.Create(path, "GRRTimeSeries", token=self.token)
+    for t in times:
+      event = timeline.Event(timestamp=t)
+      event.stat.pathspec.path = "/file%d" % t
+      fd.AddEvent(event)
+
+    fd.Close()
+    return aff4.FACTORY.Open(path, token=self.token)
+
+  def testTimeSeriesSpillsSortedRuns(self):
+    """Check that large timeseries are merged from runs."""
+    path = "/C.1/time series 3"
+    times = [random.randint(0, 10000) for _ in range(1000)]
+
+    # Spill a run every few events and merge in several passes.
+    with utils.MultiStubber((timeline.GRRTimeSeries, "SORT_BUFFER_SIZE", 200),
+                            (timeline.GRRTimeSeries, "MERGE_FAN_IN", 3),
+                            (timeline.GRRTimeSeries, "INDEX_INTERVAL", 10)):
+      fd = self._BuildTimeSeries(path, times)
+
+    times.sort()
+    events = list(fd)
+    self.assertEqual([event.timestamp for event in events], times)
+    self.assertEqual([event.id for event in events], range(len(times)))
+    self.assertEqual(fd.Get(fd.Schema.SIZE), len(times))
+    self.assertEqual(fd.Get(fd.Schema.START), times[0])
+    self.assertEqual(fd.Get(fd.Schema.END), times[-1])
+
+    # The runs are removed once merged.
+    self.assertEqual(list(aff4.FACTORY.Open(
+        path + "/Runs", token=self.token).ListChildren()), [])
+
+  def testTimeSeriesRange(self):
+    """Check that time ranges are read using the index."""
+    path = "/C.1/time series 4"
+    # Three events every minute from 2011/11/18 00:00 UTC.
+    start = 1321574400 * 1000000
+    minute = 60 * 1000000
+    times = [start + i / 3 * minute for i in range(3000)]
+
+    with utils.Stubber(timeline.GRRTimeSeries, "INDEX_INTERVAL", 10):
+      fd = self._BuildTimeSeries(path, times)
+
+    events = list(fd.Events(start=times[1500], end=times[1508]))
+    self.assertEqual([event.timestamp for event in events], times[1500:1509])
+    self.assertEqual([event.id for event in events], range(1500, 1509))
+
+    self.assertEqual(len(list(fd.Events(start=times[2970]))), 30)
+    self.assertEqual(len(list(fd.Events(end=times[0]))), 3)
+    self.assertEqual(list(fd.Events(start=times[-1] + 1)), [])
+
+    # The index lets us skip straight to the range.
+    storage = aff4.FACTORY.Open(path + "/Storage", token=self.token)
+    with utils.Stubber(timeline, "_StreamReader", RecordingStreamReader):
+      RecordingStreamReader.bytes_read = 0
+      list(fd.Events(start=times[1500], end=times[1508]))
+      self.assertLess(RecordingStreamReader.bytes_read, storage.size / 10)
+
+    # Queries only read the time range they can match, 08:20 is minute 500.
+    with utils.Stubber(timeline, "_StreamReader", RecordingStreamReader):
+      RecordingStreamReader.bytes_read = 0
+      results = list(fd.Query("timestamp >= '2011/11/18 08:20' and "
+                              "timestamp < '2011/11/18 08:22'"))
+      self.assertEqual([r.event.timestamp for r in results], times[1500:1509])
+      self.assertLess(RecordingStreamReader.bytes_read, storage.size / 10)
+
+    # Timelines without an index are scanned from the start.
+    aff4.FACTORY.Delete(aff4.ROOT_URN.Add(path).Add("Index"), token=self.token)
+    fd = aff4.FACTORY.Open(path, token=self.token)
+    events = list(fd.Events(start=times[1500], end=times[1508]))
+    self.assertEqual([event.id for event in events], range(1500, 1509))
+
+  def testGetTimestampRange(self):
+    day = 24 * 60 * 60 * 1000000
+    start = 1321574400 * 1000000
+    for query, expected in [
+        ("timestamp >= 2011/11/18", (start, None)),
+        ("timestamp >= 2011/11/18 and timestamp < 2011/11/19",
+         (start, start + day)),
+        ("timestamp < 2011/11/19 and timestamp < 2011/11/20",
+         (None, start + day)),
+        ("timestamp < 2011/11/18 or timestamp >= 2011/11/19", (None, None)),
+        ("event.stat.st_size > 10", (None, None)),
+        ("timestamp >= 2011/11/18 and event.stat.pathspec.path contains foo",
+         (start, None))]:
+      ast = aff4.AFF4QueryParser(query).Parse()
+      self.assertEqual(timeline.GetTimestampRange(ast), expected)
+
+
+class RecordingStreamReader(timeline._StreamReader):  # pylint: disable=protected-access
+  """A stream reader which counts the bytes it reads from the image."""
+
+  bytes_read = 0
+
+  def __init__(self, fd, offset=0):
+    super(RecordingStreamReader, self).__init__(fd, offset=offset)
+    # Read small blocks so the count is precise.
+    self.read_size = 1024
+
+  def Read(self, length):
+    result = super(RecordingStreamReader, self).Read(length)
+    RecordingStreamReader.bytes_read += len(result)
+    return result
+
+
+class TimelineBenchmarks(test_lib.AverageMicroBenchmarks):
+  """Benchmarks building and reading large timelines."""
+
+  REPEATS = 1
+
+  # Raise this to 10M for a full scale run.
+  EVENTS = 100000
+
+  # The memory budget for sorting the events.
+  SORT_BUFFER_SIZE = 1024 * 1024
+
+  def testBuildTimeline(self):
+    """Builds a timeline in a fixed memory budget and queries it."""
+    path = "/C.1/benchmark"
+
+    def Build():
+      fd = aff4.FACTORY.Create(path, "GRRTimeSeries", token=self.token)
+      for i in xrange(self.EVENTS):
+        event = timeline.Event(timestamp=random.randint(1, self.EVENTS))
+        event.stat.pathspec.path = "/file%d" % i
+        fd.AddEvent(event)
+        self.assertLess(fd.buffer_size, self.SORT_BUFFER_SIZE)
+
+      fd.Close()
+      return fd.run_count
+
+    with utils.Stubber(timeline.GRRTimeSeries, "SORT_BUFFER_SIZE",
+                       self.SORT_BUFFER_SIZE):
+      self.TimeIt(Build, name="Build %d events" % self.EVENTS)
+
+    fd = aff4.FACTORY.Open(path, token=self.token)
+    self.assertEqual(fd.Get(fd.Schema.SIZE), self.EVENTS)
+
+    def ReadRange():
+      return len(list(fd.Events(start=self.EVENTS / 2,
+                                end=self.EVENTS / 2 + 100)))
+
+    self.TimeIt(ReadRange, name="Read a range", repetitions=10)
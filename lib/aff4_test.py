@@ -682,6 +682,81 @@ class AFF4Tests(test_lib.AFF4ObjectTest):
         for value, _ in values:
           self.assertFalse(unique_token in utils.SmartUnicode(value))
 
+  def _CreateTree(self):
+    paths = ["aff4:/tmp/dir1/hello%d.txt" % i for i in range(4)]
+    paths += ["aff4:/tmp/dir1/foo/hello%d.txt" % i for i in range(3)]
+    paths += ["aff4:/tmp/dir1/foo/bar/hello.txt"]
+
+    for path in paths + ["aff4:/tmp/dir2/hello.txt"]:
+      with aff4.FACTORY.Create(path, "AFF4MemoryStream",
+                               token=self.token) as fd:
+        fd.Write("hello")
+
+    # The files and the foo, foo/bar and dir1 directories.
+    return len(paths) + 3
+
+  def _CheckTreeDeleted(self):
+    for subject in data_store.DB.subjects:
+      self.assertFalse(subject.startswith("aff4:/tmp/dir1"))
+
+    fd = aff4.FACTORY.Open("aff4:/tmp", token=self.token)
+    self.assertListEqual(list(fd.ListChildren()), ["aff4:/tmp/dir2"])
+    fd = aff4.FACTORY.Open("aff4:/tmp/dir2/hello.txt", token=self.token)
+    self.assertEqual(fd.Read(100), "hello")
+
+  def testRecursiveDeletionDeletesInBatches(self):
+    num_objects = self._CreateTree()
+
+    progress = []
+    deletion = aff4.RecursiveDeletion(
+        ["aff4:/tmp/dir1"], batch_size=3,
+        progress_callback=lambda deleted, _: progress.append(deleted),
+        token=self.token)
+    self.assertEqual(deletion.Run(), num_objects)
+
+    self._CheckTreeDeleted()
+    self.assertEqual(progress[-1], num_objects)
+    for previous, deleted in zip([0] + progress, progress):
+      self.assertLessEqual(deleted - previous, 3)
+
+  def testRecursiveDeletionCanBeResumed(self):
+    num_objects = self._CreateTree()
+
+    cursors = []
+
+    def Interrupt(unused_deleted, cursor):
+      cursors.append(cursor)
+      raise RuntimeError("Worker died.")
+
+    deletion = aff4.RecursiveDeletion(["aff4:/tmp/dir1"], batch_size=3,
+                                      progress_callback=Interrupt,
+                                      token=self.token)
+    self.assertRaises(RuntimeError, deletion.Run)
+
+    # The rest of the tree is still reachable.
+    fd = aff4.FACTORY.Open("aff4:/tmp", token=self.token)
+    self.assertListEqual(sorted(fd.ListChildren()),
+                         ["aff4:/tmp/dir1", "aff4:/tmp/dir2"])
+
+    deletion = aff4.RecursiveDeletion(["aff4:/tmp/dir1"], batch_size=3,
+                                      token=self.token)
+    self.assertEqual(deletion.Run(cursor=cursors[0]), num_objects - 3)
+
+    self._CheckTreeDeleted()
+
+  def testRecursiveDeletionIsRateLimited(self):
+    num_objects = self._CreateTree()
+
+    delays = []
+    with utils.Stubber(time, "sleep", delays.append):
+      with test_lib.FakeTime(100):
+        aff4.RecursiveDeletion(["aff4:/tmp/dir1"], batch_size=4, max_rate=2,
+                               token=self.token).Run()
+
+    # The clock does not move, so every batch waits for its full time slot.
+    self.assertEqual(sum(delays), num_objects / 2.0)
+    self._CheckTreeDeleted()
+
   def testClientObject(self):
     fd = aff4.FACTORY.Create(self.client_id, "VFSGRRClient", token=self.token)
 
@@ -1176,6 +1251,51 @@ class AFF4Tests(test_lib.AFF4ObjectTest):
     self.assertListEqual(sorted(all_children),
                          [root_urn.Add("some1"), root_urn.Add("some2")])
 
+  def testWriteBatch(self):
+    root_urn = aff4.ROOT_URN.Add("path")
+
+    calls = []
+    multi_set_multi = data_store.DB.MultiSetMulti
+
+    def RecordingMultiSetMulti(values, **kwargs):
+      calls.append(sorted(values))
+      return multi_set_multi(values, **kwargs)
+
+    with utils.Stubber(data_store.DB, "MultiSetMulti", RecordingMultiSetMulti):
+      with aff4.WriteBatch():
+        for i in range(10):
+          fd = aff4.FACTORY.Create(root_urn.Add("some%d" % i), "VFSFile",
+                                   token=self.token)
+          fd.Set(fd.Schema.STAT(rdf_client.StatEntry(st_size=i)))
+          fd.Close(sync=False)
+
+        # Nothing is written until the batch ends.
+        self.assertEqual(calls, [])
+
+    # One write for the objects and one for the child index.
+    self.assertEqual(len(calls), 2)
+    self.assertEqual(calls[0], [root_urn.Add("some%d" % i) for i in range(10)])
+
+    root = aff4.FACTORY.Open(root_urn, token=self.token)
+    self.assertEqual(len(list(root.ListChildren())), 10)
+
+    fd = aff4.FACTORY.Open(root_urn.Add("some7"), token=self.token)
+    self.assertEqual(fd.__class__.__name__, "VFSFile")
+    self.assertEqual(fd.Get(fd.Schema.STAT).st_size, 7)
+
+  def testWriteBatchKeepsDeletions(self):
+    urn = aff4.ROOT_URN.Add("path").Add("deleted")
+    with aff4.FACTORY.Create(urn, "VFSFile", token=self.token) as fd:
+      fd.Set(fd.Schema.STAT(rdf_client.StatEntry(st_size=1)))
+
+    with aff4.WriteBatch():
+      fd = aff4.FACTORY.Open(urn, mode="rw", token=self.token)
+      fd.DeleteAttribute(fd.Schema.STAT)
+      fd.Close(sync=False)
+
+    fd = aff4.FACTORY.Open(urn, token=self.token)
+    self.assertEqual(fd.Get(fd.Schema.STAT), None)
+
   def testMultiListChildren(self):
     client1 = "C.%016X" % 0
     client2 = "C.%016X" % 1
@@ -1200,6 +1320,67 @@ class AFF4Tests(test_lib.AFF4ObjectTest):
     self.assertListEqual(children[client2_urn],
                          [client2_urn.Add("some2")])
 
+  def testListSubtree(self):
+    root_urn = aff4.ROOT_URN.Add("path")
+    for path in ["a", "a/b", "a/b/c", "a/d", "e"]:
+      fd = aff4.FACTORY.Create(root_urn.Add(path), "VFSFile",
+                               token=self.token)
+      fd.Set(fd.Schema.STAT(rdf_client.StatEntry(st_size=len(path))))
+      fd.Close()
+
+    # A batch smaller than the hierarchy needs several round trips.
+    calls = []
+    multi_resolve_regex = data_store.DB.MultiResolveRegex
+
+    def RecordingMultiResolveRegex(subjects, *args, **kwargs):
+      calls.append(subjects)
+      return multi_resolve_regex(subjects, *args, **kwargs)
+
+    stat = aff4.Attribute.GetAttributeByName("stat")
+    with utils.Stubber(data_store.DB, "MultiResolveRegex",
+                       RecordingMultiResolveRegex):
+      results = list(aff4.FACTORY.ListSubtree([root_urn], attributes=[stat],
+                                              batch_size=2, token=self.token))
+
+    self.assertTrue(all(len(subjects) <= 2 for subjects in calls))
+
+    urns = [urn for urn, _ in results]
+    self.assertEqual(sorted(urns), [root_urn.Add(path) for path in
+                                    ["a", "a/b", "a/b/c", "a/d", "e"]])
+
+    # Parents come before their children.
+    self.assertLess(urns.index(root_urn.Add("a")),
+                    urns.index(root_urn.Add("a/b")))
+    self.assertLess(urns.index(root_urn.Add("a/b")),
+                    urns.index(root_urn.Add("a/b/c")))
+
+    for urn, values in results:
+      self.assertEqual(values[stat].st_size,
+                       len(urn.Path()) - len(root_urn.Path()) - 1)
+
+    # Without attributes only the urns are listed.
+    results = list(aff4.FACTORY.ListSubtree([root_urn.Add("a")],
+                                            token=self.token))
+    self.assertEqual(sorted(urn for urn, _ in results),
+                     [root_urn.Add(path) for path in ["a/b", "a/b/c", "a/d"]])
+    self.assertEqual([values for _, values in results], [{}, {}, {}])
+
+  def testRecursiveMultiListChildrenListsEveryUrnOnce(self):
+    root_urn = aff4.ROOT_URN.Add("path")
+    for path in ["a", "a/b", "a/b/c", "a/d"]:
+      aff4.FACTORY.Create(root_urn.Add(path), "VFSFile",
+                          token=self.token).Close()
+
+    # The given urns overlap, a/b is also a descendant of a.
+    results = list(aff4.FACTORY.RecursiveMultiListChildren(
+        [root_urn.Add("a/b"), root_urn.Add("a")], token=self.token))
+
+    subjects = [utils.SmartUnicode(subject) for subject, _ in results]
+    self.assertEqual(sorted(subjects), sorted(set(subjects)))
+    self.assertEqual(sorted(subjects),
+                     [utils.SmartUnicode(root_urn.Add(path))
+                      for path in ["a", "a/b", "a/b/c", "a/d"]])
+
   def testIndexNotUpdatedWhenWrittenWithinIntermediateCacheAge(self):
     with utils.Stubber(time, "time", lambda: 100):
       fd = aff4.FACTORY.Create(
@@ -1581,6 +1762,67 @@ class AFF4Tests(test_lib.AFF4ObjectTest):
         label_index.FindUrnsByLabel("label3"),
         [rdf_client.ClientURN("C.0000000000000001")])
 
+  def testMultiAddLabelsLabelsObjectsAndIndex(self):
+    client_ids = ["C.%016X" % i for i in range(3)]
+    for client_id in client_ids:
+      aff4.FACTORY.Create(client_id, "VFSGRRClient", token=self.token).Close()
+
+    with aff4.FACTORY.Open(client_ids[0], mode="rw",
+                           token=self.token) as client:
+      client.AddLabels("label1")
+
+    # Objects that do not exist are skipped.
+    aff4.FACTORY.MultiAddLabels(client_ids + ["C.1000000000000000"],
+                                ["label1", "label2"], token=self.token)
+
+    for client_id in client_ids:
+      client = aff4.FACTORY.Open(client_id, token=self.token)
+      self.assertListEqual(client.GetLabelsNames(), ["label1", "label2"])
+    self.assertFalse(aff4.FACTORY.Open("C.1000000000000000",
+                                       token=self.token).GetLabels())
+
+    label_index = aff4.FACTORY.Open(aff4.VFSGRRClient.labels_index_urn,
+                                    token=self.token)
+    self.assertListEqual(
+        sorted(label_index.FindUrnsByLabel("label2")),
+        [rdf_client.ClientURN(client_id) for client_id in client_ids])
+
+  def testMultiAddLabelsSkipsObjectsOfOtherTypes(self):
+    aff4.FACTORY.Create("C.0000000000000001", "VFSGRRClient",
+                        token=self.token).Close()
+    aff4.FACTORY.Create("aff4:/foo", "AFF4Volume", token=self.token).Close()
+
+    labelled = aff4.FACTORY.MultiAddLabels(
+        ["C.0000000000000001", "aff4:/foo"], ["label1"],
+        aff4_type="VFSGRRClient", token=self.token)
+
+    self.assertEqual(labelled, [rdf_client.ClientURN("C.0000000000000001")])
+    self.assertFalse(aff4.FACTORY.Open("aff4:/foo",
+                                       token=self.token).GetLabels())
+
+  def testMultiRemoveLabelsRemovesOnlyOwnersLabels(self):
+    client_ids = ["C.%016X" % i for i in range(3)]
+    for client_id in client_ids:
+      with aff4.FACTORY.Create(client_id, "VFSGRRClient",
+                               token=self.token) as client:
+        client.AddLabels("label1", "label2")
+        client.AddLabels("label1", owner="GRR")
+
+    aff4.FACTORY.MultiRemoveLabels(client_ids[:2], ["label1"],
+                                   token=self.token)
+
+    for client_id in client_ids[:2]:
+      labels = aff4.FACTORY.Open(client_id, token=self.token).GetLabels()
+      self.assertEqual(sorted((l.owner, l.name) for l in labels),
+                       [("GRR", "label1"), ("test", "label2")])
+
+    label_index = aff4.FACTORY.Open(aff4.VFSGRRClient.labels_index_urn,
+                                    token=self.token)
+    self.assertListEqual(label_index.FindUrnsByLabel("label1", owner="test"),
+                         [rdf_client.ClientURN(client_ids[2])])
+    self.assertEqual(
+        len(label_index.FindUrnsByLabel("label1", owner="GRR")), 3)
+
   def testPathSpecInterpolation(self):
     # Create a base directory containing a pathspec.
     os_urn = rdfvalue.RDFURN("aff4:/C.0000000000000002/fs/os")
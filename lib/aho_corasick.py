@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""An Aho-Corasick matcher for searching many literals in a single pass."""
+
+
+import collections
+import re
+
+
+class Matcher(object):
+  """Finds all occurrences of a set of literals in a buffer.
+
+  The patterns may be XOR encoded, as the Grep client action receives them, so
+  they never have to be present in memory in the clear: the automaton is built
+  from the encoded patterns and the data is encoded with the same key before
+  it is scanned.
+  """
+
+  def __init__(self, patterns, xor_key=0):
+    """Constructor.
+
+    Args:
+      patterns: A list of strings or bytearrays to search for, encoded with
+                xor_key.
+      xor_key: The key the patterns are encoded with.
+
+    Raises:
+      ValueError: if no patterns or an empty pattern is given.
+    """
+    if not patterns:
+      raise ValueError("At least one pattern is needed.")
+
+    self.lengths = []
+    self.xor_key = xor_key
+    self.translation = None
+    if xor_key:
+      self.translation = "".join(chr(i ^ xor_key) for i in xrange(256))
+
+    # State 0 is the root of the trie.
+    self.transitions = [{}]
+    self.outputs = [[]]
+    for index, pattern in enumerate(patterns):
+      pattern = str(pattern)
+      if not pattern:
+        raise ValueError("Empty patterns are not allowed.")
+
+      state = 0
+      for char in pattern:
+        next_state = self.transitions[state].get(char)
+        if next_state is None:
+          next_state = len(self.transitions)
+          self.transitions.append({})
+          self.outputs.append([])
+          self.transitions[state][char] = next_state
+        state = next_state
+
+      self.outputs[state].append(index)
+      self.lengths.append(len(pattern))
+
+    self._BuildFailureLinks()
+
+    # While in the root state, we can skip straight to the next character
+    # that starts a pattern.
+    self.start_regex = re.compile(
+        "[%s]" % "".join(re.escape(c) for c in self.transitions[0]))
+
+  def _BuildFailureLinks(self):
+    """Computes the failure links by walking the trie breadth first."""
+    self.failure = [0] * len(self.transitions)
+
+    queue = collections.deque(self.transitions[0].itervalues())
+    while queue:
+      state = queue.popleft()
+      for char, next_state in self.transitions[state].iteritems():
+        queue.append(next_state)
+
+        fallback = self.failure[state]
+        while fallback and char not in self.transitions[fallback]:
+          fallback = self.failure[fallback]
+
+        link = self.transitions[fallback].get(char, 0)
+        self.failure[next_state] = link
+        self.outputs[next_state] = (self.outputs[next_state] +
+                                    self.outputs[link])
+
+  @property
+  def max_length(self):
+    return max(self.lengths)
+
+  def FindIter(self, data):
+    """Yields all matches in data.
+
+    Overlapping matches and matches of patterns that are suffixes of other
+    patterns are all reported.
+
+    Args:
+      data: The buffer to search (not encoded).
+
+    Yields:
+      (start, end, pattern index) tuples ordered by end offset.
+    """
+    if self.translation:
+      data = data.translate(self.translation)
+
+    transitions = self.transitions
+    failure = self.failure
+    outputs = self.outputs
+    lengths = self.lengths
+
+    state = 0
+    pos = 0
+    data_len = len(data)
+    while pos < data_len:
+      if not state:
+        match = self.start_regex.search(data, pos)
+        if not match:
+          return
+        pos = match.start()
+
+      char = data[pos]
+      pos += 1
+      while True:
+        next_state = transitions[state].get(char)
+        if next_state is not None:
+          state = next_state
+          break
+        if not state:
+          break
+        state = failure[state]
+
+      for index in outputs[state]:
+        yield (pos - lengths[index], pos, index)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Tests for the Aho-Corasick multi-pattern matcher."""
+
+
+from grr.lib import aho_corasick
+from grr.lib import flags
+from grr.lib import test_lib
+from grr.lib import utils
+
+
+class MatcherTest(test_lib.GRRBaseTest):
+  """Tests the multi-pattern matcher."""
+
+  def testFindsAllOccurrencesOfAllPatterns(self):
+    matcher = aho_corasick.Matcher(["he", "she", "his", "hers"])
+
+    self.assertEqual(list(matcher.FindIter("ushers")),
+                     [(1, 4, 1), (2, 4, 0), (2, 6, 3)])
+
+  def testFindsOverlappingMatches(self):
+    matcher = aho_corasick.Matcher(["aa", "a"])
+
+    self.assertEqual(list(matcher.FindIter("aaa")),
+                     [(0, 1, 1), (0, 2, 0), (1, 2, 1), (1, 3, 0), (2, 3, 1)])
+
+  def testMatchesAreOrderedByEndOffset(self):
+    patterns = ["abcd", "bc", "c", "xyz", "d"]
+    data = "xxabcdxyzabc"
+    matcher = aho_corasick.Matcher(patterns)
+
+    results = list(matcher.FindIter(data))
+    self.assertEqual([end for _, end, _ in results],
+                     sorted(end for _, end, _ in results))
+
+    expected = []
+    for index, pattern in enumerate(patterns):
+      for start in range(len(data)):
+        if data.startswith(pattern, start):
+          expected.append((start, start + len(pattern), index))
+    self.assertItemsEqual(results, expected)
+
+  def testXorEncodedPatterns(self):
+    key = 37
+    matcher = aho_corasick.Matcher(
+        [utils.Xor(pattern, key) for pattern in ["secret", "cret"]],
+        xor_key=key)
+
+    self.assertEqual(list(matcher.FindIter("a secret")),
+                     [(2, 8, 0), (4, 8, 1)])
+    # Encoded patterns are not found in the clear.
+    self.assertEqual(list(matcher.FindIter(utils.Xor("secret", key))), [])
+
+  def testSpecialCharacters(self):
+    matcher = aho_corasick.Matcher(["\x00]", "^\\", "[.*"])
+
+    self.assertEqual(list(matcher.FindIter("a\x00]^\\[.*")),
+                     [(1, 3, 0), (3, 5, 1), (5, 8, 2)])
+
+  def testRejectsEmptyPatterns(self):
+    self.assertRaises(ValueError, aho_corasick.Matcher, [])
+    self.assertRaises(ValueError, aho_corasick.Matcher, ["a", ""])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -405,6 +405,54 @@ INTERPOLATED_REGEX = re.compile(r"%%([^%]+?)%%")
 GLOB_MAGIC_CHECK = re.compile("[*?[]")
 
 
+def GetKbAttributeValues(name, knowledge_base):
+  """Returns the values a knowledgebase attribute interpolates to.
+
+  Args:
+    name: The name of the attribute between the interpolation markers. For
+      example: "users.username".
+    knowledge_base: The knowledge_base to get the values from.
+
+  Returns:
+    A list of the alternative values of the attribute.
+
+  Raises:
+    AttributeError: If the knowledge base does not have the attribute.
+  """
+  alternatives = []
+  if "." in name:  # e.g. %%users.username%%
+    base_name, attr_name = name.split(".", 1)
+    kb_value = knowledge_base.Get(base_name.lower())
+    if not kb_value:
+      raise AttributeError(base_name.lower())
+    elif isinstance(kb_value, basestring):
+      alternatives.append(kb_value)
+    else:
+      # Iterate over repeated fields (e.g. users)
+      sub_attrs = []
+      for value in kb_value:
+        sub_attr = value.Get(attr_name)
+        # Ignore empty results
+        if sub_attr:
+          sub_attrs.append(unicode(sub_attr))
+
+      # If we got some results we use them. On Windows it is common for
+      # users.temp to be defined for some users, but not all users.
+      if sub_attrs:
+        alternatives.extend(sub_attrs)
+      else:
+        # If there were no results we raise
+        raise AttributeError(name.lower())
+  else:
+    kb_value = knowledge_base.Get(name.lower())
+    if not kb_value:
+      raise AttributeError(name.lower())
+    elif isinstance(kb_value, basestring):
+      alternatives.append(kb_value)
+
+  return alternatives
+
+
 def InterpolateKbAttributes(pattern, knowledge_base):
   """Interpolate all knowledgebase attributes in pattern.
 
@@ -422,38 +470,8 @@ def InterpolateKbAttributes(pattern, knowledge_base):
   for match in INTERPOLATED_REGEX.finditer(pattern):
     components.append([pattern[offset:match.start()]])
     # Expand the attribute into the set of possibilities:
-    alternatives = []
-
     try:
-      if "." in match.group(1):  # e.g. %%users.username%%
-        base_name, attr_name = match.group(1).split(".", 1)
-        kb_value = knowledge_base.Get(base_name.lower())
-        if not kb_value:
-          raise AttributeError(base_name.lower())
-        elif isinstance(kb_value, basestring):
-          alternatives.append(kb_value)
-        else:
-          # Iterate over repeated fields (e.g. users)
-          sub_attrs = []
-          for value in kb_value:
-            sub_attr = value.Get(attr_name)
-            # Ignore empty results
-            if sub_attr:
-              sub_attrs.append(unicode(sub_attr))
-
-          # If we got some results we use them. On Windows it is common for
-          # users.temp to be defined for some users, but not all users.
-          if sub_attrs:
-            alternatives.extend(sub_attrs)
-          else:
-            # If there were no results we raise
-            raise AttributeError(match.group(1).lower())
-      else:
-        kb_value = knowledge_base.Get(match.group(1).lower())
-        if not kb_value:
-          raise AttributeError(match.group(1).lower())
-        elif isinstance(kb_value, basestring):
-          alternatives.append(kb_value)
+      alternatives = GetKbAttributeValues(match.group(1), knowledge_base)
     except AttributeError as e:
       raise KnowledgeBaseInterpolationError("Failed to interpolate %s with the "
                                             "knowledgebase. %s" % (pattern, e))
@@ -6,6 +6,7 @@ An index of client machines, associating likely identifiers to client IDs.
 
 
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import keyword_index
 from grr.lib import rdfvalue
 from grr.lib import utils
@@ -236,6 +237,30 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
 
     self.AddKeywordsForName(*self.AnalyzeClient(client), **kwargs)
 
+  def AddClientLabels(self, client_urns, labels_names, **kwargs):
+    """Adds the label keywords of many clients without opening them.
+
+    Args:
+      client_urns: The ClientURNs of the labelled clients.
+      labels_names: The names of the labels added to the clients.
+      **kwargs: Additional arguments to pass to the datastore.
+    """
+    keywords = set()
+    for label_name in labels_names:
+      keyword = self._NormalizeKeyword(utils.SmartStr(label_name))
+      keywords.update([keyword, "label:" + keyword])
+
+    timestamp = rdfvalue.RDFDatetime().Now().AsMicroSecondsFromEpoch()
+    columns = dict(
+        (self.INDEX_COLUMN_FORMAT %
+         self._ClientIdFromURN(rdf_client.ClientURN(urn)), [("", timestamp)])
+        for urn in client_urns)
+
+    # All the keywords of all the clients are written in one operation.
+    data_store.DB.MultiSetMulti(
+        dict((self._KeywordToURN(keyword), columns) for keyword in keywords),
+        token=self.token, **kwargs)
+
 
 def GetClientURNsForHostnames(hostnames, token=None):
   """Gets all client_ids for a given list of hostnames or FQDNS.
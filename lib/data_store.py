@@ -37,8 +37,10 @@ able to filter it directly).
 
 import abc
 import atexit
+import functools
 import re
 import sys
+import threading
 import time
 
 import logging
@@ -79,11 +81,247 @@ class TransactionError(Error):
 # This token will be used by default if no token was provided.
 default_token = None
 
+# If False, data store operations are not instrumented. Set from the
+# Datastore.enable_instrumentation config option once the metrics are
+# registered.
+INSTRUMENTATION_ENABLED = False
+
+# Per thread instrumentation state: the stack of callers operations are
+# attributed to and whether an instrumented operation is in progress.
+_INSTRUMENTATION = threading.local()
+
+
+class OperationsCaller(object):
+  """Attributes data store operations done in this context to a caller.
+
+  Usage:
+
+  with data_store.OperationsCaller("MyCronJob"):
+    ... all the data store operations done here are reported with
+        caller="MyCronJob" in the datastore_operation_* metrics ...
+  """
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    _INSTRUMENTATION.__dict__.setdefault("callers", []).append(self.name)
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    _INSTRUMENTATION.callers.pop()
+
+
+def _ValueSize(value):
+  """Size of a single stored value. Only primitive values are measured."""
+  if isinstance(value, basestring):
+    return len(value)
+  elif isinstance(value, (int, long, float)):
+    return 8
+  return 0
+
+
+def _GetArg(args, kwargs, index, name):
+  if len(args) > index:
+    return args[index]
+  return kwargs.get(name)
+
+
+# Functions computing (subjects, values, bytes) touched by an operation from
+# its arguments.
+def _CountSubject(unused_args, unused_kwargs):
+  return 1, 0, 0
+
+
+def _CountSubjects(args, kwargs):
+  return len(_GetArg(args, kwargs, 0, "subjects") or []), 0, 0
+
+
+def _CountSet(args, kwargs):
+  return 1, 1, _ValueSize(_GetArg(args, kwargs, 2, "value"))
+
+
+def _CountAttributeValues(values):
+  count = size = 0
+  for attribute_values in values.values():
+    if not isinstance(attribute_values, list):
+      attribute_values = [attribute_values]
+
+    for value in attribute_values:
+      # Values may be (value, timestamp) tuples.
+      if isinstance(value, tuple):
+        value = value[0]
+      count += 1
+      size += _ValueSize(value)
+
+  return count, size
+
+
+def _CountMultiSet(args, kwargs):
+  count, size = _CountAttributeValues(_GetArg(args, kwargs, 1, "values") or {})
+  return 1, count, size
+
+
+def _CountMultiSetMulti(args, kwargs):
+  values = _GetArg(args, kwargs, 0, "values") or {}
+  to_delete = _GetArg(args, kwargs, 4, "to_delete") or {}
+  count = size = 0
+  for subject_values in values.values():
+    subject_count, subject_size = _CountAttributeValues(subject_values)
+    count += subject_count
+    size += subject_size
+
+  return len(set(values) | set(to_delete)), count, size
+
+
+def _CountDeleteAttributes(args, kwargs):
+  return 1, len(_GetArg(args, kwargs, 1, "attributes") or []), 0
+
+
+# Functions computing (subjects, values, bytes) of a single returned item.
+def _CountCell(item):
+  return 0, 1, _ValueSize(item[1])
+
+
+def _CountSubjectCells(item):
+  return 1, len(item[1]), sum(_ValueSize(cell[1]) for cell in item[1])
+
+
+def _RecordOperation(operation, backend, latency, subjects, values, size):
+  callers = getattr(_INSTRUMENTATION, "callers", None)
+  fields = [operation, backend, callers and callers[-1] or "unknown"]
+
+  stats.STATS.RecordEvent("datastore_operation_latency", latency,
+                          fields=fields)
+  if subjects:
+    stats.STATS.IncrementCounter("datastore_operation_subjects",
+                                 delta=subjects, fields=fields)
+  if values:
+    stats.STATS.IncrementCounter("datastore_operation_values",
+                                 delta=values, fields=fields)
+  if size:
+    stats.STATS.IncrementCounter("datastore_operation_bytes",
+                                 delta=size, fields=fields)
+
+
+def _CountResults(results, operation, backend, latency, counts, count_item):
+  """Yields the results of an operation, recording them when exhausted.
+
+  Lazy results are produced while the caller iterates over them. Only the
+  time spent producing them counts towards the latency, and the data store
+  operations run to produce them are part of this operation. Operations the
+  caller runs between two results are recorded on their own.
+  """
+  subjects, values, size = counts
+  results = iter(results)
+  try:
+    while True:
+      start = time.time()
+      active = getattr(_INSTRUMENTATION, "active", False)
+      _INSTRUMENTATION.active = True
+      try:
+        item = results.next()
+      except StopIteration:
+        return
+      finally:
+        _INSTRUMENTATION.active = active
+        latency += time.time() - start
+
+      item_subjects, item_values, item_size = count_item(item)
+      subjects += item_subjects
+      values += item_values
+      size += item_size
+      yield item
+  finally:
+    _RecordOperation(operation, backend, latency, subjects, values, size)
+
+
+def _Instrument(operation, func, count_args, count_item):
+  """Wraps a data store operation to record its latency and volume."""
+
+  @functools.wraps(func)
+  def Instrumented(self, *args, **kwargs):
+    # Only the outermost operation is recorded, so operations implemented on
+    # top of other operations are not counted twice.
+    if not INSTRUMENTATION_ENABLED or getattr(_INSTRUMENTATION, "active",
+                                              False):
+      return func(self, *args, **kwargs)
+
+    start = time.time()
+    _INSTRUMENTATION.active = True
+    try:
+      result = func(self, *args, **kwargs)
+    finally:
+      _INSTRUMENTATION.active = False
+    latency = time.time() - start
+
+    counts = (0, 0, 0)
+    if count_args:
+      counts = count_args(args, kwargs)
+
+    backend = self.__class__.__name__
+    if count_item is None or result is None:
+      _RecordOperation(operation, backend, latency, *counts)
+      return result
+
+    # Lazy results are counted as they are consumed.
+    if hasattr(result, "next"):
+      return _CountResults(result, operation, backend, latency, counts,
+                           count_item)
+
+    for _ in _CountResults(result, operation, backend, latency, counts,
+                           count_item):
+      pass
+    return result
+
+  # Data store implementations are checked to have the same signatures as the
+  # DataStore interface, the check looks through the wrapper.
+  Instrumented.__wrapped__ = func
+  return Instrumented
+
+
+class InstrumentedMetaclass(registry.MetaclassRegistry):
+  """Instruments the operations listed in INSTRUMENTED_OPERATIONS.
+
+  Every implementation of an instrumented operation is wrapped when the
+  implementing class is defined, so all data store backends are instrumented
+  without any backend specific code.
+  """
+
+  def __init__(cls, name, bases, env_dict):
+    registry.MetaclassRegistry.__init__(cls, name, bases, env_dict)
+
+    for operation, (count_args, count_item) in getattr(
+        cls, "INSTRUMENTED_OPERATIONS", {}).iteritems():
+      func = env_dict.get(operation)
+      if func is None or getattr(func, "__isabstractmethod__", False):
+        continue
+
+      prefix = getattr(cls, "INSTRUMENTATION_PREFIX", "")
+      setattr(cls, operation,
+              _Instrument(prefix + operation, func, count_args, count_item))
+
 
 class DataStore(object):
   """Abstract database access."""
 
-  __metaclass__ = registry.MetaclassRegistry
+  __metaclass__ = InstrumentedMetaclass
+
+  # Operations whose latency and volume are recorded: operation name ->
+  # (arguments counter, results item counter).
+  INSTRUMENTED_OPERATIONS = dict(
+      DeleteSubject=(_CountSubject, None),
+      DeleteSubjects=(_CountSubjects, None),
+      Set=(_CountSet, None),
+      MultiSet=(_CountMultiSet, None),
+      MultiSetMulti=(_CountMultiSetMulti, None),
+      DeleteAttributes=(_CountDeleteAttributes, None),
+      Transaction=(_CountSubject, None),
+      ResolveMulti=(_CountSubject, _CountCell),
+      ResolveRegex=(_CountSubject, _CountCell),
+      MultiResolveRegex=(None, _CountSubjectCells),
+      ScanSubjects=(None, _CountSubjectCells),
+      ScanAttributes=(_CountSubject, _CountCell))
 
   # Constants relating to timestamps.
   ALL_TIMESTAMPS = "ALL_TIMESTAMPS"
@@ -160,6 +398,21 @@ class DataStore(object):
   def DeleteSubject(self, subject, sync=False, token=None):
     """Completely deletes all information about this subject."""
 
+  def DeleteSubjects(self, subjects, sync=False, token=None):
+    """Completely deletes all information about these subjects.
+
+    The default implementation just calls DeleteSubject for every subject,
+    implementations should override this to delete all subjects in as few
+    round trips as possible.
+
+    Args:
+      subjects: A list of subjects to delete.
+      sync: If true we block until the operation completes.
+      token: An ACL token.
+    """
+    for subject in subjects:
+      self.DeleteSubject(subject, sync=sync, token=token)
+
   def Set(self, subject, attribute, value, timestamp=None, token=None,
           replace=True, sync=True):
     """Set a single value for this subject's attribute.
@@ -274,6 +527,31 @@ class DataStore(object):
       token: An ACL token.
     """
 
+  def MultiSetMulti(self, values, timestamp=None, replace=True, sync=True,
+                    to_delete=None, token=None):
+    """Set multiple attributes' values for many subjects in one operation.
+
+    The default implementation just calls MultiSet for every subject,
+    implementations should override this to write all subjects in as few
+    round trips as possible.
+
+    Args:
+      values: A dict with subjects as keys and dicts of attributes to values,
+              as accepted by MultiSet, as values.
+      timestamp: The timestamp for these entries in microseconds since the
+              epoch. None means now.
+      replace: Bool whether or not to overwrite current records.
+      sync: If true we block until the operation completes.
+      to_delete: A dict with subjects as keys and lists of attributes to clear
+              prior to setting as values.
+      token: An ACL token.
+    """
+    to_delete = to_delete or {}
+    for subject in set(values) | set(to_delete):
+      self.MultiSet(subject, values.get(subject, {}), timestamp=timestamp,
+                    replace=replace, sync=sync,
+                    to_delete=to_delete.get(subject), token=token)
+
   @abc.abstractmethod
   def DeleteAttributes(self, subject, attributes, start=None, end=None,
                        sync=True, token=None):
@@ -343,6 +621,78 @@ class DataStore(object):
       AccessError: if anything goes wrong.
     """
 
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    """Iterates over all subjects starting with a prefix in key order.
+
+    Unlike listing the children of an AFF4 object, this does not depend on a
+    single index row so it can be used to stream through very large subject
+    spaces in pages:
+
+    after = None
+    while True:
+      page = list(DB.ScanSubjects(prefix, attributes, after=after, limit=1000))
+      ...
+      if len(page) < 1000:
+        break
+      after = page[-1][0]
+
+    Args:
+      subject_prefix: Only subjects starting with this prefix are returned.
+      attributes: A list of attributes to return the newest values of.
+                  Subjects which have none of them set are skipped. If empty,
+                  all subjects are returned, without values.
+      after: Only subjects sorting after this one are returned. This is the
+             cursor to resume a scan from, the last subject returned so far.
+      limit: The maximum number of subjects to return.
+      token: An ACL token.
+
+    Returns:
+      An iterator over (subject, [(attribute, value, timestamp)]) tuples, in
+      increasing subject order.
+
+    Raises:
+      NotImplementedError: if the data store does not support scanning.
+    """
+    raise NotImplementedError("%s does not support scanning subjects." %
+                              self.__class__.__name__)
+
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """Returns the newest value of the matching attributes in attribute order.
+
+    Like ScanSubjects this allows paging through very large rows, such as
+    indexes, passing the last attribute returned as the cursor. This default
+    implementation reads all the matching attributes, implementations should
+    override it to only read the requested page.
+
+    Args:
+      subject: The subject.
+      attribute_regex: The attribute regex or a list of regexes.
+      after: Only attributes sorting after this one are returned.
+      limit: The maximum number of attributes to return.
+      token: An ACL token.
+
+    Returns:
+      A list of (attribute, value, timestamp) tuples with one entry per
+      attribute, sorted by attribute.
+    """
+    newest = {}
+    for attribute, value, ts in self.ResolveRegex(
+        subject, attribute_regex, timestamp=self.NEWEST_TIMESTAMP,
+        token=token):
+      if after is not None and attribute <= after:
+        continue
+      if attribute not in newest or newest[attribute][1] < ts:
+        newest[attribute] = (value, ts)
+
+    results = [(attribute, value, ts)
+               for attribute, (value, ts) in sorted(newest.iteritems())]
+    if limit:
+      results = results[:limit]
+
+    return results
+
   def ResolveRegex(self, subject, attribute_regex, timestamp=None,
                    limit=None, token=None):
     """Retrieve a set of value matching for this subject's attribute.
@@ -412,7 +762,10 @@ class Transaction(object):
   retry behavior for the transaction.
   """
 
-  __metaclass__ = registry.MetaclassRegistry
+  __metaclass__ = InstrumentedMetaclass
+
+  INSTRUMENTED_OPERATIONS = dict(Commit=(_CountSubject, None))
+  INSTRUMENTATION_PREFIX = "Transaction."
 
   @abc.abstractmethod
   def __init__(self, table, subject, lease_time=None, token=None):
@@ -692,5 +1045,20 @@ class DataStoreInit(registry.InitHook):
 
   def RunOnce(self):
     """Initialize some Varz."""
+    global INSTRUMENTATION_ENABLED  # pylint: disable=global-statement
+
     stats.STATS.RegisterCounterMetric("grr_commit_failure")
     stats.STATS.RegisterCounterMetric("datastore_retries")
+
+    fields = [("operation", str), ("backend", str), ("caller", str)]
+    stats.STATS.RegisterEventMetric("datastore_operation_latency",
+                                    fields=fields, units="SECONDS")
+    stats.STATS.RegisterCounterMetric("datastore_operation_subjects",
+                                      fields=fields)
+    stats.STATS.RegisterCounterMetric("datastore_operation_values",
+                                      fields=fields)
+    stats.STATS.RegisterCounterMetric("datastore_operation_bytes",
+                                      fields=fields)
+
+    INSTRUMENTATION_ENABLED = config_lib.CONFIG[
+        "Datastore.enable_instrumentation"]
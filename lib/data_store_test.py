@@ -285,6 +285,124 @@ class _DataStoreTest(test_lib.GRRBaseTest):
     self.assertListEqual(
         values, [("aff4:stored", "4", 150)])
 
+  def testMultiSetMulti(self):
+    """Test the MultiSetMulti() method."""
+    subjects = ["aff4:/row:%s" % i for i in range(5)]
+    data_store.DB.MultiSetMulti(
+        dict((subject, {"aff4:size": [(i, 100)],
+                        "aff4:stored": [("foo%d" % i, 200)]})
+             for i, subject in enumerate(subjects)),
+        token=self.token)
+
+    for i, subject in enumerate(subjects):
+      (stored, ts) = data_store.DB.Resolve(subject, "aff4:size",
+                                           token=self.token)
+      self.assertEqual(stored, i)
+      self.assertEqual(ts, 100)
+
+      (stored, ts) = data_store.DB.Resolve(subject, "aff4:stored",
+                                           token=self.token)
+      self.assertEqual(stored, "foo%d" % i)
+      self.assertEqual(ts, 200)
+
+  def testMultiSetMultiDeletesAndReplaces(self):
+    data_store.DB.MultiSetMulti(
+        {"aff4:/row:1": {"aff4:size": [1], "aff4:stored": ["2"]},
+         "aff4:/row:2": {"aff4:stored": [("2", 100)]}},
+        token=self.token)
+
+    # Only delete from row1, add a version to row2 and create row3.
+    data_store.DB.MultiSetMulti(
+        {"aff4:/row:2": {"aff4:stored": [("3", 200)]},
+         "aff4:/row:3": {"aff4:size": [3]}},
+        to_delete={"aff4:/row:1": ["aff4:size"]},
+        replace=False, token=self.token)
+
+    (stored, _) = data_store.DB.Resolve("aff4:/row:1", "aff4:size",
+                                        token=self.token)
+    self.assertEqual(stored, None)
+    (stored, _) = data_store.DB.Resolve("aff4:/row:1", "aff4:stored",
+                                        token=self.token)
+    self.assertEqual(stored, "2")
+
+    values = data_store.DB.ResolveRegex("aff4:/row:2", "aff4:stored",
+                                        timestamp=data_store.DB.ALL_TIMESTAMPS,
+                                        token=self.token)
+    self.assertListEqual(
+        values, [("aff4:stored", "3", 200), ("aff4:stored", "2", 100)])
+
+    (stored, _) = data_store.DB.Resolve("aff4:/row:3", "aff4:size",
+                                        token=self.token)
+    self.assertEqual(stored, 3)
+
+  def testScanSubjects(self):
+    for i in range(5):
+      data_store.DB.Set("aff4:/row:%s" % i, "aff4:size", i, timestamp=100,
+                        token=self.token)
+    data_store.DB.Set("aff4:/row:1", "aff4:size", 11, timestamp=200,
+                      token=self.token)
+    data_store.DB.Set("aff4:/row:1", "aff4:stored", "foo", token=self.token)
+    # Subjects not matching the prefix or missing the attributes are skipped.
+    data_store.DB.Set("aff4:/row:5", "aff4:stored", "bar", token=self.token)
+    data_store.DB.Set(self.test_row, "aff4:size", 5, token=self.token)
+    data_store.DB.Flush()
+
+    results = list(data_store.DB.ScanSubjects("aff4:/row:", ["aff4:size"],
+                                              token=self.token))
+    self.assertEqual([subject for subject, _ in results],
+                     ["aff4:/row:%s" % i for i in range(5)])
+    self.assertEqual(results[1][1], [("aff4:size", 11, 200)])
+    self.assertEqual(results[2][1], [("aff4:size", 2, 100)])
+
+    results = list(data_store.DB.ScanSubjects(
+        "aff4:/row:", ["aff4:size", "aff4:stored"], after="aff4:/row:0",
+        limit=2, token=self.token))
+    self.assertEqual([subject for subject, _ in results],
+                     ["aff4:/row:1", "aff4:/row:2"])
+    self.assertEqual(sorted(a for a, _, _ in results[0][1]),
+                     ["aff4:size", "aff4:stored"])
+
+  def testScanSubjectsPages(self):
+    subjects = ["aff4:/row:%s" % i for i in range(15)]
+    for subject in subjects:
+      data_store.DB.Set(subject, "aff4:size", 1, token=self.token)
+    data_store.DB.Flush()
+
+    scanned = []
+    after = None
+    while True:
+      page = list(data_store.DB.ScanSubjects("aff4:/row:", ["aff4:size"],
+                                             after=after, limit=4,
+                                             token=self.token))
+      scanned.extend(subject for subject, _ in page)
+      if len(page) < 4:
+        break
+      after = page[-1][0]
+
+    self.assertEqual(scanned, sorted(subjects))
+
+  def testScanAttributes(self):
+    for i in range(6):
+      data_store.DB.Set(self.test_row, "index:label:%s" % i, "X",
+                        timestamp=100, token=self.token)
+    # Newer versions replace the older ones.
+    data_store.DB.Set(self.test_row, "index:label:2", "Y", timestamp=200,
+                      replace=False, token=self.token)
+    data_store.DB.Set(self.test_row, "aff4:size", 1, token=self.token)
+    data_store.DB.Flush()
+
+    results = data_store.DB.ScanAttributes(self.test_row, "index:label:.*",
+                                           token=self.token)
+    self.assertEqual([a for a, _, _ in results],
+                     ["index:label:%s" % i for i in range(6)])
+    self.assertEqual(results[2], ("index:label:2", "Y", 200))
+
+    results = data_store.DB.ScanAttributes(
+        self.test_row, ["index:label:.*", "aff4:size"], after="index:label:1",
+        limit=3, token=self.token)
+    self.assertEqual([a for a, _, _ in results],
+                     ["index:label:2", "index:label:3", "index:label:4"])
+
   @DeletionTest
   def testDeleteAttributes(self):
     """Test we can delete an attribute."""
@@ -375,6 +493,22 @@ class _DataStoreTest(test_lib.GRRBaseTest):
     data_store.DB.DeleteSubject(self.test_row, token=self.token, sync=True)
     self.CheckLength(predicate, 0)
 
+  def testDeleteMultipleSubjects(self):
+    predicate = "metadata:tspredicate"
+    rows = [self.test_row + "/%d" % i for i in range(5)]
+    for row in rows:
+      data_store.DB.Set(row, predicate, "hello", token=self.token)
+
+    data_store.DB.DeleteSubjects(rows[:3], token=self.token)
+    data_store.DB.Flush()
+
+    for row in rows[:3]:
+      self.assertEqual(data_store.DB.Resolve(row, predicate, token=self.token),
+                       (None, 0))
+    for row in rows[3:]:
+      self.assertEqual(
+          data_store.DB.Resolve(row, predicate, token=self.token)[0], "hello")
+
   def testMultiResolveRegex(self):
     """tests MultiResolveRegex."""
     rows = self._MakeTimestampedRows()
@@ -1197,6 +1331,16 @@ class _DataStoreTest(test_lib.GRRBaseTest):
                         "aff4:stored": [("foo", 200)]},
         token=self.token)
 
+  def testMultiSetMultiChecksWriteAccess(self):
+    self._InstallACLChecks("w")
+
+    self.assertRaises(
+        access_control.UnauthorizedAccess,
+        data_store.DB.MultiSetMulti,
+        {self.test_row: {"aff4:size": [(1, 100)]},
+         "aff4:/row:2": {"aff4:stored": [("foo", 200)]}},
+        token=self.token)
+
   @DeletionTest
   def testDeleteAttributesChecksWriteAccess(self):
     self._InstallACLChecks("w")
@@ -1341,14 +1485,109 @@ class _DataStoreTest(test_lib.GRRBaseTest):
 
       self.assertEqual(len(results), min(limit, 10))
 
+  def _GetOperationStats(self, operation):
+    fields = [operation, data_store.DB.__class__.__name__, "test_caller"]
+    return (
+        stats.STATS.GetMetricValue("datastore_operation_latency",
+                                   fields=fields).count,
+        stats.STATS.GetMetricValue("datastore_operation_subjects",
+                                   fields=fields),
+        stats.STATS.GetMetricValue("datastore_operation_values",
+                                   fields=fields),
+        stats.STATS.GetMetricValue("datastore_operation_bytes",
+                                   fields=fields))
+
+  def testOperationsAreInstrumented(self):
+    multi_set = self._GetOperationStats("MultiSet")
+    resolve_multi = self._GetOperationStats("ResolveMulti")
+    multi_resolve = self._GetOperationStats("MultiResolveRegex")
+
+    with data_store.OperationsCaller("test_caller"):
+      data_store.DB.MultiSet(self.test_row,
+                             {"aff4:size": [1, 2],
+                              "aff4:stored": ["hello"]},
+                             token=self.token)
+      data_store.DB.MultiSet(self.test_row + "X", {"aff4:stored": ["x"]},
+                             token=self.token)
+
+      list(data_store.DB.ResolveMulti(self.test_row, ["aff4:stored"],
+                                      token=self.token))
+      list(data_store.DB.MultiResolveRegex(
+          [self.test_row, self.test_row + "X"], "aff4:stored",
+          token=self.token))
+
+    # Two MultiSet calls, two subjects, 4 values: 2 integers, 6 characters.
+    self.assertEqual(
+        [x - y for x, y in zip(self._GetOperationStats("MultiSet"),
+                               multi_set)],
+        [2, 2, 4, 2 * 8 + 6])
+    self.assertEqual(
+        [x - y for x, y in zip(self._GetOperationStats("ResolveMulti"),
+                               resolve_multi)],
+        [1, 1, 1, 5])
+    self.assertEqual(
+        [x - y for x, y in zip(self._GetOperationStats("MultiResolveRegex"),
+                               multi_resolve)],
+        [1, 2, 2, 6])
+
+  def testInstrumentationCanBeDisabled(self):
+    multi_set = self._GetOperationStats("MultiSet")
+
+    with utils.Stubber(data_store, "INSTRUMENTATION_ENABLED", False):
+      with data_store.OperationsCaller("test_caller"):
+        data_store.DB.MultiSet(self.test_row, {"aff4:size": [1]},
+                               token=self.token)
+
+    self.assertEqual(self._GetOperationStats("MultiSet"), multi_set)
+
+  def testLazyOperationsRecordTheirNestedOperations(self):
+    data_store.DB.MultiSet(self.test_row, {"aff4:size": [1],
+                                           "aff4:stored": ["hello"]},
+                           token=self.token)
+
+    def ResolveEach(unused_self, subject, attributes, token=None):
+      for attribute in attributes:
+        for item in data_store.DB.ResolveMulti(subject, [attribute],
+                                               token=token):
+          yield item
+
+    # pylint: disable=protected-access
+    resolve_each = data_store._Instrument(
+        "ResolveEach", ResolveEach, data_store._CountSubject,
+        data_store._CountCell)
+    # pylint: enable=protected-access
+
+    resolve_multi = self._GetOperationStats("ResolveMulti")
+    resolve = self._GetOperationStats("ResolveEach")
+    multi_set = self._GetOperationStats("MultiSet")
+
+    with data_store.OperationsCaller("test_caller"):
+      for _ in resolve_each(data_store.DB, self.test_row,
+                            ["aff4:size", "aff4:stored"], token=self.token):
+        # Operations of the caller are recorded on their own.
+        data_store.DB.MultiSet(self.test_row + "X", {"aff4:size": [1]},
+                               token=self.token)
+
+    # The ResolveMulti calls made to produce the results are part of the
+    # lazy operation.
+    self.assertEqual(self._GetOperationStats("ResolveMulti"), resolve_multi)
+    self.assertEqual(
+        [x - y for x, y in zip(self._GetOperationStats("ResolveEach"),
+                               resolve)],
+        [1, 1, 2, 8 + 5])
+    self.assertEqual(self._GetOperationStats("MultiSet")[0] - multi_set[0], 2)
+
   def testApi(self):
     api = ["DeleteAttributes",
            "DeleteSubject",
+           "DeleteSubjects",
            "MultiResolveRegex",
            "MultiSet",
+           "MultiSetMulti",
            "Resolve",
            "ResolveMulti",
            "ResolveRegex",
+           "ScanAttributes",
            "Set",
            "Transaction"]
 
@@ -1356,8 +1595,13 @@ class _DataStoreTest(test_lib.GRRBaseTest):
     reference = data_store.DataStore
 
     for f in api:
-      implementation_spec = inspect.getargspec(getattr(implementation, f))
-      reference_spec = inspect.getargspec(getattr(reference, f))
+      # Instrumented operations are wrapped, compare the wrapped functions.
+      implementation_func = getattr(implementation, f)
+      implementation_spec = inspect.getargspec(
+          getattr(implementation_func, "__wrapped__", implementation_func))
+      reference_func = getattr(reference, f)
+      reference_spec = inspect.getargspec(
+          getattr(reference_func, "__wrapped__", reference_func))
       self.assertEqual(
           implementation_spec, reference_spec,
           "Signatures for function %s not matching: \n%s !=\n%s" %(
@@ -1975,6 +2219,46 @@ class DataStoreBenchmarks(test_lib.MicroBenchmarks):
 
     self.BenchmarkAFF4Locks()
 
+  @test_lib.SetLabel("benchmark")
+  def testLabellingBenchmarks(self):
+    """Labelling throughput of the bulk label operations."""
+    for n in [10000, 100000]:
+      client_ids = ["C.%016X" % i for i in xrange(n)]
+      data_store.DB.MultiSetMulti(
+          dict(("aff4:/" + client_id, {"aff4:type": ["VFSGRRClient"]})
+               for client_id in client_ids), token=self.token)
+      data_store.DB.Flush()
+
+      # The single object API is only timed on a sample, it is much slower.
+      sample = client_ids[:n / 100]
+      start_time = time.time()
+      for client in aff4.FACTORY.MultiOpen(sample, mode="rw",
+                                           token=self.token):
+        client.AddLabels("sample")
+        client.Close()
+      data_store.DB.Flush()
+      end_time = time.time()
+
+      self.AddResult("AddLabels %d urns" % len(sample),
+                     (end_time - start_time) / len(sample), len(sample))
+
+      start_time = time.time()
+      aff4.FACTORY.MultiAddLabels(client_ids, ["label1", "label2"],
+                                  token=self.token)
+      data_store.DB.Flush()
+      end_time = time.time()
+
+      self.AddResult("MultiAddLabels %d urns" % n,
+                     (end_time - start_time) / n, n)
+
+      start_time = time.time()
+      aff4.FACTORY.MultiRemoveLabels(client_ids, ["label1"], token=self.token)
+      data_store.DB.Flush()
+      end_time = time.time()
+
+      self.AddResult("MultiRemoveLabels %d urns" % n,
+                     (end_time - start_time) / n, n)
+
   def BenchmarkWriting(self):
 
     subject_template = "aff4:/row%d"
@@ -2009,6 +2293,26 @@ class DataStoreBenchmarks(test_lib.MicroBenchmarks):
 
     self.AddResult("Set versions", (end_time - start_time) / self.n, self.n)
 
+    start_time = time.time()
+    for i in xrange(self.small_n):
+      data_store.DB.MultiSet(subject_template % i, {"task:flow": [value]},
+                             token=self.token)
+    data_store.DB.Flush()
+    end_time = time.time()
+
+    self.AddResult("MultiSet rows", (end_time - start_time) / self.small_n,
+                   self.small_n)
+
+    start_time = time.time()
+    data_store.DB.MultiSetMulti(
+        dict((subject_template % i, {"task:flow": [value]})
+             for i in xrange(self.small_n)), token=self.token)
+    data_store.DB.Flush()
+    end_time = time.time()
+
+    self.AddResult("MultiSetMulti rows", (end_time - start_time) / self.small_n,
+                   self.small_n)
+
     start_time = time.time()
     for i in xrange(self.small_n):
       data_store.DB.Set("aff4:/largerow%d" % i, "task:largeflow",
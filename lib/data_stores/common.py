@@ -3,6 +3,7 @@
 
 
 import collections
+import heapq
 import os
 import re
 import stat
@@ -72,11 +73,37 @@ def MakeDestinationKey(directory, filename):
   return utils.SmartStr(utils.JoinPath(directory, filename)).lstrip("/")
 
 
-def DatabaseDirectorySize(root_path, extension):
-  """Compute size (in bytes) and number of files of a file-based data store."""
+def SubjectPathPrefix(subject_prefix):
+  """Returns the escaped path shared by all subjects with the prefix.
+
+  The destination key of a subject is always a prefix of its escaped path, so
+  only the database files whose key is compatible with the returned path can
+  hold subjects with subject_prefix.
+
+  Args:
+   subject_prefix: A subject prefix.
+
+  Returns:
+   The escaped path, or None if the subjects may be stored in any file.
+  """
+  subject_prefix = utils.SmartUnicode(subject_prefix)
+  if not subject_prefix.startswith("aff4:/"):
+    return None
+  path = subject_prefix[len("aff4:/"):]
+  return utils.SmartStr(
+      "/".join(ConvertStringToFilename(x) for x in path.split("/")))
+
+
+def _WalkDatabaseFiles(root_path, extension, descend=None):
+  """Yields (path, stat) of all database files of a file-based data store.
+
+  Args:
+    root_path: The root directory of the data store.
+    extension: The file extension of the database files.
+    descend: If given, a callable taking a directory path which returns
+             whether the directory should be walked.
+  """
   directories = collections.deque([root_path])
-  total_size = 0
-  total_files = 0
   while directories:
     directory = directories.popleft()
     try:
@@ -92,11 +119,80 @@ def DatabaseDirectorySize(root_path, extension):
         if stat.S_ISLNK(statinfo.st_mode):
           continue
         if stat.S_ISDIR(statinfo.st_mode):
-          directories.append(path)
+          if descend is None or descend(path):
+            directories.append(path)
         elif stat.S_ISREG(statinfo.st_mode):
           if comp.endswith(extension):
-            total_size += statinfo.st_size
-            total_files += 1
+            yield path, statinfo
       except OSError:
         continue
+
+
+def DatabaseDirectorySize(root_path, extension):
+  """Compute size (in bytes) and number of files of a file-based data store."""
+  total_size = 0
+  total_files = 0
+  for _, statinfo in _WalkDatabaseFiles(root_path, extension):
+    total_size += statinfo.st_size
+    total_files += 1
   return total_size, total_files
+
+
+def DatabaseKeys(root_path, extension, subject_prefix=None):
+  """Yields the destination keys of the database files under root_path.
+
+  Args:
+    root_path: The root directory of the data store.
+    extension: The file extension of the database files.
+    subject_prefix: If given, only the keys of the files which may hold
+                    subjects with this prefix are yielded.
+  """
+  suffix = "." + extension
+  path_prefix = None
+  if subject_prefix is not None:
+    path_prefix = SubjectPathPrefix(subject_prefix)
+
+  def Compatible(key):
+    return (path_prefix is None or key.startswith(path_prefix) or
+            path_prefix.startswith(key))
+
+  def Descend(directory):
+    return Compatible(utils.SmartStr(os.path.relpath(directory, root_path)) +
+                      "/")
+
+  for path, _ in _WalkDatabaseFiles(root_path, suffix, descend=Descend):
+    key = utils.SmartStr(os.path.relpath(path, root_path)[:-len(suffix)])
+    # Subjects no pathing regex matches are stored in the default file.
+    if key == "aff4" or Compatible(key):
+      yield key
+
+
+def PagedScan(fetch_page, after=None, page_size=1000):
+  """Follows a subject scan cursor page by page.
+
+  Args:
+    fetch_page: A callable taking (after, limit) returning a list of
+                (subject, values) tuples sorted by subject.
+    after: The cursor to start after.
+    page_size: How many subjects to fetch at once.
+
+  Yields:
+    (subject, values) tuples sorted by subject.
+  """
+  while True:
+    page = fetch_page(after, page_size)
+    for item in page:
+      yield item
+
+    if len(page) < page_size:
+      return
+
+    after = page[-1][0]
+
+
+def MergeScans(scans, limit=None):
+  """Merges sorted subject scans of different shards, up to limit subjects."""
+  for count, item in enumerate(heapq.merge(*scans)):
+    if limit and count >= limit:
+      return
+    yield item
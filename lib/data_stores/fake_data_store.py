@@ -2,6 +2,8 @@
 """An implementation of an in-memory data store for testing."""
 
 
+import bisect
+import heapq
 import re
 import sys
 import threading
@@ -61,6 +63,9 @@ class FakeDataStore(data_store.DataStore):
   def __init__(self):
     super(FakeDataStore, self).__init__()
     self.subjects = {}
+    # The sorted subjects for scanning, rebuilt after subjects are added or
+    # removed.
+    self.sorted_subjects = None
 
     # All access to the store must hold this lock.
     self.lock = threading.RLock()
@@ -100,15 +105,25 @@ class FakeDataStore(data_store.DataStore):
     self.security_manager.CheckDataStoreAccess(token, [subject], "w")
     try:
       del self.subjects[subject]
+      self.sorted_subjects = None
     except KeyError:
       pass
 
+  @utils.Synchronized
+  def DeleteSubjects(self, subjects, sync=False, token=None):
+    _ = sync
+    self.security_manager.CheckDataStoreAccess(token, subjects, "w")
+    for subject in subjects:
+      self.subjects.pop(utils.SmartUnicode(subject), None)
+    self.sorted_subjects = None
+
   def Flush(self):
     pass
 
   @utils.Synchronized
   def Clear(self):
     self.subjects = {}
+    self.sorted_subjects = None
 
   def Transaction(self, subject, lease_time=None, token=None):
     return FakeTransaction(self, subject, lease_time=lease_time, token=token)
@@ -119,7 +134,10 @@ class FakeDataStore(data_store.DataStore):
     """Set the value into the data store."""
     _ = sync
     self.security_manager.CheckDataStoreAccess(token, [subject], "w")
+    self._Set(subject, attribute, value, timestamp=timestamp, replace=replace)
 
+  def _Set(self, subject, attribute, value, timestamp=None, replace=True):
+    """Sets a single value, the caller checks access and holds the lock."""
     subject = utils.SmartUnicode(subject)
     attribute = utils.SmartUnicode(attribute)
 
@@ -128,6 +146,7 @@ class FakeDataStore(data_store.DataStore):
 
     if subject not in self.subjects:
       self.subjects[subject] = {}
+      self.sorted_subjects = None
 
     if replace or attribute not in self.subjects[subject]:
       self.subjects[subject][attribute] = []
@@ -138,8 +157,26 @@ class FakeDataStore(data_store.DataStore):
   @utils.Synchronized
   def MultiSet(self, subject, values, timestamp=None, token=None,
                replace=True, sync=True, to_delete=None):
+    _ = sync
     self.security_manager.CheckDataStoreAccess(token, [subject], "w")
+    self._MultiSet(subject, values, timestamp=timestamp, replace=replace,
+                   to_delete=to_delete, token=token)
+
+  @utils.Synchronized
+  def MultiSetMulti(self, values, timestamp=None, replace=True, sync=True,
+                    to_delete=None, token=None):
+    _ = sync
+    to_delete = to_delete or {}
+    subjects = set(values) | set(to_delete)
+    self.security_manager.CheckDataStoreAccess(token, list(subjects), "w")
+
+    for subject in subjects:
+      self._MultiSet(subject, values.get(subject, {}), timestamp=timestamp,
+                     replace=replace, to_delete=to_delete.get(subject),
+                     token=token)
 
+  def _MultiSet(self, subject, values, timestamp=None, replace=True,
+                to_delete=None, token=None):
     if to_delete:
       self.DeleteAttributes(subject, to_delete, token=token)
 
@@ -150,8 +187,7 @@ class FakeDataStore(data_store.DataStore):
         else:
           element_timestamp = timestamp
 
-        self.Set(subject, k, v, timestamp=element_timestamp, token=token,
-                 replace=replace, sync=sync)
+        self._Set(subject, k, v, timestamp=element_timestamp, replace=replace)
 
   @utils.Synchronized
   def DeleteAttributes(self, subject, attributes, start=None, end=None,
@@ -270,6 +306,82 @@ class FakeDataStore(data_store.DataStore):
 
         yield (attribute, v[2], v[1])
 
+  @utils.Synchronized
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    self.security_manager.CheckDataStoreAccess(token, [subject_prefix], "q")
+
+    subject_prefix = utils.SmartUnicode(subject_prefix)
+    if after is not None:
+      after = utils.SmartUnicode(after)
+
+    if self.sorted_subjects is None:
+      self.sorted_subjects = sorted(self.subjects)
+
+    if after is None or after < subject_prefix:
+      start = bisect.bisect_left(self.sorted_subjects, subject_prefix)
+    else:
+      start = bisect.bisect_right(self.sorted_subjects, after)
+
+    results = []
+    for index in xrange(start, len(self.sorted_subjects)):
+      subject = self.sorted_subjects[index]
+      if not subject.startswith(subject_prefix):
+        break
+
+      # Values are returned newest first, only keep the newest one.
+      values = []
+      seen = set()
+      for attribute, value, ts in self.ResolveMulti(
+          subject, attributes, timestamp=self.NEWEST_TIMESTAMP, token=token):
+        if attribute not in seen:
+          seen.add(attribute)
+          values.append((attribute, value, ts))
+
+      if values or not attributes:
+        results.append((subject, values))
+        if limit and len(results) >= limit:
+          break
+
+    return results
+
+  @utils.Synchronized
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """Returns a page of the newest attribute values in attribute order."""
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attribute_regex))
+
+    if isinstance(attribute_regex, basestring):
+      attribute_regex = [attribute_regex]
+    regexes = [re.compile(regex, re.DOTALL) for regex in attribute_regex]
+
+    try:
+      record = self.subjects[utils.SmartUnicode(subject)]
+    except KeyError:
+      return []
+
+    if after is not None:
+      after = utils.SmartUnicode(after)
+
+    matching = [attribute for attribute in record
+                if (after is None or attribute > after) and
+                any(regex.match(utils.SmartStr(attribute))
+                    for regex in regexes)]
+
+    # Only the requested page needs to be sorted.
+    if limit:
+      matching = heapq.nsmallest(limit, matching)
+    else:
+      matching.sort()
+
+    results = []
+    for attribute in matching:
+      value, ts = max(record[attribute], key=lambda x: x[1])
+      results.append((attribute, value, ts))
+
+    return results
+
   @utils.Synchronized
   def ResolveRegex(self, subject, attribute_regex, token=None,
                    timestamp=None, limit=None):
@@ -441,6 +441,9 @@ class HTTPDataStore(data_store.DataStore):
   cache = None
   inquirer = None
 
+  # Number of subjects fetched from a data server at once when scanning.
+  SCAN_PAGE_SIZE = 1000
+
   def __init__(self):
     super(HTTPDataStore, self).__init__()
     self.cache = RemoteMappingCache(1000)
@@ -575,6 +578,51 @@ class HTTPDataStore(data_store.DataStore):
 
     return results.iteritems()
 
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    """Scans all the data servers and merges the results."""
+    typ = rdf_data_server.DataStoreCommand.Command.SCAN_SUBJECTS
+    page_size = min(limit or self.SCAN_PAGE_SIZE, self.SCAN_PAGE_SIZE)
+
+    def ScanServer(server):
+
+      def FetchPage(page_after, page_limit):
+        request = self._MakeRequest([subject_prefix], attributes, token=token,
+                                    limit=page_limit)
+        if page_after is not None:
+          request.subject_after = utils.SmartUnicode(page_after)
+
+        cmd = rdf_data_server.DataStoreCommand(command=typ, request=request)
+        response = server.GetConnection().SyncAndMakeRequest(cmd)
+        return [(result.subject,
+                 [(pred, self._Decode(value), ts)
+                  for (pred, value, ts) in result.payload])
+                for result in response.results]
+
+      return common.PagedScan(FetchPage, after=after, page_size=page_size)
+
+    # Subjects are distributed over the servers by their pathing, so every
+    # server may have subjects with the prefix.
+    return common.MergeScans(
+        [ScanServer(server) for server in self.inquirer.servers], limit=limit)
+
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """ScanAttributes."""
+    request = self._MakeRequest([subject], attribute_regex, token=token,
+                                limit=limit)
+    if after is not None:
+      request.attribute_after = utils.SmartUnicode(after)
+
+    typ = rdf_data_server.DataStoreCommand.Command.SCAN_ATTRIBUTES
+    response = self._MakeSyncRequest(request, typ)
+
+    results = []
+    for result in response.results:
+      for (attribute, value, timestamp) in result.payload:
+        results.append((attribute, self._Decode(value), timestamp))
+    return results
+
   def MultiSet(self, subject, values, timestamp=None, replace=True,
                sync=True, to_delete=None, token=None):
     """MultiSet."""
@@ -584,11 +632,44 @@ class HTTPDataStore(data_store.DataStore):
       request.token = token
 
     request.subject.Append(subject)
+    self._AppendValues(request, values, timestamp, replace, to_delete)
+
+    typ = rdf_data_server.DataStoreCommand.Command.MULTI_SET
+    self._MakeRequestSyncOrAsync(request, typ, sync)
+
+  def MultiSetMulti(self, values, timestamp=None, replace=True, sync=True,
+                    to_delete=None, token=None):
+    """Sends a single request per data server for all the subjects."""
+    to_delete = to_delete or {}
+    token = token or data_store.default_token
+
+    requests = {}
+    for subject in set(values) | set(to_delete):
+      server = self.GetServer(subject)
+      request = requests.get(server)
+      if request is None:
+        request = requests[server] = rdf_data_store.DataStoreRequest(sync=sync)
+        if token:
+          request.token = token
+
+      subject_index = len(request.subject)
+      request.subject.Append(subject)
+      self._AppendValues(request, values.get(subject, {}), timestamp, replace,
+                         to_delete.get(subject), subject_index=subject_index)
+
+    typ = rdf_data_server.DataStoreCommand.Command.MULTI_SET_MULTI
+    for request in requests.itervalues():
+      self._MakeRequestSyncOrAsync(request, typ, sync)
+
+  def _AppendValues(self, request, values, timestamp, replace, to_delete,
+                    subject_index=None):
+    """Adds the values to set for one subject to the request."""
     now = time.time() * 1000000
 
     if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
       timestamp = now
 
+    values = dict(values)
     to_delete = set(to_delete or [])
     for attribute in to_delete:
       if attribute not in values:
@@ -612,6 +693,9 @@ class HTTPDataStore(data_store.DataStore):
             attribute=utils.SmartUnicode(k),
             option=option)
 
+        if subject_index is not None:
+          new_value.subject_index = subject_index
+
         if element_timestamp is None:
           element_timestamp = now
 
@@ -621,9 +705,6 @@ class HTTPDataStore(data_store.DataStore):
         if v is not None:
           new_value.value.SetValue(v)
 
-    typ = rdf_data_server.DataStoreCommand.Command.MULTI_SET
-    self._MakeRequestSyncOrAsync(request, typ, sync)
-
   def ResolveMulti(self, subject, attributes, timestamp=None, limit=None,
                    token=None):
     """ResolveMulti."""
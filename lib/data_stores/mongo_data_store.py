@@ -5,6 +5,7 @@
 
 
 import hashlib
+import re
 import threading
 import time
 from bson import binary
@@ -279,6 +280,79 @@ class MongoDataStore(data_store.DataStore):
 
     return result.iteritems()
 
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    """Returns a page of subjects in subject order with their newest values."""
+    self.security_manager.CheckDataStoreAccess(token, [subject_prefix], "q")
+
+    spec = {"$and": [
+        dict(subject={"$regex": "^" + re.escape(
+            utils.SmartUnicode(subject_prefix))}),
+        dict(subject={"$gt": utils.SmartUnicode(after or "")}),
+    ]}
+    if attributes:
+      spec["$and"].append(dict(predicate={
+          "$in": [utils.SmartUnicode(x) for x in attributes]}))
+
+    # The cursor is read lazily, in subject order, until the page is full.
+    cursor = self.latest_collection.find(spec).sort(
+        [("subject", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)])
+
+    results = []
+    seen = set()
+    for document in cursor:
+      subject = document["subject"]
+      if not results or results[-1][0] != subject:
+        if limit and len(results) >= limit:
+          break
+        results.append((subject, []))
+        seen = set()
+
+      attribute = document.get("predicate")
+      if not attributes or attribute in seen:
+        continue
+
+      # The latest_collection can hold duplicate versions of an attribute,
+      # see MultiResolveRegex.
+      seen.add(attribute)
+      results[-1][1].append((attribute, Decode(document),
+                             document["timestamp"]))
+
+    return results
+
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """Returns a page of the newest attribute values in attribute order."""
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attribute_regex))
+
+    if isinstance(attribute_regex, basestring):
+      attribute_regex = [attribute_regex]
+
+    spec = {"$and": [
+        dict(subject=utils.SmartUnicode(subject)),
+        dict(predicate={"$gt": utils.SmartUnicode(after or "")}),
+        {"$or": [dict(predicate={"$regex": x}) for x in attribute_regex]},
+    ]}
+
+    # The cursor is read lazily so only about one page of documents is
+    # fetched. It is not limited since the latest_collection can hold
+    # duplicate versions of an attribute, see MultiResolveRegex.
+    cursor = self.latest_collection.find(spec).sort(
+        [("predicate", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)])
+
+    results = []
+    for document in cursor:
+      attribute = document["predicate"]
+      if results and results[-1][0] == attribute:
+        continue
+
+      results.append((attribute, Decode(document), document["timestamp"]))
+      if limit and len(results) >= limit:
+        break
+
+    return results
+
   def Size(self):
     info = self.db_handle.command("dbStats")
     return info["storageSize"]
@@ -135,6 +135,14 @@ class ConnectionPool(object):
     self.connections.task_done()
 
 
+def _LikePrefix(prefix):
+  """Returns a LIKE pattern matching the strings starting with prefix."""
+  prefix = utils.SmartUnicode(prefix)
+  for char in "\\%_":
+    prefix = prefix.replace(char, "\\" + char)
+  return prefix + "%"
+
+
 class MySQLAdvancedDataStore(data_store.DataStore):
   """A mysql based data store."""
 
@@ -272,6 +280,101 @@ class MySQLAdvancedDataStore(data_store.DataStore):
 
     return results
 
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    """Returns a page of subjects in subject order with their newest values."""
+    self.security_manager.CheckDataStoreAccess(token, [subject_prefix], "q")
+
+    # Subjects are compared as binary strings so they sort like the other
+    # data stores' subjects.
+    query = ("SELECT subjects.subject FROM subjects "
+             "WHERE subjects.subject LIKE BINARY %s "
+             "AND BINARY subjects.subject > %s")
+    args = [_LikePrefix(subject_prefix), utils.SmartUnicode(after or "")]
+    if attributes:
+      query += (" AND EXISTS (SELECT 1 FROM aff4 "
+                "WHERE aff4.subject_hash=subjects.hash AND "
+                "aff4.attribute_hash IN (%s))" %
+                ",".join(["unhex(md5(%s))"] * len(attributes)))
+      args.extend(attributes)
+    query += " ORDER BY BINARY subjects.subject"
+    if limit:
+      query += " LIMIT %s" % int(limit)
+
+    subjects = [row["subject"] for row in self.ExecuteQuery(query, args)]
+
+    values = {}
+    if subjects and attributes:
+      query = ("SELECT subjects.subject, attributes.attribute, aff4.value, "
+               "aff4.timestamp FROM aff4 "
+               "JOIN subjects ON aff4.subject_hash=subjects.hash "
+               "JOIN attributes ON aff4.attribute_hash=attributes.hash "
+               "WHERE aff4.subject_hash IN (%s) "
+               "AND aff4.attribute_hash IN (%s) "
+               "ORDER BY aff4.timestamp DESC" % (
+                   ",".join(["unhex(md5(%s))"] * len(subjects)),
+                   ",".join(["unhex(md5(%s))"] * len(attributes))))
+      args = subjects + list(attributes)
+
+      for row in self.ExecuteQuery(query, args):
+        attribute = row["attribute"]
+        subject_values = values.setdefault(row["subject"], {})
+        # Rows are newest first, only keep the newest one.
+        if attribute not in subject_values:
+          subject_values[attribute] = (
+              attribute, self._Decode(attribute, row["value"]),
+              row["timestamp"])
+
+    results = []
+    for subject in subjects:
+      subject_values = values.get(subject, {})
+      results.append((subject, [subject_values[name] for name in attributes
+                                if name in subject_values]))
+    return results
+
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """Returns a page of the newest attribute values in attribute order."""
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attribute_regex))
+
+    if isinstance(attribute_regex, basestring):
+      attribute_regex = [attribute_regex]
+
+    # The page of attributes is selected with their newest timestamp first so
+    # only the rows holding the newest values are read back.
+    criteria = ("WHERE aff4.subject_hash=unhex(md5(%s)) "
+                "AND attributes.attribute > %s AND (" +
+                " OR ".join(["attributes.attribute rlike %s"] *
+                            len(attribute_regex)) + ")")
+    args = [subject, utils.SmartUnicode(after or "")] + list(attribute_regex)
+
+    page = ("SELECT aff4.attribute_hash, MAX(aff4.timestamp) timestamp "
+            "FROM aff4 JOIN attributes ON aff4.attribute_hash=attributes.hash "
+            "%s GROUP BY aff4.attribute_hash, attributes.attribute "
+            "ORDER BY attributes.attribute") % criteria
+    if limit:
+      page += " LIMIT %s" % int(limit)
+
+    query = ("SELECT aff4.value, aff4.timestamp, attributes.attribute "
+             "FROM aff4 JOIN attributes ON aff4.attribute_hash=attributes.hash "
+             "JOIN (%s) newest ON aff4.attribute_hash=newest.attribute_hash "
+             "AND aff4.timestamp=newest.timestamp "
+             "WHERE aff4.subject_hash=unhex(md5(%%s)) "
+             "ORDER BY attributes.attribute") % page
+    args.append(subject)
+
+    results = []
+    for row in self.ExecuteQuery(query, args):
+      attribute = row["attribute"]
+      # Two values written with the same timestamp would both match.
+      if results and results[-1][0] == attribute:
+        continue
+      value = self._Decode(attribute, row["value"])
+      results.append((attribute, value, row["timestamp"]))
+
+    return results
+
   def MultiSet(self, subject, values, timestamp=None, replace=True, sync=True,
                to_delete=None, token=None):
     """Set multiple attributes' values for this subject in one operation."""
@@ -109,6 +109,14 @@ class ConnectionPool(object):
     return self.connections.get(block=True)
 
 
+def _LikePrefix(prefix):
+  """Returns a LIKE pattern matching the strings starting with prefix."""
+  prefix = utils.SmartUnicode(prefix)
+  for char in "\\%_":
+    prefix = prefix.replace(char, "\\" + char)
+  return prefix + "%"
+
+
 class MySQLDataStore(data_store.DataStore):
   """A mysql based data store."""
 
@@ -316,6 +324,91 @@ class MySQLDataStore(data_store.DataStore):
 
       return result.iteritems()
 
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    """Returns a page of subjects in subject order with their newest values."""
+    self.security_manager.CheckDataStoreAccess(token, [subject_prefix], "q")
+
+    # Subjects are compared as binary strings so they sort like the other
+    # data stores' subjects.
+    query = ("select distinct subject from `%s` where "
+             "subject like binary %%s and binary subject > %%s " %
+             self.table_name)
+    args = [_LikePrefix(subject_prefix), utils.SmartUnicode(after or "")]
+    if attributes:
+      query += "and attribute in (%s) " % ",".join(["%s"] * len(attributes))
+      args.extend(attributes)
+    query += "order by binary subject"
+    if limit:
+      query += " LIMIT %d" % limit
+
+    with self.pool.GetConnection() as cursor:
+      subjects = [row["subject"] for row in cursor.Execute(query, args)]
+
+    values = {}
+    if subjects and attributes:
+      query = ("select * from `%s` where hash in (%s) and subject in (%s) "
+               "and attribute in (%s) order by age desc" % (
+                   self.table_name, ",".join(["md5(%s)"] * len(subjects)),
+                   ",".join(["%s"] * len(subjects)),
+                   ",".join(["%s"] * len(attributes))))
+      args = subjects + subjects + list(attributes)
+
+      with self.pool.GetConnection() as cursor:
+        rows = cursor.Execute(query, args)
+
+      for row in rows:
+        subject_values = values.setdefault(row["subject"], {})
+        # Rows are newest first, only keep the newest one.
+        if row["attribute"] not in subject_values:
+          subject_values[row["attribute"]] = (
+              row["attribute"], self.DecodeValue(row), row["age"])
+
+    results = []
+    for subject in subjects:
+      subject_values = values.get(subject, {})
+      results.append((subject, [subject_values[name] for name in attributes
+                                if name in subject_values]))
+    return results
+
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """Returns a page of the newest attribute values in attribute order."""
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attribute_regex))
+
+    if isinstance(attribute_regex, basestring):
+      attribute_regex = [attribute_regex]
+
+    # The page of attributes is selected with their newest age first so only
+    # the rows holding the newest values are read back.
+    page = ("select attribute, max(age) as age from `%s` where "
+            "hash = md5(%%s) and subject = %%s and attribute > %%s and (%s) "
+            "group by attribute order by attribute" % (
+                self.table_name,
+                " or ".join(["attribute rlike %s"] * len(attribute_regex))))
+    if limit:
+      page += " LIMIT %d" % limit
+
+    query = ("select t.* from `%s` t join (%s) newest on "
+             "t.attribute = newest.attribute and t.age = newest.age "
+             "where t.hash = md5(%%s) and t.subject = %%s "
+             "order by t.attribute" % (self.table_name, page))
+    args = ([subject, subject, utils.SmartUnicode(after or "")] +
+            list(attribute_regex) + [subject, subject])
+
+    with self.pool.GetConnection() as cursor:
+      rows = cursor.Execute(query, args)
+
+    results = []
+    for row in rows:
+      # Two values written with the same age would both match.
+      if results and results[-1][0] == row["attribute"]:
+        continue
+      results.append((row["attribute"], self.DecodeValue(row), row["age"]))
+
+    return results
+
   def MultiSet(self, subject, values, timestamp=None, replace=True,
                sync=True, to_delete=None, token=None):
     """Set multiple attributes' values for this subject in one operation."""
@@ -148,6 +148,21 @@ class SqliteConnectionCache(utils.FastStore):
   def KillObject(self, conn):
     conn.Close()
 
+  @utils.Synchronized
+  def GetByKey(self, key):
+    """Returns the connection to an existing database file."""
+    try:
+      return super(SqliteConnectionCache, self).Get(key)
+    except KeyError:
+      path = utils.SmartStr(utils.JoinPath(self.root_path, key) + "." +
+                            SQLITE_EXTENSION)
+      self._WaitUntilReadable(path)
+      connection = SqliteConnection(path)
+
+      super(SqliteConnectionCache, self).Put(key, connection)
+
+      return connection
+
   @utils.Synchronized
   def Get(self, subject):
     """This will create the connection if needed so should not fail."""
@@ -254,6 +269,23 @@ class SqliteConnection(object):
     else:
       return None
 
+  @utils.Synchronized
+  def ScanSubjects(self, subject_prefix, after, attributes, limit):
+    """Returns up to limit subjects with the prefix sorting after 'after'."""
+    subject_prefix = utils.SmartStr(subject_prefix)
+    # Subjects are UTF-8 encoded so no subject contains a \xff byte.
+    args = [subject_prefix, subject_prefix + "\xff",
+            utils.SmartStr(after or "")]
+    query = """SELECT DISTINCT subject FROM tbl
+               WHERE subject >= ? AND subject < ? AND subject > ?"""
+    if attributes:
+      query += " AND predicate IN (%s)" % ",".join("?" * len(attributes))
+      args.extend(utils.SmartStr(a) for a in attributes)
+    query += " ORDER BY subject LIMIT ?"
+    args.append(limit)
+
+    return [row[0] for row in self.cursor.execute(query, args).fetchall()]
+
   @utils.Synchronized
   def GetNewestFromRegex(self, subject, regex, limit=None):
     """Returns the newest values for attributes that match 'regex'.
@@ -281,6 +313,33 @@ class SqliteConnection(object):
     data = self.cursor.execute(query, args).fetchall()
     return [(pred, val, ts) for pred, ts, val in data]
 
+  @utils.Synchronized
+  def ScanAttributes(self, subject, regexes, after, limit=None):
+    """Returns the newest values of matching attributes sorted by attribute.
+
+    Args:
+     subject: The subject.
+     regexes: A list of attribute regexes.
+     after: Only attributes sorting after this one are returned.
+     limit: The maximum number of records to return.
+
+    Returns:
+     A list of the form (attribute, value, timestamp).
+    """
+    query = """SELECT predicate, MAX(timestamp), value FROM tbl
+               WHERE subject = ? AND predicate > ? AND (%s)
+               GROUP BY predicate ORDER BY predicate""" % " OR ".join(
+                   ["predicate REGEXP ?"] * len(regexes))
+    args = [utils.SmartStr(subject), utils.SmartStr(after or "")]
+    args.extend(regexes)
+    if limit:
+      query += " LIMIT ?"
+      args.append(limit)
+
+    # Reorder columns.
+    data = self.cursor.execute(query, args).fetchall()
+    return [(pred, val, ts) for pred, ts, val in data]
+
   @utils.Synchronized
   def GetValuesFromRegex(self, subject, regex, start, end, limit=None):
     """Returns the values of the attributes that match 'regex'.
@@ -359,6 +418,16 @@ class SqliteConnection(object):
     self.dirty = True
     self.deleted = max(0, self.deleted - self.cursor.rowcount)
 
+  @utils.Synchronized
+  def SetAttributes(self, rows):
+    """Inserts many (subject, attribute, timestamp, value) rows at once."""
+    query = "INSERT INTO tbl VALUES (?, ?, ?, ?)"
+    self.cursor.executemany(
+        query, [(utils.SmartStr(subject), utils.SmartStr(attribute), timestamp,
+                 value) for subject, attribute, timestamp, value in rows])
+    self.dirty = True
+    self.deleted = max(0, self.deleted - self.cursor.rowcount)
+
   @utils.Synchronized
   def DeleteAttributeRange(self, subject, attribute, start, end):
     """Deletes all values of a attribute within the range [start, end]."""
@@ -381,6 +450,15 @@ class SqliteConnection(object):
     self.dirty = True
     self.deleted += self.cursor.rowcount
 
+  @utils.Synchronized
+  def DeleteSubjects(self, subjects):
+    """Deletes the information of many subjects."""
+    query = "DELETE FROM tbl WHERE subject = ?"
+    self.cursor.executemany(query, [(utils.SmartStr(subject),)
+                                    for subject in subjects])
+    self.dirty = True
+    self.deleted += self.cursor.rowcount
+
   def PrettyPrint(self):
     """Print the SQLite database."""
     query = "SELECT subject, predicate, timestamp, value FROM tbl"
@@ -484,11 +562,17 @@ class SqliteDataStore(data_store.DataStore):
   # A cache of SQLite connections.
   cache = None
 
+  # Number of subjects fetched from a database file at once when scanning.
+  SCAN_PAGE_SIZE = 1000
+
   def __init__(self, path=None):
     self._CalculateAttributeStorageTypes()
     super(SqliteDataStore, self).__init__()
     self.cache = SqliteConnectionCache(
         config_lib.CONFIG["SqliteDatastore.connection_cache_size"], path)
+    # Scans which returned a full page, keyed by (prefix, attributes, last
+    # subject) so the next page continues with the same per-file cursors.
+    self.suspended_scans = utils.TimeBasedCache(max_size=100, max_age=60)
 
   def RecreatePathing(self, pathing):
     self.cache.RecreatePathing(pathing)
@@ -529,30 +613,60 @@ class SqliteDataStore(data_store.DataStore):
     if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
       timestamp = time.time() * 1000000
 
-    if to_delete is None:
-      to_delete = []
-
     with self.cache.Get(subject) as sqlite_connection:
-      if replace:
-        to_delete.extend(values.keys())
-
-      # Delete attribute if needed.
-      if to_delete:
-        for attribute in to_delete:
-          sqlite_connection.DeleteAttribute(subject, attribute)
-
-      for attribute, seq in values.items():
-        for v in seq:
-          element_timestamp = None
-          if isinstance(v, (list, tuple)):
-            v, element_timestamp = v
-          if element_timestamp is None:
-            element_timestamp = timestamp
+      self._MultiSet(sqlite_connection, subject, values, timestamp, replace,
+                     to_delete)
+
+  def MultiSetMulti(self, values, timestamp=None, replace=True, sync=True,
+                    to_delete=None, token=None):
+    """Set multiple values for many subjects at once."""
+    to_delete = to_delete or {}
+    subjects = set(values) | set(to_delete)
+    self.security_manager.CheckDataStoreAccess(token, list(subjects), "w")
+    _ = sync
+    if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
+      timestamp = time.time() * 1000000
 
-          element_timestamp = long(element_timestamp)
-          value = self._Encode(v)
-          sqlite_connection.SetAttribute(subject, attribute, value,
-                                         element_timestamp)
+    # Group the subjects by database file so every file is locked and
+    # committed only once.
+    subjects_by_database = {}
+    for subject in subjects:
+      filename, directory = common.ResolveSubjectDestination(
+          subject, self.cache.path_regexes)
+      subjects_by_database.setdefault(
+          common.MakeDestinationKey(directory, filename), []).append(subject)
+
+    for database_subjects in subjects_by_database.itervalues():
+      with self.cache.Get(database_subjects[0]) as sqlite_connection:
+        for subject in database_subjects:
+          self._MultiSet(sqlite_connection, subject, values.get(subject, {}),
+                         timestamp, replace, to_delete.get(subject))
+
+  def _MultiSet(self, sqlite_connection, subject, values, timestamp, replace,
+                to_delete):
+    """Writes the values of a single subject into an open connection."""
+    to_delete = list(to_delete or [])
+    if replace:
+      to_delete.extend(values.keys())
+
+    # Delete attribute if needed.
+    for attribute in to_delete:
+      sqlite_connection.DeleteAttribute(subject, attribute)
+
+    rows = []
+    for attribute, seq in values.items():
+      for v in seq:
+        element_timestamp = None
+        if isinstance(v, (list, tuple)):
+          v, element_timestamp = v
+        if element_timestamp is None:
+          element_timestamp = timestamp
+
+        rows.append((subject, attribute, long(element_timestamp),
+                     self._Encode(v)))
+
+    if rows:
+      sqlite_connection.SetAttributes(rows)
 
   def DeleteAttributes(self, subject, attributes, start=None, end=None,
                        sync=True, token=None):
@@ -582,6 +696,23 @@ class SqliteDataStore(data_store.DataStore):
     with self.cache.Get(subject) as sqlite_connection:
       sqlite_connection.DeleteSubject(subject)
 
+  def DeleteSubjects(self, subjects, sync=False, token=None):
+    _ = sync
+    self.security_manager.CheckDataStoreAccess(token, subjects, "w")
+
+    # Group the subjects by database file so every file is locked and
+    # committed only once.
+    subjects_by_database = {}
+    for subject in subjects:
+      filename, directory = common.ResolveSubjectDestination(
+          subject, self.cache.path_regexes)
+      subjects_by_database.setdefault(
+          common.MakeDestinationKey(directory, filename), []).append(subject)
+
+    for database_subjects in subjects_by_database.itervalues():
+      with self.cache.Get(database_subjects[0]) as sqlite_connection:
+        sqlite_connection.DeleteSubjects(database_subjects)
+
   def MultiResolveRegex(self, subjects, attribute_regex, timestamp=None,
                         limit=None, token=None):
     """Result multiple subjects using one or more attribute regexps."""
@@ -653,6 +784,20 @@ class SqliteDataStore(data_store.DataStore):
 
       return results
 
+  def ScanAttributes(self, subject, attribute_regex, after=None, limit=None,
+                     token=None):
+    """Returns a page of the newest attribute values in attribute order."""
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attribute_regex))
+
+    if isinstance(attribute_regex, basestring):
+      attribute_regex = [attribute_regex]
+
+    with self.cache.Get(subject) as sqlite_connection:
+      return [(attribute, self._Decode(attribute, value), ts)
+              for attribute, value, ts in sqlite_connection.ScanAttributes(
+                  subject, attribute_regex, after, limit)]
+
   def ResolveMulti(self, subject, attributes, timestamp=None,
                    limit=None, token=None):
     """Resolve multiple attributes for a subject."""
@@ -688,6 +833,78 @@ class SqliteDataStore(data_store.DataStore):
 
     return results
 
+  def ScanSubjects(self, subject_prefix, attributes, after=None, limit=None,
+                   token=None):
+    """Scans the subjects of all database files in order."""
+    self.security_manager.CheckDataStoreAccess(token, [subject_prefix], "q")
+
+    page_size = min(limit or self.SCAN_PAGE_SIZE, self.SCAN_PAGE_SIZE)
+
+    def ScanDatabase(key):
+
+      def FetchPage(page_after, page_limit):
+        results = []
+        with self.cache.GetByKey(key) as sqlite_connection:
+          for subject in sqlite_connection.ScanSubjects(
+              subject_prefix, page_after, attributes, page_limit):
+            values = []
+            for attribute in attributes:
+              ret = sqlite_connection.GetNewestValue(subject, attribute)
+              if ret:
+                value, ts = ret
+                values.append((attribute, self._Decode(attribute, value), ts))
+            results.append((utils.SmartUnicode(subject), values))
+
+        return results
+
+      return common.PagedScan(FetchPage, after=after, page_size=page_size)
+
+    scan_key = (utils.SmartUnicode(subject_prefix), tuple(attributes))
+    if after is not None:
+      after = utils.SmartUnicode(after)
+
+    with self.suspended_scans.lock:
+      try:
+        scan = self.suspended_scans.Get(scan_key + (after,))
+        self.suspended_scans.ExpireObject(scan_key + (after,))
+      except KeyError:
+        # Only the files the pathing can map subjects with the prefix to are
+        # scanned, and their results merged.
+        scan = common.MergeScans(
+            [ScanDatabase(key) for key in common.DatabaseKeys(
+                self.cache.RootPath(), SQLITE_EXTENSION,
+                subject_prefix=subject_prefix)])
+
+    return self._ResumableScan(scan, scan_key, limit)
+
+  def _ResumableScan(self, scan, scan_key, limit):
+    """Yields up to limit subjects of scan, suspending it after a full page.
+
+    A suspended scan is resumed by the next call asking for the subjects after
+    the last one returned. Like a database cursor it may miss subjects written
+    after its pages were read, which is bounded by the suspended scans expiry.
+
+    Args:
+      scan: An iterator of (subject, values) tuples sorted by subject.
+      scan_key: The (subject prefix, attributes) tuple the scan was made for.
+      limit: The maximum number of subjects to return.
+
+    Yields:
+      (subject, values) tuples sorted by subject.
+    """
+    count = 0
+    subject = None
+    while not limit or count < limit:
+      try:
+        subject, values = scan.next()
+      except StopIteration:
+        return
+
+      yield subject, values
+      count += 1
+
+    self.suspended_scans.Put(scan_key + (subject,), scan)
+
   def DumpDatabase(self, token=None):
     self.security_manager.CheckDataStoreAccess(token, [], "r")
     for _, sql_connection in self.cache:
@@ -33,3 +33,5 @@ try:
   from grr.lib.data_stores import http_data_store_test
 except ImportError:
   pass
+
+from grr.lib.data_stores import workload_trace_test
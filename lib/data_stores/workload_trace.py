@@ -0,0 +1,585 @@
+#!/usr/bin/env python
+"""Capture and replay of data store workloads.
+
+A CapturingDataStore wraps data_store.DB and writes a trace of every data store
+operation: the operation, its subjects and attributes, the sizes (but not the
+contents) of the values written and the time it took. The trace is a gzip
+compressed file with one JSON encoded record per line.
+
+A Replayer runs a trace against any data store, at the recorded speed or
+faster, and reports the throughput and latency percentiles per operation so
+backends and their tuning options can be compared on real traffic shapes.
+
+When anonymisation is requested, subject path components and attribute names
+that are not part of the AFF4 schema are replaced by keyed hashes. The same
+name always maps to the same pseudonym within a trace, so access patterns are
+preserved. The top level namespace of subjects is kept as is (client ids are
+mapped to other valid client ids), so subjects are still sharded the same way
+by the file based data stores.
+"""
+
+
+import atexit
+import gzip
+import hashlib
+import hmac
+import inspect
+import json
+import math
+import os
+import Queue
+import re
+import threading
+import time
+
+
+import logging
+
+from grr.lib import aff4
+from grr.lib import config_lib
+from grr.lib import data_store
+from grr.lib import registry
+from grr.lib import utils
+
+# The format version written in the trace header.
+TRACE_VERSION = 1
+
+# Values of integer types are recorded with this size.
+INTEGER_VALUE = -1
+
+CLIENT_ID_RE = re.compile(r"^C\.[0-9a-fA-F]{16}$")
+
+
+class Error(data_store.Error):
+  """Raised when a trace can't be read."""
+
+
+class Anonymiser(object):
+  """Replaces names by consistent keyed hashes."""
+
+  def __init__(self, key=None):
+    self.key = utils.SmartStr(key or os.urandom(32))
+    self.cache = {}
+
+  def _Hash(self, name):
+    try:
+      return self.cache[name]
+    except KeyError:
+      result = hmac.new(self.key, utils.SmartStr(name),
+                        hashlib.sha1).hexdigest()[:16]
+      self.cache[name] = result
+      return result
+
+  def Subject(self, subject):
+    subject = utils.SmartUnicode(subject)
+    if not subject.startswith("aff4:/"):
+      return self._Hash(subject)
+
+    components = subject[len("aff4:/"):].split("/")
+    if CLIENT_ID_RE.match(components[0]):
+      components[0] = "C." + self._Hash(components[0].upper())
+    result = components[:1]
+    result.extend(self._Hash(c) for c in components[1:])
+    return "aff4:/" + "/".join(result)
+
+  def Attribute(self, attribute):
+    attribute = utils.SmartUnicode(attribute)
+    if attribute in aff4.Attribute.PREDICATES:
+      return attribute
+
+    # Keep the attribute prefix ("index:dir/", "task:", "notify:") which
+    # identifies what the attribute is used for.
+    match = re.match(r"^[^:]*:([^/]*/)?", attribute)
+    prefix = match and match.group(0) or ""
+    return prefix + self._Hash(attribute[len(prefix):])
+
+
+class _Identity(object):
+
+  def Subject(self, subject):
+    return utils.SmartUnicode(subject)
+
+  def Attribute(self, attribute):
+    return utils.SmartUnicode(attribute)
+
+
+def _ValueSpec(value):
+  """Returns the size recorded for a value."""
+  if isinstance(value, (int, long)):
+    return INTEGER_VALUE
+
+  if hasattr(value, "SerializeToString"):
+    value = value.SerializeToString()
+
+  return len(utils.SmartStr(value))
+
+
+def _Scalar(value):
+  """Converts timestamps and other scalar arguments to JSON values."""
+  if value is None or isinstance(value, (bool, int, long, float, basestring)):
+    return value
+
+  if isinstance(value, (list, tuple)):
+    return [_Scalar(v) for v in value]
+
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return utils.SmartUnicode(value)
+
+
+def _AttributeValues(values, names):
+  """Records sizes and timestamps of a MultiSet values dict."""
+  result = {}
+  for attribute, seq in values.iteritems():
+    if not isinstance(seq, list):
+      seq = [seq]
+
+    recorded = []
+    for value in seq:
+      timestamp = None
+      if isinstance(value, tuple):
+        value, timestamp = value
+      recorded.append([_ValueSpec(value), _Scalar(timestamp)])
+
+    result[names.Attribute(attribute)] = recorded
+
+  return result
+
+
+def _AttributeList(attributes, names):
+  if isinstance(attributes, basestring):
+    return names.Attribute(attributes)
+  return [names.Attribute(a) for a in attributes]
+
+
+def RecordArguments(operation, args, names):
+  """Converts the arguments of an operation into their recorded form.
+
+  Args:
+    operation: The name of the data store operation.
+    args: A dict of the arguments the operation was called with.
+    names: An Anonymiser or an object returning names unchanged.
+
+  Returns:
+    A dict that can be JSON encoded.
+  """
+  result = {}
+  for name, value in args.iteritems():
+    if name in ("self", "token", "sync") or value is None:
+      continue
+
+    if name in ("subject", "subject_prefix"):
+      value = names.Subject(value)
+    elif name == "after" and operation == "ScanSubjects":
+      value = names.Subject(value)
+    elif name == "after" and operation == "ScanAttributes":
+      value = names.Attribute(value)
+    elif name == "subjects":
+      value = [names.Subject(s) for s in value]
+    elif name in ("attribute", "attributes"):
+      value = _AttributeList(value, names)
+    elif name == "value":
+      value = _ValueSpec(value)
+    elif name == "values" and operation == "MultiSetMulti":
+      value = dict((names.Subject(subject), _AttributeValues(v, names))
+                   for subject, v in value.iteritems())
+    elif name == "values":
+      value = _AttributeValues(value, names)
+    elif name == "to_delete" and isinstance(value, dict):
+      value = dict((names.Subject(subject), _AttributeList(v, names))
+                   for subject, v in value.iteritems())
+    elif name == "to_delete":
+      value = _AttributeList(value, names)
+    elif name == "operations":
+      value = [[op, RecordArguments(op, op_args, names)]
+               for op, op_args in value]
+    else:
+      # Timestamps, limits and attribute regexes, which come from the code
+      # rather than from the data.
+      value = _Scalar(value)
+
+    result[name] = value
+
+  return result
+
+
+def _CallArgs(method, args, kwargs):
+  """Returns the arguments of a bound method call by name."""
+  # Instrumented data store operations take (*args, **kwargs), the names are
+  # those of the operation they wrap.
+  func = getattr(method, "__wrapped__", None)
+  if func is None:
+    return inspect.getcallargs(method, *args, **kwargs)
+  return inspect.getcallargs(func, method.__self__, *args, **kwargs)
+
+
+class TraceWriter(object):
+  """Writes trace records to a compressed file."""
+
+  def __init__(self, path, anonymise=False, anonymisation_key=None):
+    self.lock = threading.Lock()
+    self.fd = gzip.open(path, "wb")
+    self.start = time.time()
+    if anonymise:
+      self.names = Anonymiser(anonymisation_key)
+    else:
+      self.names = _Identity()
+
+    self._WriteLine(dict(version=TRACE_VERSION, start=self.start,
+                         anonymised=anonymise))
+
+  def _WriteLine(self, data):
+    self.fd.write(json.dumps(data, separators=(",", ":")) + "\n")
+
+  def Write(self, operation, args, start, duration):
+    record = [round(start - self.start, 6), operation, round(duration, 6),
+              RecordArguments(operation, args, self.names)]
+    with self.lock:
+      if self.fd:
+        self._WriteLine(record)
+
+  def Close(self):
+    with self.lock:
+      if self.fd:
+        self.fd.close()
+        self.fd = None
+
+
+def ReadTrace(path):
+  """Yields (offset, operation, duration, args) records from a trace file."""
+  with gzip.open(path, "rb") as fd:
+    try:
+      header = json.loads(fd.readline())
+    except ValueError:
+      raise Error("%s is not a data store trace." % path)
+
+    if header.get("version") != TRACE_VERSION:
+      raise Error("Unsupported trace version %s." % header.get("version"))
+
+    for line in fd:
+      offset, operation, duration, args = json.loads(line)
+      yield offset, operation, duration, args
+
+
+class CapturingDataStore(object):
+  """Wraps a data store and records its operations to a TraceWriter.
+
+  All attributes that are not recorded operations are passed through to the
+  wrapped data store.
+  """
+
+  RECORDED_OPERATIONS = frozenset([
+      "DeleteAttributes", "DeleteSubject", "DeleteSubjects",
+      "MultiResolveRegex", "MultiSet", "MultiSetMulti", "Resolve",
+      "ResolveMulti", "ResolveRegex", "ScanAttributes", "ScanSubjects", "Set",
+      "Transaction"])
+
+  def __init__(self, store, writer):
+    self.store = store
+    self.writer = writer
+
+  def __getattr__(self, name):
+    attribute = getattr(self.store, name)
+    if name not in self.RECORDED_OPERATIONS:
+      return attribute
+
+    def Recorded(*args, **kwargs):
+      return self._Call(name, attribute, args, kwargs)
+
+    return Recorded
+
+  def _Call(self, operation, method, args, kwargs):
+    start = time.time()
+    result = method(*args, **kwargs)
+
+    call_args = _CallArgs(method, args, kwargs)
+    if operation == "Transaction":
+      # The transaction is recorded with its operations when it finishes.
+      return _RecordedTransaction(result, self.writer, call_args, start)
+
+    if result is not None and hasattr(result, "next"):
+      # Lazy results take as long as it takes to consume them.
+      return self._RecordWhenExhausted(result, operation, call_args, start)
+
+    self.writer.Write(operation, call_args, start, time.time() - start)
+    return result
+
+  def _RecordWhenExhausted(self, results, operation, call_args, start):
+    try:
+      for item in results:
+        yield item
+    finally:
+      self.writer.Write(operation, call_args, start, time.time() - start)
+
+
+class _RecordedTransaction(object):
+  """Wraps a transaction and records it once it is committed or aborted.
+
+  The operations done in the transaction are recorded with it, so a replay
+  can issue them against a single transaction of its own.
+  """
+
+  RECORDED_OPERATIONS = frozenset([
+      "DeleteAttribute", "Resolve", "ResolveRegex", "Set"])
+
+  def __init__(self, transaction, writer, call_args, start):
+    self.transaction = transaction
+    self.writer = writer
+    self.call_args = call_args
+    self.start = start
+    self.operations = []
+
+  def __getattr__(self, name):
+    attribute = getattr(self.transaction, name)
+    if name not in self.RECORDED_OPERATIONS:
+      return attribute
+
+    def Recorded(*args, **kwargs):
+      self.operations.append((name, _CallArgs(attribute, args, kwargs)))
+      return attribute(*args, **kwargs)
+
+    return Recorded
+
+  def _Finish(self, name):
+    try:
+      return getattr(self.transaction, name)()
+    finally:
+      args = dict(self.call_args, operations=self.operations, finish=name)
+      self.writer.Write("Transaction", args, self.start,
+                        time.time() - self.start)
+
+  def Commit(self):
+    return self._Finish("Commit")
+
+  def Abort(self):
+    return self._Finish("Abort")
+
+
+def StartCapture(path, anonymise=False, anonymisation_key=None):
+  """Starts recording all operations on data_store.DB to path."""
+  if isinstance(data_store.DB, CapturingDataStore):
+    StopCapture()
+
+  writer = TraceWriter(path, anonymise=anonymise,
+                       anonymisation_key=anonymisation_key)
+  data_store.DB = CapturingDataStore(data_store.DB, writer)
+  logging.info("Capturing data store operations to %s", path)
+
+
+def StopCapture():
+  """Stops recording and restores the wrapped data store."""
+  if isinstance(data_store.DB, CapturingDataStore):
+    data_store.DB.writer.Close()
+    data_store.DB = data_store.DB.store
+
+
+class _ValueFactory(object):
+  """Produces values of the recorded sizes."""
+
+  def __init__(self):
+    self.data = os.urandom(64 * 1024)
+
+  def Make(self, spec):
+    if spec == INTEGER_VALUE:
+      return 1
+
+    while len(self.data) < spec:
+      self.data *= 2
+    return self.data[:spec]
+
+
+def _ReplayValues(values, factory):
+  result = {}
+  for attribute, seq in values.iteritems():
+    result[attribute] = [(factory.Make(spec), timestamp)
+                         for spec, timestamp in seq]
+  return result
+
+
+def _ReplayTimestamp(timestamp):
+  if isinstance(timestamp, list):
+    return tuple(timestamp)
+  return timestamp
+
+
+def ReplayArguments(operation, args, factory):
+  """Converts recorded arguments back into data store call arguments."""
+  result = {}
+  for name, value in args.iteritems():
+    if name == "value":
+      value = factory.Make(value)
+    elif name == "values" and operation == "MultiSetMulti":
+      value = dict((subject, _ReplayValues(v, factory))
+                   for subject, v in value.iteritems())
+    elif name == "values":
+      value = _ReplayValues(value, factory)
+    elif name == "timestamp":
+      value = _ReplayTimestamp(value)
+    elif name == "operations":
+      value = [(op, ReplayArguments(op, op_args, factory))
+               for op, op_args in value]
+
+    result[name] = value
+
+  return result
+
+
+def Percentile(values, percentile):
+  """Returns the nearest rank percentile of a sorted list."""
+  if not values:
+    return 0
+  index = int(math.ceil(percentile / 100.0 * len(values))) - 1
+  return values[max(0, min(index, len(values) - 1))]
+
+
+class ReplayReport(object):
+  """Latencies of the replayed operations."""
+
+  PERCENTILES = (50, 90, 99)
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.latencies = {}
+    self.errors = {}
+    self.elapsed = 0
+
+  def Add(self, operation, latency, error=False):
+    with self.lock:
+      self.latencies.setdefault(operation, []).append(latency)
+      if error:
+        self.errors[operation] = self.errors.get(operation, 0) + 1
+
+  @property
+  def total(self):
+    return sum(len(l) for l in self.latencies.itervalues())
+
+  def Summary(self):
+    """Returns a dict of operation -> statistics, latencies in seconds."""
+    result = {}
+    for operation, latencies in self.latencies.iteritems():
+      latencies = sorted(latencies)
+      stats = dict(count=len(latencies),
+                   errors=self.errors.get(operation, 0),
+                   max=latencies[-1])
+      for percentile in self.PERCENTILES:
+        stats["p%d" % percentile] = Percentile(latencies, percentile)
+      result[operation] = stats
+
+    return result
+
+  def __str__(self):
+    lines = ["%d operations in %.2fs (%.1f ops/s)" % (
+        self.total, self.elapsed, self.total / max(self.elapsed, 1e-6))]
+    lines.append("%-20s %8s %6s %10s %10s %10s %10s" % (
+        "operation", "count", "errors", "p50 ms", "p90 ms", "p99 ms",
+        "max ms"))
+    for operation, stats in sorted(self.Summary().iteritems()):
+      lines.append("%-20s %8d %6d %10.3f %10.3f %10.3f %10.3f" % (
+          operation, stats["count"], stats["errors"], stats["p50"] * 1000,
+          stats["p90"] * 1000, stats["p99"] * 1000, stats["max"] * 1000))
+    return "\n".join(lines)
+
+
+class Replayer(object):
+  """Replays a trace against a data store.
+
+  Operations are issued from a number of threads at the time they were
+  recorded, divided by speed. A speed of 0 replays as fast as possible.
+  """
+
+  def __init__(self, store, speed=1.0, threads=10, token=None):
+    self.store = store
+    self.speed = speed
+    self.threads = threads
+    self.token = token
+    self.factory = _ValueFactory()
+
+  def _Execute(self, operation, args, report):
+    start = time.time()
+    error = False
+    try:
+      if operation == "Transaction":
+        self._ExecuteTransaction(args)
+      else:
+        self._Consume(getattr(self.store, operation)(token=self.token, **args))
+    except Exception as e:  # pylint: disable=broad-except
+      logging.debug("Replaying %s failed: %s", operation, e)
+      error = True
+
+    report.Add(operation, time.time() - start, error=error)
+
+  def _ExecuteTransaction(self, args):
+    # Traces of older captures only recorded that a transaction committed.
+    args = dict(args)
+    operations = args.pop("operations", [])
+    finish = args.pop("finish", "Commit")
+
+    transaction = self.store.Transaction(token=self.token, **args)
+    for operation, operation_args in operations:
+      self._Consume(getattr(transaction, operation)(**operation_args))
+    getattr(transaction, finish)()
+
+  def _Consume(self, result):
+    if result is not None and hasattr(result, "__iter__"):
+      for _ in result:
+        pass
+
+  def _Worker(self, queue, report):
+    while True:
+      item = queue.get()
+      if item is None:
+        return
+      self._Execute(item[0], item[1], report)
+
+  def Replay(self, records):
+    """Replays the records.
+
+    Args:
+      records: An iterable of (offset, operation, duration, args) records as
+               returned by ReadTrace.
+
+    Returns:
+      A ReplayReport.
+    """
+    report = ReplayReport()
+    queue = Queue.Queue(maxsize=self.threads * 10)
+    workers = []
+    for _ in range(self.threads):
+      worker = threading.Thread(target=self._Worker, args=(queue, report))
+      worker.daemon = True
+      worker.start()
+      workers.append(worker)
+
+    start = time.time()
+    try:
+      for offset, operation, _, args in records:
+        if self.speed:
+          delay = start + offset / self.speed - time.time()
+          if delay > 0:
+            time.sleep(delay)
+
+        queue.put((operation, ReplayArguments(operation, args, self.factory)))
+    finally:
+      for _ in workers:
+        queue.put(None)
+      for worker in workers:
+        worker.join()
+
+    report.elapsed = time.time() - start
+    return report
+
+
+class DataStoreCaptureInit(registry.InitHook):
+  """Starts capturing data store operations if a trace path is configured."""
+
+  pre = ["DataStoreInit"]
+
+  def RunOnce(self):
+    path = config_lib.CONFIG["Datastore.trace_path"]
+    if path:
+      StartCapture(path,
+                   anonymise=config_lib.CONFIG["Datastore.trace_anonymise"],
+                   anonymisation_key=config_lib.CONFIG[
+                       "Datastore.trace_anonymisation_key"])
+      atexit.register(StopCapture)
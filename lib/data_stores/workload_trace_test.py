@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Tests for the data store workload capture and replay."""
+
+
+import os
+
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import test_lib
+from grr.lib.data_stores import fake_data_store
+from grr.lib.data_stores import workload_trace
+
+
+class WorkloadTraceTest(test_lib.GRRBaseTest):
+  """Tests capturing and replaying data store operations."""
+
+  client_id = "aff4:/C.0000000000000001"
+
+  def setUp(self):
+    super(WorkloadTraceTest, self).setUp()
+    self.trace_path = os.path.join(self.temp_dir, "trace.gz")
+
+  def tearDown(self):
+    workload_trace.StopCapture()
+    super(WorkloadTraceTest, self).tearDown()
+
+  def _Capture(self, anonymise=False):
+    workload_trace.StartCapture(self.trace_path, anonymise=anonymise,
+                                anonymisation_key="key")
+    data_store.DB.Set(self.client_id + "/fs/os/etc", "aff4:size", 1234,
+                      token=self.token)
+    data_store.DB.MultiSet(self.client_id + "/fs/os/etc/passwd",
+                           {"aff4:stored": [("x" * 100, 200)],
+                            "index:dir/passwd": ["y" * 10]},
+                           token=self.token)
+    list(data_store.DB.ResolveRegex(self.client_id + "/fs/os/etc",
+                                    "aff4:.*", token=self.token))
+    data_store.DB.DeleteSubject(self.client_id + "/fs/os/etc/passwd",
+                                token=self.token)
+    workload_trace.StopCapture()
+
+    return list(workload_trace.ReadTrace(self.trace_path))
+
+  def testCaptureRecordsOperationsAndSizes(self):
+    records = self._Capture()
+    self.assertFalse(isinstance(data_store.DB,
+                                workload_trace.CapturingDataStore))
+
+    self.assertEqual([r[1] for r in records],
+                     ["Set", "MultiSet", "ResolveRegex", "DeleteSubject"])
+
+    set_args = records[0][3]
+    self.assertEqual(set_args["subject"], self.client_id + "/fs/os/etc")
+    self.assertEqual(set_args["attribute"], "aff4:size")
+    self.assertEqual(set_args["value"], workload_trace.INTEGER_VALUE)
+    self.assertNotIn("token", set_args)
+
+    self.assertEqual(records[1][3]["values"],
+                     {"aff4:stored": [[100, 200]],
+                      "index:dir/passwd": [[10, None]]})
+    self.assertEqual(records[2][3]["attribute_regex"], "aff4:.*")
+
+    for offset, _, duration, _ in records:
+      self.assertGreaterEqual(offset, 0)
+      self.assertGreaterEqual(duration, 0)
+
+  def testCaptureAnonymisesSubjectsAndAttributes(self):
+    records = self._Capture(anonymise=True)
+
+    subject = records[1][3]["subject"]
+    self.assertNotIn("passwd", subject)
+    self.assertNotIn("0000000000000001", subject)
+    # The client namespace and the path structure are kept.
+    self.assertTrue(workload_trace.CLIENT_ID_RE.match(subject.split("/")[1]))
+    self.assertEqual(len(subject.split("/")), 6)
+    # The same name always maps to the same pseudonym.
+    self.assertEqual(records[0][3]["subject"], subject.rsplit("/", 1)[0])
+    self.assertEqual(records[3][3]["subject"], subject)
+
+    attributes = sorted(records[1][3]["values"])
+    self.assertEqual(attributes[0], "aff4:stored")
+    self.assertTrue(attributes[1].startswith("index:dir/"))
+    self.assertNotIn("passwd", attributes[1])
+
+  def testReplayReproducesWorkload(self):
+    self._Capture()
+
+    store = fake_data_store.FakeDataStore()
+    replayer = workload_trace.Replayer(store, speed=0, threads=2,
+                                       token=self.token)
+    report = replayer.Replay(workload_trace.ReadTrace(self.trace_path))
+
+    self.assertEqual(report.total, 4)
+    summary = report.Summary()
+    self.assertEqual(summary["MultiSet"]["count"], 1)
+    self.assertEqual(summary["MultiSet"]["errors"], 0)
+    self.assertLessEqual(summary["Set"]["p50"], summary["Set"]["max"])
+
+    self.assertEqual(
+        store.Resolve(self.client_id + "/fs/os/etc", "aff4:size",
+                      token=self.token)[0], 1)
+    self.assertEqual(
+        store.Resolve(self.client_id + "/fs/os/etc/passwd", "aff4:stored",
+                      token=self.token), (None, 0))
+
+  def testCaptureRecordsScansAndTransactions(self):
+    data_store.DB.Set(self.client_id + "/fs/os/etc", "aff4:size", 1,
+                      token=self.token)
+    workload_trace.StartCapture(self.trace_path)
+    list(data_store.DB.ScanSubjects(self.client_id + "/fs/", ["aff4:size"],
+                                    limit=10, token=self.token))
+    transaction = data_store.DB.Transaction(self.client_id + "/fs/os/etc",
+                                            token=self.token)
+    transaction.Resolve("aff4:size")
+    transaction.Set("aff4:stored", "x" * 10)
+    transaction.Commit()
+    workload_trace.StopCapture()
+
+    records = list(workload_trace.ReadTrace(self.trace_path))
+    self.assertEqual([r[1] for r in records], ["ScanSubjects", "Transaction"])
+    self.assertEqual(records[0][3]["subject_prefix"], self.client_id + "/fs/")
+    self.assertEqual(records[0][3]["attributes"], ["aff4:size"])
+
+    transaction_args = records[1][3]
+    self.assertEqual(transaction_args["finish"], "Commit")
+    self.assertEqual(transaction_args["operations"],
+                     [["Resolve", {"attribute": "aff4:size"}],
+                      ["Set", {"attribute": "aff4:stored", "value": 10,
+                               "replace": True}]])
+
+    store = fake_data_store.FakeDataStore()
+    replayer = workload_trace.Replayer(store, speed=0, threads=1,
+                                       token=self.token)
+    report = replayer.Replay(workload_trace.ReadTrace(self.trace_path))
+    self.assertEqual(report.Summary()["Transaction"]["errors"], 0)
+    self.assertEqual(
+        len(store.Resolve(self.client_id + "/fs/os/etc", "aff4:stored",
+                          token=self.token)[0]), 10)
+
+  def testPercentile(self):
+    values = range(1, 101)
+    self.assertEqual(workload_trace.Percentile(values, 50), 50)
+    self.assertEqual(workload_trace.Percentile(values, 99), 99)
+    self.assertEqual(workload_trace.Percentile(values, 100), 100)
+    self.assertEqual(workload_trace.Percentile([], 50), 0)
+
+
+def main(argv):
+  test_lib.GrrTestProgram(argv=argv)
+
+if __name__ == "__main__":
+  flags.StartMain(main)
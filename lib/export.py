@@ -15,8 +15,10 @@ import logging
 
 
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import stats
 from grr.lib import type_info
 from grr.lib import utils
 from grr.lib.aff4_objects import filestore
@@ -25,6 +27,10 @@ from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import export_pb2
 
 
+# Process-wide cache of client metadata, see ExportedMetadataCache.
+METADATA_CACHE = None
+
+
 class Error(Exception):
   """Errors generated by export converters."""
 
@@ -826,10 +832,6 @@ class GrrMessageConverter(ExportConverter):
 
   input_rdf_type = "GrrMessage"
 
-  def __init__(self, *args, **kw):
-    super(GrrMessageConverter, self).__init__(*args, **kw)
-    self.cached_metadata = {}
-
   def Convert(self, metadata, grr_message, token=None):
     """Converts GrrMessage into a set of RDFValues.
 
@@ -869,7 +871,7 @@ class GrrMessageConverter(ExportConverter):
     # Open the clients we don't have metadata for and fetch metadata.
     for client_urn in msg_dict.iterkeys():
       try:
-        metadata_objects.append(self.cached_metadata[client_urn])
+        metadata_objects.append(METADATA_CACHE.Get(client_urn, token=token))
       except KeyError:
         metadata_to_fetch.append(client_urn)
 
@@ -878,8 +880,13 @@ class GrrMessageConverter(ExportConverter):
                                           token=token)
       fetched_metadata = [GetMetadata(client_fd, token=token)
                           for client_fd in client_fds]
+
+      urns_to_fetch = dict((utils.SmartUnicode(urn), urn)
+                           for urn in metadata_to_fetch)
       for metadata in fetched_metadata:
-        self.cached_metadata[metadata.client_urn] = metadata
+        client_urn = urns_to_fetch.get(utils.SmartUnicode(metadata.client_urn))
+        if client_urn is not None:
+          METADATA_CACHE.Put(client_urn, metadata, token=token)
       metadata_objects.extend(fetched_metadata)
 
     data_by_type = {}
@@ -1189,6 +1196,36 @@ class RekallResponseConverter(ExportConverter):
         yield result
 
 
+class ExportedMetadataCache(utils.AgeBasedCache):
+  """A process-wide cache of ExportedMetadata objects.
+
+  Client metadata is shared by all the converters and all conversion calls, so
+  that converting a collection in many small batches doesn't reopen the same
+  clients for every batch. Entries are keyed by client URN and by the username
+  of the token used to fetch them, so that metadata does not leak between
+  users. Changes to a client are picked up once its entry expires.
+  """
+
+  def _MakeKey(self, client_urn, token):
+    return (utils.SmartUnicode(client_urn), token and token.username)
+
+  def Get(self, client_urn, token=None):
+    """Returns cached metadata for the client, raises KeyError if missing."""
+    try:
+      result = super(ExportedMetadataCache, self).Get(
+          self._MakeKey(client_urn, token))
+    except KeyError:
+      stats.STATS.IncrementCounter("export_metadata_cache_misses")
+      raise
+
+    stats.STATS.IncrementCounter("export_metadata_cache_hits")
+    return result
+
+  def Put(self, client_urn, metadata, token=None):
+    super(ExportedMetadataCache, self).Put(self._MakeKey(client_urn, token),
+                                           metadata)
+
+
 def GetMetadata(client, token=None):
   """Builds ExportedMetadata object for a given client id.
 
@@ -1306,3 +1343,20 @@ def ConvertValues(default_metadata, values, token=None, options=None):
 
   batch_data = [(default_metadata, obj) for obj in values]
   return ConvertValuesWithMetadata(batch_data, token=token, options=options)
+
+
+class ExportInitHook(registry.InitHook):
+  """Initializes the metadata cache and export stats."""
+
+  pre = ["StatsInit"]
+
+  def Run(self):
+    global METADATA_CACHE  # pylint: disable=global-statement
+
+    METADATA_CACHE = ExportedMetadataCache(
+        max_size=config_lib.CONFIG["Export.metadata_cache_max_size"],
+        max_age=config_lib.CONFIG["Export.metadata_cache_age"])
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric("export_metadata_cache_hits")
+    stats.STATS.RegisterCounterMetric("export_metadata_cache_misses")
@@ -10,13 +10,17 @@ import socket
 from grr.client.client_actions import grr_rekall
 
 from grr.lib import action_mocks
+from grr.lib import access_control
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import export
 from grr.lib import flags
 from grr.lib import flow
 from grr.lib import queues
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.checks import checks
 # This test calls flows from these files. pylint: disable=unused-import
 from grr.lib.flows.general import file_finder
@@ -973,6 +977,84 @@ class ExportTest(test_lib.GRRBaseTest):
     self.assertItemsEqual(["DummyRDFValue2", "DummyRDFValue", "DummyRDFValue5"],
                           [x.__class__.__name__ for x in results])
 
+  def _MakeGrrMessageConverterInput(self):
+    payload = DummyRDFValue4(
+        "some", age=rdfvalue.RDFDatetime().FromSecondsFromEpoch(1))
+    msg = rdf_flows.GrrMessage(payload=payload)
+    msg.source = rdf_client.ClientURN("C.0000000000000000")
+    test_lib.ClientFixture(msg.source, token=self.token)
+
+    metadata = export.ExportedMetadata(
+        source_urn=rdfvalue.RDFURN("aff4:/hunts/" + str(queues.HUNTS) +
+                                   ":000000/Results"))
+    return metadata, msg
+
+  def testGrrMessageConverterSharesMetadataCacheBetweenInstances(self):
+    metadata, msg = self._MakeGrrMessageConverterInput()
+
+    opened_urns = []
+    original_multi_open = aff4.FACTORY.MultiOpen
+
+    def MultiOpen(urns, **kwargs):
+      urns = list(urns)
+      opened_urns.extend(urns)
+      return original_multi_open(urns, **kwargs)
+
+    hits = stats.STATS.GetMetricValue("export_metadata_cache_hits")
+    misses = stats.STATS.GetMetricValue("export_metadata_cache_misses")
+
+    with utils.Stubber(aff4.FACTORY, "MultiOpen", MultiOpen):
+      for _ in range(3):
+        converter = export.GrrMessageConverter()
+        results = list(converter.BatchConvert([(metadata, msg)],
+                                              token=self.token))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].metadata.client_urn, msg.source)
+
+    # The client was opened only by the first converter.
+    self.assertEqual(opened_urns, [msg.source])
+    self.assertEqual(
+        stats.STATS.GetMetricValue("export_metadata_cache_hits") - hits, 2)
+    self.assertEqual(
+        stats.STATS.GetMetricValue("export_metadata_cache_misses") - misses, 1)
+
+  def testGrrMessageConverterMetadataCacheEntriesExpire(self):
+    metadata, msg = self._MakeGrrMessageConverterInput()
+
+    misses = stats.STATS.GetMetricValue("export_metadata_cache_misses")
+    max_age = config_lib.CONFIG["Export.metadata_cache_age"]
+
+    with test_lib.FakeTime(100):
+      list(export.GrrMessageConverter().BatchConvert([(metadata, msg)],
+                                                     token=self.token))
+
+    with test_lib.FakeTime(100 + max_age - 1):
+      list(export.GrrMessageConverter().BatchConvert([(metadata, msg)],
+                                                     token=self.token))
+    self.assertEqual(
+        stats.STATS.GetMetricValue("export_metadata_cache_misses") - misses, 1)
+
+    with test_lib.FakeTime(100 + max_age + 1):
+      list(export.GrrMessageConverter().BatchConvert([(metadata, msg)],
+                                                     token=self.token))
+    self.assertEqual(
+        stats.STATS.GetMetricValue("export_metadata_cache_misses") - misses, 2)
+
+  def testGrrMessageConverterMetadataCacheIsPerUser(self):
+    metadata, msg = self._MakeGrrMessageConverterInput()
+
+    misses = stats.STATS.GetMetricValue("export_metadata_cache_misses")
+
+    list(export.GrrMessageConverter().BatchConvert([(metadata, msg)],
+                                                   token=self.token))
+    other_token = access_control.ACLToken(username="other_user",
+                                          reason="testing")
+    list(export.GrrMessageConverter().BatchConvert([(metadata, msg)],
+                                                   token=other_token))
+
+    self.assertEqual(
+        stats.STATS.GetMetricValue("export_metadata_cache_misses") - misses, 2)
+
   def testDNSClientConfigurationToExportedDNSClientConfiguration(self):
     dns_servers = ["192.168.1.1", "8.8.8.8"]
     dns_suffixes = ["internal.company.com", "company.com"]
@@ -1278,6 +1360,44 @@ class RekallResponseConverterTest(test_lib.GRRBaseTest):
     self.assertEqual(converted_values[0].str, "some string")
 
 
+class ExportBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark for converting hunt results in small batches."""
+
+  REPEATS = 5
+  NUM_CLIENTS = 100
+  RESULTS_PER_CLIENT = 10
+  BATCH_SIZE = 20
+
+  def testConvertHuntResultsInSmallBatches(self):
+    """Converts hunt results the way output plugins do it, batch by batch."""
+    client_ids = self.SetupClients(self.NUM_CLIENTS)
+
+    messages = []
+    for i in range(self.RESULTS_PER_CLIENT):
+      for client_id in client_ids:
+        payload = DummyRDFValue4(
+            "result %d" % i, age=rdfvalue.RDFDatetime().FromSecondsFromEpoch(1))
+        messages.append(rdf_flows.GrrMessage(payload=payload,
+                                             source=client_id))
+
+    metadata = export.ExportedMetadata(
+        source_urn=rdfvalue.RDFURN("aff4:/hunts/" + str(queues.HUNTS) +
+                                   ":000000/Results"))
+
+    def ConvertInBatches():
+      for batch in utils.Grouper(messages, self.BATCH_SIZE):
+        list(export.ConvertValuesWithMetadata(
+            [(metadata, msg) for msg in batch], token=self.token))
+
+    def ConvertWithEmptyCache():
+      export.METADATA_CACHE.Flush()
+      ConvertInBatches()
+
+    self.TimeIt(ConvertWithEmptyCache, name="Convert with empty cache")
+    self.TimeIt(ConvertInBatches, name="Convert with warm cache",
+                pre=ConvertInBatches)
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -41,7 +41,9 @@ self.state.context.args: The flow runners args. This is an instance of
 """
 
 
+import cPickle
 import functools
+import hashlib
 import operator
 import time
 
@@ -520,11 +522,24 @@ class GRRFlow(aff4.AFF4Volume):
 
   runner_cls = flow_runner.FlowRunner
 
+  # Lists, dicts and sets in the state holding more than this many items are
+  # stored as separate chunk records of about this size.
+  STATE_CHUNK_SIZE = 1000
+
+  # The digests of the state records as last read or written, keyed by
+  # predicate, and the ChunkedStateEntry of each chunked collection.
+  _state_digests = None
+  _state_layout = None
+
+  # State records queued by WriteState() for the next _WriteAttributes().
+  _pending_state = None
+
   def Initialize(self):
     """The initialization method."""
     if "r" in self.mode:
       self.state = self.Get(self.Schema.FLOW_STATE)
       if self.state:
+        self._ReadStateChunks()
         self.Load()
 
         # A convenience attribute to allow flows to access their args directly.
@@ -597,7 +612,113 @@ class GRRFlow(aff4.AFF4Volume):
       if self.state.Empty():
         raise IOError("Trying to write an empty state for flow %s." %
                       self.urn)
-      self.Set(self.Schema.FLOW_STATE(self.state))
+      self._WriteStateRecords()
+
+  def _StateChunkPredicate(self, name, index):
+    return "%s_chunk/%s/%s" % (self.Schema.FLOW_STATE.predicate, name, index)
+
+  def _ReadStateChunks(self):
+    """Replaces the chunked collections in the state with their contents."""
+    self._state_digests = {}
+    self._state_layout = {}
+
+    entries = dict((name, value) for name, value in self.state.data.iteritems()
+                   if isinstance(value, rdf_flows.ChunkedStateEntry))
+    if not entries:
+      return
+
+    records = {}
+    for predicate, value, _ in data_store.DB.ResolveRegex(
+        self.urn, self._StateChunkPredicate(".*", "[0-9]+"),
+        timestamp=data_store.DB.NEWEST_TIMESTAMP, token=self.token):
+      records[predicate] = utils.SmartStr(value)
+      self._state_digests[predicate] = hashlib.md5(records[predicate]).digest()
+
+    for name, value in entries.iteritems():
+      try:
+        chunks = [cPickle.loads(records[self._StateChunkPredicate(name, i)])
+                  for i in xrange(value.chunk_count)]
+      except Exception as e:  # pylint: disable=broad-except
+        # Leaving the placeholder in would hand the flow a ChunkedStateEntry
+        # where it expects its collection, so the entry is dropped instead.
+        # Noting the error opens the flow read only so the incomplete state
+        # is never written back.
+        logging.error("Unable to read the chunks of state entry %s of flow "
+                      "%s: %s", name, self.urn, e)
+        self.state.errors = e
+        del self.state.data[name]
+        continue
+
+      self.state.data[name] = value.Join(chunks)
+      self._state_layout[name] = value
+
+  def _WriteStateRecords(self):
+    """Serializes the state and queues the records which changed.
+
+    Large collections are split into chunk records and replaced by a
+    ChunkedStateEntry in the FLOW_STATE record. Only records whose contents
+    differ from what is in the data store are written, records which are no
+    longer used are deleted.
+    """
+    digests = self._state_digests or {}
+    layout = self._state_layout or {}
+
+    inline = rdf_flows.FlowState()
+    records = {}
+    new_layout = {}
+    for name, value in self.state.data.iteritems():
+      if (type(value) in rdf_flows.ChunkedStateEntry.COLLECTION_TYPES and
+          len(value) > self.STATE_CHUNK_SIZE):
+        value, chunks = rdf_flows.ChunkedStateEntry.Split(
+            value, self.STATE_CHUNK_SIZE, previous=layout.get(name))
+        for i, chunk in enumerate(chunks):
+          records[self._StateChunkPredicate(name, i)] = cPickle.dumps(
+              chunk, cPickle.HIGHEST_PROTOCOL)
+
+        new_layout[name] = value
+
+      inline.data[name] = value
+
+    records[self.Schema.FLOW_STATE.predicate] = inline.SerializeToString()
+
+    new_digests = {}
+    to_set = {}
+    for predicate, value in records.iteritems():
+      new_digests[predicate] = hashlib.md5(value).digest()
+      if new_digests[predicate] != digests.get(predicate):
+        to_set[predicate] = [value]
+
+    to_delete = set(digests) - set(records)
+    self._pending_state = (to_set, to_delete, new_digests, new_layout,
+                           sum(len(value) for value in records.itervalues()))
+
+  def _WriteAttributes(self, sync=True):
+    if self._pending_state is not None and "w" in self.mode:
+      to_set, to_delete, digests, layout, state_size = self._pending_state
+      self._pending_state = None
+
+      if to_set or to_delete:
+        # The records are raw predicates, not schema attributes, so they are
+        # written to the data store directly.
+        data_store.DB.MultiSet(self.urn, to_set, replace=False, sync=sync,
+                               to_delete=to_delete | set(to_set),
+                               token=self.token)
+        try:
+          aff4.FACTORY.cache.ExpirePrefix(utils.SmartStr(self.urn) + ":")
+        except KeyError:
+          pass
+
+      self._state_digests = digests
+      self._state_layout = layout
+
+      fields = [self.__class__.__name__]
+      stats.STATS.RecordEvent("flow_state_size", state_size, fields=fields)
+      stats.STATS.RecordEvent(
+          "flow_state_bytes_written",
+          sum(len(values[0]) for values in to_set.itervalues()),
+          fields=fields)
+
+    super(GRRFlow, self)._WriteAttributes(sync=sync)
 
   def FlushMessages(self):
     """Write all the messages queued in the queue manager."""
@@ -1190,7 +1311,7 @@ class WellKnownFlow(GRRFlow):
   def WriteState(self):
     if "w" in self.mode:
       # For normal flows it's a bug to write an empty state, here it's ok.
-      self.Set(self.Schema.FLOW_STATE(self.state))
+      self._WriteStateRecords()
 
   def UpdateKillNotification(self):
     # For WellKnownFlows it doesn't make sense to kill them ever.
@@ -1902,6 +2023,16 @@ class FlowInit(registry.InitHook):
                                       fields=[("flow", str)])
     stats.STATS.RegisterCounterMetric("flow_completions",
                                       fields=[("flow", str)])
+    stats.STATS.RegisterCounterMetric("flow_inline_states",
+                                      fields=[("flow", str)])
+    stats.STATS.RegisterCounterMetric("flow_inline_queue_writes_saved")
+    stats.STATS.RegisterEventMetric("flow_inline_state_latency")
+    state_size_bins = [2 ** i for i in range(10, 30, 2)]
+    stats.STATS.RegisterEventMetric("flow_state_size", bins=state_size_bins,
+                                    fields=[("flow", str)])
+    stats.STATS.RegisterEventMetric("flow_state_bytes_written",
+                                    bins=state_size_bins,
+                                    fields=[("flow", str)])
     stats.STATS.RegisterCounterMetric("well_known_flow_requests",
                                       fields=[("flow", str)])
     stats.STATS.RegisterCounterMetric("well_known_flow_errors",
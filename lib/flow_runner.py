@@ -110,8 +110,16 @@ class FlowRunner(object):
 
   # Normal flows must process responses in order.
   process_requests_in_order = True
+
+  # If True, the worker keeps processing requests that complete while it holds
+  # the lease on the flow, instead of leaving them for another lease.
+  batch_completed_requests = False
   queue_manager = None
 
+  # The maximum number of CallState() requests processed inline, without
+  # going through the queues, in a single ProcessCompletedRequests() pass.
+  MAX_INLINE_STATES = 100
+
   client_id = None
 
   def __init__(self, flow_obj, parent_runner=None, runner_args=None,
@@ -165,6 +173,13 @@ class FlowRunner(object):
     # when the flow is saved.
     self.sent_replies = []
 
+    # CallState() requests processed inline in this pass: True while
+    # ProcessCompletedRequests() runs states, the pending (request, responses,
+    # time queued) and the number of states run so far.
+    self.processing_requests = False
+    self.inline_requests = []
+    self.inline_states_run = 0
+
   @property
   def output(self):
     return self.context.output
@@ -324,7 +339,9 @@ class FlowRunner(object):
 
     This is basically the same as CallFlow() except we are calling
     ourselves. The state will be invoked in a later time and receive all the
-    messages we send.
+    messages we send. When the request is the next one the flow has to
+    process, the worker runs the state right after the current one instead,
+    without writing it to the queues.
 
     Args:
        messages: A list of rdfvalues to send. If the last one is not a
@@ -359,13 +376,11 @@ class FlowRunner(object):
     if request_data:
       request_state.data = rdf_protodict.Dict().FromDict(request_data)
 
-    self.QueueRequest(request_state, timestamp=start_time)
-
     # Add the status message if needed.
     if not messages or not isinstance(messages[-1], rdf_flows.GrrStatus):
       messages.append(rdf_flows.GrrStatus())
 
-    # Send all the messages
+    responses = []
     for i, payload in enumerate(messages):
       if isinstance(payload, rdfvalue.RDFValue):
         msg = rdf_flows.GrrMessage(
@@ -381,11 +396,69 @@ class FlowRunner(object):
         raise FlowRunnerError("Bad message %s of type %s." % (payload,
                                                               type(payload)))
 
+      responses.append(msg)
+
+    if self._CanProcessInline(request_state, start_time):
+      # The state runs in this worker pass, right after the current one, so
+      # nothing needs to be written to the queues. The responses are copied
+      # as they would be by the queues.
+      self.IncrementOutstandingRequests()
+      self.inline_requests.append((
+          request_state,
+          [rdf_flows.GrrMessage(msg.SerializeToString()) for msg in responses],
+          time.time()))
+
+      # One request, the responses and one notification.
+      stats.STATS.IncrementCounter("flow_inline_queue_writes_saved",
+                                   len(responses) + 2)
+      return
+
+    self.QueueRequest(request_state, timestamp=start_time)
+
+    # Send all the messages
+    for msg in responses:
       self.QueueResponse(msg, start_time)
 
     # Notify the worker about it.
     self.QueueNotification(session_id=self.session_id, timestamp=start_time)
 
+  def _CanProcessInline(self, request_state, start_time):
+    """Can a CallState() request be processed inline in this pass?
+
+    This is only the case for the request following the one being processed,
+    so requests are still processed in order.
+
+    Args:
+      request_state: The RequestState of the CallState() request.
+      start_time: The time the request should be processed at.
+
+    Returns:
+      True if the request can be processed inline.
+    """
+    return (self.process_requests_in_order and
+            self.processing_requests and
+            not start_time and
+            self.inline_states_run < self.MAX_INLINE_STATES and
+            request_state.id == self.context.next_processed_request + 1)
+
+  def ProcessInlineRequests(self):
+    """Runs the states of the CallState() requests kept for this pass."""
+    while self.inline_requests and self.IsRunning():
+      request, responses, queued = self.inline_requests.pop(0)
+      self.inline_states_run += 1
+
+      stats.STATS.IncrementCounter("flow_inline_states",
+                                   fields=[self.flow_obj.Name()])
+      stats.STATS.RecordEvent("flow_inline_state_latency",
+                              time.time() - queued)
+
+      self.RunStateMethod(request.next_state, request, responses)
+      self.context.next_processed_request += 1
+      self.DecrementOutstandingRequests()
+
+    # The flow is no longer running so the requests are dropped.
+    self.inline_requests = []
+
   def ProcessCompletedRequests(self, notification, thread_pool):
     """Go through the list of requests and process the completed ones.
 
@@ -423,6 +496,7 @@ class FlowRunner(object):
       return
 
     processing = []
+    self.inline_states_run = 0
     while True:
       try:
         # Here we only care about completed requests - i.e. those requests with
@@ -467,8 +541,12 @@ class FlowRunner(object):
           # If we get here its all good - run the flow.
           if self.IsRunning():
             self.flow_obj.HeartBeat()
-            self._Process(request, responses, thread_pool=thread_pool,
-                          events=processing)
+            self.processing_requests = True
+            try:
+              self._Process(request, responses, thread_pool=thread_pool,
+                            events=processing)
+            finally:
+              self.processing_requests = False
 
           # Quit early if we are no longer alive.
           else:
@@ -480,6 +558,13 @@ class FlowRunner(object):
           self.context.next_processed_request += 1
           self.DecrementOutstandingRequests()
 
+          # Run the states the request called with CallState() straight away.
+          self.processing_requests = True
+          try:
+            self.ProcessInlineRequests()
+          finally:
+            self.processing_requests = False
+
         # Are there any more outstanding requests?
         if not self.OutstandingRequests():
           # Allow the flow to cleanup
@@ -564,9 +649,10 @@ class FlowRunner(object):
         raise FlowRunnerError("Flow %s has no state method %s" % (
             self.flow_obj.__class__.__name__, method))
 
-      method(direct_response=direct_response,
-             request=request,
-             responses=responses)
+      with data_store.OperationsCaller(self.flow_obj.__class__.__name__):
+        method(direct_response=direct_response,
+               request=request,
+               responses=responses)
 
       if self.sent_replies:
         self.ProcessRepliesWithOutputPlugins(self.sent_replies)
@@ -17,6 +17,7 @@ from grr.lib import flow_runner
 from grr.lib import output_plugin
 from grr.lib import queue_manager
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import test_lib
 from grr.lib import type_info
 from grr.lib import utils
@@ -167,6 +168,78 @@ class FlowCreationTest(BasicFlowTest):
                                      client_id=self.client_id):
       pass
 
+  def _StateChunkTimestamps(self, session_id):
+    return dict((predicate, ts) for predicate, _, ts in
+                data_store.DB.ResolveRegex(
+                    session_id, "aff4:flow_state_chunk/.*",
+                    timestamp=data_store.DB.NEWEST_TIMESTAMP,
+                    token=self.token))
+
+  def testLargeStateCollectionsAreChunked(self):
+    """Check that large state collections are written incrementally."""
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id, flow_name="FlowOrderTest", token=self.token)
+
+    with utils.Stubber(flow.GRRFlow, "STATE_CHUNK_SIZE", 10):
+      with aff4.FACTORY.Open(session_id, mode="rw",
+                             token=self.token) as flow_obj:
+        flow_obj.state.Register("pending", range(35))
+        flow_obj.state.Register("hashes",
+                                dict((i, str(i)) for i in range(50)))
+        flow_obj.state.Register("blobs", set(range(30)))
+
+      # 4 list slices, 4 dict buckets and 2 set buckets.
+      timestamps = self._StateChunkTimestamps(session_id)
+      self.assertEqual(len(timestamps), 10)
+
+      # The FLOW_STATE record only holds placeholders for the collections.
+      flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+      state = flow_obj.Get(flow_obj.Schema.FLOW_STATE)
+      self.assertTrue(isinstance(state.pending, rdf_flows.ChunkedStateEntry))
+
+      written = stats.STATS.GetMetricValue(
+          "flow_state_bytes_written", fields=["FlowOrderTest"]).sum
+
+      flow_obj = aff4.FACTORY.Open(session_id, mode="rw", token=self.token)
+      self.assertEqual(flow_obj.state.pending, range(35))
+      self.assertEqual(flow_obj.state.hashes,
+                       dict((i, str(i)) for i in range(50)))
+      self.assertEqual(flow_obj.state.blobs, set(range(30)))
+
+      flow_obj.state.pending.append(35)
+      flow_obj.Close()
+
+      # Only the last slice of the list was rewritten.
+      new_timestamps = self._StateChunkTimestamps(session_id)
+      changed = [predicate for predicate in new_timestamps
+                 if new_timestamps[predicate] != timestamps[predicate]]
+      self.assertEqual(changed, ["aff4:flow_state_chunk/pending/3"])
+      self.assertGreater(
+          stats.STATS.GetMetricValue(
+              "flow_state_bytes_written", fields=["FlowOrderTest"]).sum,
+          written)
+
+      # Chunks which are no longer used are deleted.
+      flow_obj = aff4.FACTORY.Open(session_id, mode="rw", token=self.token)
+      flow_obj.state.blobs = set()
+      flow_obj.Close()
+
+      self.assertEqual(len(self._StateChunkTimestamps(session_id)), 8)
+      flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+      self.assertEqual(flow_obj.state.pending, range(36))
+      self.assertEqual(flow_obj.state.blobs, set())
+
+      # A flow whose chunks can not be read is opened read only without the
+      # entry rather than seeing the placeholder in place of its collection.
+      data_store.DB.DeleteAttributes(
+          session_id, ["aff4:flow_state_chunk/pending/0"], sync=True,
+          token=self.token)
+      flow_obj = aff4.FACTORY.Open(session_id, mode="rw", token=self.token)
+      self.assertEqual(flow_obj.mode, "r")
+      self.assertTrue(flow_obj.state.errors)
+      self.assertFalse("pending" in flow_obj.state.data)
+      self.assertEqual(flow_obj.state.blobs, set())
+
   def testTerminate(self):
     session_id = flow.GRRFlow.StartFlow(
         client_id=self.client_id, flow_name="FlowOrderTest", token=self.token)
@@ -789,6 +862,55 @@ class GeneralFlowsTest(BasicFlowTest):
       self.Work(client_mock, worker_mock)
       self.assertEqual(DelayedCallStateFlow.flow_ran, 2)
 
+  def _RunChainedCallStateFlow(self):
+    ChainedCallStateFlow.steps = []
+    worker_mock = test_lib.MockWorker(check_flow_errors=True,
+                                      token=self.token)
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id, flow_name="ChainedCallStateFlow",
+        token=self.token)
+
+    worker_mock.Next()
+    return session_id, worker_mock
+
+  def testChainedCallStatesRunInline(self):
+    """Tests that chained CallState() requests run in the same pass."""
+    inline_states = stats.STATS.GetMetricValue(
+        "flow_inline_states", fields=["ChainedCallStateFlow"])
+    writes_saved = stats.STATS.GetMetricValue(
+        "flow_inline_queue_writes_saved")
+
+    session_id, _ = self._RunChainedCallStateFlow()
+
+    # A single worker pass ran all the states and completed the flow.
+    self.assertEqual(ChainedCallStateFlow.steps, range(6))
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertEqual(flow_obj.state.context.state,
+                     rdf_flows.Flow.State.TERMINATED)
+    self.assertEqual(flow_obj.state.context.outstanding_requests, 0)
+
+    self.assertEqual(stats.STATS.GetMetricValue(
+        "flow_inline_states", fields=["ChainedCallStateFlow"]),
+                     inline_states + 5)
+    # Each call saved its request, response, status and notification.
+    self.assertEqual(stats.STATS.GetMetricValue(
+        "flow_inline_queue_writes_saved"), writes_saved + 5 * 4)
+
+  def testInlineCallStatesAreBounded(self):
+    """Tests that only a few CallState() requests run inline in a pass."""
+    with utils.Stubber(flow_runner.FlowRunner, "MAX_INLINE_STATES", 2):
+      session_id, worker_mock = self._RunChainedCallStateFlow()
+      self.assertEqual(ChainedCallStateFlow.steps, range(3))
+
+      # The other requests were queued for the next passes.
+      while worker_mock.Next():
+        pass
+
+    self.assertEqual(ChainedCallStateFlow.steps, range(6))
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertEqual(flow_obj.state.context.state,
+                     rdf_flows.Flow.State.TERMINATED)
+
   def testChainedFlow(self):
     """Test the ability to chain flows."""
     ParentFlow.success = False
@@ -1384,6 +1506,25 @@ class CallStateFlow(flow.GRRFlow):
     CallStateFlow.success = True
 
 
+class ChainedCallStateFlow(flow.GRRFlow):
+  """A flow that calls its own state a few times in a row."""
+
+  # The steps run so far.
+  steps = []
+
+  @flow.StateHandler(next_state="Step")
+  def Start(self):
+    self.CallState([rdfvalue.RDFInteger(0)], next_state="Step")
+
+  @flow.StateHandler(next_state="Step")
+  def Step(self, responses):
+    step = int(responses.First())
+    ChainedCallStateFlow.steps.append(step)
+
+    if step < 5:
+      self.CallState([rdfvalue.RDFInteger(step + 1)], next_state="Step")
+
+
 class DelayedCallStateFlow(flow.GRRFlow):
   """A flow that calls one of its own states with a delay."""
 
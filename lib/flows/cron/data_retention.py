@@ -2,21 +2,135 @@
 """These cron flows do the datastore cleanup."""
 
 
+import time
 
 from grr.lib import aff4
 from grr.lib import config_lib
+from grr.lib import data_store
 from grr.lib import flow
+from grr.lib import hunts
 from grr.lib import rdfvalue
+from grr.lib import registry
+from grr.lib import stats
 
 from grr.lib.aff4_objects import cronjobs
 
 
-class CleanHunts(cronjobs.SystemCronFlow):
-  """Cleaner that deletes old hunts."""
+class DataRetentionCronFlow(cronjobs.StatefulSystemCronFlow):
+  """Base class for the cleaners, deletes expired objects in batches.
+
+  Objects are deleted DataRetention.deletion_batch_size at a time, sleeping
+  between batches so no more than DataRetention.max_deleted_objects_per_second
+  objects are removed per second, so a large cleanup does not starve the rest
+  of the system of data store capacity.
+  """
+
+  __abstract = True
 
   frequency = rdfvalue.Duration("7d")
   lifetime = rdfvalue.Duration("6h")
 
+  def _ReadState(self, key):
+    try:
+      return self.ReadCronState().get(key)
+    except cronjobs.StateReadError:
+      # We are not running as a scheduled cron job, nowhere to keep state.
+      self.checkpointing = False
+      return None
+
+  def _WriteState(self, key, value):
+    if not self.checkpointing:
+      return
+
+    cron_state = self.ReadCronState()
+    cron_state.Register(key, value)
+    self.WriteCronState(cron_state)
+
+  def StartDeletion(self):
+    self.checkpointing = True
+    self.batch_size = config_lib.CONFIG["DataRetention.deletion_batch_size"]
+    self.max_rate = config_lib.CONFIG[
+        "DataRetention.max_deleted_objects_per_second"]
+
+    self.deleted_objects = 0
+    self.initial_size = data_store.DB.Size()
+    self.batch_started = time.time()
+
+  def _DeletionProgress(self, unused_deleted, unused_cursor):
+    # Deleting a single large object can take a while.
+    self.HeartBeat()
+
+  def DeleteBatch(self, urns):
+    """Recursively deletes a batch of objects, throttling the deletion rate."""
+    if urns:
+      deleted = aff4.FACTORY.MultiDelete(
+          urns, token=self.token, progress_callback=self._DeletionProgress)
+      self.deleted_objects += deleted
+      stats.STATS.IncrementCounter("data_retention_deleted_objects", deleted,
+                                   fields=[self.__class__.__name__])
+
+      if self.max_rate:
+        delay = (float(deleted) / self.max_rate -
+                 (time.time() - self.batch_started))
+        if delay > 0:
+          time.sleep(delay)
+
+    self.batch_started = time.time()
+
+    # This flow is not dead: we don't want to run out of lease time.
+    self.HeartBeat()
+
+  def FinishDeletion(self):
+    """Reports how much was deleted in this run."""
+    size = data_store.DB.Size()
+    if self.initial_size < 0 or size < 0:
+      self.Log("Deleted %d objects.", self.deleted_objects)
+      return
+
+    # Other writers change the size too, so this is only an estimate.
+    bytes_freed = max(0, self.initial_size - size)
+    stats.STATS.IncrementCounter("data_retention_bytes_freed", bytes_freed,
+                                 fields=[self.__class__.__name__])
+    self.Log("Deleted %d objects, freeing approximately %d bytes.",
+             self.deleted_objects, bytes_freed)
+
+
+class CleanHunts(DataRetentionCronFlow):
+  """Cleaner that deletes old hunts.
+
+  Hunts are found through the hunts expiry index, so only the hunts which
+  expired before the deadline are read.
+  """
+
+  HUNTS_ROOT = rdfvalue.RDFURN("aff4:/hunts")
+
+  def _BackfillExpiryIndex(self, index):
+    """Adds the hunts created before the expiry index existed to it."""
+    backfill = self._ReadState("expiry_index_backfill") or dict(cursor=None)
+    if backfill.get("done"):
+      return
+
+    while True:
+      page = data_store.DB.ScanAttributes(
+          self.HUNTS_ROOT, "index:dir/.+", after=backfill["cursor"],
+          limit=self.batch_size, token=self.token)
+      if not page:
+        break
+
+      hunts_urns = [self.HUNTS_ROOT.Add(column[len("index:dir/"):])
+                    for column, _, _ in page]
+      for hunt in aff4.FACTORY.MultiOpen(hunts_urns, aff4_type="GRRHunt",
+                                         token=self.token):
+        index.Add(hunt.urn, hunt.GetRunner().context.expires)
+      index.Flush()
+
+      backfill["cursor"] = page[-1][0]
+      self._WriteState("expiry_index_backfill", backfill)
+      self.HeartBeat()
+
+    backfill["done"] = True
+    self._WriteState("expiry_index_backfill", backfill)
+
   @flow.StateHandler()
   def Start(self):
     hunts_ttl = config_lib.CONFIG["DataRetention.hunts_ttl"]
@@ -27,30 +141,69 @@ class CleanHunts(cronjobs.SystemCronFlow):
     exception_label = config_lib.CONFIG[
         "DataRetention.hunts_ttl_exception_label"]
 
-    hunts_root = aff4.FACTORY.Open("aff4:/hunts", token=self.token)
-    hunts_urns = list(hunts_root.ListChildren())
+    self.StartDeletion()
+    index = aff4.FACTORY.Create(hunts.GRRHunt.expiry_index_urn,
+                                "AFF4ExpiryIndex", mode="rw", token=self.token)
+    self._BackfillExpiryIndex(index)
 
-    urns_to_delete = []
     deadline = rdfvalue.RDFDatetime().Now() - hunts_ttl
+    cursor = None
+    while True:
+      expired = index.ListExpired(deadline, after=cursor,
+                                  limit=self.batch_size)
+      if not expired:
+        break
+      cursor = expired[-1][2]
+
+      hunts_objs = aff4.FACTORY.MultiOpen([urn for urn, _, _ in expired],
+                                          aff4_type="GRRHunt",
+                                          token=self.token)
+      hunts_by_urn = dict((hunt.urn, hunt) for hunt in hunts_objs)
+
+      urns_to_delete = []
+      for urn, expires, _ in expired:
+        hunt = hunts_by_urn.get(urn)
+        if hunt is None:
+          # The hunt is gone already.
+          index.Remove(urn, expires)
+          continue
+
+        if exception_label in hunt.GetLabelsNames():
+          continue
+
+        hunt_expires = hunt.GetRunner().context.expires
+        if hunt_expires < deadline:
+          urns_to_delete.append(urn)
+          index.Remove(urn, expires)
+        elif hunt_expires != expires:
+          # The hunt was restarted, it is indexed under its new expiry time.
+          index.Remove(urn, expires)
+
+      self.DeleteBatch(urns_to_delete)
+      index.Flush()
+
+    index.Close()
+    self.FinishDeletion()
+
+
+class CleanCronJobs(DataRetentionCronFlow):
+  """Cleaner that deletes old finished cron flows."""
 
-    hunts = aff4.FACTORY.MultiOpen(hunts_urns, aff4_type="GRRHunt",
-                                   token=self.token)
-    for hunt in hunts:
-      if exception_label in hunt.GetLabelsNames():
-        continue
-
-      runner = hunt.GetRunner()
-      if runner.context.expires < deadline:
-        urns_to_delete.append(hunt.urn)
-
-    aff4.FACTORY.MultiDelete(urns_to_delete, token=self.token)
+  def _DeleteJobFlows(self, job_urn, age):
+    """Deletes the flows of a job started before age, a batch at a time."""
+    age = age.AsMicroSecondsFromEpoch()
 
+    cursor = None
+    while True:
+      page = data_store.DB.ScanAttributes(
+          job_urn, "index:dir/.+", after=cursor, limit=self.batch_size,
+          token=self.token)
+      if not page:
+        break
+      cursor = page[-1][0]
 
-class CleanCronJobs(cronjobs.SystemCronFlow):
-  """Cleaner that deletes old finished cron flows."""
-
-  frequency = rdfvalue.Duration("7d")
-  lifetime = rdfvalue.Duration("6h")
+      self.DeleteBatch([job_urn.Add(column[len("index:dir/"):])
+                        for column, _, timestamp in page if timestamp <= age])
 
   @flow.StateHandler()
   def Start(self):
@@ -59,10 +212,23 @@ class CleanCronJobs(cronjobs.SystemCronFlow):
       self.Log("TTL not set - nothing to do...")
       return
 
-    jobs = cronjobs.CRON_MANAGER.ListJobs(token=self.token)
-    jobs_objs = aff4.FACTORY.MultiOpen(jobs, aff4_type="CronJob",
-                                       mode="r", token=self.token)
+    self.StartDeletion()
+
+    age = rdfvalue.RDFDatetime().Now() - cron_jobs_ttl
+    for job_urn in cronjobs.CRON_MANAGER.ListJobs(token=self.token):
+      self._DeleteJobFlows(job_urn, age)
+
+    self.FinishDeletion()
+
+
+class DataRetentionInitHook(registry.InitHook):
+  """Registers the data retention metrics."""
+
+  pre = ["StatsInit"]
 
-    for obj in jobs_objs:
-      age = rdfvalue.RDFDatetime().Now() - cron_jobs_ttl
-      obj.DeleteJobFlows(age)
+  def RunOnce(self):
+    """Register data retention stats."""
+    stats.STATS.RegisterCounterMetric("data_retention_deleted_objects",
+                                      fields=[("type", str)])
+    stats.STATS.RegisterCounterMetric("data_retention_bytes_freed",
+                                      fields=[("type", str)])
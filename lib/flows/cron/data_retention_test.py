@@ -2,6 +2,7 @@
 """Tests for datastore cleaning cron flows."""
 
 
+import time
 
 from grr.lib import aff4
 from grr.lib import config_lib
@@ -10,6 +11,7 @@ from grr.lib import flags
 from grr.lib import flow
 from grr.lib import hunts
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib.aff4_objects import cronjobs
@@ -113,6 +115,38 @@ class CleanHuntsTest(test_lib.FlowTestsBaseclass):
                                         token=self.token).ListChildren())
     self.assertEqual(len(hunts_urns), 3)
 
+  def testDeletesHuntsMissingFromTheExpiryIndex(self):
+    # Hunts created before the expiry index existed are added to it first.
+    data_store.DB.DeleteSubject(hunts.GRRHunt.expiry_index_urn,
+                                token=self.token)
+    config_lib.CONFIG.Set("DataRetention.hunts_ttl",
+                          rdfvalue.Duration("150s"))
+
+    with test_lib.FakeTime(40 + 60 * self.NUM_HUNTS):
+      flow.GRRFlow.StartFlow(
+          flow_name=data_retention.CleanHunts.__name__,
+          sync=True, token=self.token)
+
+    hunts_urns = list(aff4.FACTORY.Open("aff4:/hunts",
+                                        token=self.token).ListChildren())
+    self.assertEqual(len(hunts_urns), 2)
+
+  def testReportsNumberOfDeletedObjects(self):
+    config_lib.CONFIG.Set("DataRetention.hunts_ttl",
+                          rdfvalue.Duration("150s"))
+
+    prev_deleted = stats.STATS.GetMetricValue(
+        "data_retention_deleted_objects", fields=["CleanHunts"])
+    with test_lib.FakeTime(40 + 60 * self.NUM_HUNTS):
+      flow.GRRFlow.StartFlow(
+          flow_name=data_retention.CleanHunts.__name__,
+          sync=True, token=self.token)
+
+    deleted = stats.STATS.GetMetricValue(
+        "data_retention_deleted_objects", fields=["CleanHunts"])
+    # Every hunt has at least one child object.
+    self.assertGreater(deleted - prev_deleted, 8)
+
 
 class DummySystemCronJob(cronjobs.SystemCronFlow):
   """Dummy system cron job."""
@@ -182,6 +216,40 @@ class CleanCronJobsTest(test_lib.FlowTestsBaseclass):
         self.assertTrue(child_urn.age >
                         latest_timestamp - rdfvalue.Duration("150s"))
 
+  def testDeletesFlowsInRateLimitedBatches(self):
+    config_lib.CONFIG.Set("DataRetention.cron_jobs_flows_ttl",
+                          rdfvalue.Duration("150s"))
+    config_lib.CONFIG.Set("DataRetention.deletion_batch_size", 3)
+    config_lib.CONFIG.Set("DataRetention.max_deleted_objects_per_second", 10)
+
+    batches = []
+    delays = []
+
+    def MultiDelete(urns, **kwargs):
+      batches.append(list(urns))
+      return MultiDelete.old_target(urns, **kwargs)
+
+    with utils.MultiStubber((aff4.FACTORY, "MultiDelete", MultiDelete),
+                            (time, "sleep", delays.append)):
+      with test_lib.FakeTime(40 + 60 * self.NUM_CRON_RUNS):
+        flow.GRRFlow.StartFlow(
+            flow_name=data_retention.CleanCronJobs.__name__,
+            sync=True, token=self.token)
+
+    self.assertEqual(sum(len(batch) for batch in batches),
+                     2 * (self.NUM_CRON_RUNS - 2))
+    for batch in batches:
+      self.assertLessEqual(len(batch), 3)
+
+    # The clock does not move, so every batch waits for its full time slot.
+    self.assertEqual(len(delays), len(batches))
+    for delay in delays:
+      self.assertGreaterEqual(delay, 0.1)
+
+    for cron_urn in self.cron_jobs_urns:
+      fd = aff4.FACTORY.Open(cron_urn, token=self.token)
+      self.assertEqual(len(list(fd.ListChildren())), 2)
+
 
 def main(argv):
   # Run the full test suite
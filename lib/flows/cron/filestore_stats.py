@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 """Filestore stats crons."""
 
+import logging
+
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flow
 from grr.lib import rdfvalue
 from grr.lib import stats as stats_lib
@@ -9,22 +12,31 @@ from grr.lib import utils
 
 from grr.lib.aff4_objects import cronjobs
 # For FilestoreStats. pylint: disable=unused-import
-from grr.lib.aff4_objects import stats as _
+from grr.lib.aff4_objects import stats as aff4_stats
 # pylint: enable=unused-import
 
 
 class ClassCounter(object):
   """Populates a stats.Graph with counts of each object class."""
 
+  # The data store columns the consumer reads, in addition to the type.
+  COLUMNS = []
+
   def __init__(self, attribute, title):
     self.attribute = attribute
     self.value_dict = {}
     self.graph = self.attribute(title=title)
 
-  def ProcessFile(self, fd):
+  def ProcessFile(self, fd, unused_columns):
     classname = fd.__class__.__name__
     self.value_dict[classname] = self.value_dict.get(classname, 0) + 1
 
+  def GetState(self):
+    return dict(self.value_dict)
+
+  def SetState(self, state):
+    self.value_dict = dict(state)
+
   def Save(self, fd):
     for classname, count in self.value_dict.items():
       self.graph.Append(label=classname, y_value=count)
@@ -34,9 +46,11 @@ class ClassCounter(object):
 class ClassFileSizeCounter(ClassCounter):
   """Count total filesize by classtype."""
 
+  COLUMNS = [aff4.AFF4Stream.SchemaCls.SIZE.predicate]
+
   GB = 1024 * 1024 * 1024
 
-  def ProcessFile(self, fd):
+  def ProcessFile(self, fd, unused_columns):
     classname = fd.__class__.__name__
     self.value_dict[classname] = self.value_dict.get(classname, 0) + fd.Get(
         fd.Schema.SIZE)
@@ -50,6 +64,8 @@ class ClassFileSizeCounter(ClassCounter):
 class GraphDistribution(stats_lib.Distribution):
   """Abstract class for building histograms."""
 
+  COLUMNS = []
+
   _bins = []
 
   def __init__(self, attribute, title):
@@ -57,9 +73,18 @@ class GraphDistribution(stats_lib.Distribution):
     self.graph = self.attribute(title=title)
     super(GraphDistribution, self).__init__(bins=self._bins)
 
-  def ProcessFile(self, fd):
+  def ProcessFile(self, fd, columns):
     raise NotImplementedError()
 
+  def GetState(self):
+    return dict(heights=list(self.heights), sum=float(self.sum),
+                count=int(self.count))
+
+  def SetState(self, state):
+    self.heights = list(state["heights"])
+    self.sum = state["sum"]
+    self.count = state["count"]
+
   def Save(self, fd):
     for x, y in sorted(self.bins_heights.items()):
       if x >= 0:
@@ -71,36 +96,52 @@ class GraphDistribution(stats_lib.Distribution):
 class FileSizeHistogram(GraphDistribution):
   """Graph filesize."""
 
+  COLUMNS = [aff4.AFF4Stream.SchemaCls.SIZE.predicate]
+
   _bins = [0, 2, 50, 100, 1e3, 10e3, 100e3, 500e3, 1e6, 5e6, 10e6, 50e6,
            100e6, 500e6, 1e9, 5e9, 10e9]
 
-  def ProcessFile(self, fd):
+  def ProcessFile(self, fd, unused_columns):
     self.Record(fd.Get(fd.Schema.SIZE))
 
 
 class ClientCountHistogram(GraphDistribution):
   """Graph the number of files that are found on 0, 1, 5...etc clients."""
 
+  # The FileStoreImage index of client files having this content.
+  COLUMNS = ["index:target:aff4:/c.+"]
+
   _bins = [0, 1, 5, 10, 20, 50, 100]
 
-  def ProcessFile(self, fd):
+  def ProcessFile(self, unused_fd, columns):
 
     # The same file can be in multiple locations on the one client so we use a
     # set to kill the dups.
     clients = set()
-    for urn in fd.Query("aff4:/C.+"):
-      client, _ = urn.Split(2)
-      clients.add(client)
+    for column, target, _ in columns:
+      if column.startswith("index:target:"):
+        client, _ = rdfvalue.RDFURN(target).Split(2)
+        clients.add(client)
     self.Record(len(clients))
 
 
-class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
-  """Build statistics about the filestore."""
+class FilestoreStatsCronFlow(cronjobs.StatefulSystemCronFlow):
+  """Build statistics about the filestore.
+
+  Hashes are scanned in order and only the columns the consumers need are
+  read. The scan position and the consumers'
+  state are periodically saved in the cron job state, so an interrupted scan
+  resumes where it stopped on the next run.
+  """
   frequency = rdfvalue.Duration("1w")
   lifetime = rdfvalue.Duration("1d")
   HASH_PATH = "aff4:/files/hash/generic/sha256"
   FILESTORE_STATS_URN = rdfvalue.RDFURN("aff4:/stats/FileStoreStats")
   OPEN_FILES_LIMIT = 500
+  INDEX_PREFIX = "index:dir/"
+
+  # Save the scan state every this many batches.
+  CHECKPOINT_INTERVAL = 100
 
   def _CreateConsumers(self):
     self.consumers = [ClassCounter(self.stats.Schema.FILESTORE_FILETYPES,
@@ -115,26 +156,124 @@ class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
                           self.stats.Schema.FILESTORE_CLIENTCOUNT_HISTOGRAM,
                           "Number of files found on X clients")]
 
+  def _ListHashes(self, after=None):
+    """Yields batches of hash urns in hash order.
+
+    The hash objects are scanned directly where the data store supports it,
+    otherwise the hash directory index is paged through.
+
+    Args:
+      after: The last hash already processed.
+
+    Yields:
+      (urns, cursor) tuples, cursor is the last hash of the batch.
+    """
+    try:
+      for batch in self._ScanHashes(after=after):
+        yield batch
+    except NotImplementedError:
+      for batch in self._ScanHashIndex(after=after):
+        yield batch
+
+  def _ScanHashes(self, after=None):
+    prefix = self.HASH_PATH + "/"
+    if after is not None:
+      after = prefix + after
+
+    # Only the hash objects themselves have a type, the other subjects with
+    # the prefix are not counted.
+    type_attribute = aff4.AFF4Object.SchemaCls.TYPE.predicate
+    while True:
+      page = list(data_store.DB.ScanSubjects(
+          prefix, [type_attribute], after=after, limit=self.OPEN_FILES_LIMIT,
+          token=self.token))
+      if not page:
+        return
+
+      after = page[-1][0]
+      urns = [subject for subject, _ in page
+              if "/" not in subject[len(prefix):]]
+      if urns:
+        yield (urns, after[len(prefix):])
+
+      if len(page) < self.OPEN_FILES_LIMIT:
+        return
+
+  def _ScanHashIndex(self, after=None):
+    if after is not None:
+      after = self.INDEX_PREFIX + after
+
+    while True:
+      page = data_store.DB.ScanAttributes(
+          self.HASH_PATH, self.INDEX_PREFIX + ".+", after=after,
+          limit=self.OPEN_FILES_LIMIT, token=self.token)
+      if not page:
+        return
+
+      after = page[-1][0]
+      yield ([u"%s/%s" % (self.HASH_PATH, column[len(self.INDEX_PREFIX):])
+              for column, _, _ in page], after[len(self.INDEX_PREFIX):])
+
+      if len(page) < self.OPEN_FILES_LIMIT:
+        return
+
   @flow.StateHandler()
   def Start(self):
-    """Retrieve all the clients for the AbstractClientStatsCollectors."""
+    """Scan all the hashes in the filestore, feeding them to the consumers."""
     self.stats = aff4.FACTORY.Create(self.FILESTORE_STATS_URN, "FilestoreStats",
                                      mode="w", token=self.token)
 
     self._CreateConsumers()
-    hashes = list(aff4.FACTORY.Open(self.HASH_PATH,
-                                    token=self.token).ListChildren())
 
-    try:
-      for urns in utils.Grouper(hashes, self.OPEN_FILES_LIMIT):
-        for fd in aff4.FACTORY.MultiOpen(urns, mode="r", token=self.token,
-                                         age=aff4.NEWEST_TIME):
-
-          for consumer in self.consumers:
-            consumer.ProcessFile(fd)
-        self.HeartBeat()
-
-    finally:
-      for consumer in self.consumers:
-        consumer.Save(self.stats)
-      self.stats.Close()
+    checkpoint = self.ReadCheckpoint("filestore_scan")
+    if checkpoint:
+      logging.info("%s: resuming scan after %s (%d files processed).",
+                   self.__class__.__name__, checkpoint["cursor"],
+                   checkpoint["processed"])
+      for consumer, state in zip(self.consumers, checkpoint["consumers"]):
+        consumer.SetState(state)
+    else:
+      checkpoint = dict(started=rdfvalue.RDFDatetime().Now(), cursor=None,
+                        processed=0)
+
+    columns = set([aff4.AFF4Object.SchemaCls.TYPE.predicate])
+    for consumer in self.consumers:
+      columns.update(consumer.COLUMNS)
+    columns = sorted(columns)
+
+    for batch_count, (urns, cursor) in enumerate(
+        self._ListHashes(after=checkpoint["cursor"]), 1):
+      local_cache = {}
+      for subject, values in data_store.DB.MultiResolveRegex(
+          urns, columns, timestamp=data_store.DB.NEWEST_TIMESTAMP,
+          token=self.token):
+        # Objects expect their attributes sorted by age, newest first.
+        values.sort(key=lambda x: x[-1], reverse=True)
+        local_cache[utils.SmartUnicode(subject)] = values
+
+      for urn in urns:
+        if urn not in local_cache:
+          continue
+
+        fd = aff4.FACTORY.Open(urn, mode="r", local_cache=local_cache,
+                               age=aff4.NEWEST_TIME, token=self.token)
+        for consumer in self.consumers:
+          consumer.ProcessFile(fd, local_cache[urn])
+
+      checkpoint["cursor"] = cursor
+      checkpoint["processed"] += len(local_cache)
+
+      if batch_count % self.CHECKPOINT_INTERVAL == 0:
+        checkpoint["consumers"] = [consumer.GetState()
+                                   for consumer in self.consumers]
+        self.WriteCheckpoint("filestore_scan", checkpoint)
+
+      # This flow is not dead: we don't want to run out of lease time.
+      self.HeartBeat()
+
+    for consumer in self.consumers:
+      consumer.Save(self.stats)
+    self.stats.Close()
+
+    # The scan is complete, the next run starts from scratch.
+    self.WriteCheckpoint("filestore_scan", None)
@@ -2,8 +2,13 @@
 """Tests for grr.lib.flows.cron.filestore_stats."""
 
 from grr.lib import aff4
+from grr.lib import config_lib
+from grr.lib import data_store
 from grr.lib import flags
+from grr.lib import flow
 from grr.lib import test_lib
+from grr.lib import utils
+from grr.lib.aff4_objects import cronjobs
 from grr.lib.flows.cron import filestore_stats
 
 
@@ -70,6 +75,72 @@ class FilestoreStatsCronFlowTest(test_lib.FlowTestsBaseclass):
     self.assertEqual(clientcount.data[2].x_value, 5)
     self.assertEqual(clientcount.data[2].y_value, 5)
 
+  def testSkipsSubjectsWhichAreNotHashes(self):
+    hash_path = filestore_stats.FilestoreStatsCronFlow.HASH_PATH
+    # Neither an untyped subject nor a subject below a hash is a hash object.
+    data_store.DB.Set(hash_path + "/untyped", "aff4:size", 1,
+                      token=self.token)
+    data_store.DB.Set(hash_path + "/fsi1/child",
+                      aff4.AFF4Object.SchemaCls.TYPE.predicate,
+                      "FileStoreImage", token=self.token)
+
+    for _ in test_lib.TestFlowHelper("FilestoreStatsCronFlow",
+                                     token=self.token):
+      pass
+
+    fd = aff4.FACTORY.Open(
+        filestore_stats.FilestoreStatsCronFlow.FILESTORE_STATS_URN,
+        token=self.token)
+    filetypes = fd.Get(fd.Schema.FILESTORE_FILETYPES)
+    self.assertEqual(filetypes.data[0].y_value, 12)
+
+  def testFallsBackToHashIndex(self):
+    def ScanSubjects(*unused_args, **unused_kwargs):
+      raise NotImplementedError()
+
+    with utils.Stubber(data_store.DB, "ScanSubjects", ScanSubjects):
+      for _ in test_lib.TestFlowHelper("FilestoreStatsCronFlow",
+                                       token=self.token):
+        pass
+
+    fd = aff4.FACTORY.Open(
+        filestore_stats.FilestoreStatsCronFlow.FILESTORE_STATS_URN,
+        token=self.token)
+    filetypes = fd.Get(fd.Schema.FILESTORE_FILETYPES)
+    self.assertEqual(filetypes.data[0].y_value, 12)
+
+  def testInterruptedRunResumesFromCheckpoint(self):
+    config_lib.CONFIG.Set("Cron.enabled_system_jobs",
+                          ["FilestoreStatsCronFlow"])
+    cronjobs.ScheduleSystemCronFlows(token=self.token)
+
+    processed_urns = []
+
+    def FailingProcessFile(consumer, fd, columns):
+      processed_urns.append(fd.urn)
+      if len(processed_urns) == 6:
+        raise RuntimeError("Worker died.")
+      FailingProcessFile.old_target(consumer, fd, columns)
+
+    flow_cls = filestore_stats.FilestoreStatsCronFlow
+    with utils.MultiStubber(
+        (flow_cls, "OPEN_FILES_LIMIT", 2),
+        (flow_cls, "CHECKPOINT_INTERVAL", 1),
+        (filestore_stats.ClassCounter, "ProcessFile", FailingProcessFile)):
+      self.assertRaises(RuntimeError, flow.GRRFlow.StartFlow,
+                        flow_name="FilestoreStatsCronFlow", token=self.token)
+
+    with utils.Stubber(flow_cls, "OPEN_FILES_LIMIT", 2):
+      flow.GRRFlow.StartFlow(flow_name="FilestoreStatsCronFlow",
+                             token=self.token)
+
+    # Files from the checkpointed batches are not counted twice.
+    fd = aff4.FACTORY.Open(flow_cls.FILESTORE_STATS_URN, token=self.token)
+    filetypes = fd.Get(fd.Schema.FILESTORE_FILETYPES)
+    self.assertEqual(filetypes.data[0].y_value, 12)
+    clientcount = fd.Get(fd.Schema.FILESTORE_CLIENTCOUNT_HISTOGRAM)
+    self.assertEqual(clientcount.data[1].y_value, 6)
+
 
 def main(argv):
   # Run the full test suite
@@ -17,6 +17,7 @@ from grr.lib import flow
 from grr.lib import flow_runner
 from grr.lib import hunts
 from grr.lib import rdfvalue
+from grr.lib import registry
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import cronjobs
@@ -89,84 +90,58 @@ class _ActiveCounter(object):
       fds_by_label[label].AddAttribute(histogram)
 
 
-class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
-  """A cron job which opens every client in the system.
+class ClientStatsCollector(object):
+  """Base class for statistics computed over the whole client fleet.
 
-  We feed all the client objects to the AbstractClientStatsCollector instances.
-  """
-
-  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+  Collectors are fed by the ClientFleetScanner. Every collector declares the
+  client attributes it reads in ATTRIBUTES, and the scanner only fetches the
+  union of the attributes of the collectors being run. Collectors must
+  therefore not Get() anything they have not declared.
 
-  def BeginProcessing(self):
-    pass
-
-  def ProcessClient(self, client):
-    raise NotImplementedError()
-
-  def FinishProcessing(self):
-    pass
+  Collectors are kept in the cron job state between checkpoints, so they must
+  be picklable.
+  """
 
-  def GetClientLabelsList(self, client):
-    """Get set of labels applied to this client."""
-    client_labels = [aff4_grr.ALL_CLIENTS_LABEL]
-    label_set = client.GetLabelsNames(owner="GRR")
-    client_labels.extend(label_set)
-    return client_labels
+  __metaclass__ = registry.MetaclassRegistry
+  __abstract = True  # pylint: disable=g-bad-name
 
-  @flow.StateHandler()
-  def Start(self):
-    """Retrieve all the clients for the AbstractClientStatsCollectors."""
-    try:
+  # Client attributes read by ProcessClient().
+  ATTRIBUTES = []
 
-      # Get a list of all the client labels in the db
-      self.labels = aff4_grr.GetAllClientLabels(self.token,
-                                                include_catchall=True)
-      self.stats = {}
-      for label in self.labels:
-        self.stats[label] = aff4.FACTORY.Create(
-            self.CLIENT_STATS_URN.Add(label), "ClientFleetStats",
-            mode="w", token=self.token)
-
-      self.BeginProcessing()
-
-      root = aff4.FACTORY.Open(aff4.ROOT_URN, token=self.token)
-      children_urns = list(root.ListChildren())
-      logging.debug("Found %d children.", len(children_urns))
+  def __init__(self, labels):
+    """Constructor.
 
-      processed_count = 0
-      for child in aff4.FACTORY.MultiOpen(
-          children_urns, mode="r", token=self.token, age=aff4.NEWEST_TIME):
-        if isinstance(child, aff4.AFF4Object.VFSGRRClient):
-          self.ProcessClient(child)
-          processed_count += 1
+    Args:
+      labels: The set of client labels the statistics are calculated for.
+    """
+    self.labels = labels
 
-        # This flow is not dead: we don't want to run out of lease time.
-        self.HeartBeat()
+  def ProcessClient(self, client, client_labels):
+    """Accounts for a single client.
 
-      self.FinishProcessing()
-      for fd in self.stats.values():
-        fd.Close()
+    Args:
+      client: A VFSGRRClient object holding only the requested attributes.
+      client_labels: The list of labels this client should be counted in.
+    """
+    raise NotImplementedError()
 
-      logging.info("%s: processed %d clients.", self.__class__.__name__,
-                   processed_count)
-    except Exception as e:  # pylint: disable=broad-except
-      logging.exception("Error while calculating stats: %s", e)
-      raise
+  def Save(self, fds_by_label):
+    """Writes the statistics into the ClientFleetStats objects by label."""
+    raise NotImplementedError()
 
 
-class GRRVersionBreakDown(AbstractClientStatsCronFlow):
+class GRRVersionCollector(ClientStatsCollector):
   """Records relative ratios of GRR versions in 7 day actives."""
 
-  frequency = rdfvalue.Duration("4h")
+  ATTRIBUTES = [aff4_grr.VFSGRRClient.SchemaCls.PING,
+                aff4_grr.VFSGRRClient.SchemaCls.CLIENT_INFO]
 
-  def BeginProcessing(self):
+  def __init__(self, labels):
+    super(GRRVersionCollector, self).__init__(labels)
     self.counter = _ActiveCounter(
-        aff4.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
-
-  def FinishProcessing(self):
-    self.counter.Save(self.stats)
+        stats_aff4.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
 
-  def ProcessClient(self, client):
+  def ProcessClient(self, client, client_labels):
     ping = client.Get(client.Schema.PING)
     c_info = client.Get(client.Schema.CLIENT_INFO)
 
@@ -174,25 +149,29 @@ class GRRVersionBreakDown(AbstractClientStatsCronFlow):
       category = " ".join([c_info.client_description or c_info.client_name,
                            str(c_info.client_version)])
 
-      for label in self.GetClientLabelsList(client):
+      for label in client_labels:
         self.counter.Add(category, label, ping)
 
+  def Save(self, fds_by_label):
+    self.counter.Save(fds_by_label)
+
 
-class OSBreakDown(AbstractClientStatsCronFlow):
+class OSCollector(ClientStatsCollector):
   """Records relative ratios of OS versions in 7 day actives."""
 
-  def BeginProcessing(self):
+  ATTRIBUTES = [aff4_grr.VFSGRRClient.SchemaCls.PING,
+                aff4_grr.VFSGRRClient.SchemaCls.SYSTEM,
+                aff4_grr.VFSGRRClient.SchemaCls.UNAME]
+
+  def __init__(self, labels):
+    super(OSCollector, self).__init__(labels)
     self.counters = [
-        _ActiveCounter(aff4.ClientFleetStats.SchemaCls.OS_HISTOGRAM),
-        _ActiveCounter(aff4.ClientFleetStats.SchemaCls.RELEASE_HISTOGRAM),
+        _ActiveCounter(stats_aff4.ClientFleetStats.SchemaCls.OS_HISTOGRAM),
+        _ActiveCounter(
+            stats_aff4.ClientFleetStats.SchemaCls.RELEASE_HISTOGRAM),
     ]
 
-  def FinishProcessing(self):
-    # Write all the counter attributes.
-    for counter in self.counters:
-      counter.Save(self.stats)
-
-  def ProcessClient(self, client):
+  def ProcessClient(self, client, client_labels):
     """Update counters for system, version and release attributes."""
     ping = client.Get(client.Schema.PING)
     if not ping:
@@ -200,7 +179,7 @@ class OSBreakDown(AbstractClientStatsCronFlow):
     system = client.Get(client.Schema.SYSTEM, "Unknown")
     uname = client.Get(client.Schema.UNAME, "Unknown")
 
-    for label in self.GetClientLabelsList(client):
+    for label in client_labels:
       # Windows, Linux, Darwin
       self.counters[0].Add(system, label, ping)
 
@@ -208,47 +187,257 @@ class OSBreakDown(AbstractClientStatsCronFlow):
       # Darwin-OSX-10.9.3
       self.counters[1].Add(uname, label, ping)
 
+  def Save(self, fds_by_label):
+    # Write all the counter attributes.
+    for counter in self.counters:
+      counter.Save(fds_by_label)
+
 
-class LastAccessStats(AbstractClientStatsCronFlow):
+class LastAccessCollector(ClientStatsCollector):
   """Calculates a histogram statistics of clients last contacted times."""
 
-  # The number of clients fall into these bins (number of hours ago)
+  ATTRIBUTES = [aff4_grr.VFSGRRClient.SchemaCls.PING]
+
+  # The number of clients fall into these bins (number of days ago)
   _bins = [1, 2, 3, 7, 14, 30, 60]
 
-  def BeginProcessing(self):
-    self._bins = [long(x * 1e6 * 24 * 60 * 60) for x in self._bins]
+  def __init__(self, labels):
+    super(LastAccessCollector, self).__init__(labels)
+    self.bins = [long(x * 1e6 * 24 * 60 * 60) for x in self._bins]
 
     self.values = {}
     for label in self.labels:
       # We will count them in this bin
-      self.values[label] = [0] * len(self._bins)
-
-  def FinishProcessing(self):
-    # Build and store the graph now. Day actives are cumulative.
-    for label in self.labels:
-      cumulative_count = 0
-      graph = stats_aff4.ClientFleetStats.SchemaCls.LAST_CONTACTED_HISTOGRAM()
-      for x, y in zip(self._bins, self.values[label]):
-        cumulative_count += y
-        graph.Append(x_value=x, y_value=cumulative_count)
-
-      self.stats[label].AddAttribute(graph)
+      self.values[label] = [0] * len(self.bins)
 
-  def ProcessClient(self, client):
+  def ProcessClient(self, client, client_labels):
     now = rdfvalue.RDFDatetime().Now()
 
     ping = client.Get(client.Schema.PING)
     if ping:
-      for label in self.GetClientLabelsList(client):
+      for label in client_labels:
         time_ago = now - ping
-        pos = bisect.bisect(self._bins, time_ago.microseconds)
+        pos = bisect.bisect(self.bins, time_ago.microseconds)
 
         # If clients are older than the last bin forget them.
         try:
           self.values[label][pos] += 1
-        except IndexError:
+        except (IndexError, KeyError):
           pass
 
+  def Save(self, fds_by_label):
+    # Build and store the graph now. Day actives are cumulative.
+    for label in self.labels:
+      cumulative_count = 0
+      graph = stats_aff4.ClientFleetStats.SchemaCls.LAST_CONTACTED_HISTOGRAM()
+      for x, y in zip(self.bins, self.values[label]):
+        cumulative_count += y
+        graph.Append(x_value=x, y_value=cumulative_count)
+
+      fds_by_label[label].AddAttribute(graph)
+
+
+class ClientFleetScanner(object):
+  """Streams all the clients in the system in batches.
+
+  Instead of opening every client with all its attributes, only the requested
+  attributes are read from the data store, one batch of clients at a time.
+  Clients are returned in URN order so a scan can be resumed from the last
+  client seen.
+  """
+
+  # The clients are found in the directory index of the root object.
+  INDEX_PREFIX = "index:dir/"
+  CLIENT_INDEX_REGEX = INDEX_PREFIX + r"C\.[0-9a-fA-F]{16}"
+
+  def __init__(self, attributes, batch_size=1000, token=None):
+    """Constructor.
+
+    Args:
+      attributes: An iterable of aff4.Attribute to read for each client.
+      batch_size: Number of clients to read from the data store at once.
+      token: The security token to use.
+    """
+    # The type is needed to instantiate the right AFF4 class and labels are
+    # needed for the per label breakdown.
+    predicates = set([aff4.AFF4Object.SchemaCls.TYPE.predicate,
+                      aff4.AFF4Object.SchemaCls.LABELS.predicate])
+    for attribute in attributes:
+      predicates.add(attribute.predicate)
+
+    self.predicates = sorted(predicates)
+    self.batch_size = batch_size
+    self.token = token
+
+  def ListClients(self, after=None):
+    """Yields the client URNs in URN order, optionally after a cursor.
+
+    The root index is read one page of batch_size clients at a time.
+
+    Args:
+      after: If set, only clients with URNs sorting after this one are
+          returned.
+
+    Yields:
+      Client URNs.
+    """
+    cursor = None
+    if after is not None:
+      cursor = self.INDEX_PREFIX + rdfvalue.RDFURN(after).Basename()
+
+    while True:
+      page = data_store.DB.ScanAttributes(
+          aff4.ROOT_URN, self.CLIENT_INDEX_REGEX, after=cursor,
+          limit=self.batch_size, token=self.token)
+
+      for column, _, _ in page:
+        yield aff4.ROOT_URN.Add(column[len(self.INDEX_PREFIX):])
+
+      if len(page) < self.batch_size:
+        break
+
+      cursor = page[-1][0]
+
+  def Scan(self, after=None):
+    """Yields lists of VFSGRRClient objects.
+
+    Args:
+      after: If set, only clients with URNs sorting after this one are
+          returned.
+
+    Yields:
+      Lists of at most batch_size read only client objects, in URN order.
+    """
+    for batch in utils.Grouper(self.ListClients(after=after), self.batch_size):
+      values_by_urn = {}
+      for subject, values in data_store.DB.MultiResolveRegex(
+          batch, self.predicates, token=self.token,
+          timestamp=data_store.DB.NEWEST_TIMESTAMP):
+        # Objects expect their attributes sorted by age, newest first.
+        values.sort(key=lambda x: x[-1], reverse=True)
+        values_by_urn[utils.SmartUnicode(subject)] = values
+
+      clients = []
+      for urn in batch:
+        local_cache = {utils.SmartUnicode(urn): values_by_urn.get(
+            utils.SmartUnicode(urn), [])}
+        client = aff4.FACTORY.Open(urn, mode="r", token=self.token,
+                                   local_cache=local_cache)
+        if isinstance(client, aff4_grr.VFSGRRClient):
+          clients.append(client)
+
+      yield clients
+
+
+class AbstractClientStatsCronFlow(cronjobs.StatefulSystemCronFlow):
+  """A cron job which scans every client in the system.
+
+  All the clients are fed to the ClientStatsCollector instances named in
+  COLLECTORS in a single pass over the fleet. The scan position and the
+  collectors are periodically saved in the cron job state, so an interrupted
+  scan resumes where it stopped on the next run.
+  """
+
+  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+
+  # Names of the ClientStatsCollector classes to run. None runs all of them.
+  COLLECTORS = None
+
+  # Number of clients read from the data store at once.
+  BATCH_SIZE = 1000
+
+  # Save the scan state every this many batches.
+  CHECKPOINT_INTERVAL = 10
+
+  def GetCollectorClasses(self):
+    if self.COLLECTORS is None:
+      return [cls for _, cls in sorted(ClientStatsCollector.classes.items())]
+
+    return [ClientStatsCollector.classes[name] for name in self.COLLECTORS]
+
+  def GetClientLabelsList(self, client):
+    """Get set of labels applied to this client."""
+    client_labels = [aff4_grr.ALL_CLIENTS_LABEL]
+    label_set = client.GetLabelsNames(owner="GRR")
+    client_labels.extend(label_set)
+    return client_labels
+
+  @flow.StateHandler()
+  def Start(self):
+    """Scan all the clients, feeding them to the collectors."""
+    try:
+      checkpoint = self.ReadCheckpoint("fleet_scan")
+      if checkpoint:
+        logging.info("%s: resuming scan after %s (%d clients processed).",
+                     self.__class__.__name__, checkpoint["cursor"],
+                     checkpoint["processed"])
+      else:
+        # Get a list of all the client labels in the db
+        labels = aff4_grr.GetAllClientLabels(self.token,
+                                             include_catchall=True)
+        checkpoint = dict(
+            started=rdfvalue.RDFDatetime().Now(),
+            cursor=None,
+            processed=0,
+            labels=labels,
+            collectors=[cls(labels) for cls in self.GetCollectorClasses()])
+
+      collectors = checkpoint["collectors"]
+      attributes = set()
+      for collector in collectors:
+        attributes.update(collector.ATTRIBUTES)
+
+      scanner = ClientFleetScanner(attributes, batch_size=self.BATCH_SIZE,
+                                   token=self.token)
+
+      for batch_count, clients in enumerate(
+          scanner.Scan(after=checkpoint["cursor"]), 1):
+        for client in clients:
+          client_labels = self.GetClientLabelsList(client)
+          for collector in collectors:
+            collector.ProcessClient(client, client_labels)
+
+        if clients:
+          checkpoint["cursor"] = utils.SmartStr(clients[-1].urn)
+          checkpoint["processed"] += len(clients)
+
+        if batch_count % self.CHECKPOINT_INTERVAL == 0:
+          self.WriteCheckpoint("fleet_scan", checkpoint)
+
+        # This flow is not dead: we don't want to run out of lease time.
+        self.HeartBeat()
+
+      self.stats = {}
+      for label in checkpoint["labels"]:
+        self.stats[label] = aff4.FACTORY.Create(
+            self.CLIENT_STATS_URN.Add(label), "ClientFleetStats",
+            mode="w", token=self.token)
+
+      for collector in collectors:
+        collector.Save(self.stats)
+
+      for fd in self.stats.values():
+        fd.Close()
+
+      # The scan is complete, the next run starts from scratch.
+      self.WriteCheckpoint("fleet_scan", None)
+
+      logging.info("%s: processed %d clients.", self.__class__.__name__,
+                   checkpoint["processed"])
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error while calculating stats: %s", e)
+      raise
+
+
+class ClientFleetStatsCronFlow(AbstractClientStatsCronFlow):
+  """Runs all the client statistics collectors in a single fleet scan.
+
+  This replaces the GRRVersionBreakDown, OSBreakDown and LastAccessStats cron
+  jobs, each of which scanned the whole fleet.
+  """
+
+  frequency = rdfvalue.Duration("4h")
+
 
 class InterrogateClientsCronFlow(cronjobs.SystemCronFlow):
   """A cron job which runs an interrogate hunt on all clients.
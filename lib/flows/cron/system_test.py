@@ -10,6 +10,7 @@ from grr.lib import flags
 from grr.lib import flow
 from grr.lib import test_lib
 from grr.lib import utils
+from grr.lib.aff4_objects import cronjobs
 from grr.lib.flows.cron import system
 from grr.lib.flows.general import endtoend as endtoend_flows
 from grr.lib.flows.general import endtoend_test
@@ -65,14 +66,15 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
     self.assertEqual(histogram[3][0].label, "GRR Monitor 1")
     self.assertEqual(histogram[3][0].y_value, counts[3])
 
-  def testGRRVersionBreakDown(self):
-    """Check that all client stats cron jobs are run.
+  def testGRRVersionStats(self):
+    """Check the GRR version stats of the fleet scan.
 
     All machines should be in All once.
     Windows machines should be in Label1 and Label2.
     There should be no stats for UserLabel.
     """
-    for _ in test_lib.TestFlowHelper("GRRVersionBreakDown", token=self.token):
+    for _ in test_lib.TestFlowHelper("ClientFleetStatsCronFlow",
+                                     token=self.token):
       pass
 
     histogram = aff4.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM
@@ -116,9 +118,10 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
       self.assertEqual(item.y_value, counts[3][item.label])
     self.assertItemsEqual(all_labels, counts[3].keys())
 
-  def testOSBreakdown(self):
-    """Check that all client stats cron jobs are run."""
-    for _ in test_lib.TestFlowHelper("OSBreakDown", token=self.token):
+  def testOSStats(self):
+    """Check the OS stats of the fleet scan."""
+    for _ in test_lib.TestFlowHelper("ClientFleetStatsCronFlow",
+                                     token=self.token):
       pass
 
     histogram = aff4.ClientFleetStats.SchemaCls.OS_HISTOGRAM
@@ -148,8 +151,9 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
         (5184000000000L, count)])
 
   def testLastAccessStats(self):
-    """Check that all client stats cron jobs are run."""
-    for _ in test_lib.TestFlowHelper("LastAccessStats", token=self.token):
+    """Check the last access stats of the fleet scan."""
+    for _ in test_lib.TestFlowHelper("ClientFleetStatsCronFlow",
+                                     token=self.token):
       pass
 
     # All our clients appeared at the same time (and did not appear since).
@@ -161,6 +165,52 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
     # All our clients appeared at the same time but this label is only half.
     self._CheckAccessStats("Label2", count=10L)
 
+  def testClientFleetStatsRunsAllCollectors(self):
+    """Check that a single fleet scan produces all the client stats."""
+    for _ in test_lib.TestFlowHelper("ClientFleetStatsCronFlow",
+                                     token=self.token):
+      pass
+
+    histogram = aff4.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM
+    self._CheckVersionStats("All", histogram, [0, 0, 20, 20])
+    self._CheckVersionStats("Label1", histogram, [0, 0, 10, 10])
+
+    histogram = aff4.ClientFleetStats.SchemaCls.OS_HISTOGRAM
+    self._CheckOSStats("All", histogram, [0, 0, {"Linux": 10, "Windows": 10},
+                                          {"Linux": 10, "Windows": 10}])
+
+    self._CheckAccessStats("All", count=20L)
+    self._CheckAccessStats("Label1", count=10L)
+
+  def testClientFleetStatsResumesFromCheckpoint(self):
+    config_lib.CONFIG.Set("Cron.enabled_system_jobs",
+                          ["ClientFleetStatsCronFlow"])
+    cronjobs.ScheduleSystemCronFlows(token=self.token)
+
+    processed_urns = []
+
+    def FailingProcessClient(collector, client, client_labels):
+      processed_urns.append(client.urn)
+      if len(processed_urns) == 12:
+        raise RuntimeError("Worker died.")
+      FailingProcessClient.old_target(collector, client, client_labels)
+
+    with utils.MultiStubber(
+        (system.ClientFleetStatsCronFlow, "BATCH_SIZE", 5),
+        (system.ClientFleetStatsCronFlow, "CHECKPOINT_INTERVAL", 1),
+        (system.LastAccessCollector, "ProcessClient", FailingProcessClient)):
+      self.assertRaises(RuntimeError, flow.GRRFlow.StartFlow,
+                        flow_name="ClientFleetStatsCronFlow",
+                        token=self.token)
+
+    with utils.Stubber(system.ClientFleetStatsCronFlow, "BATCH_SIZE", 5):
+      flow.GRRFlow.StartFlow(flow_name="ClientFleetStatsCronFlow",
+                             token=self.token)
+
+    # Clients from the checkpointed batches are not counted twice.
+    self._CheckAccessStats("All", count=20L)
+    self._CheckAccessStats("Label1", count=10L)
+
   def testPurgeClientStats(self):
     max_age = system.PurgeClientStats.MAX_AGE
 
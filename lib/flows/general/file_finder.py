@@ -12,53 +12,27 @@ from grr.lib.flows.general import filesystem
 from grr.lib.flows.general import fingerprint
 from grr.lib.flows.general import transfer
 from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import file_finder as rdf_file_finder
 from grr.lib.rdfvalues import paths as rdf_paths
-from grr.lib.rdfvalues import structs as rdf_structs
-from grr.proto import flows_pb2
 
 
-class FileFinderModificationTimeCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderModificationTimeCondition
-
-
-class FileFinderAccessTimeCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderAccessTimeCondition
-
-
-class FileFinderInodeChangeTimeCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderInodeChangeTimeCondition
-
-
-class FileFinderSizeCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderSizeCondition
-
-
-class FileFinderContentsRegexMatchCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderContentsRegexMatchCondition
-
-
-class FileFinderContentsLiteralMatchCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderContentsLiteralMatchCondition
-
-
-class FileFinderCondition(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderCondition
-
-
-class FileFinderDownloadActionOptions(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderDownloadActionOptions
-
-
-class FileFinderAction(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderAction
-
-
-class FileFinderArgs(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderArgs
-
-
-class FileFinderResult(rdf_structs.RDFProtoStruct):
-  protobuf = flows_pb2.FileFinderResult
+# The FileFinder rdfvalues are shared with the FileFinderOS client action.
+FileFinderModificationTimeCondition = (
+    rdf_file_finder.FileFinderModificationTimeCondition)
+FileFinderAccessTimeCondition = rdf_file_finder.FileFinderAccessTimeCondition
+FileFinderInodeChangeTimeCondition = (
+    rdf_file_finder.FileFinderInodeChangeTimeCondition)
+FileFinderSizeCondition = rdf_file_finder.FileFinderSizeCondition
+FileFinderContentsRegexMatchCondition = (
+    rdf_file_finder.FileFinderContentsRegexMatchCondition)
+FileFinderContentsLiteralMatchCondition = (
+    rdf_file_finder.FileFinderContentsLiteralMatchCondition)
+FileFinderCondition = rdf_file_finder.FileFinderCondition
+FileFinderDownloadActionOptions = (
+    rdf_file_finder.FileFinderDownloadActionOptions)
+FileFinderAction = rdf_file_finder.FileFinderAction
+FileFinderArgs = rdf_file_finder.FileFinderArgs
+FileFinderResult = rdf_file_finder.FileFinderResult
 
 
 class FileFinder(transfer.MultiGetFileMixin,
@@ -141,10 +115,71 @@ class FileFinder(transfer.MultiGetFileMixin,
         self.ApplyCondition(FileFinderResult(stat_entry=stat_entry),
                             condition_index=0)
 
+    elif self.args.pathtype == rdf_paths.PathSpec.PathType.OS:
+      # The client globs and applies all the conditions itself, only the
+      # matching files come back.
+      client = aff4.FACTORY.Open(self.client_id, token=self.token)
+
+      paths = []
+      for path in self.args.paths:
+        paths.extend(path.Interpolate(client=client))
+
+      request = self.args.Copy()
+      request.paths = paths
+      request.conditions = self.state.sorted_conditions
+
+      self.CallClient("FileFinderOS", request,
+                      next_state="ProcessFileFinderResults")
+
     else:
       self.GlobForPaths(self.args.paths, pathtype=self.args.pathtype,
                         no_file_type_check=self.args.no_file_type_check)
 
+  @flow.StateHandler()
+  def ProcessFileFinderResults(self, responses):
+    """Acts on the files that matched all the conditions on the client."""
+    if not responses.success:
+      if not responses:
+        # Old clients don't have the FileFinderOS action, do it the slow way.
+        self.Log("FileFinderOS failed (%s), globbing from the server.",
+                 responses.status)
+        self.GlobForPaths(self.args.paths, pathtype=self.args.pathtype,
+                          no_file_type_check=self.args.no_file_type_check)
+        return
+
+      raise flow.FlowError("FileFinderOS failed: %s" % responses.status)
+
+    for response in responses:
+      filesystem.CreateAFF4Object(response.stat_entry, self.client_id,
+                                  self.token)
+      self.ProcessClientAction(response)
+
+  def ProcessClientAction(self, response):
+    """Completes the action for a result the client already hashed."""
+    self.state.files_found += 1
+    action = self.state.args.action.action_type
+
+    if action == FileFinderAction.Action.STAT:
+      self.SendReply(response)
+
+    elif (action == FileFinderAction.Action.DOWNLOAD and
+          response.stat_entry.st_size <= self.args.action.download.max_size):
+      self.StartFileFetchWithHash(response.stat_entry, response.hash_entry,
+                                  request_data=dict(original_result=response))
+
+    else:
+      if action == FileFinderAction.Action.DOWNLOAD:
+        self.Log("%s too large to fetch. Size=%d",
+                 response.stat_entry.pathspec.CollapsePath(),
+                 response.stat_entry.st_size)
+
+      fd = aff4.FACTORY.Create(response.stat_entry.aff4path, "VFSFile",
+                               mode="w", token=self.token)
+      fd.Set(fd.Schema.HASH, response.hash_entry)
+      fd.Close(sync=False)
+
+      self.SendReply(response)
+
   def GlobReportMatch(self, response):
     """This method is called by the glob mixin when there is a match."""
     super(FileFinder, self).GlobReportMatch(response)
@@ -534,6 +534,47 @@ class TestFileFinderFlow(test_lib.FlowTestsBaseclass):
           expected_files=expected_files,
           non_expected_files=non_expected_files)
 
+  def testEvaluatesConditionsOnTheClient(self):
+    # Neither Find nor Grep are available, everything has to be done by the
+    # FileFinderOS client action.
+    self.client_mock = action_mocks.ActionMock(
+        "FileFinderOS", "TransferBuffer", "HashBuffer")
+
+    literal_condition = file_finder.FileFinderCondition(
+        condition_type=
+        file_finder.FileFinderCondition.Type.CONTENTS_LITERAL_MATCH,
+        contents_literal_match=
+        file_finder.FileFinderContentsLiteralMatchCondition(
+            literal="session opened for user dearjohn"))
+
+    actions = sorted(file_finder.FileFinderAction.Action.enum_dict.values())
+    for action in actions:
+      aff4.FACTORY.Delete(self.FileNameToURN("auth.log"), token=self.token)
+
+      results = self.RunFlow(conditions=[literal_condition], action=action)
+      self.CheckReplies(results, action, ["auth.log"])
+      self.CheckFilesInCollection(["auth.log"])
+
+      fd = aff4.FACTORY.Open(self.client_id.Add(self.output_path),
+                             aff4_type="RDFValueCollection",
+                             token=self.token)
+      self.assertEqual(len(fd[0].matches), 1)
+      self.assertEqual(fd[0].matches[0].offset, 350)
+
+      if action == file_finder.FileFinderAction.Action.DOWNLOAD:
+        self.CheckFilesDownloaded(["auth.log"])
+      else:
+        self.CheckFilesNotDownloaded(["auth.log"])
+
+      if action == file_finder.FileFinderAction.Action.HASH:
+        fd = aff4.FACTORY.Open(self.FileNameToURN("auth.log"),
+                               token=self.token)
+        self.assertEqual(str(fd.Get(fd.Schema.HASH).sha1),
+                         "67b8fc07bd4b6efc3b2dce322e8ddf609b540805")
+
+    self.assertEqual(self.client_mock.action_counts["FileFinderOS"],
+                     len(actions))
+
   def testTreatsGlobsAsPathsWhenMemoryPathTypeIsUsed(self):
     # No need to setup VFS handlers as we're not actually looking at the files,
     # as there's no condition/action specified.
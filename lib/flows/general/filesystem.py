@@ -1,13 +1,13 @@
 #!/usr/bin/env python
 """These are filesystem related flows."""
 
-import fnmatch
 import re
 import stat
 
 from grr.lib import aff4
 from grr.lib import artifact_lib
 from grr.lib import flow
+from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 # pylint: disable=unused-import
 from grr.lib.flows.general import transfer
@@ -180,13 +180,24 @@ class RecursiveListDirectoryArgs(rdf_structs.RDFProtoStruct):
 
 
 class RecursiveListDirectory(flow.GRRFlow):
-  """Recursively list directory on the client."""
+  """Recursively list directory on the client.
+
+  The client walks the tree and sends the entries back in batches, a limited
+  number per iteration. Every iteration carries the cursor of the walk, so if
+  the client restarts the walk resumes from the last iteration. A listing
+  which did not complete can be resumed by starting the flow with the last
+  cursor it got. Clients which do not support the RecursiveListDirectory
+  action are walked one directory at a time.
+  """
 
   category = "/Filesystem/"
 
   args_type = RecursiveListDirectoryArgs
 
-  @flow.StateHandler(next_state="ProcessDirectory")
+  # Maximum number of entries the client sends in an iteration.
+  ENTRIES_PER_ITERATION = 5000
+
+  @flow.StateHandler(next_state=["ProcessEntries", "ProcessDirectory"])
   def Start(self):
     """List the initial directory."""
     # The first directory we listed.
@@ -195,8 +206,51 @@ class RecursiveListDirectory(flow.GRRFlow):
     self.state.Register("dir_count", 0)
     self.state.Register("file_count", 0)
 
-    self.CallClient("ListDirectory", pathspec=self.state.args.pathspec,
-                    next_state="ProcessDirectory")
+    request = rdf_client.RecursiveListDirRequest(
+        pathspec=self.state.args.pathspec, max_depth=self.state.args.max_depth)
+    if self.state.args.HasField("cursor"):
+      request.iterator = self.state.args.cursor
+    request.iterator.number = self.ENTRIES_PER_ITERATION
+    self.state.Register("request", request)
+
+    self.CallClient("RecursiveListDirectory", request,
+                    next_state="ProcessEntries")
+
+  @flow.StateHandler(next_state=["ProcessEntries", "ProcessDirectory"])
+  def ProcessEntries(self, responses):
+    """Stores a batch of entries and continues the walk."""
+    if not responses.success and not responses:
+      if not self.state.file_count:
+        # The client does not support the action, or the directory can not be
+        # listed - in which case ListDirectory fails as well.
+        self.CallClient("ListDirectory", pathspec=self.state.args.pathspec,
+                        next_state="ProcessDirectory")
+        return
+
+      raise flow.FlowError(str(responses.status))
+
+    stat_entries = []
+    for batch in responses:
+      stat_entries.extend(batch.entries)
+    self.StoreDirectory(stat_entries)
+
+    self.state.file_count += len(stat_entries)
+    self.state.dir_count += len([s for s in stat_entries
+                                 if stat.S_ISDIR(s.st_mode)])
+
+    if not responses.success:
+      raise flow.FlowError(str(responses.status))
+
+    # Keep the cursor in the state so an interrupted listing can be resumed.
+    self.state.request.iterator = responses.iterator
+    if responses.iterator.state == rdf_client.Iterator.State.FINISHED:
+      return
+
+    self.Status("Listing %s. (%d nodes, %d directories done)",
+                self.state.args.pathspec.CollapsePath(),
+                self.state.file_count, self.state.dir_count)
+    self.CallClient("RecursiveListDirectory", self.state.request,
+                    next_state="ProcessEntries")
 
   @flow.StateHandler(next_state="ProcessDirectory")
   def ProcessDirectory(self, responses):
@@ -213,6 +267,7 @@ class RecursiveListDirectory(flow.GRRFlow):
           directory_pathspec, self.client_id)
 
       self.StoreDirectory(responses)
+      self.state.file_count += len(responses)
 
       # If the urn is too deep we quit to prevent recursion errors.
       if self.state.first_directory is None:
@@ -238,14 +293,13 @@ class RecursiveListDirectory(flow.GRRFlow):
                         urn.RelativeName(self.state.first_directory),
                         self.state.file_count, self.state.dir_count)
 
-      self.state.file_count += len(responses)
-
   def StoreDirectory(self, responses):
     """Stores all stat responses."""
-    for st in responses:
-      st = rdf_client.StatEntry(st)
-      CreateAFF4Object(st, self.client_id, self.token)
-      self.SendReply(st)  # Send Stats to parent flows.
+    with aff4.WriteBatch():
+      for st in responses:
+        st = rdf_client.StatEntry(st)
+        CreateAFF4Object(st, self.client_id, self.token)
+        self.SendReply(st)  # Send Stats to parent flows.
 
   @flow.StateHandler()
   def End(self):
@@ -509,6 +563,125 @@ class GlobArgs(rdf_structs.RDFProtoStruct):
     self.paths.Validate()
 
 
+class GlobPlan(object):
+  """A set of glob expressions compiled into a component tree.
+
+  Every flow and hunt globbing for the same paths shares the same plan, so
+  the expressions are only parsed and converted into components once per
+  worker. Only the knowledge base interpolation depends on the client, and
+  the resulting component tree is memoised by the values of the knowledge
+  base attributes the expressions use.
+  """
+
+  # The number of plans, and of component trees per plan, which are kept.
+  MAX_CACHED = 100
+
+  # The number of interpolated patterns whose components are kept per plan.
+  MAX_CACHED_PATTERNS = 10000
+
+  _plans = utils.FastStore(max_size=MAX_CACHED)
+
+  @classmethod
+  def Get(cls, paths, pathtype):
+    """Returns the plan for a list of GlobExpressions."""
+    key = (tuple(sorted(set(utils.SmartUnicode(path) for path in paths))),
+           utils.SmartStr(pathtype))
+    try:
+      return cls._plans.Get(key)
+    except KeyError:
+      plan = cls(key[0], pathtype)
+      cls._plans.Put(key, plan)
+      return plan
+
+  def __init__(self, paths, pathtype):
+    self.paths = [rdf_paths.GlobExpression(path) for path in paths]
+    self.pathtype = pathtype
+
+    # The knowledge base attributes interpolated in the paths.
+    self.attributes = sorted(set(
+        match.group(1) for path in paths
+        for match in artifact_lib.INTERPOLATED_REGEX.finditer(path)))
+
+    self._trees = utils.FastStore(max_size=self.MAX_CACHED)
+    self._components = utils.FastStore(max_size=self.MAX_CACHED_PATTERNS)
+
+  def _GetKnowledgeBaseValues(self, client):
+    """Returns the values of the attributes, None if one is missing."""
+    knowledge_base = client.Get(client.Schema.KNOWLEDGE_BASE)
+    if not knowledge_base:
+      # The paths are interpolated from the client attributes instead, unless
+      # they do not interpolate anything.
+      return () if not self.attributes else None
+
+    values = []
+    for attribute in self.attributes:
+      try:
+        values.append(frozenset(artifact_lib.GetKbAttributeValues(
+            attribute, knowledge_base)))
+      except AttributeError:
+        return None
+
+    return tuple(values)
+
+  def _GetComponents(self, pattern):
+    """Returns the serialized pathspec components of a pattern."""
+    try:
+      return self._components.Get(pattern)
+    except KeyError:
+      components = [
+          component.SerializeToString() for component in
+          rdf_paths.GlobExpression(pattern).AsPathComponents(self.pathtype)]
+      self._components.Put(pattern, components)
+      return components
+
+  def ComponentTree(self, client):
+    """Returns the component tree of the paths for a client.
+
+    Duplicated components are merged so we do not reissue the same client
+    requests for them. For example, the patterns
+    '/home/%%Usernames%%*' -> {'/home/': {
+         'syslog.*\\Z(?ms)': {}, 'test.*\\Z(?ms)': {}}}
+
+    The tree is shared with the other clients and must not be modified.
+
+    Args:
+      client: The client VFSGRRClient object we interpolate the paths for.
+
+    Returns:
+      The component tree, nested dicts keyed by serialized pathspecs.
+    """
+    values = self._GetKnowledgeBaseValues(client)
+    if values is not None:
+      try:
+        return self._trees.Get(values)
+      except KeyError:
+        pass
+
+    tree = {}
+    for path in self.paths:
+      # Transform the patterns by substitution of client attributes. When the
+      # client has multiple values for an attribute, this generates multiple
+      # copies of the pattern, one for each variation. e.g.:
+      # /home/%%Usernames%%/* -> [ /home/user1/*, /home/user2/* ]
+      for pattern in path.Interpolate(client=client):
+        node = tree
+        for component in self._GetComponents(pattern):
+          node = node.setdefault(component, {})
+
+    # Trees interpolated from client attributes are not cached since those
+    # attributes are not part of the key.
+    if values is not None:
+      self._trees.Put(values, tree)
+
+    return tree
+
+
+def _MergeComponentTree(tree, other):
+  """Merges a copy of the other component tree into tree."""
+  for component, node in other.iteritems():
+    _MergeComponentTree(tree.setdefault(component, {}), node)
+
+
 class GlobMixin(object):
   """A MixIn to implement the glob functionality."""
 
@@ -529,8 +702,6 @@ class GlobMixin(object):
       no_file_type_check: Work with all kinds of files - not only with regular
                           ones.
     """
-    patterns = []
-
     if not paths:
       # Nothing to do.
       return
@@ -541,29 +712,9 @@ class GlobMixin(object):
     self.state.Register("root_path", root_path)
     self.state.Register("no_file_type_check", no_file_type_check)
 
-    # Transform the patterns by substitution of client attributes. When the
-    # client has multiple values for an attribute, this generates multiple
-    # copies of the pattern, one for each variation. e.g.:
-    # /home/%%Usernames%%/* -> [ /home/user1/*, /home/user2/* ]
-    for path in paths:
-      patterns.extend(path.Interpolate(client=client))
-
-    # Expand each glob pattern into a list of components. A component is either
-    # a wildcard or a literal component.
-    # e.g. /usr/lib/*.exe -> ['/usr/lib', '.*.exe']
-
-    # We build a tree for each component such that duplicated components are
-    # merged. We do not need to reissue the same client requests for the same
-    # components. For example, the patterns:
-    # '/home/%%Usernames%%*' -> {'/home/': {
-    #      'syslog.*\\Z(?ms)': {}, 'test.*\\Z(?ms)': {}}}
-    # Note: The component tree contains serialized pathspecs in dicts.
-    for pattern in patterns:
-      # The root node.
-      node = self.state.component_tree
-
-      for component in self.ConvertGlobIntoPathComponents(pattern):
-        node = node.setdefault(component.SerializeToString(), {})
+    # The plan is shared so the state gets its own copy of the tree.
+    plan = GlobPlan.Get(paths, pathtype)
+    _MergeComponentTree(self.state.component_tree, plan.ComponentTree(client))
 
     root_path = self.state.component_tree.keys()[0]
     self.CallStateInline(messages=[None], next_state="ProcessEntry",
@@ -574,73 +725,9 @@ class GlobMixin(object):
     # By default write the stat_response to the AFF4 VFS.
     CreateAFF4Object(stat_response, self.client_id, self.token)
 
-  # A regex indicating if there are shell globs in this path.
-  GLOB_MAGIC_CHECK = re.compile("[*?[]")
-
   # Maximum number of files to inspect in a single directory
   FILE_MAX_PER_DIR = 100000
 
-  def ConvertGlobIntoPathComponents(self, pattern):
-    """Converts a glob pattern into a list of pathspec components.
-
-    Wildcards are also converted to regular expressions. The pathspec components
-    do not span directories, and are marked as a regex or a literal component.
-
-    We also support recursion into directories using the ** notation.  For
-    example, /home/**2/foo.txt will find all files named foo.txt recursed 2
-    directories deep. If the directory depth is omitted, it defaults to 3.
-
-    Example:
-     /home/test/* -> ['home', 'test', '.*\\Z(?ms)']
-
-    Args:
-      pattern: A glob expression with wildcards.
-
-    Returns:
-      A list of PathSpec instances for each component.
-
-    Raises:
-      ValueError: If the glob is invalid.
-    """
-
-    components = []
-    for path_component in pattern.split("/"):
-      # A ** in the path component means recurse into directories that match the
-      # pattern.
-      m = rdf_paths.GlobExpression.RECURSION_REGEX.search(path_component)
-      if m:
-        path_component = path_component.replace(m.group(0), "*")
-
-        component = rdf_paths.PathSpec(
-            path=fnmatch.translate(path_component),
-            pathtype=self.state.pathtype,
-            path_options=rdf_paths.PathSpec.Options.RECURSIVE)
-
-        # Allow the user to override the recursion depth.
-        if m.group(1):
-          component.recursion_depth = int(m.group(1))
-
-      elif self.GLOB_MAGIC_CHECK.search(path_component):
-        component = rdf_paths.PathSpec(
-            path=fnmatch.translate(path_component),
-            pathtype=self.state.pathtype,
-            path_options=rdf_paths.PathSpec.Options.REGEX)
-      else:
-        pathtype = self.state.pathtype
-        # TODO(user): This is a backwards compatibility hack. Remove when
-        # all clients reach 3.0.0.2.
-        if (pathtype == rdf_paths.PathSpec.PathType.TSK and
-            re.match("^.:$", path_component)):
-          path_component = "%s\\" % path_component
-        component = rdf_paths.PathSpec(
-            path=path_component,
-            pathtype=pathtype,
-            path_options=rdf_paths.PathSpec.Options.CASE_INSENSITIVE)
-
-      components.append(component)
-
-    return components
-
   @flow.StateHandler()
   def Start(self, **_):
     super(GlobMixin, self).Start()
@@ -714,11 +801,11 @@ class GlobMixin(object):
       # This is a combined match.
       base_path = responses.request_data["base_path"]
       base_node = self.FindNode(base_path)
+      next_nodes = [(next_node, rdf_paths.PathSpec(next_node))
+                    for next_node in base_node]
       for response in stat_responses:
         matching_components = []
-        for next_node in base_node.keys():
-          pathspec = rdf_paths.PathSpec(next_node)
-
+        for next_node, pathspec in next_nodes:
           if self._MatchPath(pathspec, response):
             matching_path = base_path + [next_node]
             matching_components.append(matching_path)
@@ -99,6 +99,44 @@ class TestFilesystem(test_lib.FlowTestsBaseclass):
     self.assertEqual(
         os.path.basename(utils.SmartUnicode(child.urn)), u"入乡随俗.txt")
 
+  def testRecursiveListDirectory(self):
+    """Test the client side walk and the fallback for old clients."""
+    for i, client_mock in enumerate([
+        action_mocks.ActionMock("RecursiveListDirectory"),
+        action_mocks.ActionMock("ListDirectory")]):
+      root = os.path.join(self.temp_dir, str(i))
+      for path in ["a/b/c/deep.txt", "a/b/b.txt", "top.txt"]:
+        path = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+          os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fd:
+          fd.write("data")
+
+      pathspec = rdf_paths.PathSpec(path=root,
+                                    pathtype=rdf_paths.PathSpec.PathType.OS)
+
+      # Force a few iterations.
+      with utils.Stubber(filesystem.RecursiveListDirectory,
+                         "ENTRIES_PER_ITERATION", 2):
+        for session_id in test_lib.TestFlowHelper(
+            "RecursiveListDirectory", client_mock, client_id=self.client_id,
+            pathspec=pathspec, max_depth=2, token=self.token):
+          pass
+
+      urn = aff4.AFF4Object.VFSGRRClient.PathspecToURN(pathspec,
+                                                       self.client_id)
+      children = []
+      for _, subject_children in aff4.FACTORY.RecursiveMultiListChildren(
+          [urn], token=self.token):
+        children.extend(child.RelativeName(urn) for child in subject_children)
+
+      # The contents of a/b/c are too deep to be listed.
+      self.assertItemsEqual(children,
+                            ["a", "a/b", "a/b/b.txt", "a/b/c", "top.txt"])
+
+      flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+      self.assertEqual(flow_obj.state.file_count, 5)
+
   def testGlob(self):
     """Test that glob works properly."""
 
@@ -424,6 +462,58 @@ class TestFilesystem(test_lib.FlowTestsBaseclass):
         paths=[path], token=self.token):
       pass
 
+  def _SetUsers(self, *usernames):
+    client = aff4.FACTORY.Open(self.client_id, mode="rw", token=self.token)
+    kb = client.Schema.KNOWLEDGE_BASE()
+    for username in usernames:
+      kb.users.Append(rdf_client.KnowledgeBaseUser(username=username))
+    client.Set(client.Schema.KNOWLEDGE_BASE, kb)
+    client.Close()
+
+    return aff4.FACTORY.Open(self.client_id, token=self.token)
+
+  def _CountLeaves(self, tree):
+    return sum(self._CountLeaves(node) if node else 1
+               for node in tree.itervalues())
+
+  def testGlobPlanIsMemoisedByKnowledgeBase(self):
+    """Test that glob plans are only interpolated for new users."""
+    paths = [rdf_paths.GlobExpression("/home/%%users.username%%/*.log"),
+             rdf_paths.GlobExpression("/var/log/wtmp")]
+    pathtype = rdf_paths.PathSpec.PathType.OS
+
+    conversions = []
+    as_path_components = rdf_paths.GlobExpression.AsPathComponents
+
+    def RecordingAsPathComponents(glob, pathtype):
+      conversions.append(utils.SmartUnicode(glob))
+      return as_path_components(glob, pathtype)
+
+    with utils.MultiStubber(
+        (filesystem.GlobPlan, "_plans", utils.FastStore()),
+        (rdf_paths.GlobExpression, "AsPathComponents",
+         RecordingAsPathComponents)):
+      plan = filesystem.GlobPlan.Get(paths, pathtype)
+      self.assertIs(filesystem.GlobPlan.Get(paths[::-1], pathtype), plan)
+
+      client = self._SetUsers("test", "syslog")
+      tree = plan.ComponentTree(client)
+      self.assertEqual(self._CountLeaves(tree), 3)
+      self.assertEqual(len(conversions), 3)
+
+      # The same users reuse the tree.
+      self.assertIs(plan.ComponentTree(client), tree)
+      self.assertEqual(len(conversions), 3)
+
+      # A new user only needs its own pattern converted.
+      client = self._SetUsers("test", "syslog", "other")
+      new_tree = plan.ComponentTree(client)
+      self.assertEqual(self._CountLeaves(new_tree), 4)
+      self.assertEqual(conversions[3:], ["/home/other/*.log"])
+
+      # The trees handed out are not modified.
+      self.assertEqual(self._CountLeaves(tree), 3)
+
   def testIllegalGlob(self):
     """Test that illegal globs raise."""
 
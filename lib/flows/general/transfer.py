@@ -309,6 +309,33 @@ class MultiGetFileMixin(object):
     self.CallClient("HashFile", request, next_state="ReceiveFileHash",
                     request_data=request_data)
 
+  def StartFileFetchWithHash(self, stat_entry, hash_obj, request_data=None):
+    """Schedules the transfer of a file the client has already hashed.
+
+    This saves the StatFile and HashFile round trips of StartFileFetch.
+
+    Args:
+      stat_entry: rdf_client.StatEntry of the file.
+      hash_obj: rdf_crypto.Hash of the first state.file_size bytes of the file.
+      request_data: Arbitrary dictionary that is passed back to
+                    ReceiveFetchedFile.
+    """
+    vfs_urn = aff4.AFF4Object.VFSGRRClient.PathspecToURN(
+        stat_entry.pathspec, self.client_id)
+    request_data = request_data or {}
+    request_data["vfs_urn"] = vfs_urn
+
+    tracker = FileTracker(stat_entry, self.client_id, request_data)
+    tracker.hash_obj = hash_obj
+    if self.state.file_size:
+      tracker.bytes_read = min(stat_entry.st_size, self.state.file_size)
+    self.state.pending_hashes[vfs_urn] = tracker
+
+    self.state.files_hashed += 1
+    self.state.files_hashed_since_check += 1
+    if self.state.files_hashed_since_check >= self.MIN_CALL_TO_FILE_STORE:
+      self._CheckHashesWithFileStore()
+
   def ReceiveFetchedFile(self, stat_entry, file_hash, request_data=None):
     """This method will be called for each new file successfully fetched.
 
@@ -70,6 +70,26 @@ class HuntRunner(flow_runner.FlowRunner):
 
   schedule_kill_notifications = False
   process_requests_in_order = False
+  batch_completed_requests = True
+
+  def ProcessCompletedRequests(self, notification, thread_pool):
+    """Processes the completed requests, batching the collection writes."""
+    self.flow_obj.StartCollectionBatch()
+    try:
+      super(HuntRunner, self).ProcessCompletedRequests(notification,
+                                                       thread_pool)
+    finally:
+      self.flow_obj.FlushCollectionBatch()
+
+  def FlushMessages(self):
+    """Writes the buffered collection values, then flushes the messages.
+
+    Flushing the queues deletes the processed responses, so the values they
+    produced have to be written first or a worker dying later in the pass
+    would lose them.
+    """
+    self.flow_obj.FlushCollectionBatch(keep_batching=True)
+    super(HuntRunner, self).FlushMessages()
 
   def _AddClient(self, client_id):
     next_client_due = self.flow_obj.state.context.next_client_due
@@ -237,6 +257,14 @@ class HuntRunner(flow_runner.FlowRunner):
     """
     return rdfvalue.SessionID(base="aff4:/hunts", queue=self.args.queue)
 
+  def UpdateExpiryIndex(self, old_expires=None):
+    """Records when this hunt expires in the hunts expiry index."""
+    with aff4.FACTORY.Create(self.flow_obj.expiry_index_urn, "AFF4ExpiryIndex",
+                             mode="w", token=self.token) as index:
+      if old_expires is not None:
+        index.Remove(self.session_id, old_expires)
+      index.Add(self.session_id, self.context.expires)
+
   def _CreateAuditEvent(self, event_action):
     try:
       flow_name = self.flow_obj.args.flow_runner_args.flow_name
@@ -264,7 +292,9 @@ class HuntRunner(flow_runner.FlowRunner):
         self.flow_obj.token, self.session_id)
 
     # Determine when this hunt will expire.
+    old_expires = self.context.expires
     self.context.expires = self.args.expiry_time.Expiry()
+    self.UpdateExpiryIndex(old_expires=old_expires)
 
     # When the next client can be scheduled. Implements gradual client
     # recruitment rate according to the client_rate.
@@ -476,6 +506,9 @@ class GRRHunt(flow.GRRFlow):
   MATCH_DARWIN = rdf_foreman.ForemanAttributeRegex(attribute_name="System",
                                                    attribute_regex="Darwin")
 
+  # Hunts are indexed by the time they expire for the data retention cleanup.
+  expiry_index_urn = rdfvalue.RDFURN("aff4:/index/expiry/hunts")
+
   class SchemaCls(flow.GRRFlow.SchemaCls):
     """The schema for hunts.
 
@@ -503,6 +536,9 @@ class GRRHunt(flow.GRRFlow):
 
   runner_cls = HuntRunner
 
+  # The collection writes buffered by StartCollectionBatch(), by collection.
+  _collection_writes = None
+
   def Initialize(self):
     super(GRRHunt, self).Initialize()
     # Hunts run in multiple threads so we need to protect access.
@@ -540,9 +576,76 @@ class GRRHunt(flow.GRRFlow):
   def creator(self):
     return self.state.context.creator
 
-  def _AddObjectToCollection(self, obj, collection_urn):
-    aff4_collections.PackedVersionedCollection.AddToCollection(
-        collection_urn, [obj], sync=False, token=self.token)
+  def StartCollectionBatch(self):
+    """Buffers the collection writes until FlushCollectionBatch() is called.
+
+    The worker processes many clients' responses in a single pass, so instead
+    of writing each client's values to the hunt collections as they come in,
+    we write them once per collection at the end of the pass.
+    """
+    with self.lock:
+      if self._collection_writes is None:
+        self._collection_writes = {}
+
+  def FlushCollectionBatch(self, keep_batching=False):
+    """Writes the collection values buffered since StartCollectionBatch().
+
+    Args:
+      keep_batching: If True and a batch was started, the following writes
+          are buffered again instead of ending the batch.
+    """
+    with self.lock:
+      writes = self._collection_writes
+      if keep_batching and writes is not None:
+        self._collection_writes = {}
+      else:
+        self._collection_writes = None
+
+    for collection_urn, (collection_cls, entries) in (writes or {}).items():
+      try:
+        collection_cls.AddToCollection(
+            collection_urn, [value for _, value in entries], sync=True,
+            token=self.token)
+      except Exception:  # pylint: disable=broad-except
+        # One client's bad value must not lose the values of the others, so
+        # fall back to writing them client by client.
+        self._WriteCollectionEntries(collection_cls, collection_urn, entries)
+
+  def _WriteCollectionEntries(self, collection_cls, collection_urn, entries):
+    values_by_client = {}
+    for client_id, value in entries:
+      values_by_client.setdefault(client_id, []).append(value)
+
+    for client_id, values in values_by_client.items():
+      try:
+        collection_cls.AddToCollection(collection_urn, values, sync=True,
+                                       token=self.token)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("Unable to write %d values for client %s to %s.",
+                          len(values), client_id, collection_urn)
+        if client_id and collection_urn != self.clients_errors_collection_urn:
+          self.LogClientError(client_id, log_message=utils.SmartStr(e))
+
+  def _AddToCollection(self, collection_cls, collection_urn, values,
+                       client_id=None, sync=False):
+    with self.lock:
+      if self._collection_writes is not None:
+        _, entries = self._collection_writes.setdefault(
+            collection_urn, (collection_cls, []))
+        for value in values:
+          # Keep the time the value was added rather than the time of the
+          # flush.
+          if value is not None and not value.age:
+            value.age.Now()
+          entries.append((client_id, value))
+        return
+
+    collection_cls.AddToCollection(collection_urn, values, sync=sync,
+                                   token=self.token)
+
+  def _AddObjectToCollection(self, obj, collection_urn, client_id=None):
+    self._AddToCollection(aff4_collections.PackedVersionedCollection,
+                          collection_urn, [obj], client_id=client_id)
 
   def _GetCollectionItems(self, collection_urn):
     collection = aff4.FACTORY.Create(collection_urn,
@@ -554,11 +657,13 @@ class GRRHunt(flow.GRRFlow):
     return client_id.Add("flows").Add("%s:hunt" % (self.urn.Basename()))
 
   def RegisterClient(self, client_urn):
-    self._AddObjectToCollection(client_urn, self.all_clients_collection_urn)
+    self._AddObjectToCollection(client_urn, self.all_clients_collection_urn,
+                                client_id=client_urn)
 
   def RegisterCompletedClient(self, client_urn):
     self._AddObjectToCollection(client_urn,
-                                self.completed_clients_collection_urn)
+                                self.completed_clients_collection_urn,
+                                client_id=client_urn)
 
   def RegisterClientError(self, client_id, log_message=None, backtrace=None):
     error = rdf_flows.HuntError(client_id=client_id,
@@ -566,7 +671,8 @@ class GRRHunt(flow.GRRFlow):
     if log_message:
       error.log_message = utils.SmartUnicode(log_message)
 
-    self._AddObjectToCollection(error, self.clients_errors_collection_urn)
+    self._AddObjectToCollection(error, self.clients_errors_collection_urn,
+                                client_id=client_id)
 
   def OnDelete(self, deletion_pool=None):
     super(GRRHunt, self).OnDelete(deletion_pool=deletion_pool)
@@ -640,6 +746,7 @@ class GRRHunt(flow.GRRFlow):
     runner.RunStateMethod("Start")
 
     hunt_obj.Flush()
+    runner.UpdateExpiryIndex()
 
     try:
       flow_name = args.flow_runner_args.flow_name
@@ -714,9 +821,9 @@ class GRRHunt(flow.GRRFlow):
 
         msgs = [rdf_flows.GrrMessage(payload=response, source=client_id)
                 for response in responses]
-        aff4.ResultsOutputCollection.AddToCollection(
-            self.state.context.results_collection_urn, msgs,
-            sync=True, token=self.token)
+        self._AddToCollection(aff4.ResultsOutputCollection,
+                              self.state.context.results_collection_urn, msgs,
+                              client_id=client_id, sync=True)
 
         # Update stats.
         stats.STATS.IncrementCounter("hunt_results_added",
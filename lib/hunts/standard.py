@@ -3,7 +3,9 @@
 
 
 
+import Queue
 import threading
+import time
 
 import logging
 
@@ -14,6 +16,7 @@ from grr.lib import flow
 from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import stats
+from grr.lib import threadpool
 from grr.lib import utils
 from grr.lib.aff4_objects import collections
 from grr.lib.aff4_objects import cronjobs
@@ -354,7 +357,16 @@ class ProcessHuntResultsCronFlowArgs(rdf_structs.RDFProtoStruct):
 
 
 class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
-  """Periodic cron flow that processes hunts results with output plugins."""
+  """Periodic cron flow that processes hunts results with output plugins.
+
+  Hunts with new results are processed in parallel, one task per hunt, on the
+  HUNTS_THREADPOOL_NAME thread pool. Within a hunt, batches are processed in
+  order and every batch is fed to all the output plugins in parallel on the
+  PLUGINS_THREADPOOL_NAME thread pool. All the plugins have to finish with a
+  batch before the next batch is processed, so every plugin still sees the
+  hunt's results in order, but a slow plugin or a slow hunt does not delay
+  other hunts.
+  """
   frequency = rdfvalue.Duration("5m")
   lifetime = rdfvalue.Duration("40m")
 
@@ -363,6 +375,9 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
   DEFAULT_BATCH_SIZE = 1000
   MAX_REVERSED_RESULTS = 500000
 
+  HUNTS_THREADPOOL_NAME = "HuntResultsProcessor"
+  PLUGINS_THREADPOOL_NAME = "HuntOutputPluginsProcessor"
+
   def CheckIfRunningTooLong(self):
     if self.state.args.max_running_time:
       elapsed = (rdfvalue.RDFDatetime().Now().AsSecondsFromEpoch() -
@@ -378,15 +393,54 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
   def ErrorsCollectionUrn(self, hunt_urn):
     return hunt_urn.Add("OutputPluginsErrors")
 
+  def _HeartBeat(self):
+    # Hunts are processed in parallel, the flow lease is shared by all of them.
+    with self.processing_lock:
+      self.HeartBeat()
+
+  def _Log(self, format_str, *args):
+    with self.processing_lock:
+      self.Log(format_str, *args)
+
+  def _ApplyPlugin(self, plugin_def, plugin, batch, results_queue):
+    """Runs a single plugin on a batch and reports the outcome."""
+    start_time = time.time()
+    exception = None
+    try:
+      plugin.ProcessResponses(batch)
+    except Exception as e:  # pylint: disable=broad-except
+      exception = e
+      logging.exception("Error processing hunt results: plugin %s",
+                        plugin_def.plugin_name)
+    finally:
+      stats.STATS.RecordEvent("hunt_output_plugin_latency",
+                              time.time() - start_time,
+                              fields=[plugin_def.plugin_name])
+      results_queue.put((plugin_def, exception))
+
   def ApplyPluginsToBatch(self, hunt_urn, plugins, batch, batch_index):
-    exceptions_by_plugin = {}
+    """Feeds the batch to all the plugins in parallel and records statuses."""
+    results_queue = Queue.Queue()
     for plugin_def, plugin in plugins:
       logging.debug("Processing hunt %s with %s, batch %d", hunt_urn,
                     plugin_def.plugin_name, batch_index)
-
-      try:
-        plugin.ProcessResponses(batch)
-
+      self.plugins_pool.AddTask(
+          target=self._ApplyPlugin,
+          args=(plugin_def, plugin, batch, results_queue),
+          name="%s_%s_%d" % (hunt_urn.Basename(), plugin_def.plugin_name,
+                             batch_index))
+
+    exceptions = {}
+    for _ in plugins:
+      plugin_def, exception = results_queue.get()
+      exceptions[plugin_def] = exception
+
+    # Statuses are written in plugins order, regardless of the order in which
+    # the plugins have finished.
+    exceptions_by_plugin = {}
+    for plugin_def, _ in plugins:
+      e = exceptions[plugin_def]
+      if e is None:
         stats.STATS.IncrementCounter("hunt_results_ran_through_plugin",
                                      delta=len(batch),
                                      fields=[plugin_def.plugin_name])
@@ -396,7 +450,7 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
             status="SUCCESS",
             batch_index=batch_index,
             batch_size=len(batch))
-      except Exception as e:  # pylint: disable=broad-except
+      else:
         stats.STATS.IncrementCounter("hunt_output_plugin_errors",
                                      fields=[plugin_def.plugin_name])
 
@@ -407,12 +461,12 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
             batch_index=batch_index,
             batch_size=len(batch))
 
-        logging.exception("Error processing hunt results: hunt %s, "
-                          "plugin %s, batch %d", hunt_urn,
-                          plugin_def.plugin_name, batch_index)
-        self.Log("Error processing hunt results (hunt %s, "
-                 "plugin %s, batch %d): %s" %
-                 (hunt_urn, plugin_def.plugin_name, batch_index, e))
+        logging.error("Error processing hunt results: hunt %s, "
+                      "plugin %s, batch %d: %s", hunt_urn,
+                      plugin_def.plugin_name, batch_index, e)
+        self._Log("Error processing hunt results (hunt %s, "
+                  "plugin %s, batch %d): %s" %
+                  (hunt_urn, plugin_def.plugin_name, batch_index, e))
         exceptions_by_plugin[plugin_def] = e
 
       collections.PackedVersionedCollection.AddToCollection(
@@ -428,14 +482,21 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
   def FlushPlugins(self, hunt_urn, plugins):
     flush_exceptions = {}
     for plugin_def, plugin in plugins:
+      start_time = time.time()
       try:
         plugin.Flush()
       except Exception as e:  # pylint: disable=broad-except
+        stats.STATS.IncrementCounter("hunt_output_plugin_errors",
+                                     fields=[plugin_def.plugin_name])
         logging.exception("Error flushing hunt results: hunt %s, "
                           "plugin %s", hunt_urn, str(plugin))
-        self.Log("Error processing hunt results (hunt %s, "
-                 "plugin %s): %s" % (hunt_urn, str(plugin), e))
+        self._Log("Error processing hunt results (hunt %s, "
+                  "plugin %s): %s" % (hunt_urn, str(plugin), e))
         flush_exceptions[plugin_def] = e
+      finally:
+        stats.STATS.RecordEvent("hunt_output_plugin_flush_latency",
+                                time.time() - start_time,
+                                fields=[plugin_def.plugin_name])
 
     return flush_exceptions
 
@@ -479,13 +540,13 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
           for key, value in batch_exceptions.items():
             plugins_exceptions.setdefault(key, []).append(value)
 
-        self.HeartBeat()
+        self._HeartBeat()
 
         # If this flow is working for more than max_running_time - stop
         # processing.
         if self.CheckIfRunningTooLong():
-          self.Log("Running for too long, skipping rest of batches for %s",
-                   hunt_urn)
+          self._Log("Running for too long, skipping rest of batches for %s",
+                    hunt_urn)
           break
 
       if not used_plugins:
@@ -500,6 +561,64 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
 
       return plugins_exceptions
 
+  def ProcessResultsCollection(self, results_urn, freeze_timestamp,
+                               exceptions_by_hunt):
+    """Runs output plugins on the new results of a hunt and compacts them."""
+    # Notifications of the hunts we don't get to are kept, so they will be
+    # processed by the next run.
+    if self.CheckIfRunningTooLong():
+      logging.debug("Running for too long, skipping %s.", results_urn)
+      return
+
+    start_time = time.time()
+
+    aff4.ResultsOutputCollection.DeleteNotifications(
+        [results_urn], end=results_urn.age, token=self.token)
+
+    # Feed the results to output plugins
+    try:
+      results = aff4.FACTORY.Open(
+          results_urn, aff4_type="ResultsOutputCollection", token=self.token)
+    except aff4.InstantiationError:  # Collection does not exist.
+      return
+
+    exceptions_by_plugin = self.ProcessHuntResults(results, freeze_timestamp)
+    if exceptions_by_plugin:
+      hunt_urn = results.Get(results.Schema.RESULTS_SOURCE)
+      with self.processing_lock:
+        exceptions_by_hunt[hunt_urn] = exceptions_by_plugin
+
+    lease_time = config_lib.CONFIG["Worker.compaction_lease_time"]
+    try:
+      with aff4.FACTORY.OpenWithLock(results_urn, blocking=False,
+                                     aff4_type="ResultsOutputCollection",
+                                     lease_time=lease_time,
+                                     token=self.token) as results:
+        num_compacted = results.Compact(callback=self._HeartBeat,
+                                        timestamp=freeze_timestamp)
+        stats.STATS.IncrementCounter("hunt_results_compacted",
+                                     delta=num_compacted)
+        logging.debug("Compacted %d results in %s.", num_compacted,
+                      results_urn)
+    except aff4.LockError:
+      logging.error("Trying to compact a collection that's already "
+                    "locked: %s", results_urn)
+      stats.STATS.IncrementCounter("hunt_results_compaction_locking_errors")
+
+    stats.STATS.RecordEvent("hunt_results_processing_latency",
+                            time.time() - start_time)
+
+  def _ProcessResultsCollectionTask(self, results_urn, freeze_timestamp,
+                                    exceptions_by_hunt, task_errors):
+    # Thread pool tasks can't raise, errors are reported back to Start().
+    try:
+      self.ProcessResultsCollection(results_urn, freeze_timestamp,
+                                    exceptions_by_hunt)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error processing results of %s: %s", results_urn, e)
+      with self.processing_lock:
+        task_errors.append(e)
+
   @flow.StateHandler()
   def Start(self):
     """Start state of the flow."""
@@ -510,47 +629,47 @@ class ProcessHuntResultsCronFlow(cronjobs.SystemCronFlow):
           "%ds" % int(ProcessHuntResultsCronFlow.lifetime.seconds * 0.6))
 
     self.start_time = rdfvalue.RDFDatetime().Now()
+    self.processing_lock = threading.RLock()
 
     exceptions_by_hunt = {}
+    task_errors = []
     freeze_timestamp = rdfvalue.RDFDatetime().Now()
-    for results_urn in aff4.ResultsOutputCollection.QueryNotifications(
-        timestamp=freeze_timestamp, token=self.token):
 
-      aff4.ResultsOutputCollection.DeleteNotifications(
-          [results_urn], end=results_urn.age, token=self.token)
-
-      # Feed the results to output plugins
-      try:
-        results = aff4.FACTORY.Open(
-            results_urn, aff4_type="ResultsOutputCollection", token=self.token)
-      except aff4.InstantiationError:  # Collection does not exist.
-        continue
-
-      exceptions_by_plugin = self.ProcessHuntResults(results, freeze_timestamp)
-      if exceptions_by_plugin:
-        hunt_urn = results.Get(results.Schema.RESULTS_SOURCE)
-        exceptions_by_hunt[hunt_urn] = exceptions_by_plugin
-
-      lease_time = config_lib.CONFIG["Worker.compaction_lease_time"]
-      try:
-        with aff4.FACTORY.OpenWithLock(results_urn, blocking=False,
-                                       aff4_type="ResultsOutputCollection",
-                                       lease_time=lease_time,
-                                       token=self.token) as results:
-          num_compacted = results.Compact(callback=self.HeartBeat,
-                                          timestamp=freeze_timestamp)
-          stats.STATS.IncrementCounter("hunt_results_compacted",
-                                       delta=num_compacted)
-          logging.debug("Compacted %d results in %s.", num_compacted,
-                        results_urn)
-      except aff4.LockError:
-        logging.error("Trying to compact a collection that's already "
-                      "locked: %s", results_urn)
-        stats.STATS.IncrementCounter("hunt_results_compaction_locking_errors")
-
-      if self.CheckIfRunningTooLong():
-        self.Log("Running for too long, skipping rest of hunts.")
-        break
+    # The plugins pool is shared by the tasks of all the hunts, so it is
+    # started and stopped once per run.
+    self.plugins_pool = threadpool.ThreadPool.Factory(
+        self.PLUGINS_THREADPOOL_NAME,
+        config_lib.CONFIG["Worker.hunt_results_threadpool_size"])
+    self.plugins_pool.Start()
+
+    pool = threadpool.ThreadPool.Factory(
+        self.HUNTS_THREADPOOL_NAME,
+        config_lib.CONFIG["Worker.hunt_results_threadpool_size"])
+    pool.Start()
+    try:
+      seen_urns = set()
+      for results_urn in aff4.ResultsOutputCollection.QueryNotifications(
+          timestamp=freeze_timestamp, token=self.token):
+        if results_urn in seen_urns:
+          continue
+        seen_urns.add(results_urn)
+
+        # Only one task is ever running per hunt, so results of every hunt
+        # are processed in order.
+        pool.AddTask(target=self._ProcessResultsCollectionTask,
+                     args=(results_urn, freeze_timestamp, exceptions_by_hunt,
+                           task_errors),
+                     name=utils.SmartStr(results_urn))
+    finally:
+      # The hunt tasks use the plugins pool until they are done.
+      pool.Stop()
+      self.plugins_pool.Stop()
+
+    if task_errors:
+      raise task_errors[0]
+
+    if self.CheckIfRunningTooLong():
+      self.Log("Running for too long, skipping rest of hunts.")
 
     if exceptions_by_hunt:
       e = ResultsProcessingError()
@@ -881,5 +1000,10 @@ class StandardHuntInitHook(registry.InitHook):
                                       fields=[("plugin", str)])
     stats.STATS.RegisterCounterMetric("hunt_results_ran_through_plugin",
                                       fields=[("plugin", str)])
+    stats.STATS.RegisterEventMetric("hunt_output_plugin_latency",
+                                    fields=[("plugin", str)])
+    stats.STATS.RegisterEventMetric("hunt_output_plugin_flush_latency",
+                                    fields=[("plugin", str)])
+    stats.STATS.RegisterEventMetric("hunt_results_processing_latency")
     stats.STATS.RegisterCounterMetric("hunt_results_compacted")
     stats.STATS.RegisterCounterMetric("hunt_results_compaction_locking_errors")
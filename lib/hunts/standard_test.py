@@ -20,6 +20,7 @@ from grr.lib import flow_runner
 from grr.lib import hunts
 from grr.lib import output_plugin
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib.aff4_objects import user_managers
@@ -522,6 +523,66 @@ class StandardHuntTest(test_lib.FlowTestsBaseclass):
     self.assertEqual(DummyHuntOutputPlugin.num_calls, 1)
     self.assertListEqual(StatefulDummyHuntOutputPlugin.data, [0])
 
+  def testOutputPluginsLatencyAndErrorsAreTrackedPerPlugin(self):
+    self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="FailingDummyHuntOutputPlugin"),
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    def LatencyCount(plugin_name):
+      return stats.STATS.GetMetricValue("hunt_output_plugin_latency",
+                                        fields=[plugin_name]).count
+
+    def ErrorsCount(plugin_name):
+      return stats.STATS.GetMetricValue("hunt_output_plugin_errors",
+                                        fields=[plugin_name])
+
+    failing_latency = LatencyCount("FailingDummyHuntOutputPlugin")
+    dummy_latency = LatencyCount("DummyHuntOutputPlugin")
+    failing_errors = ErrorsCount("FailingDummyHuntOutputPlugin")
+    dummy_errors = ErrorsCount("DummyHuntOutputPlugin")
+
+    self.assertRaises(standard.ResultsProcessingError,
+                      self.ProcessHuntOutputPlugins, batch_size=5)
+
+    # 10 results in batches of 5 mean 2 calls for every plugin.
+    self.assertEqual(LatencyCount("FailingDummyHuntOutputPlugin"),
+                     failing_latency + 2)
+    self.assertEqual(LatencyCount("DummyHuntOutputPlugin"), dummy_latency + 2)
+    self.assertEqual(ErrorsCount("FailingDummyHuntOutputPlugin"),
+                     failing_errors + 2)
+    self.assertEqual(ErrorsCount("DummyHuntOutputPlugin"), dummy_errors)
+
+    # The failing plugin doesn't affect the working one.
+    self.assertEqual(DummyHuntOutputPlugin.num_calls, 2)
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 10)
+
+  def testHuntResultsAreProcessedSeriallyWithoutThreadpool(self):
+    self.StartHunt(output_plugins=[output_plugin.OutputPluginDescriptor(
+        plugin_name="DummyHuntOutputPlugin")])
+    self.StartHunt(output_plugins=[output_plugin.OutputPluginDescriptor(
+        plugin_name="StatefulDummyHuntOutputPlugin")])
+
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    with utils.MultiStubber(
+        (standard.ProcessHuntResultsCronFlow, "HUNTS_THREADPOOL_NAME",
+         "HuntResultsProcessorSerialTest"),
+        (standard.ProcessHuntResultsCronFlow, "PLUGINS_THREADPOOL_NAME",
+         "HuntOutputPluginsProcessorSerialTest")):
+      with test_lib.ConfigOverrider({
+          "Worker.hunt_results_threadpool_size": 0}):
+        self.ProcessHuntOutputPlugins(batch_size=5)
+
+    self.assertEqual(DummyHuntOutputPlugin.num_calls, 2)
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 10)
+    self.assertListEqual(StatefulDummyHuntOutputPlugin.data, [0, 1])
+
   def testProcessHuntResultsCronFlowAbortsIfRunningTooLong(self):
     self.assertEqual(LongRunningDummyHuntOutputPlugin.num_calls, 0)
 
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+"""Columnar compressed output plugin.
+
+Converted values are written into one stream per exported value type. Every
+stream starts with a header containing the schema derived from the value's
+RDF descriptors and is followed by any number of row groups:
+
+  header:    MAGIC, varint(len(schema)), JSON-encoded schema
+  row group: varint(number of rows), then for every column in the schema:
+             varint(len(chunk)), zlib-compressed chunk
+
+A column chunk is a presence byte per row followed by the encoded non-null
+values of the column. As row groups are self-contained, streams can be
+appended to after every hunt batch and columns not needed by the reader are
+skipped without being decompressed.
+"""
+
+
+
+import json
+import struct
+import zlib
+
+from grr.lib import export
+from grr.lib import output_plugin
+from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.lib.rdfvalues import structs as rdf_structs
+from grr.proto import output_plugin_pb2
+
+
+MAGIC = "GRRCOL\x01\n"
+
+FILE_EXTENSION = ".grrcol"
+
+
+class Error(output_plugin.Error):
+  """Raised when a columnar stream can't be parsed."""
+
+
+class ColumnarOutputPluginArgs(rdf_structs.RDFProtoStruct):
+  protobuf = output_plugin_pb2.ColumnarOutputPluginArgs
+
+
+def _EncodeUnsigned(value):
+  return rdf_structs.VarintEncode(int(value))
+
+
+def _EncodeSigned(value):
+  return rdf_structs.SignedVarintEncode(int(value))
+
+
+def _EncodeDouble(value):
+  return struct.pack("<d", float(value))
+
+
+def _EncodeBool(value):
+  return value and "\x01" or "\x00"
+
+
+def _EncodeString(value):
+  value = utils.SmartStr(value)
+  return rdf_structs.VarintEncode(len(value)) + value
+
+
+def _DecodeUnsigned(buf, pos):
+  return rdf_structs.VarintReader(buf, pos)
+
+
+def _DecodeSigned(buf, pos):
+  return rdf_structs.SignedVarintReader(buf, pos)
+
+
+def _DecodeDouble(buf, pos):
+  return struct.unpack("<d", buf[pos:pos + 8])[0], pos + 8
+
+
+def _DecodeBool(buf, pos):
+  return buf[pos] != "\x00", pos + 1
+
+
+def _DecodeBytes(buf, pos):
+  length, pos = rdf_structs.VarintReader(buf, pos)
+  return buf[pos:pos + length], pos + length
+
+
+def _DecodeString(buf, pos):
+  value, pos = _DecodeBytes(buf, pos)
+  return value.decode("utf-8"), pos
+
+
+# Column type -> (encoder, decoder).
+COLUMN_TYPES = dict(
+    uint64=(_EncodeUnsigned, _DecodeUnsigned),
+    int64=(_EncodeSigned, _DecodeSigned),
+    double=(_EncodeDouble, _DecodeDouble),
+    bool=(_EncodeBool, _DecodeBool),
+    string=(_EncodeString, _DecodeString),
+    bytes=(_EncodeString, _DecodeBytes))
+
+# RDFValue.data_store_type -> column type.
+_DATA_STORE_TYPE_MAP = dict(
+    unsigned_integer="uint64",
+    integer="uint64",
+    signed_integer="int64",
+    bytes="bytes",
+    string="string")
+
+
+class Column(object):
+  """A single column of the schema, describing a leaf field of the value."""
+
+  def __init__(self, path, column_type, rdf_type=None):
+    self.path = path
+    self.name = ".".join(path)
+    self.column_type = column_type
+    self.rdf_type = rdf_type
+    self.encoder, self.decoder = COLUMN_TYPES[column_type]
+
+  def GetValue(self, value):
+    """Extracts this column's value from the exported value."""
+    for name in self.path:
+      value = value.Get(name)
+
+    if value is None:
+      return None
+
+    if self.rdf_type is not None:
+      return value.SerializeToDataStore()
+
+    if self.column_type == "string":
+      return utils.SmartUnicode(value)
+
+    return value
+
+  def ToDict(self):
+    result = dict(name=self.name, type=self.column_type)
+    if self.rdf_type:
+      result["rdf_type"] = self.rdf_type
+    return result
+
+
+def _GetColumnType(type_descriptor):
+  """Maps a field's type descriptor to (column type, rdf type name)."""
+  if isinstance(type_descriptor, rdf_structs.ProtoRDFValue):
+    if type_descriptor.type is None:
+      return "string", None
+    return (_DATA_STORE_TYPE_MAP[type_descriptor.type.data_store_type],
+            type_descriptor.type.__name__)
+
+  if isinstance(type_descriptor, rdf_structs.ProtoBoolean):
+    return "bool", None
+
+  # Enums are written by name, the same way the CSV plugin writes them.
+  if isinstance(type_descriptor, rdf_structs.ProtoEnum):
+    return "string", None
+
+  if isinstance(type_descriptor, (rdf_structs.ProtoFloat,
+                                  rdf_structs.ProtoDouble)):
+    return "double", None
+
+  if isinstance(type_descriptor, rdf_structs.ProtoSignedInteger):
+    return "int64", None
+
+  if isinstance(type_descriptor, rdf_structs.ProtoUnsignedInteger):
+    return "uint64", None
+
+  if isinstance(type_descriptor, rdf_structs.ProtoBinary):
+    return "bytes", None
+
+  # Strings and everything that can't be represented as a single primitive
+  # value (lists, dynamic fields) are written as strings.
+  return "string", None
+
+
+def GetSchema(value_class, prefix=()):
+  """Derives the list of columns from the exported value's descriptors."""
+  columns = []
+  for type_descriptor in value_class.type_infos:
+    path = prefix + (type_descriptor.name,)
+    if isinstance(type_descriptor, rdf_structs.ProtoEmbedded):
+      columns.extend(GetSchema(type_descriptor.type, prefix=path))
+    else:
+      column_type, rdf_type = _GetColumnType(type_descriptor)
+      columns.append(Column(path, column_type, rdf_type=rdf_type))
+
+  return columns
+
+
+def EncodeHeader(value_type, columns):
+  schema = json.dumps(dict(value_type=value_type,
+                           columns=[c.ToDict() for c in columns]))
+  return MAGIC + rdf_structs.VarintEncode(len(schema)) + schema
+
+
+def EncodeRowGroup(columns, column_values):
+  """Encodes a row group.
+
+  Args:
+    columns: List of Column objects.
+    column_values: List of lists of values, one list per column.
+
+  Returns:
+    Encoded row group as a string.
+  """
+  num_rows = len(column_values[0])
+  result = [rdf_structs.VarintEncode(num_rows)]
+  for column, values in zip(columns, column_values):
+    presence = []
+    encoded = []
+    for value in values:
+      if value is None:
+        presence.append("\x00")
+      else:
+        presence.append("\x01")
+        encoded.append(column.encoder(value))
+
+    chunk = zlib.compress("".join(presence) + "".join(encoded))
+    result.append(rdf_structs.VarintEncode(len(chunk)))
+    result.append(chunk)
+
+  return "".join(result)
+
+
+class ColumnarReader(object):
+  """Reads a stream written by the ColumnarOutputPlugin.
+
+  Works with any file-like object: AFF4 streams as well as local files.
+  """
+
+  read_size = 1024 * 1024
+
+  def __init__(self, fd):
+    self.read = getattr(fd, "Read", None) or fd.read
+    self.buffer = ""
+
+    if self._Read(len(MAGIC)) != MAGIC:
+      raise Error("Not a columnar stream.")
+
+    schema = json.loads(self._Read(self._ReadVarint()))
+    self.value_type = schema["value_type"]
+    self.columns = [(c["name"], c["type"]) for c in schema["columns"]]
+    self.rdf_types = dict((c["name"], c["rdf_type"])
+                          for c in schema["columns"] if "rdf_type" in c)
+
+  def _Fill(self, length):
+    while len(self.buffer) < length:
+      data = self.read(max(self.read_size, length - len(self.buffer)))
+      if not data:
+        break
+      self.buffer += data
+
+  def _Read(self, length):
+    self._Fill(length)
+    if len(self.buffer) < length:
+      raise Error("Truncated columnar stream.")
+
+    result, self.buffer = self.buffer[:length], self.buffer[length:]
+    return result
+
+  def _ReadVarint(self):
+    # A 64 bit varint is at most 10 bytes long.
+    self._Fill(10)
+    if not self.buffer:
+      raise EOFError()
+
+    try:
+      result, pos = rdf_structs.VarintReader(self.buffer, 0)
+    except IndexError:
+      raise Error("Truncated columnar stream.")
+
+    self.buffer = self.buffer[pos:]
+    return result
+
+  def _DecodeChunk(self, chunk, column_type, num_rows):
+    data = zlib.decompress(chunk)
+    decoder = COLUMN_TYPES[column_type][1]
+
+    values = []
+    pos = num_rows
+    for i in xrange(num_rows):
+      if data[i] == "\x00":
+        values.append(None)
+      else:
+        value, pos = decoder(data, pos)
+        values.append(value)
+
+    return values
+
+  def ReadRowGroups(self, columns=None):
+    """Yields row groups as dicts of column name -> list of values.
+
+    Args:
+      columns: If given, only these columns are decoded.
+
+    Yields:
+      Dictionaries with column names as keys and lists of values (None for
+      unset values) as values.
+    """
+    if columns is not None:
+      columns = set(columns)
+
+    while True:
+      try:
+        num_rows = self._ReadVarint()
+      except EOFError:
+        return
+
+      result = {}
+      for name, column_type in self.columns:
+        chunk = self._Read(self._ReadVarint())
+        if columns is None or name in columns:
+          result[name] = self._DecodeChunk(chunk, column_type, num_rows)
+
+      yield result
+
+  def __iter__(self):
+    """Yields rows as dicts of column name -> value."""
+    for row_group in self.ReadRowGroups():
+      names = row_group.keys()
+      for row in zip(*[row_group[name] for name in names]):
+        yield dict(zip(names, row))
+
+
+class ColumnarOutputPlugin(output_plugin.OutputPluginWithOutputStreams):
+  """Output plugin that writes results into columnar compressed streams."""
+
+  name = "columnar"
+  description = "Output columnar compressed files."
+  args_type = ColumnarOutputPluginArgs
+
+  def __init__(self, *args, **kwargs):
+    super(ColumnarOutputPlugin, self).__init__(*args, **kwargs)
+    # Value type -> list of columns.
+    self.schemas = {}
+    # Value type -> list of per-column lists of values not yet written.
+    self.pending = {}
+
+  def ProcessResponses(self, responses):
+    default_metadata = export.ExportedMetadata(
+        annotations=u",".join(self.args.export_options.annotations),
+        source_urn=self.state.source_urn)
+
+    if self.args.convert_values:
+      # This is thread-safe - we just convert the values.
+      converted_responses = export.ConvertValues(
+          default_metadata, responses, token=self.token,
+          options=self.args.export_options)
+    else:
+      converted_responses = responses
+
+    self.AddValues(converted_responses)
+
+  def GetSchema(self, value_type):
+    try:
+      return self.schemas[value_type]
+    except KeyError:
+      schema = GetSchema(rdfvalue.RDFValue.classes[value_type])
+      self.schemas[value_type] = schema
+      return schema
+
+  def GetOutputFd(self, value_type):
+    """Initializes output AFF4Image for a given value type."""
+    file_name = value_type + FILE_EXTENSION
+    try:
+      output_stream = self._GetOutputStream(file_name)
+    except KeyError:
+      output_stream = self._CreateOutputStream(file_name)
+      output_stream.Write(EncodeHeader(value_type,
+                                       self.GetSchema(value_type)))
+
+    return output_stream
+
+  @utils.Synchronized
+  def AddValues(self, values):
+    """Adds values to the pending columns, writing full row groups."""
+    row_group_size = self.args.row_group_size
+    for value in values:
+      value_type = value.__class__.__name__
+      columns = self.GetSchema(value_type)
+      try:
+        column_values = self.pending[value_type]
+      except KeyError:
+        column_values = self.pending[value_type] = [[] for _ in columns]
+
+      for column, values_list in zip(columns, column_values):
+        values_list.append(column.GetValue(value))
+
+      if len(column_values[0]) >= row_group_size:
+        self.WriteRowGroup(value_type)
+
+  def WriteRowGroup(self, value_type):
+    column_values = self.pending.pop(value_type, None)
+    if column_values and column_values[0]:
+      output_file = self.GetOutputFd(value_type)
+      output_file.Write(EncodeRowGroup(self.GetSchema(value_type),
+                                       column_values))
+
+  def Flush(self):
+    # Row groups can't span batches as the next batch may be processed by a
+    # different worker, so whatever is pending is written as a smaller group.
+    for value_type in sorted(self.pending):
+      self.WriteRowGroup(value_type)
+
+    super(ColumnarOutputPlugin, self).Flush()
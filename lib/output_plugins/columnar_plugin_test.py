@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- mode: python; encoding: utf-8 -*-
+
+"""Tests for columnar output plugin."""
+
+import StringIO
+
+from grr.lib import export
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib.output_plugins import columnar_plugin
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
+
+
+class ColumnarOutputPluginTest(test_lib.FlowTestsBaseclass):
+  """Tests columnar hunt output plugin."""
+
+  def setUp(self):
+    super(ColumnarOutputPluginTest, self).setUp()
+    self.client_id = self.SetupClients(1)[0]
+    self.results_urn = self.client_id.Add("Results")
+    self.base_urn = rdfvalue.RDFURN("aff4:/foo/bar")
+
+  def ProcessResponses(self, plugin_args=None, batches=None):
+    plugin = columnar_plugin.ColumnarOutputPlugin(
+        source_urn=self.results_urn, output_base_urn=self.base_urn,
+        args=plugin_args, token=self.token)
+
+    for batch in batches:
+      messages = [rdf_flows.GrrMessage(source=self.client_id,
+                                       payload=response)
+                  for response in batch]
+      plugin.ProcessResponses(messages)
+      plugin.Flush()
+
+    return plugin.OpenOutputStreams()
+
+  def GetStatEntries(self, count):
+    responses = []
+    for i in range(count):
+      responses.append(rdf_client.StatEntry(
+          aff4path=self.client_id.Add("/fs/os/foo/bar").Add(str(i)),
+          pathspec=rdf_paths.PathSpec(path="/foo/bar"),
+          st_mode=33184,
+          st_ino=1063090,
+          st_nlink=1 + i,
+          st_size=i * 1024,
+          st_atime=1336469177))
+    return responses
+
+  def testColumnarPluginWithValuesOfSameType(self):
+    streams = self.ProcessResponses(
+        plugin_args=columnar_plugin.ColumnarOutputPluginArgs(),
+        batches=[self.GetStatEntries(10)])
+    self.assertEqual(streams.keys(), ["ExportedFile.grrcol"])
+    self.assertEqual(streams["ExportedFile.grrcol"].urn,
+                     rdfvalue.RDFURN("aff4:/foo/bar/ExportedFile.grrcol"))
+
+    reader = columnar_plugin.ColumnarReader(streams["ExportedFile.grrcol"])
+    self.assertEqual(reader.value_type, "ExportedFile")
+    self.assertEqual(reader.columns[0], ("metadata.client_urn", "string"))
+    self.assertIn(("st_atime", "uint64"), reader.columns)
+    self.assertEqual(reader.rdf_types["st_atime"], "RDFDatetimeSeconds")
+
+    rows = list(reader)
+    self.assertEqual(len(rows), 10)
+    for i, row in enumerate(rows):
+      self.assertEqual(row["metadata.client_urn"], self.client_id)
+      self.assertEqual(row["metadata.hostname"], "Host-0")
+      self.assertEqual(row["metadata.source_urn"], self.results_urn)
+      self.assertEqual(row["urn"],
+                       self.client_id.Add("/fs/os/foo/bar").Add(str(i)))
+      self.assertEqual(row["st_mode"], 33184)
+      self.assertEqual(row["st_ino"], 1063090)
+      self.assertEqual(row["st_nlink"], 1 + i)
+      self.assertEqual(row["st_size"], i * 1024)
+      self.assertEqual(row["st_atime"], 1336469177)
+
+  def testRowGroupsAreLimitedInSizeAndAppendedPerBatch(self):
+    responses = self.GetStatEntries(10)
+    streams = self.ProcessResponses(
+        plugin_args=columnar_plugin.ColumnarOutputPluginArgs(
+            row_group_size=4),
+        batches=[responses[:7], responses[7:]])
+
+    reader = columnar_plugin.ColumnarReader(streams["ExportedFile.grrcol"])
+    row_groups = list(reader.ReadRowGroups(columns=["st_nlink"]))
+
+    # First batch: 4 + 3 rows, second batch: 3 rows.
+    self.assertEqual([len(g["st_nlink"]) for g in row_groups], [4, 3, 3])
+    self.assertEqual([g.keys() for g in row_groups], [["st_nlink"]] * 3)
+    self.assertEqual(sum([g["st_nlink"] for g in row_groups], []),
+                     range(1, 11))
+
+  def testColumnarPluginWithValuesOfMultipleTypes(self):
+    streams = self.ProcessResponses(
+        plugin_args=columnar_plugin.ColumnarOutputPluginArgs(),
+        batches=[[rdf_client.StatEntry(
+            aff4path=self.client_id.Add("/fs/os/foo/bar"),
+            pathspec=rdf_paths.PathSpec(path="/foo/bar")),
+                  rdf_client.Process(pid=42)]])
+
+    self.assertEqual(sorted(streams.keys()),
+                     ["ExportedFile.grrcol", "ExportedProcess.grrcol"])
+
+    rows = list(columnar_plugin.ColumnarReader(
+        streams["ExportedProcess.grrcol"]))
+    self.assertEqual(len(rows), 1)
+    self.assertEqual(rows[0]["metadata.client_urn"], self.client_id)
+    self.assertEqual(rows[0]["pid"], 42)
+
+  def testColumnarPluginWritesUnicodeValuesCorrectly(self):
+    streams = self.ProcessResponses(
+        plugin_args=columnar_plugin.ColumnarOutputPluginArgs(),
+        batches=[[rdf_client.StatEntry(
+            aff4path=self.client_id.Add("/fs/os/中国新闻网新闻中"),
+            pathspec=rdf_paths.PathSpec(path="/中国新闻网新闻中"))]])
+
+    rows = list(columnar_plugin.ColumnarReader(
+        streams["ExportedFile.grrcol"]))
+    self.assertEqual(len(rows), 1)
+    self.assertEqual(rows[0]["urn"],
+                     self.client_id.Add("/fs/os/中国新闻网新闻中"))
+
+
+class ColumnarFormatTest(test_lib.GRRBaseTest):
+  """Tests the columnar format round trip through local files."""
+
+  def testAllColumnTypesRoundTrip(self):
+    columns = [columnar_plugin.Column(("u",), "uint64"),
+               columnar_plugin.Column(("i",), "int64"),
+               columnar_plugin.Column(("d",), "double"),
+               columnar_plugin.Column(("b",), "bool"),
+               columnar_plugin.Column(("s",), "string"),
+               columnar_plugin.Column(("r",), "bytes")]
+    column_values = [[0, 2 ** 64 - 1, None],
+                     [-5, 2 ** 63 - 1, None],
+                     [1.5, -0.25, None],
+                     [True, False, None],
+                     [u"", u"中国新闻网新闻中", None],
+                     ["\x00\xff", "", None]]
+
+    fd = StringIO.StringIO()
+    fd.write(columnar_plugin.EncodeHeader("Test", columns))
+    fd.write(columnar_plugin.EncodeRowGroup(columns, column_values))
+    fd.write(columnar_plugin.EncodeRowGroup(columns, column_values))
+    fd.seek(0)
+
+    reader = columnar_plugin.ColumnarReader(fd)
+    row_groups = list(reader.ReadRowGroups())
+    self.assertEqual(len(row_groups), 2)
+    for row_group in row_groups:
+      for column, values in zip(columns, column_values):
+        self.assertEqual(row_group[column.name], values)
+
+  def testSchemaIsDerivedFromDescriptors(self):
+    columns = columnar_plugin.GetSchema(export.ExportedProcess)
+    names = [c.name for c in columns]
+
+    self.assertIn("metadata.client_urn", names)
+    self.assertIn("pid", names)
+    self.assertNotIn("metadata", names)
+
+  def testReaderRaisesOnInvalidData(self):
+    with self.assertRaises(columnar_plugin.Error):
+      columnar_plugin.ColumnarReader(StringIO.StringIO("foo"))
+
+
+def main(argv):
+  test_lib.GrrTestProgram(argv=argv)
+
+if __name__ == "__main__":
+  flags.StartMain(main)
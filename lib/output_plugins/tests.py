@@ -2,5 +2,6 @@
 """Loads up all output plugins tests."""
 
 # pylint: disable=unused-import
+from grr.lib.output_plugins import columnar_plugin_test
 from grr.lib.output_plugins import csv_plugin_test
 from grr.lib.output_plugins import email_plugin_test
@@ -351,13 +351,26 @@ class QueueManager(object):
   def Flush(self):
     """Writes the changes in this object to the datastore."""
     session_ids = set(self.to_write) | set(self.to_delete)
-    for session_id in session_ids:
-      try:
-        self.data_store.MultiSet(session_id, self.to_write.get(session_id, {}),
-                                 to_delete=self.to_delete.get(session_id, []),
-                                 sync=False, token=self.token)
-      except data_store.Error:
-        pass
+    try:
+      self.data_store.MultiSetMulti(self.to_write, to_delete=self.to_delete,
+                                    sync=False, token=self.token)
+    except data_store.Error:
+      # Retry subject by subject so one bad subject does not lose the writes
+      # of all the others, the last failure is still raised afterwards.
+      error = None
+      for session_id in session_ids:
+        try:
+          self.data_store.MultiSet(session_id,
+                                   self.to_write.get(session_id, {}),
+                                   to_delete=self.to_delete.get(session_id, []),
+                                   sync=False, token=self.token)
+        except data_store.Error as e:
+          logging.exception("Unable to write the queued messages of %s.",
+                            session_id)
+          error = e
+
+      if error is not None:
+        raise error
 
     for client_id, messages in self.client_messages_to_delete.iteritems():
       self.Delete(client_id.Queue(), messages)
@@ -617,13 +630,25 @@ class QueueManager(object):
       RuntimeError: An invalid session_id was passed.
     """
     extract_queue = lambda notification: notification.session_id.Queue()
+    to_write = {}
     for queue, notifications in utils.GroupBy(
         notifications, extract_queue).iteritems():
-      self._MultiNotifyQueue(
-          queue, notifications, timestamp=timestamp, sync=sync)
+      to_write.setdefault(self.GetNotificationShard(queue), {}).update(
+          self._SerializeNotifications(notifications, timestamp=timestamp))
+
+    # All shards are written in a single data store operation.
+    data_store.DB.MultiSetMulti(to_write, sync=sync, replace=False,
+                                token=self.token)
 
   def _MultiNotifyQueue(self, queue, notifications, timestamp=None, sync=True):
     """Does the actual queuing."""
+    data_store.DB.MultiSet(
+        self.GetNotificationShard(queue),
+        self._SerializeNotifications(notifications, timestamp=timestamp),
+        sync=sync, replace=False, token=self.token)
+
+  def _SerializeNotifications(self, notifications, timestamp=None):
+    """Returns the notification attributes to write to a shard."""
     serialized_notifications = {}
     now = rdfvalue.RDFDatetime().Now()
     expiry_time = config_lib.CONFIG["Worker.notification_expiry_time"]
@@ -643,12 +668,9 @@ class QueueManager(object):
       notification.timestamp = None
       serialized_notifications[session_id] = notification.SerializeToString()
 
-    data_store.DB.MultiSet(
-        self.GetNotificationShard(queue),
-        dict([(self.NOTIFY_PREDICATE_PREFIX % session_id,
-               [(data, timestamp)])
-              for session_id, data in serialized_notifications.iteritems()]),
-        sync=sync, replace=False, token=self.token)
+    return dict([(self.NOTIFY_PREDICATE_PREFIX % session_id,
+                  [(data, timestamp)])
+                 for session_id, data in serialized_notifications.iteritems()])
 
   def DeleteNotification(self, session_id, start=None, end=None):
     """This deletes the notification when all messages have been processed."""
@@ -13,6 +13,7 @@ from grr.lib import queues
 from grr.lib import rdfvalue
 from grr.lib import stats
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.rdfvalues import flows as rdf_flows
 
 # pylint: mode=test
@@ -140,6 +141,35 @@ class QueueManagerTest(test_lib.FlowTestsBaseclass):
     all_requests = list(manager.FetchRequestsAndResponses(session_id))
     self.assertEqual(len(all_requests), 0)
 
+  def testFlushWritesOtherSubjectsWhenOneFails(self):
+    session_ids = [rdfvalue.SessionID(flow_name="test%d" % i)
+                   for i in range(2)]
+    bad_subject = session_ids[0].Add("state")
+    multi_set = data_store.DB.MultiSet
+
+    def FailingMultiSetMulti(*unused_args, **unused_kwargs):
+      raise data_store.Error("Write failed.")
+
+    def FailingMultiSet(subject, *args, **kwargs):
+      if subject == bad_subject:
+        raise data_store.Error("Write failed.")
+      return multi_set(subject, *args, **kwargs)
+
+    with utils.Stubber(data_store.DB, "MultiSetMulti", FailingMultiSetMulti):
+      with utils.Stubber(data_store.DB, "MultiSet", FailingMultiSet):
+        # The failure is raised once the other subjects are written.
+        with self.assertRaises(data_store.Error):
+          with queue_manager.QueueManager(token=self.token) as manager:
+            for session_id in session_ids:
+              manager.QueueRequest(session_id, rdf_flows.RequestState(
+                  id=1, client_id=self.client_id, next_state="TestState",
+                  session_id=session_id))
+
+    self.assertEqual(
+        len(list(manager.FetchRequestsAndResponses(session_ids[0]))), 0)
+    self.assertEqual(
+        len(list(manager.FetchRequestsAndResponses(session_ids[1]))), 1)
+
   def testDestroyFlowStates(self):
     """Check that we can efficiently destroy the flow's request queues."""
     session_id = rdfvalue.SessionID(flow_name="test2")
@@ -649,7 +649,8 @@ class FindSpec(structs.RDFProtoStruct):
         self.start_time > self.end_time):
       raise ValueError("Start time must be before end time.")
 
-    if not self.path_regex and not self.data_regex and not self.path_glob:
+    if (not self.path_regex and not self.data_regex and
+        not self.data_literals and not self.path_glob):
       raise ValueError("A Find specification can not contain both an empty "
                        "path regex and an empty data regex")
 
@@ -713,6 +714,14 @@ class ListDirRequest(structs.RDFProtoStruct):
   protobuf = jobs_pb2.ListDirRequest
 
 
+class RecursiveListDirRequest(structs.RDFProtoStruct):
+  protobuf = jobs_pb2.RecursiveListDirRequest
+
+
+class StatEntryBatch(structs.RDFProtoStruct):
+  protobuf = jobs_pb2.StatEntryBatch
+
+
 class FingerprintTuple(structs.RDFProtoStruct):
   protobuf = jobs_pb2.FingerprintTuple
 
@@ -269,6 +269,79 @@ class FlowState(rdfvalue.RDFValue):
     return dir(self.data) + dir(self.__class__)
 
 
+class ChunkedStateEntry(object):
+  """Stands in for a large flow state collection stored in chunks.
+
+  Lists, dicts and sets registered in the flow state which grow large are
+  split into chunks that are stored as separate records, so a flush only
+  rewrites the chunks which changed. The serialized FlowState holds one of
+  these in place of the collection.
+  """
+
+  COLLECTION_TYPES = {list: "list", dict: "dict", set: "set"}
+
+  def __init__(self, collection_type, chunk_count):
+    self.collection_type = collection_type
+    self.chunk_count = chunk_count
+
+  @classmethod
+  def Split(cls, value, chunk_size, previous=None):
+    """Splits a collection into chunks.
+
+    Lists are cut into consecutive slices so appending only changes the last
+    chunk. Dicts and sets are spread over buckets by hash, reusing the bucket
+    count of the previous split for as long as the buckets stay small.
+
+    Args:
+      value: The list, dict or set to split.
+      chunk_size: The number of items to aim for in each chunk.
+      previous: The ChunkedStateEntry this collection was last stored as.
+
+    Returns:
+      A tuple of the ChunkedStateEntry for the value and the list of chunks.
+    """
+    collection_type = cls.COLLECTION_TYPES[type(value)]
+    if collection_type == "list":
+      chunks = [value[i:i + chunk_size]
+                for i in xrange(0, len(value), chunk_size)]
+      return cls(collection_type, len(chunks)), chunks
+
+    count = 1
+    if previous is not None and previous.collection_type == collection_type:
+      count = previous.chunk_count
+
+    while len(value) > 2 * chunk_size * count:
+      count *= 2
+
+    if collection_type == "dict":
+      chunks = [{} for _ in xrange(count)]
+      for key, item in value.iteritems():
+        chunks[hash(key) % count][key] = item
+    else:
+      chunks = [set() for _ in xrange(count)]
+      for item in value:
+        chunks[hash(item) % count].add(item)
+
+    return cls(collection_type, count), chunks
+
+  def Join(self, chunks):
+    """Rebuilds the collection from its chunks."""
+    if self.collection_type == "list":
+      result = []
+      for chunk in chunks:
+        result.extend(chunk)
+      return result
+
+    result = {} if self.collection_type == "dict" else set()
+    for chunk in chunks:
+      result.update(chunk)
+    return result
+
+  def __str__(self):
+    return "<%s stored in %d chunks>" % (self.collection_type,
+                                         self.chunk_count)
+
+
 class Notification(rdf_structs.RDFProtoStruct):
   """A notification is used in the GUI to alert users.
 
@@ -325,3 +325,60 @@ class GlobExpression(rdfvalue.RDFString):
     """
     return rdf_standard.RegularExpression(
         "(?i)^" + fnmatch.translate(self._value))
+
+  # A regex indicating if there are shell globs in a path component.
+  GLOB_MAGIC_CHECK = re.compile("[*?[]")
+
+  def AsPathComponents(self, pathtype):
+    """Converts the glob into a list of pathspec components.
+
+    Wildcards are also converted to regular expressions. The pathspec components
+    do not span directories, and are marked as a regex or a literal component.
+
+    We also support recursion into directories using the ** notation.  For
+    example, /home/**2/foo.txt will find all files named foo.txt recursed 2
+    directories deep. If the directory depth is omitted, it defaults to 3.
+
+    Note: No interpolation is performed.
+
+    Example:
+     /home/test/* -> ['home', 'test', '.*\\Z(?ms)']
+
+    Args:
+      pathtype: The pathtype to use for the components.
+
+    Returns:
+      A list of PathSpec instances for each component.
+    """
+    components = []
+    for path_component in self._value.split("/"):
+      # A ** in the path component means recurse into directories that match the
+      # pattern.
+      m = self.RECURSION_REGEX.search(path_component)
+      if m:
+        path_component = path_component.replace(m.group(0), "*")
+
+        component = PathSpec(path=fnmatch.translate(path_component),
+                             pathtype=pathtype,
+                             path_options=PathSpec.Options.RECURSIVE)
+
+        # Allow the user to override the recursion depth.
+        if m.group(1):
+          component.recursion_depth = int(m.group(1))
+
+      elif self.GLOB_MAGIC_CHECK.search(path_component):
+        component = PathSpec(path=fnmatch.translate(path_component),
+                             pathtype=pathtype,
+                             path_options=PathSpec.Options.REGEX)
+      else:
+        # TODO(user): This is a backwards compatibility hack. Remove when
+        # all clients reach 3.0.0.2.
+        if (pathtype == PathSpec.PathType.TSK and
+            re.match("^.:$", path_component)):
+          path_component = "%s\\" % path_component
+        component = PathSpec(path=path_component, pathtype=pathtype,
+                             path_options=PathSpec.Options.CASE_INSENSITIVE)
+
+      components.append(component)
+
+    return components
@@ -10,6 +10,7 @@ from grr.lib.rdfvalues import cronjobs
 from grr.lib.rdfvalues import crypto
 from grr.lib.rdfvalues import data_server
 from grr.lib.rdfvalues import data_store
+from grr.lib.rdfvalues import file_finder
 from grr.lib.rdfvalues import flows
 from grr.lib.rdfvalues import foreman
 from grr.lib.rdfvalues import grr_rdf
@@ -51,6 +51,7 @@ from grr.lib import client_index
 from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import email_alerts
+from grr.lib import export
 from grr.lib import flags
 from grr.lib import flow
 # pylint: disable=unused-import
@@ -321,6 +322,10 @@ class GRRBaseTest(unittest.TestCase):
     # Reinitialize the config system each time.
     startup.TestInit()
 
+    # Client metadata cached by an earlier test must not be exported for the
+    # clients of this one.
+    export.METADATA_CACHE.Flush()
+
     config_lib.CONFIG.SetWriteBack(
         os.path.join(self.temp_dir, "writeback.yaml"))
 
@@ -8,6 +8,7 @@ This module loads and registers all the GRR library tests.
 # These need to register plugins so, pylint: disable=unused-import
 from grr.lib import access_control_test
 from grr.lib import aff4_test
+from grr.lib import aho_corasick_test
 from grr.lib import artifact_lib_test
 from grr.lib import artifact_test
 from grr.lib import build_test
@@ -294,7 +294,12 @@ class FastStore(object):
 
   @Synchronized
   def ExpirePrefix(self, prefix):
-    """Expire all the objects with the key having a given prefix."""
+    """Expire all the objects with the key having a given prefix.
+
+    Args:
+      prefix: The key prefix, or a tuple of prefixes to expire them all in a
+              single pass over the cache.
+    """
     for key in list(self._hash):
       if key.startswith(prefix):
         self.ExpireObject(key)
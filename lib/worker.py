@@ -2,7 +2,9 @@
 """Module with GRRWorker implementation."""
 
 
+import collections
 import pdb
+import threading
 import time
 import traceback
 
@@ -35,6 +37,293 @@ class FlowProcessingError(Error):
   """Raised when flow requests/responses can't be processed."""
 
 
+class _SessionGroup(object):
+  """The queued sessions of one flow or hunt."""
+
+  def __init__(self, root, user, session_class, weight):
+    self.root = root
+    self.user = user
+    self.session_class = session_class
+    self.weight = weight
+    self.tasks = collections.deque()
+    self.running = 0
+    self.virtual_time = 0.0
+
+
+class _UserQueue(object):
+  """The session groups belonging to one user."""
+
+  def __init__(self, virtual_time):
+    self.groups = set()
+    self.virtual_time = virtual_time
+    # The virtual time of the group of this user which ran last.
+    self.group_virtual_time = 0.0
+
+
+class FlowScheduler(object):
+  """Schedules flow sessions on a thread pool with weighted fair queuing.
+
+  Sessions are grouped by the flow or hunt they belong to - their root session
+  - and the groups by the user who started them. Each dispatch picks the user
+  which received the least service so far, and then that user's group which
+  received the least service relative to its weight. A hunt with thousands of
+  responding clients can therefore not starve the flows other users start, and
+  interactive flows are preferred over hunts of the same user.
+
+  Each group runs at most max_running sessions at once. The thread pool is
+  only handed a bounded number of sessions, so the order in which sessions run
+  is decided here rather than by the pool's queue.
+  """
+
+  # The relative share of the threads each class of session gets.
+  CLASS_WEIGHTS = {"flow": 4, "well_known": 4, "cron": 2, "hunt": 1}
+
+  def __init__(self, thread_pool, max_running=None, max_dispatched=None,
+               well_known_flows=None, owner_resolver=None):
+    """Constructor.
+
+    Args:
+      thread_pool: The ThreadPool to run the sessions on.
+      max_running: The maximum number of sessions of a single flow or hunt
+        which run at the same time. None or 0 means no limit.
+      max_dispatched: The maximum number of sessions handed to the thread pool
+        at once. Defaults to twice the pool size so the pool can still grow.
+      well_known_flows: Names of the well known flows.
+      owner_resolver: A callable which returns the user who started the flow
+        or hunt of a root session. Used when a root session is first queued.
+    """
+    self.thread_pool = thread_pool
+    self.max_running = max_running
+    self.max_dispatched = max_dispatched or 2 * max(
+        getattr(thread_pool, "max_threads", 1), 1)
+    self.well_known_flows = set(well_known_flows or [])
+    self.owner_resolver = owner_resolver
+
+    self.lock = threading.RLock()
+    self.groups = {}
+    self.users = {}
+    self.queued_sessions = set()
+    self.queue_depth = collections.Counter()
+    self.dispatched = 0
+    self.dispatching = False
+    self.virtual_time = 0.0
+
+    # The users who started the flows and hunts we have seen.
+    self.owners = utils.FastStore(max_size=10000)
+
+  @staticmethod
+  def GetRootSession(session_id):
+    """Returns the session of the flow or hunt a session belongs to.
+
+    Child flows and the client flows of hunts are created below their parent
+    session, so the root is the first component which is a flow id.
+
+    Args:
+      session_id: The session id of a flow.
+
+    Returns:
+      The root session as a string.
+    """
+    components = rdfvalue.RDFURN(session_id).Split()
+    for i, component in enumerate(components):
+      if ":" in component:
+        return "aff4:/" + "/".join(components[:i + 1])
+
+    return utils.SmartStr(session_id)
+
+  def GetSessionClass(self, root):
+    """Returns the class of session the root session represents."""
+    components = rdfvalue.RDFURN(root).Split() or [""]
+    if components[0] == "hunts":
+      return "hunt"
+    elif components[0] == "cron":
+      return "cron"
+    elif components[-1].split(":", 1)[-1] in self.well_known_flows:
+      return "well_known"
+
+    return "flow"
+
+  def Add(self, session_id, target, args, name="Unnamed task"):
+    """Queues a session to be processed.
+
+    Args:
+      session_id: The session id the task processes.
+      target: A callable which processes the session.
+      args: A tuple of arguments to target.
+      name: The name of the task in the thread pool.
+
+    Returns:
+      False if the session is already queued or running, True otherwise.
+    """
+    root = self.GetRootSession(session_id)
+    session_class = self.GetSessionClass(root)
+    self._ResolveOwner(root, session_class)
+
+    with self.lock:
+      if session_id in self.queued_sessions:
+        return False
+
+      group = self.groups.get(root)
+      if group is None:
+        try:
+          user = self.owners.Get(root)
+        except KeyError:
+          user = ""
+
+        group = _SessionGroup(root, user, session_class,
+                              self.CLASS_WEIGHTS[session_class])
+        self.groups[root] = group
+        self._Activate(group)
+
+      self.queued_sessions.add(session_id)
+      group.tasks.append((session_id, target, args, name, time.time()))
+      self._UpdateQueueDepth(group.session_class, 1)
+
+    self._Dispatch()
+    return True
+
+  def _ResolveOwner(self, root, session_class):
+    """Looks up the owner of a root session we have not seen yet."""
+    # Well known flows are not started by a user.
+    if self.owner_resolver is None or session_class == "well_known":
+      return
+
+    with self.lock:
+      if root in self.groups:
+        return
+
+      try:
+        self.owners.Get(root)
+        return
+      except KeyError:
+        pass
+
+    # Resolving may hit the data store so we do not hold the lock.
+    user = self.owner_resolver(root) or ""
+    with self.lock:
+      self.owners.Put(root, user)
+
+  def SetOwner(self, session_id, user):
+    """Records the user who started the flow or hunt of a session."""
+    root = self.GetRootSession(session_id)
+    user = user or ""
+    with self.lock:
+      self.owners.Put(root, user)
+
+      group = self.groups.get(root)
+      if group is not None and group.user != user:
+        self._Deactivate(group)
+        group.user = user
+        self._Activate(group)
+
+  def _Activate(self, group):
+    user_queue = self.users.get(group.user)
+    if user_queue is None:
+      # New users start at the current virtual time so they can not claim the
+      # service they missed while they were idle.
+      user_queue = self.users[group.user] = _UserQueue(self.virtual_time)
+
+    group.virtual_time = max(group.virtual_time, user_queue.group_virtual_time)
+    user_queue.groups.add(group)
+
+  def _Deactivate(self, group):
+    user_queue = self.users[group.user]
+    user_queue.groups.discard(group)
+    if not user_queue.groups:
+      del self.users[group.user]
+
+  def _UpdateQueueDepth(self, session_class, delta):
+    self.queue_depth[session_class] += delta
+    stats.STATS.SetGaugeValue("worker_scheduler_queue_depth",
+                              self.queue_depth[session_class],
+                              fields=[session_class])
+
+  def _NextTask(self):
+    """Removes the next task to run from the queues, or returns None."""
+    if self.dispatched >= self.max_dispatched:
+      return None
+
+    best_user = best_group = None
+    for user_queue in self.users.itervalues():
+      if best_user is not None and (user_queue.virtual_time >=
+                                    best_user.virtual_time):
+        continue
+
+      group = None
+      for candidate in user_queue.groups:
+        if not candidate.tasks:
+          continue
+
+        if self.max_running and candidate.running >= self.max_running:
+          continue
+
+        if group is None or candidate.virtual_time < group.virtual_time:
+          group = candidate
+
+      if group is not None:
+        best_user, best_group = user_queue, group
+
+    if best_group is None:
+      return None
+
+    self.virtual_time = max(self.virtual_time, best_user.virtual_time)
+    best_user.virtual_time += 1.0
+    best_user.group_virtual_time = best_group.virtual_time
+    best_group.virtual_time += 1.0 / best_group.weight
+    best_group.running += 1
+    self.dispatched += 1
+
+    session_id, target, args, name, queued = best_group.tasks.popleft()
+    self._UpdateQueueDepth(best_group.session_class, -1)
+    stats.STATS.RecordEvent("worker_scheduler_wait_time",
+                            time.time() - queued,
+                            fields=[best_group.session_class])
+
+    return best_group, session_id, target, args, name
+
+  def _Dispatch(self):
+    """Hands tasks to the thread pool while there is capacity."""
+    with self.lock:
+      # Only one thread dispatches at a time. This also keeps dispatching
+      # iterative when the pool runs tasks inline.
+      if self.dispatching:
+        return
+      self.dispatching = True
+
+    try:
+      while True:
+        with self.lock:
+          task = self._NextTask()
+          if task is None:
+            self.dispatching = False
+            return
+
+        group, session_id, target, args, name = task
+        self.thread_pool.AddTask(target=self._RunTask,
+                                 args=(group, session_id, target, args),
+                                 name=name)
+    except Exception:
+      with self.lock:
+        self.dispatching = False
+      raise
+
+  def _RunTask(self, group, session_id, target, args):
+    try:
+      target(*args)
+    finally:
+      with self.lock:
+        group.running -= 1
+        self.dispatched -= 1
+        self.queued_sessions.discard(session_id)
+        if not group.tasks and not group.running:
+          self._Deactivate(group)
+          del self.groups[group.root]
+
+      # Queue the next task before this one is marked as done, so joining the
+      # thread pool also waits for the sessions still queued here.
+      self._Dispatch()
+
+
 class GRRWorker(object):
   """A GRR worker."""
 
@@ -47,6 +336,11 @@ class GRRWorker(object):
   # target maximum time to spend on RunOnce
   RUN_ONCE_MAX_SECONDS = 300
 
+  # Limits on the extra passes made over the requests of a flow which batches
+  # its completed requests (e.g. a hunt) while the worker holds its lease.
+  BATCH_MAX_PASSES = 10
+  BATCH_MAX_SECONDS = 60
+
   # A class global threadpool to be used for all workers.
   thread_pool = None
 
@@ -90,10 +384,24 @@ class GRRWorker(object):
 
     # Well known flows are just instantiated.
     self.well_known_flows = flow.WellKnownFlow.GetAllWellKnownFlows(token=token)
+    self.scheduler = FlowScheduler(
+        self.thread_pool,
+        max_running=config_lib.CONFIG["Worker.max_running_sessions_per_flow"],
+        well_known_flows=self.well_known_flows,
+        owner_resolver=self._GetFlowCreator)
     self.flow_lease_time = config_lib.CONFIG["Worker.flow_lease_time"]
     self.well_known_flow_lease_time = config_lib.CONFIG[
         "Worker.well_known_flow_lease_time"]
 
+  def _GetFlowCreator(self, root):
+    """Returns the user who started the flow or hunt at root."""
+    try:
+      flow_obj = aff4.FACTORY.Open(root, mode="r", token=self.token)
+      return flow_obj.state.context.creator
+    except Exception as e:  # pylint: disable=broad-except
+      logging.debug("Unable to read the creator of %s: %s", root, e)
+      return ""
+
   def Run(self):
     """Event loop."""
     try:
@@ -230,12 +538,11 @@ class GRRWorker(object):
         if time_limit and time.time() - now > time_limit:
           break
 
-        processed += 1
         self.queued_flows.Put(notification.session_id, 1)
-        self.thread_pool.AddTask(target=self._ProcessMessages,
-                                 args=(notification,
-                                       queue_manager.Copy()),
-                                 name=self.__class__.__name__)
+        if self.scheduler.Add(notification.session_id, self._ProcessMessages,
+                              (notification, queue_manager.Copy()),
+                              name=self.__class__.__name__):
+          processed += 1
 
     return processed
 
@@ -274,6 +581,8 @@ class GRRWorker(object):
 
     try:
       runner.ProcessCompletedRequests(notification, self.thread_pool)
+      if runner.batch_completed_requests:
+        self._ProcessLaterRequests(runner, notification)
 
     # Something went wrong - log it in the flow.
     except Exception as e:  # pylint: disable=broad-except
@@ -305,6 +614,42 @@ class GRRWorker(object):
           manager.QueueNotification(
               notification, timestamp=notification.timestamp + delay)
 
+  def _ProcessLaterRequests(self, runner, notification):
+    """Processes the requests completed after the notification.
+
+    When many clients report to a hunt at once, each of them notifies the
+    hunt. Rather than releasing the lease and flushing the hunt for every
+    client, we keep processing whatever completed in the meantime under the
+    lease we already hold. The notifications covered by a pass are deleted so
+    no other worker picks them up, and the hunt is flushed once when the
+    caller closes it.
+
+    Args:
+      runner: The runner of the flow we hold the lease on.
+      notification: The notification that triggered the processing.
+    """
+    start_time = time.time()
+    session_id = notification.session_id
+
+    for _ in xrange(self.BATCH_MAX_PASSES):
+      if (not runner.IsRunning() or
+          time.time() - start_time > self.BATCH_MAX_SECONDS):
+        break
+
+      later_notification = rdf_flows.GrrNotification(
+          session_id=session_id, timestamp=rdfvalue.RDFDatetime().Now())
+      with queue_manager_lib.QueueManager(token=self.token) as manager:
+        manager.DeleteNotification(session_id,
+                                   end=later_notification.timestamp)
+
+      processed_before = runner.context.next_processed_request
+      runner.ProcessCompletedRequests(later_notification, self.thread_pool)
+      processed = runner.context.next_processed_request - processed_before
+      if not processed:
+        break
+
+      stats.STATS.IncrementCounter("worker_batched_requests", delta=processed)
+
   def _ProcessMessages(self, notification, queue_manager):
     """Does the real work with a single flow."""
     flow_obj = None
@@ -352,6 +697,9 @@ class GRRWorker(object):
         with flow_obj:
           self._ProcessRegularFlowMessages(flow_obj, notification)
 
+        self.scheduler.SetOwner(session_id,
+                                flow_obj.GetRunner().context.creator)
+
       elapsed = time.time() - now
       logging.debug("Done processing %s: %s sec", session_id, elapsed)
       stats.STATS.RecordEvent("worker_flow_processing_time", elapsed,
@@ -403,3 +751,10 @@ class WorkerInit(registry.InitHook):
     stats.STATS.RegisterEventMetric("worker_flow_processing_time",
                                     fields=[("flow", str)])
     stats.STATS.RegisterEventMetric("worker_time_to_retrieve_notifications")
+    stats.STATS.RegisterCounterMetric(
+        "worker_batched_requests", docstring=("Requests processed in extra "
+                                              "passes under a held lease."))
+    stats.STATS.RegisterGaugeMetric("worker_scheduler_queue_depth", int,
+                                    fields=[("class", str)])
+    stats.STATS.RegisterEventMetric("worker_scheduler_wait_time",
+                                    fields=[("class", str)])
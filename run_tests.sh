@@ -10,7 +10,8 @@ FakeDataStoreBenchmarks,\
 AverageMicroBenchmarks,\
 SqliteDataStoreBenchmarks,\
 DataStoreCSVBenchmarks,\
-AFF4Benchmark
+AFF4Benchmark,\
+ExportBenchmark
 PYTHONPATH=. \
 python grr/run_tests.py \
   --processes=1 \
@@ -789,8 +789,11 @@ def Start(db, port=0, is_master=False, server_cls=ThreadedHTTPServer,
   CMDTABLE = {cmd.DELETE_ATTRIBUTES: (SERVICE.DeleteAttributes, "w"),
               cmd.DELETE_SUBJECT: (SERVICE.DeleteSubject, "w"),
               cmd.MULTI_SET: (SERVICE.MultiSet, "w"),
+              cmd.MULTI_SET_MULTI: (SERVICE.MultiSetMulti, "w"),
               cmd.MULTI_RESOLVE_REGEX: (SERVICE.MultiResolveRegex, "r"),
               cmd.RESOLVE_MULTI: (SERVICE.ResolveMulti, "r"),
+              cmd.SCAN_SUBJECTS: (SERVICE.ScanSubjects, "r"),
+              cmd.SCAN_ATTRIBUTES: (SERVICE.ScanAttributes, "r"),
               cmd.LOCK_SUBJECT: (SERVICE.LockSubject, "w"),
               cmd.EXTEND_SUBJECT: (SERVICE.ExtendSubject, "w"),
               cmd.UNLOCK_SUBJECT: (SERVICE.UnlockSubject, "w")}
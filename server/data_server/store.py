@@ -130,6 +130,29 @@ class DataStoreService(object):
                      sync=request.sync, replace=False,
                      token=request.token)
 
+  @RPCWrapper
+  def MultiSetMulti(self, request, unused_response):
+    """Set multiple attributes for many subjects at once."""
+
+    values = {}
+    to_delete = {}
+
+    for value in request.values:
+      subject = request.subject[value.subject_index]
+      if value.option == rdf_data_store.DataStoreValue.Option.REPLACE:
+        to_delete.setdefault(subject, set()).add(value.attribute)
+
+      timestamp = self.FromTimestampSpec(request.timestamp)
+      if value.HasField("value"):
+        if value.HasField("timestamp"):
+          timestamp = self.FromTimestampSpec(value.timestamp)
+
+        values.setdefault(subject, {}).setdefault(value.attribute, []).append(
+            (value.value.GetValue(), timestamp))
+
+    self.db.MultiSetMulti(values, to_delete=to_delete, sync=request.sync,
+                          replace=False, token=request.token)
+
   @RPCWrapper
   def ResolveMulti(self, request, response):
     """Resolve multiple attributes for a given subject at once."""
@@ -167,6 +190,35 @@ class DataStoreService(object):
           payload=[(utils.SmartStr(attribute), self._Encode(value), int(ts))
                    for (attribute, value, ts) in values])
 
+  @RPCWrapper
+  def ScanSubjects(self, request, response):
+    """Scan the subjects starting with a prefix in order."""
+    attributes = [utils.SmartUnicode(v.attribute) for v in request.values]
+
+    for subject, values in self.db.ScanSubjects(
+        request.subject[0], attributes,
+        after=request.subject_after or None,
+        limit=request.limit or None, token=request.token):
+      response.results.Append(
+          subject=subject,
+          payload=[(utils.SmartStr(attribute), self._Encode(value), int(ts))
+                   for (attribute, value, ts) in values])
+
+  @RPCWrapper
+  def ScanAttributes(self, request, response):
+    """Return a page of attributes of a subject in attribute order."""
+    attribute_regex = [utils.SmartUnicode(v.attribute) for v in request.values]
+    subject = request.subject[0]
+
+    values = self.db.ScanAttributes(
+        subject, attribute_regex, after=request.attribute_after or None,
+        limit=request.limit or None, token=request.token)
+
+    response.results.Append(
+        subject=subject,
+        payload=[(utils.SmartStr(attribute), self._Encode(value), int(ts))
+                 for (attribute, value, ts) in values])
+
   @RPCWrapper
   def DeleteAttributes(self, request, unused_response):
     """Delete attributes from a given subject."""
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Replays a data store workload trace against the configured data store.
+
+Traces are recorded by setting Datastore.trace_path on the servers. Run this
+with the configuration of the data store to benchmark, e.g.:
+
+  replay_data_store_trace.py --trace /tmp/worker.trace.gz --speed 10 \
+      --config ... -p Datastore.implementation=SqliteDataStore
+"""
+
+
+# pylint: disable=unused-import,g-bad-import-order
+from grr.lib import server_plugins
+# pylint: enable=unused-import,g-bad-import-order
+
+from grr.lib import aff4
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import startup
+
+from grr.lib.data_stores import workload_trace
+
+
+flags.DEFINE_string("trace", "", "The workload trace to replay.")
+
+flags.DEFINE_float("speed", 1.0, "Replay speed relative to the recorded "
+                   "speed. 0 replays as fast as possible.")
+
+flags.DEFINE_integer("threads", 10, "Number of threads issuing operations.")
+
+
+def main(unused_argv):
+  """Main."""
+  startup.Init()
+
+  replayer = workload_trace.Replayer(data_store.DB, speed=flags.FLAGS.speed,
+                                     threads=flags.FLAGS.threads,
+                                     token=aff4.FACTORY.root_token)
+  report = replayer.Replay(workload_trace.ReadTrace(flags.FLAGS.trace))
+  data_store.DB.Flush()
+
+  print "Replayed %s against %s" % (flags.FLAGS.trace,
+                                    data_store.DB.__class__.__name__)
+  print report
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
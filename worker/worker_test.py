@@ -16,6 +16,7 @@ from grr.lib import hunts
 from grr.lib import queue_manager
 from grr.lib import queues
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib import worker
@@ -110,6 +111,20 @@ class WorkerStuckableHunt(implementation.GRRHunt):
     cls.WAIT_FOR_TEST_SEMAPHORE.acquire()
 
 
+class WorkerChainingHunt(implementation.GRRHunt):
+  """Hunt which adds the next client in CLIENTS whenever a client runs."""
+
+  CLIENTS = []
+
+  @flow.StateHandler()
+  def RunClient(self, responses):
+    for client_id in responses:
+      index = self.CLIENTS.index(client_id) + 1
+      if index < len(self.CLIENTS):
+        hunts.GRRHunt.StartClients(self.session_id, [self.CLIENTS[index]],
+                                   token=self.token)
+
+
 class WorkerStuckableTestFlow(flow.GRRFlow):
   """Flow that can be paused with sempahores when processed by the worker."""
 
@@ -353,6 +368,36 @@ class GrrWorkerTest(test_lib.FlowTestsBaseclass):
       WorkerStuckableHunt.LetWorkerFinishProcessing()
       worker_obj.thread_pool.Join()
 
+  def testHuntRequestsCompletedDuringProcessingAreBatched(self):
+    client_ids = [rdf_client.ClientURN("C.1%015d" % i) for i in range(5)]
+    WorkerChainingHunt.CLIENTS = client_ids
+    worker_obj = worker.GRRWorker(token=self.token)
+
+    with hunts.GRRHunt.StartHunt(hunt_name="WorkerChainingHunt",
+                                 client_rate=0, token=self.token) as hunt:
+      hunt.GetRunner().Start()
+
+    hunts.GRRHunt.StartClients(hunt.session_id, client_ids[:1])
+    batched = stats.STATS.GetMetricValue("worker_batched_requests")
+
+    # Every client added by the hunt while it was processed is picked up under
+    # the same lease, in a single worker pass.
+    worker_obj.RunOnce()
+    worker_obj.thread_pool.Join()
+
+    self.assertEqual(
+        stats.STATS.GetMetricValue("worker_batched_requests") - batched, 4)
+
+    hunt = aff4.FACTORY.Open(hunt.session_id, token=self.token)
+    self.assertEqual(hunt.GetClients(), set(client_ids))
+
+    # The notifications of the batched requests were consumed as well.
+    with queue_manager.QueueManager(token=self.token) as manager:
+      notifications = manager.GetNotificationsForAllShards(
+          hunt.session_id.Queue())
+    self.assertFalse([n for n in notifications
+                      if n.session_id == hunt.session_id])
+
   def testKillNotificationsScheduledForFlows(self):
     worker_obj = worker.GRRWorker(token=self.token)
     initial_time = rdfvalue.RDFDatetime().FromSecondsFromEpoch(0)
@@ -564,8 +609,8 @@ class GrrWorkerTest(test_lib.FlowTestsBaseclass):
     worker_obj.thread_pool.Join()
 
     client = aff4.FACTORY.Open(client_id.Add("stats"), token=self.token)
-    stats = client.Get(client.Schema.STATS)
-    self.assertEqual(stats.RSS_size, 1234)
+    client_stats = client.Get(client.Schema.STATS)
+    self.assertEqual(client_stats.RSS_size, 1234)
 
     # Make sure no notifications have been sent.
     user = aff4.FACTORY.Open("aff4:/users/%s" % self.token.username,
@@ -588,8 +633,8 @@ class GrrWorkerTest(test_lib.FlowTestsBaseclass):
     worker_obj.thread_pool.Join()
 
     client = aff4.FACTORY.Open(client_id.Add("stats"), token=self.token)
-    stats = client.Get(client.Schema.STATS)
-    self.assertEqual(stats.RSS_size, 1234)
+    client_stats = client.Get(client.Schema.STATS)
+    self.assertEqual(client_stats.RSS_size, 1234)
 
     aff4.FACTORY.Delete(client_id.Add("stats"), token=self.token)
 
@@ -831,6 +876,157 @@ class GrrWorkerTest(test_lib.FlowTestsBaseclass):
         self.assertEqual(timestamp, frozen_timestamp)
 
 
+class SimulatedThreadPool(object):
+  """Runs tasks in ticks, as if every task took one tick on a thread."""
+
+  def __init__(self, max_threads):
+    self.max_threads = max_threads
+    self.tasks = []
+    self.tick = 0
+
+  def AddTask(self, target, args, name="Unnamed task"):
+    _ = name
+    self.tasks.append((target, args))
+
+  def RunTick(self):
+    tasks = self.tasks[:self.max_threads]
+    self.tasks = self.tasks[self.max_threads:]
+    for target, args in tasks:
+      target(*args)
+
+    self.tick += 1
+
+
+class FlowSchedulerTest(test_lib.GRRBaseTest):
+  """Tests the worker's flow scheduler."""
+
+  def _Sessions(self, base, count):
+    return [rdfvalue.SessionID(base=base, queue=queues.FLOWS,
+                               flow_name="%06X" % i) for i in range(count)]
+
+  def _SimulateHuntLoad(self, max_dispatched):
+    """Runs interactive flows while a large hunt is being processed.
+
+    Args:
+      max_dispatched: The number of sessions the scheduler hands the pool.
+
+    Returns:
+      The number of ticks until all the interactive flows ran.
+    """
+    pool = SimulatedThreadPool(10)
+    scheduler = worker.FlowScheduler(pool, max_dispatched=max_dispatched)
+    ran = {}
+
+    def Process(session_id):
+      ran[session_id] = pool.tick
+
+    hunt_sessions = self._Sessions("aff4:/hunts/W:123456/C.1000000000000001",
+                                   1000)
+    scheduler.SetOwner(hunt_sessions[0], "hunt_creator")
+    for session_id in hunt_sessions:
+      scheduler.Add(session_id, Process, (session_id,))
+
+    for _ in range(5):
+      pool.RunTick()
+
+    flow_sessions = self._Sessions("aff4:/C.1000000000000002/flows", 3)
+    for session_id in flow_sessions:
+      scheduler.SetOwner(session_id, "analyst")
+      scheduler.Add(session_id, Process, (session_id,))
+
+    start = pool.tick
+    while pool.tasks:
+      pool.RunTick()
+
+    self.assertEqual(len(ran), 1003)
+    return max(ran[session_id] for session_id in flow_sessions) - start
+
+  def testInteractiveFlowsAreNotStarvedByHunts(self):
+    # Handing everything to the pool runs the sessions first come first
+    # served, so the flows wait for most of the hunt.
+    self.assertGreater(self._SimulateHuntLoad(max_dispatched=10 ** 6), 50)
+
+    # The scheduler runs them as soon as a thread is free.
+    self.assertLessEqual(self._SimulateHuntLoad(max_dispatched=10), 1)
+
+  def testConcurrencyIsCappedPerFlow(self):
+    pool = SimulatedThreadPool(10)
+    scheduler = worker.FlowScheduler(pool, max_running=3, max_dispatched=10)
+    for session_id in self._Sessions("aff4:/hunts/W:123456/C.1000000000000001",
+                                     20):
+      scheduler.Add(session_id, lambda: None, ())
+
+    self.assertEqual(len(pool.tasks), 3)
+    self.assertEqual(stats.STATS.GetMetricValue(
+        "worker_scheduler_queue_depth", fields=["hunt"]), 17)
+
+    # Other flows can use the rest of the threads.
+    for session_id in self._Sessions("aff4:/C.1000000000000002/flows", 2):
+      scheduler.Add(session_id, lambda: None, ())
+    self.assertEqual(len(pool.tasks), 5)
+
+    pool.RunTick()
+    self.assertEqual(len(pool.tasks), 3)
+    self.assertEqual(stats.STATS.GetMetricValue(
+        "worker_scheduler_queue_depth", fields=["hunt"]), 14)
+
+  def testSessionsAreQueuedOnce(self):
+    pool = SimulatedThreadPool(10)
+    scheduler = worker.FlowScheduler(pool, max_dispatched=10)
+    session_id = self._Sessions("aff4:/C.1000000000000002/flows", 1)[0]
+    waits = stats.STATS.GetMetricValue("worker_scheduler_wait_time",
+                                       fields=["flow"]).count
+
+    self.assertTrue(scheduler.Add(session_id, lambda: None, ()))
+    self.assertFalse(scheduler.Add(session_id, lambda: None, ()))
+    self.assertEqual(stats.STATS.GetMetricValue(
+        "worker_scheduler_wait_time", fields=["flow"]).count, waits + 1)
+
+    pool.RunTick()
+    self.assertTrue(scheduler.Add(session_id, lambda: None, ()))
+
+  def testOwnerIsResolvedWhenQueueing(self):
+    resolved = []
+
+    def Resolve(root):
+      resolved.append(root)
+      return "analyst"
+
+    pool = SimulatedThreadPool(10)
+    scheduler = worker.FlowScheduler(pool, max_dispatched=1,
+                                     well_known_flows=["Stats"],
+                                     owner_resolver=Resolve)
+    session_ids = self._Sessions("aff4:/C.1000000000000002/flows", 2)
+    for session_id in session_ids:
+      scheduler.Add(session_id, lambda: None, ())
+
+    # The flows are queued under their creator before they were processed.
+    self.assertEqual(resolved, [str(session_id) for session_id in session_ids])
+    self.assertEqual(scheduler.users.keys(), ["analyst"])
+
+    # Roots we have seen before are not resolved again.
+    pool.RunTick()
+    scheduler.Add(session_ids[0], lambda: None, ())
+    self.assertEqual(len(resolved), 2)
+
+    scheduler.Add("aff4:/flows/S:Stats", lambda: None, ())
+    self.assertEqual(len(resolved), 2)
+
+  def testRootSessions(self):
+    scheduler = worker.FlowScheduler(SimulatedThreadPool(1),
+                                     well_known_flows=["Stats"])
+    for session_id, root, session_class in [
+        ("aff4:/hunts/W:123456/C.1000000000000001/W:ABCDEF",
+         "aff4:/hunts/W:123456", "hunt"),
+        ("aff4:/C.1000000000000001/flows/W:ABCDEF/W:123456",
+         "aff4:/C.1000000000000001/flows/W:ABCDEF", "flow"),
+        ("aff4:/cron/OSBreakDown/W:ABCDEF",
+         "aff4:/cron/OSBreakDown/W:ABCDEF", "cron"),
+        ("aff4:/flows/S:Stats", "aff4:/flows/S:Stats", "well_known")]:
+      self.assertEqual(scheduler.GetRootSession(session_id), root)
+      self.assertEqual(scheduler.GetSessionClass(root), session_class)
+
+
 def main(_):
   test_lib.main()
 